@@ -1,12 +1,18 @@
 import json
 import logging
 import os
+import sys
 
-# Configure logging
+# The shared helper sits next to this file in the deployment package and in examples/common in the source tree
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from log_shipping import LogShipper  # noqa: E402
+
+# Configure logging; JSON lines tagged with the request id, see log_shipping.py
 # sonarignore:start
+log_shipper = LogShipper('basic-lambda').install()
 logger = logging.getLogger()
-logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
 
+@log_shipper.invocation
 def lambda_handler(event, context):
     """
     Basic Lambda function handler
@@ -27,6 +27,10 @@ data "archive_file" "lambda_zip" {
     })
     filename = "lambda_function.py"
   }
+  source {
+    content  = file("${path.module}/../common/log_shipping.py")
+    filename = "log_shipping.py"
+  }
 }
 
 module "tags" {
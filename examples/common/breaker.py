@@ -0,0 +1,283 @@
+"""
+Circuit breakers for calls to downstream AWS services.
+
+While a service is degraded, every call to it waits for its timeout and
+retries before failing, and a handler that logs the failure and carries on pays
+that again on the next event. `Breakers` keeps one `CircuitBreaker` per service
+for the life of the instance, so warm invocations share what earlier ones
+learned, and `instrument` wraps a client so that its calls pass through the
+breaker of its service:
+
+    closed      calls go through; BREAKER_FAILURE_THRESHOLD consecutive
+                failures open the breaker
+    open        calls fail at once with CircuitOpenError for
+                BREAKER_OPEN_SECONDS
+    half_open   one trial call goes through while the others fail at once; its
+                success closes the breaker and its failure opens it again
+
+Only failures that point at the service count: connection errors, timeouts,
+throttling and 5xx responses. An error in the request, such as a missing
+permission, fails fast anyway and leaves the breaker as it is. Transitions and
+rejected calls are emitted per service as a CloudWatch Embedded Metric Format
+log line by `publish_metrics`, which needs no call to CloudWatch.
+
+`Spool` keeps messages a handler could not send in a JSON Lines file in /tmp
+and sends them, oldest first, once the service answers again. The file belongs
+to one instance and goes with it, so spooling bounds what an outage loses
+rather than guaranteeing delivery.
+"""
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+
+logger = logging.getLogger(__name__)
+
+BREAKER_ENABLED = os.environ.get('BREAKER_ENABLED', 'true').lower() == 'true'
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', '5'))
+BREAKER_OPEN_SECONDS = float(os.environ.get('BREAKER_OPEN_SECONDS', '30'))
+BREAKER_SPOOL_DIR = os.environ.get('BREAKER_SPOOL_DIR', '')
+BREAKER_SPOOL_MAX_MB = int(os.environ.get('BREAKER_SPOOL_MAX_MB', '10'))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+# Value of the CircuitBreakerState metric
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+THROTTLING_CODES = frozenset((
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottled', 'RequestThrottledException',
+    'TooManyRequestsException', 'RequestLimitExceeded', 'SlowDown', 'KMSThrottlingException'
+))
+# Messages sent from the spool per call to `drain`, so one invocation does not spend its time on a backlog
+DRAIN_LIMIT = 100
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a service whose breaker is open."""
+
+    def __init__(self, service: str, retry_in: float):
+        super().__init__(f"Circuit breaker for {service} is open; retrying in {retry_in:.1f}s")
+        self.service = service
+        self.retry_in = retry_in
+
+
+def is_service_failure(error: BaseException) -> bool:
+    """Whether an error says the service is unavailable or overloaded, rather than that the request was wrong."""
+    if isinstance(error, ClientError):
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return status >= 500 or status == 429 or error.response.get('Error', {}).get('Code') in THROTTLING_CODES
+    return isinstance(error, (BotoConnectionError, HTTPClientError, TimeoutError, ConnectionError))
+
+
+class CircuitBreaker:
+    """Closed, open and half-open state of one service, with counters since the last publish."""
+
+    def __init__(self, service: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 open_seconds: float = BREAKER_OPEN_SECONDS):
+        self.service = service
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.counters = {OPEN: 0, HALF_OPEN: 0, CLOSED: 0, 'rejected': 0}
+        self._opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def _transition(self, state: str) -> None:
+        logger.warning(f"Circuit breaker for {self.service}: {self.state} -> {state}")
+        self.state = state
+        self.counters[state] += 1
+
+    def before_call(self) -> None:
+        """Admit a call or raise CircuitOpenError."""
+        with self._lock:
+            if self.state == OPEN:
+                waited = time.monotonic() - self._opened_at
+                if waited < self.open_seconds:
+                    self.counters['rejected'] += 1
+                    raise CircuitOpenError(self.service, self.open_seconds - waited)
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._trial:
+                    self.counters['rejected'] += 1
+                    raise CircuitOpenError(self.service, 0)
+                self._trial = True
+
+    def after_call(self, error: Optional[BaseException]) -> None:
+        """Record the outcome of an admitted call."""
+        failed = error is not None and is_service_failure(error)
+        with self._lock:
+            trial, self._trial = self._trial, False
+            if not failed:
+                self.failures = 0
+                if trial:
+                    self._transition(CLOSED)
+                return
+            self.failures += 1
+            if trial or self.failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                if self.state != OPEN:
+                    self._transition(OPEN)
+
+    def take_counters(self) -> Tuple[str, Dict[str, int]]:
+        """The current state and the counters since the last call, which are reset."""
+        with self._lock:
+            counters, self.counters = self.counters, dict.fromkeys(self.counters, 0)
+            return self.state, counters
+
+    def call(self, function: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        self.before_call()
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as e:
+            self.after_call(e)
+            raise
+        self.after_call(None)
+        return result
+
+
+class _GuardedClient:
+    """Proxy sending every call of a client through the breaker of its service."""
+
+    def __init__(self, client: Any, breaker: CircuitBreaker):
+        self._client = client
+        self._breaker = breaker
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._client, name)
+        if name.startswith('_') or not callable(attr) or name in ('get_paginator', 'get_waiter', 'can_paginate'):
+            return attr
+
+        breaker = self._breaker
+
+        @functools.wraps(attr)
+        def guarded(*args, **kwargs):
+            return breaker.call(attr, *args, **kwargs)
+
+        setattr(self, name, guarded)
+        return guarded
+
+
+class Breakers:
+    """The circuit breakers of one function, kept across warm invocations."""
+
+    def __init__(self, namespace: str, function: str, enabled: bool = BREAKER_ENABLED):
+        self.namespace = namespace
+        self.function = function
+        self.enabled = enabled
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, service: str) -> CircuitBreaker:
+        with self._lock:
+            if service not in self._breakers:
+                self._breakers[service] = CircuitBreaker(service)
+            return self._breakers[service]
+
+    def instrument(self, client: Any, service: str) -> Any:
+        """Wrap a client so that its calls pass through the breaker of `service`; unchanged when disabled."""
+        return _GuardedClient(client, self.get(service)) if self.enabled else client
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: {'state': breaker.state, 'consecutive_failures': breaker.failures}
+                for name, breaker in self._breakers.items()}
+
+    def publish_metrics(self) -> None:
+        """Print transitions and rejections since the last call, per service that had any or is not closed."""
+        for name, breaker in list(self._breakers.items()):
+            state, counters = breaker.take_counters()
+            if any(counters.values()) or state != CLOSED:
+                print(json.dumps(self.emf_document(name, state, counters)))
+
+    def emf_document(self, service: str, state: str, counters: Dict[str, int]) -> Dict[str, Any]:
+        metrics = {
+            'CircuitBreakerOpened': counters[OPEN],
+            'CircuitBreakerHalfOpened': counters[HALF_OPEN],
+            'CircuitBreakerClosed': counters[CLOSED],
+            'CircuitBreakerRejections': counters['rejected'],
+            'CircuitBreakerState': STATE_VALUES[state]
+        }
+        dimensions = {'Function': self.function, 'Dependency': service}
+        return {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [list(dimensions.keys())],
+                    'Metrics': [{'Name': name, 'Unit': 'None' if name == 'CircuitBreakerState' else 'Count'}
+                                for name in metrics]
+                }]
+            },
+            **dimensions,
+            **metrics
+        }
+
+
+class Spool:
+    """Messages kept in a JSON Lines file until their service accepts them again."""
+
+    def __init__(self, path: str, max_bytes: int = BREAKER_SPOOL_MAX_MB * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def append(self, message: Dict[str, Any]) -> bool:
+        """Keep a message; False when the spool is full and the message is dropped."""
+        line = json.dumps(message, default=str) + '\n'
+        with self._lock:
+            size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            if size + len(line) > self.max_bytes:
+                logger.error(f"Spool {self.path} is full; dropping a message")
+                return False
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write(line)
+            return True
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._read())
+
+    def _read(self) -> List[str]:
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, encoding='utf-8') as file:
+            return [line for line in file if line.strip()]
+
+    def drain(self, send: Callable[..., Any], limit: int = DRAIN_LIMIT) -> bool:
+        """Send up to `limit` kept messages as keyword arguments of `send`, oldest first; True once none is left.
+
+        Draining stops at the first message the service fails to take, which
+        stays first. A message the service refuses, as for a missing
+        permission, is dropped.
+        """
+        with self._lock:
+            lines = self._read()
+            if not lines:
+                return True
+            done = 0
+            for line in lines[:limit]:
+                try:
+                    send(**json.loads(line))
+                except Exception as e:
+                    if isinstance(e, CircuitOpenError) or is_service_failure(e):
+                        logger.warning(f"Spool {self.path}: {len(lines) - done} messages left after {e}")
+                        break
+                    logger.error(f"Spool {self.path}: dropping a message the service refused: {e}")
+                done += 1
+            remaining = lines[done:]
+            if not remaining:
+                os.unlink(self.path)
+                return True
+            if done:
+                temporary = self.path + '.tmp'
+                with open(temporary, 'w', encoding='utf-8') as file:
+                    file.writelines(remaining)
+                os.replace(temporary, self.path)
+            return False
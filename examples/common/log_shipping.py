@@ -0,0 +1,204 @@
+"""
+Structured logs tagged with the invocation's request id, optionally written off its thread.
+
+`LogShipper.install` replaces the root logger's handlers with one writing each
+record as one JSON object per line, with `timestamp`, `level`, `logger`,
+`message`, `function` and `request_id`, any attributes passed in `extra`, and
+the traceback as `exception`; a traceback stays in one CloudWatch Logs event
+instead of one event per line. LOG_FORMAT=text writes the tab-separated lines
+of the Lambda runtime's own handler instead. The `invocation` decorator binds
+the request id for the records logged while the handler runs.
+
+By default each record is formatted and written, a system call, by the thread
+that logs it. With LOG_ASYNC=true a `QueueHandler` goes on the root logger
+instead: a call to the logger only merges the message with its arguments and
+tags it before queueing it, and a `QueueListener` thread formats and writes the
+record. Lambda freezes the instance as soon as the handler returns, so the
+decorator then waits, before the response is returned, until every record of
+the invocation has been written. That flush costs about as much as the logger
+calls save unless the handler spends long stretches waiting on I/O between
+them, as tools/bench_logging.py shows, so it is not the default.
+"""
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Any, Callable, Optional, TextIO
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_ASYNC = os.environ.get('LOG_ASYNC', 'false').lower() == 'true'
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+LOG_FLUSH_TIMEOUT_SECONDS = float(os.environ.get('LOG_FLUSH_TIMEOUT_SECONDS', '2'))
+
+TEXT_FORMAT = '[%(levelname)s]\t%(asctime)s\t%(request_id)s\t%(message)s'
+# Attributes every LogRecord has; anything else on a record came from `extra`
+RECORD_ATTRIBUTES = frozenset(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {
+    'message', 'asctime', 'request_id', 'taskName'
+}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, on a single line."""
+
+    def __init__(self, function: str):
+        super().__init__()
+        self.function = function
+
+    def format(self, record: logging.LogRecord) -> str:
+        document = {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'function': self.function,
+            'request_id': getattr(record, 'request_id', None)
+        }
+        for name, value in record.__dict__.items():
+            if name not in RECORD_ATTRIBUTES:
+                document[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            document['exception'] = record.exc_text
+        if record.stack_info:
+            document['stack'] = record.stack_info
+        return json.dumps(document, default=str)
+
+
+class _RequestFilter(logging.Filter):
+    """Tags records with the request id of the invocation that logged them."""
+
+    def __init__(self):
+        super().__init__()
+        self.request_id: Optional[str] = None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = self.request_id
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler leaving the formatting to the listener."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Arguments are merged now, as they may change once the call returns; exc_info stays for the listener
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class _Flush:
+    """Queued after the records to flush; the listener sets `done` once it reaches it."""
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def handle(self, record: Any) -> None:
+        if isinstance(record, _Flush):
+            for handler in self.handlers:
+                handler.flush()
+            record.done.set()
+            return
+        super().handle(record)
+
+
+class LogShipper:
+    """Root logger configuration of one function, writing records in place or from a background thread."""
+
+    def __init__(self, function: str, enabled: bool = LOG_ASYNC, log_format: str = LOG_FORMAT,
+                 level: str = LOG_LEVEL, flush_timeout: float = LOG_FLUSH_TIMEOUT_SECONDS):
+        self.function = function
+        self.enabled = enabled
+        self.log_format = log_format
+        self.level = level
+        self.flush_timeout = flush_timeout
+        self._filter = _RequestFilter()
+        self._handler: Optional[logging.Handler] = None
+        self._queue_handler: Optional[logging.Handler] = None
+        self._listener: Optional[_QueueListener] = None
+        self._fork_hook = False
+        # Decorated entry points currently running; a handler may call another one, as BUFFERED mode does
+        self._depth = 0
+
+    def install(self, stream: Optional[TextIO] = None) -> 'LogShipper':
+        """Replace the root logger's handlers, such as the Lambda runtime's, with this configuration."""
+        self.stop()
+        handler = logging.StreamHandler(stream or sys.stderr)
+        if self.log_format == 'json':
+            handler.setFormatter(JsonFormatter(self.function))
+        else:
+            handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.setLevel(self.level)
+        self._handler = handler
+        if not self._fork_hook:
+            os.register_at_fork(after_in_child=self._after_fork)
+            self._fork_hook = True
+        if self.enabled:
+            records: queue.SimpleQueue = queue.SimpleQueue()
+            self._queue_handler = _QueueHandler(records)
+            self._queue_handler.addFilter(self._filter)
+            self._listener = _QueueListener(records, handler)
+            self._listener.start()
+            root.addHandler(self._queue_handler)
+        else:
+            handler.addFilter(self._filter)
+            root.addHandler(handler)
+        return self
+
+    def _after_fork(self) -> None:
+        # The listener thread is not copied into a child process; log from the calling thread there
+        if self._listener is not None:
+            root = logging.getLogger()
+            root.removeHandler(self._queue_handler)
+            self._handler.addFilter(self._filter)
+            root.addHandler(self._handler)
+            self._listener = None
+
+    def flush(self) -> bool:
+        """Wait until every record logged so far is written; False if that took longer than `flush_timeout`."""
+        if self._listener is None:
+            if self._handler is not None:
+                self._handler.flush()
+            return True
+        marker = _Flush()
+        self._listener.queue.put(marker)
+        return marker.done.wait(self.flush_timeout)
+
+    def invocation(self, handler: Callable) -> Callable:
+        """
+        Decorator tagging records with the invocation's request id and writing them all before it returns.
+
+        Nested calls, such as a decorated handler calling another one, restore the caller's request id and leave
+        the flush to the outermost entry point.
+        """
+
+        @functools.wraps(handler)
+        def wrapper(event, context, *args):
+            previous = self._filter.request_id
+            self._filter.request_id = getattr(context, 'aws_request_id', None)
+            self._depth += 1
+            try:
+                return handler(event, context, *args)
+            finally:
+                self._depth -= 1
+                if not self._depth:
+                    self.flush()
+                self._filter.request_id = previous
+
+        return wrapper
+
+    def stop(self) -> None:
+        """Write what is queued and stop the listener."""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
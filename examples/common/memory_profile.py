@@ -0,0 +1,201 @@
+"""
+Opt-in memory profile of each invocation and detection of growth across warm ones.
+
+A warm instance keeps everything a module holds between invocations, so a cache
+without a bound or a list appended to on every event grows the instance's RSS
+until Lambda recycles it or the function runs out of memory. With
+MEMORY_PROFILE_ENABLED=true, `MemoryProfiler.profile` wraps the handler and
+`tracemalloc` traces Python allocations from the moment the profiler is
+created. After each invocation it records the resident set size, its peak
+during the invocation and the traced memory with its peak, and every
+MEMORY_PROFILE_INTERVAL invocations it takes a snapshot grouped by source line
+and compares it with the previous one.
+
+An allocation site whose traced size grew in MEMORY_PROFILE_GROWTH_SNAPSHOTS
+consecutive comparisons is reported as growing, with how much it has grown
+since its streak began. Each invocation prints one CloudWatch Embedded Metric
+Format log line with the memory metrics and the number of growing sites, which
+also carries, as plain properties, the MEMORY_PROFILE_TOP largest allocation
+sites and the growing ones, so the sites can be found with Logs Insights.
+
+Tracing makes every allocation slower, and a snapshot takes time and memory in
+proportion to the objects alive, so profile a share of traffic, such as one
+alias, rather than the whole function. When disabled the handler is returned
+unwrapped and nothing is traced.
+"""
+import functools
+import json
+import logging
+import os
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MEMORY_PROFILE_ENABLED = os.environ.get('MEMORY_PROFILE_ENABLED', 'false').lower() == 'true'
+MEMORY_PROFILE_INTERVAL = int(os.environ.get('MEMORY_PROFILE_INTERVAL', '10'))
+MEMORY_PROFILE_GROWTH_SNAPSHOTS = int(os.environ.get('MEMORY_PROFILE_GROWTH_SNAPSHOTS', '5'))
+MEMORY_PROFILE_TOP = int(os.environ.get('MEMORY_PROFILE_TOP', '10'))
+MEMORY_PROFILE_FRAMES = int(os.environ.get('MEMORY_PROFILE_FRAMES', '1'))
+
+# Growth streaks kept per comparison, largest growth first, so bookkeeping stays bounded
+TRACKED_SITES = 100
+UNITS = {'KiB': 'Kilobytes', 'MiB': 'Megabytes'}
+PROC_STATUS = '/proc/self/status'
+# Writing 5 here resets VmHWM, the peak resident set size, on Linux 4.0 and later
+PROC_CLEAR_REFS = '/proc/self/clear_refs'
+# Allocations of the profiler itself and of the import machinery, left out of the sites reported
+EXCLUDED_FILES = frozenset((
+    tracemalloc.__file__, __file__, '<frozen importlib._bootstrap>', '<frozen importlib._bootstrap_external>',
+    '<unknown>'
+))
+
+
+def resident_set() -> Dict[str, float]:
+    """Current and peak resident set size in MiB, from /proc; empty where it does not exist."""
+    sizes = {}
+    try:
+        with open(PROC_STATUS, encoding='ascii') as status:
+            for line in status:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    sizes[line[:5]] = int(line.split()[1]) / 1024
+    except OSError:
+        return {}
+    return {'rss_mib': sizes.get('VmRSS', 0.0), 'peak_rss_mib': sizes.get('VmHWM', 0.0)}
+
+
+def reset_peak_rss() -> bool:
+    """Start a new VmHWM peak; False where the kernel does not allow it and the peak covers the instance's life."""
+    try:
+        with open(PROC_CLEAR_REFS, 'w', encoding='ascii') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def site(statistic: Any) -> str:
+    """File and line of a tracemalloc statistic grouped by line."""
+    frame = statistic.traceback[0]
+    return f"{frame.filename}:{frame.lineno}"
+
+
+class MemoryProfiler:
+    """Memory metrics per invocation and allocation sites that keep growing across warm invocations."""
+
+    def __init__(self, namespace: str, function: str, enabled: bool = MEMORY_PROFILE_ENABLED,
+                 interval: int = MEMORY_PROFILE_INTERVAL, growth_snapshots: int = MEMORY_PROFILE_GROWTH_SNAPSHOTS,
+                 top: int = MEMORY_PROFILE_TOP, frames: int = MEMORY_PROFILE_FRAMES):
+        self.namespace = namespace
+        self.function = function
+        self.enabled = enabled
+        self.interval = max(interval, 1)
+        self.growth_snapshots = growth_snapshots
+        self.top = top
+        self.invocations = 0
+        # Traced bytes per allocation site at the last snapshot
+        self._sizes: Optional[Dict[str, int]] = None
+        # Allocation site -> (consecutive comparisons it grew in, bytes grown over them)
+        self._streaks: Dict[str, List[int]] = {}
+        self._peak_resettable = False
+        if enabled:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+            self._peak_resettable = reset_peak_rss()
+
+    def profile(self, handler: Callable) -> Callable:
+        """Decorator measuring each invocation; returns the handler itself when disabled."""
+        if not self.enabled:
+            return handler
+
+        @functools.wraps(handler)
+        def wrapper(event, context, *args):
+            tracemalloc.reset_peak()
+            try:
+                return handler(event, context, *args)
+            finally:
+                try:
+                    self.publish_metrics(self.measure())
+                except Exception as e:
+                    logger.warning(f"Memory profile not recorded: {e}")
+                if self._peak_resettable:
+                    reset_peak_rss()
+
+        return wrapper
+
+    def measure(self) -> Dict[str, Any]:
+        """Memory of the invocation that just ended, with the growing and largest sites when a snapshot is due."""
+        self.invocations += 1
+        traced, traced_peak = tracemalloc.get_traced_memory()
+        measurement: Dict[str, Any] = {
+            **resident_set(),
+            'traced_kib': traced / 1024,
+            'traced_peak_kib': traced_peak / 1024,
+            'growing': None,
+            'top_allocators': None
+        }
+        if self.invocations % self.interval == 0:
+            # Sites are filtered after grouping, as filtering the traces of a snapshot costs far more
+            statistics = [statistic for statistic in tracemalloc.take_snapshot().statistics('lineno')
+                          if statistic.traceback[0].filename not in EXCLUDED_FILES]
+            measurement['top_allocators'] = [
+                {'site': site(statistic), 'kib': round(statistic.size / 1024, 1), 'blocks': statistic.count}
+                for statistic in statistics[:self.top]
+            ]
+            sizes = {site(statistic): statistic.size for statistic in statistics}
+            if self._sizes is not None:
+                measurement['growing'] = self._compare(sizes)
+            self._sizes = sizes
+        return measurement
+
+    def _compare(self, sizes: Dict[str, int]) -> List[Dict[str, Any]]:
+        growth = {name: size - self._sizes.get(name, 0) for name, size in sizes.items()
+                  if size > self._sizes.get(name, 0)}
+        streaks = {}
+        for name in sorted(growth, key=growth.get, reverse=True)[:TRACKED_SITES]:
+            streak = self._streaks.get(name, [0, 0])
+            streaks[name] = [streak[0] + 1, streak[1] + growth[name]]
+        self._streaks = streaks
+        growing = [(name, streak) for name, streak in streaks.items() if streak[0] >= self.growth_snapshots]
+        growing.sort(key=lambda item: item[1][1], reverse=True)
+        return [{'site': name, 'snapshots': streak[0], 'grown_kib': round(streak[1] / 1024, 1)}
+                for name, streak in growing[:self.top]]
+
+    def publish_metrics(self, measurement: Dict[str, Any]) -> None:
+        """Print the measurement as an EMF log line."""
+        print(json.dumps(self.emf_document(measurement)))
+        for growing in measurement['growing'] or []:
+            logger.warning(f"Memory at {growing['site']} grew by {growing['grown_kib']} KiB "
+                           f"over {growing['snapshots']} snapshots")
+
+    def emf_document(self, measurement: Dict[str, Any]) -> Dict[str, Any]:
+        metrics = {
+            'MemoryTracedKiB': round(measurement['traced_kib'], 1),
+            'MemoryTracedPeakKiB': round(measurement['traced_peak_kib'], 1)
+        }
+        if 'rss_mib' in measurement:
+            metrics['MemoryRssMiB'] = round(measurement['rss_mib'], 1)
+            metrics['MemoryPeakRssMiB'] = round(measurement['peak_rss_mib'], 1)
+        if measurement['growing'] is not None:
+            metrics['MemoryGrowingSites'] = len(measurement['growing'])
+        dimensions = {'Function': self.function}
+        document = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [list(dimensions.keys())],
+                    'Metrics': [{'Name': name, 'Unit': UNITS[name[-3:]] if name[-3:] in UNITS else 'Count'}
+                                for name in metrics]
+                }]
+            },
+            **dimensions,
+            **metrics,
+            'Invocation': self.invocations
+        }
+        if measurement['top_allocators'] is not None:
+            document['TopAllocators'] = measurement['top_allocators']
+        if measurement['growing']:
+            document['GrowingAllocators'] = measurement['growing']
+        return document
@@ -0,0 +1,323 @@
+"""
+Warm-instance cache for S3 objects read by many invocations.
+
+Reference data such as schemas, dictionaries and JSON configuration is read on
+every invocation but rarely changes. `ObjectCache` keeps objects across warm
+invocations in an LRU bounded by total size, in memory and, when
+OBJECT_CACHE_DIR is set, in a second tier in /tmp that takes objects evicted
+from memory and those too large for it. An entry is served without a request
+for OBJECT_CACHE_TTL_SECONDS; after that it is revalidated with a conditional
+GET (If-None-Match on its ETag), which costs a request but no transfer when the
+object is unchanged. Objects listed in OBJECT_CACHE_PREFETCH ("bucket/key" or
+"s3://bucket/key", comma-separated) are loaded during initialisation, outside
+the billed duration of the first invocation.
+
+With a `SharedCache` on a mounted file system (see shared_cache.py), an object
+missing from this instance is read from the shared tier while it is within the
+TTL, and otherwise fetched or revalidated by one instance for all of them.
+
+Hits, misses, revalidations, refreshes and evictions are counted and emitted
+as a CloudWatch Embedded Metric Format log line by `publish_metrics`, so they
+reach CloudWatch without an API call.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+from shared_cache import SharedCache, SharedEntry
+
+OBJECT_CACHE_MAX_MB = float(os.environ.get('OBJECT_CACHE_MAX_MB', '64'))
+OBJECT_CACHE_TTL_SECONDS = float(os.environ.get('OBJECT_CACHE_TTL_SECONDS', '300'))
+OBJECT_CACHE_DIR = os.environ.get('OBJECT_CACHE_DIR', '')
+OBJECT_CACHE_DISK_MAX_MB = float(os.environ.get('OBJECT_CACHE_DISK_MAX_MB', '256'))
+OBJECT_CACHE_PREFETCH = os.environ.get('OBJECT_CACHE_PREFETCH', '')
+
+# Objects larger than this share of the memory tier go to disk, so one object cannot flush the rest
+MAX_MEMORY_ITEM_SHARE = 0.25
+PREFETCH_CONCURRENCY = 8
+COUNTERS = ('hits', 'shared_hits', 'misses', 'revalidations', 'refreshes', 'evictions', 'errors')
+
+logger = logging.getLogger(__name__)
+
+
+def parse_references(value: str) -> List[Tuple[str, str]]:
+    """Split a comma-separated list of bucket/key or s3://bucket/key references."""
+    references = []
+    for item in value.split(','):
+        item = item.strip()
+        if item.startswith('s3://'):
+            item = item[len('s3://'):]
+        bucket, _, key = item.partition('/')
+        if bucket and key:
+            references.append((bucket, key))
+    return references
+
+
+def is_not_modified(error: ClientError) -> bool:
+    response = error.response
+    return (response.get('ResponseMetadata', {}).get('HTTPStatusCode') == 304
+            or response.get('Error', {}).get('Code') in ('304', 'NotModified'))
+
+
+class _Entry:
+    """One cached object, held in memory (`data`) or in a file (`path`)."""
+
+    __slots__ = ('etag', 'size', 'validated_at', 'data', 'path', 'parsed')
+
+    def __init__(self, etag: str, size: int, data: Optional[bytes] = None, path: Optional[str] = None):
+        self.etag = etag
+        self.size = size
+        self.validated_at = time.monotonic()
+        self.data = data
+        self.path = path
+        self.parsed: Any = None
+
+
+class ObjectCache:
+    """Size-bounded LRU of S3 objects kept across warm invocations, revalidated by ETag."""
+
+    def __init__(self, client: Any, namespace: str, service: str,
+                 max_bytes: int = int(OBJECT_CACHE_MAX_MB * 1024 * 1024),
+                 ttl_seconds: float = OBJECT_CACHE_TTL_SECONDS, directory: str = OBJECT_CACHE_DIR,
+                 max_disk_bytes: int = int(OBJECT_CACHE_DISK_MAX_MB * 1024 * 1024),
+                 expected_owner: Optional[str] = None, shared: Optional[SharedCache] = None):
+        self.client = client
+        self.namespace = namespace
+        self.service = service
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes if directory else 0
+        self.expected_owner = expected_owner
+        self.shared = shared
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self._published = dict(self.counters)
+        self._entries: 'OrderedDict[Tuple[str, str], _Entry]' = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self.counters[counter] += 1
+
+    def get(self, bucket: str, key: str) -> bytes:
+        """Return the object's content, from the cache while it is fresh or unchanged."""
+        return self._content(bucket, key, self._entry(bucket, key))[1]
+
+    def get_json(self, bucket: str, key: str) -> Any:
+        """Return the object parsed as JSON; the parsed value is cached with the content."""
+        entry = self._entry(bucket, key)
+        if entry.parsed is None:
+            entry, content = self._content(bucket, key, entry)
+            entry.parsed = json.loads(content)
+        return entry.parsed
+
+    def _content(self, bucket: str, key: str, entry: _Entry) -> Tuple[_Entry, bytes]:
+        try:
+            return entry, self._read(entry)
+        except FileNotFoundError:
+            # The file was evicted between lookup and read
+            self.invalidate(bucket, key)
+            entry = self._entry(bucket, key)
+            return entry, self._read(entry)
+
+    def invalidate(self, bucket: str, key: str) -> None:
+        with self._lock:
+            entry = self._entries.pop((bucket, key), None)
+            if entry is not None:
+                self._release(entry)
+
+    def prefetch(self, references: List[Tuple[str, str]]) -> int:
+        """Load objects in parallel, logging failures instead of raising; returns how many loaded."""
+        if not references:
+            return 0
+
+        def load(reference: Tuple[str, str]) -> bool:
+            try:
+                self._entry(*reference)
+                return True
+            except Exception as e:
+                logger.warning(f"Could not prefetch s3://{reference[0]}/{reference[1]}: {e}")
+                return False
+
+        with ThreadPoolExecutor(max_workers=min(PREFETCH_CONCURRENCY, len(references))) as pool:
+            return sum(pool.map(load, references))
+
+    def _entry(self, bucket: str, key: str) -> _Entry:
+        cache_key = (bucket, key)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                self._entries.move_to_end(cache_key)
+                if time.monotonic() - entry.validated_at < self.ttl_seconds:
+                    self.counters['hits'] += 1
+                    return entry
+
+        if self.shared is not None:
+            try:
+                return self._shared_entry(cache_key, entry)
+            except OSError as e:
+                logger.warning(f"Shared cache unavailable, reading s3://{bucket}/{key} directly: {e}")
+        fetched = self._fetch(bucket, key, entry.etag if entry is not None else None)
+        if fetched is None:
+            entry.validated_at = time.monotonic()
+            self._count('revalidations')
+            return entry
+        self._count('misses' if entry is None else 'refreshes')
+        etag, data = fetched
+        return self._store(cache_key, _Entry(etag, len(data), data))
+
+    def _fetch(self, bucket: str, key: str, etag: Optional[str]) -> Optional[Tuple[str, bytes]]:
+        """GET the object, conditional on `etag` when given; None when it is unchanged."""
+        kwargs: Dict[str, Any] = {'ExpectedBucketOwner': self.expected_owner} if self.expected_owner else {}
+        if etag is not None:
+            kwargs['IfNoneMatch'] = etag
+        try:
+            response = self.client.get_object(Bucket=bucket, Key=key, **kwargs)  # NOSONAR
+        except ClientError as e:
+            if etag is not None and is_not_modified(e):
+                return None
+            self._count('errors')
+            raise
+        return response.get('ETag', ''), response['Body'].read()
+
+    def _shared_entry(self, cache_key: Tuple[str, str], entry: Optional[_Entry]) -> _Entry:
+        """Load through the shared tier, where one instance fetches or revalidates for all."""
+        bucket, key = cache_key
+        fetched_by_this_instance = False
+
+        def fetch(stale: Optional[SharedEntry]) -> Tuple[bytes, Dict[str, Any]]:
+            nonlocal fetched_by_this_instance
+            fetched_by_this_instance = True
+            etag = stale.meta.get('etag') if stale is not None else entry.etag if entry is not None else None
+            fetched = self._fetch(bucket, key, etag)
+            if fetched is None:
+                self._count('revalidations')
+                return stale.data if stale is not None else self._read(entry), {'etag': etag}
+            self._count('misses' if stale is None and entry is None else 'refreshes')
+            return fetched[1], {'etag': fetched[0]}
+
+        shared = self.shared.get_or_compute(f"s3://{bucket}/{key}", fetch, max_age=self.ttl_seconds)
+        etag = shared.meta.get('etag', '')
+        if not fetched_by_this_instance:
+            self._count('shared_hits')
+        if entry is not None and entry.etag == etag:
+            entry.validated_at = time.monotonic()
+            return entry
+        return self._store(cache_key, _Entry(etag, len(shared.data), shared.data))
+
+    def _read(self, entry: _Entry) -> bytes:
+        data = entry.data
+        if data is not None:
+            return data
+        with open(entry.path, 'rb') as file:
+            return file.read()
+
+    def _store(self, cache_key: Tuple[str, str], entry: _Entry) -> _Entry:
+        with self._lock:
+            previous = self._entries.pop(cache_key, None)
+            if previous is not None:
+                self._release(previous)
+            if entry.size > self.max_bytes * MAX_MEMORY_ITEM_SHARE:
+                if not self._spill(cache_key, entry):
+                    # Too large for either tier; served this time only
+                    return entry
+            else:
+                self.memory_bytes += entry.size
+            self._entries[cache_key] = entry
+            self._evict()
+        return entry
+
+    def _spill(self, cache_key: Tuple[str, str], entry: _Entry) -> bool:
+        """Move an entry's content to the disk tier; False when there is none or it does not fit."""
+        if not self.directory or entry.size > self.max_disk_bytes:
+            return False
+        name = hashlib.sha256(f"{cache_key[0]}/{cache_key[1]}".encode('utf-8')).hexdigest()
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path + '.part', 'wb') as file:
+                file.write(entry.data)
+            os.replace(path + '.part', path)
+        except OSError as e:
+            logger.warning(f"Could not write cache file {path}: {e}")
+            return False
+        entry.path = path
+        entry.data = None
+        self.disk_bytes += entry.size
+        return True
+
+    def _evict(self) -> None:
+        """Demote least recently used entries to disk, then drop them, until both tiers fit."""
+        while self.memory_bytes > self.max_bytes:
+            cache_key, entry = next((item for item in self._entries.items() if item[1].data is not None))
+            self.memory_bytes -= entry.size
+            if not self._spill(cache_key, entry):
+                del self._entries[cache_key]
+                self.counters['evictions'] += 1
+        while self.disk_bytes > self.max_disk_bytes:
+            cache_key, entry = next((item for item in self._entries.items() if item[1].path is not None))
+            del self._entries[cache_key]
+            self._release(entry)
+            self.counters['evictions'] += 1
+
+    def _release(self, entry: _Entry) -> None:
+        if entry.data is not None:
+            self.memory_bytes -= entry.size
+        elif entry.path is not None:
+            self.disk_bytes -= entry.size
+            try:
+                os.unlink(entry.path)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self.counters,
+                'objects': len(self._entries),
+                'memory_bytes': self.memory_bytes,
+                'disk_bytes': self.disk_bytes
+            }
+
+    def publish_metrics(self, dimensions: Optional[Dict[str, str]] = None) -> None:
+        """Print the counters accumulated since the last call as an EMF log line, if any changed."""
+        with self._lock:
+            deltas = {name: self.counters[name] - self._published[name] for name in COUNTERS}
+            self._published = dict(self.counters)
+            memory_bytes, disk_bytes = self.memory_bytes, self.disk_bytes
+        if not any(deltas.values()):
+            return
+        print(json.dumps(self.emf_document(deltas, memory_bytes + disk_bytes, dimensions or {})))
+
+    def emf_document(self, deltas: Dict[str, int], cached_bytes: int, dimensions: Dict[str, str]) -> Dict[str, Any]:
+        metrics = {f"ObjectCache{name.title().replace('_', '')}": value for name, value in deltas.items()}
+        dimensions = {'Service': self.service, **dimensions}
+        return {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [list(dimensions.keys())],
+                    'Metrics': [{'Name': name, 'Unit': 'Count'} for name in metrics] + [
+                        {'Name': 'ObjectCacheBytes', 'Unit': 'Bytes'}
+                    ]
+                }]
+            },
+            **dimensions,
+            **metrics,
+            'ObjectCacheBytes': cached_bytes
+        }
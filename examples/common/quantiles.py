@@ -0,0 +1,73 @@
+"""
+Streaming quantile estimation in fixed memory.
+
+`StreamingQuantiles` keeps counts in logarithmically spaced buckets, so any
+quantile is returned within `relative_error` of a value actually observed,
+whatever the spread of the values, in a few hundred buckets. Counts are halved
+every `half_life` observations, so estimates follow a distribution that drifts,
+such as request latencies over the life of a warm instance, and old samples
+fade instead of pinning the estimate. Adding is O(1) and a quantile costs one
+pass over the buckets. Instances are thread-safe.
+"""
+import math
+import threading
+from typing import List, Optional
+
+
+class StreamingQuantiles:
+    """Approximate quantiles of a stream of positive values, weighted towards recent ones."""
+
+    def __init__(self, relative_error: float = 0.02, min_value: float = 1e-4, max_value: float = 3600.0,
+                 half_life: int = 1000):
+        if not 0 < relative_error < 1:
+            raise ValueError(f"Relative error must be between 0 and 1, got {relative_error}")
+        self.relative_error = relative_error
+        self.min_value = min_value
+        self.max_value = max_value
+        self.half_life = half_life
+        self._gamma = (1 + relative_error) / (1 - relative_error)
+        self._log_gamma = math.log(self._gamma)
+        self._counts: List[float] = [0.0] * (int(math.ceil(math.log(max_value / min_value) / self._log_gamma)) + 1)
+        self._total = 0.0
+        self._since_decay = 0
+        self._observations = 0
+        self._lock = threading.Lock()
+
+    def _bucket(self, value: float) -> int:
+        if value <= self.min_value:
+            return 0
+        return min(int(math.ceil(math.log(value / self.min_value) / self._log_gamma)), len(self._counts) - 1)
+
+    def _value(self, bucket: int) -> float:
+        # Midpoint of the bucket's range, within relative_error of every value in it
+        return self.min_value * 2 * self._gamma ** bucket / (self._gamma + 1)
+
+    def add(self, value: float) -> None:
+        bucket = self._bucket(value)
+        with self._lock:
+            self._counts[bucket] += 1
+            self._total += 1
+            self._observations += 1
+            self._since_decay += 1
+            if self.half_life and self._since_decay >= self.half_life:
+                self._counts = [count / 2 for count in self._counts]
+                self._total /= 2
+                self._since_decay = 0
+
+    @property
+    def observations(self) -> int:
+        """Values added since creation, without decay."""
+        return self._observations
+
+    def quantile(self, fraction: float) -> Optional[float]:
+        """Estimated value below which `fraction` of the (decayed) observations fall; None before any."""
+        with self._lock:
+            if not self._total:
+                return None
+            rank = fraction * self._total
+            seen = 0.0
+            for bucket, count in enumerate(self._counts):
+                seen += count
+                if seen >= rank and count:
+                    return self._value(bucket)
+            return self._value(len(self._counts) - 1)
@@ -0,0 +1,241 @@
+"""
+Opt-in capture of invocation events and the AWS responses they trigger.
+
+When RECORD_BUCKET (or RECORD_FILE, for local runs) is set, each sampled
+invocation is written as one JSON line holding the event, the handler response
+and every call made through an instrumented client with its parameters, response
+or error and duration. Lines are buffered and flushed as gzip-compressed chunks
+at the end of the invocation that fills a chunk or finds it RECORD_FLUSH_SECONDS
+old. Lambda may freeze and recycle an idle instance without running `atexit`,
+so when sampled invocations are sparse, each is written at the end of its own
+invocation. `tools/corpus.py pack` merges chunks into a deduplicated, indexed
+corpus that `tools/replay.py` can run without network access.
+
+Paginators and waiters are not recorded. Recorded payloads include everything
+the function reads, such as decrypted parameters, so the bucket must be private.
+"""
+import atexit
+import base64
+import functools
+import gzip
+import io
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional
+
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+
+RECORD_BUCKET = os.environ.get('RECORD_BUCKET', '')
+RECORD_FILE = os.environ.get('RECORD_FILE', '')
+RECORD_PREFIX = os.environ.get('RECORD_PREFIX', 'corpus/')
+RECORD_SAMPLE_RATE = float(os.environ.get('RECORD_SAMPLE_RATE', '1.0'))
+RECORD_FLUSH_INVOCATIONS = int(os.environ.get('RECORD_FLUSH_INVOCATIONS', '25'))
+RECORD_FLUSH_SECONDS = float(os.environ.get('RECORD_FLUSH_SECONDS', '60'))
+
+# Client attributes that return helpers rather than performing an AWS call
+UNRECORDED_CLIENT_ATTRIBUTES = frozenset({
+    'can_paginate', 'close', 'generate_presigned_post', 'generate_presigned_url',
+    'get_paginator', 'get_waiter'
+})
+
+logger = logging.getLogger(__name__)
+
+
+def encode(value: Any) -> Any:
+    """Convert a boto3 request or response into JSON-safe values."""
+    if isinstance(value, dict):
+        return {key: encode(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode(item) for item in value]
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, datetime):
+        return {'$datetime': value.isoformat()}
+    if isinstance(value, (bytes, bytearray)):
+        return {'$bytes': base64.b64encode(value).decode('ascii')}
+    return str(value)
+
+
+def decode(value: Any) -> Any:
+    """Inverse of `encode`; recorded stream bodies come back as fresh StreamingBody objects."""
+    if isinstance(value, dict):
+        if len(value) == 1:
+            if '$datetime' in value:
+                return datetime.fromisoformat(value['$datetime'])
+            if '$bytes' in value:
+                return base64.b64decode(value['$bytes'])
+            if '$stream' in value:
+                data = base64.b64decode(value['$stream'])
+                return StreamingBody(io.BytesIO(data), len(data))
+        return {key: decode(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    return value
+
+
+class _RecordingClient:
+    """Proxy appending every operation of a boto3 client to the recorder's current invocation."""
+
+    def __init__(self, client: Any, recorder: 'Recorder', service: str):
+        self._client = client
+        self._recorder = recorder
+        self._service = service
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._client, name)
+        if name in UNRECORDED_CLIENT_ATTRIBUTES or name.startswith('_') or not callable(attr):
+            return attr
+
+        recorder = self._recorder
+        service = self._service
+
+        @functools.wraps(attr)
+        def recorded(**kwargs):
+            calls = recorder.calls
+            if calls is None:
+                return attr(**kwargs)
+            call = {'service': service, 'operation': name, 'params': encode(kwargs)}
+            start = perf_counter()
+            try:
+                response = attr(**kwargs)
+            except ClientError as e:
+                call['duration_ms'] = round((perf_counter() - start) * 1000, 3)
+                call['error'] = {
+                    'code': e.response.get('Error', {}).get('Code', ''),
+                    'message': e.response.get('Error', {}).get('Message', ''),
+                    'status': e.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 400)
+                }
+                calls.append(call)
+                raise
+            call['duration_ms'] = round((perf_counter() - start) * 1000, 3)
+            call['response'] = self._capture(response)
+            calls.append(call)
+            return response
+
+        setattr(self, name, recorded)
+        return recorded
+
+    @staticmethod
+    def _capture(response: Any) -> Any:
+        if not isinstance(response, dict):
+            return encode(response)
+        body = response.get('Body')
+        if not isinstance(body, StreamingBody):
+            return encode(response)
+        # Streams can only be read once: keep a copy and hand the caller a fresh one
+        data = body.read()
+        response['Body'] = StreamingBody(io.BytesIO(data), len(data))
+        captured = encode({key: value for key, value in response.items() if key != 'Body'})
+        captured['Body'] = {'$stream': base64.b64encode(data).decode('ascii')}
+        return captured
+
+
+class Recorder:
+    """Buffers recorded invocations and flushes them to S3 or a local file."""
+
+    def __init__(self, function_name: str, bucket: str = RECORD_BUCKET, path: str = RECORD_FILE,
+                 prefix: str = RECORD_PREFIX, sample_rate: float = RECORD_SAMPLE_RATE,
+                 flush_invocations: int = RECORD_FLUSH_INVOCATIONS, flush_seconds: float = RECORD_FLUSH_SECONDS):
+        self.function_name = function_name
+        self.bucket = bucket
+        self.path = path
+        self.prefix = prefix
+        self.sample_rate = sample_rate
+        self.flush_invocations = flush_invocations
+        self.flush_seconds = flush_seconds
+        self.enabled = bool(bucket or path)
+        self.calls: Optional[List[Dict[str, Any]]] = None
+        self._buffer: List[str] = []
+        self._buffer_started = 0.0
+        self._last_append: Optional[float] = None
+        self._chunk = 0
+        self._instance = uuid.uuid4().hex[:12]
+        self._upload_client = None
+        if self.enabled:
+            # Best effort only: a recycled instance exits without running it
+            atexit.register(self.flush)
+
+    def instrument(self, client: Any, service: str) -> Any:
+        """Wrap a boto3 client so that its calls are recorded; returns it unchanged when disabled."""
+        return _RecordingClient(client, self, service) if self.enabled else client
+
+    def record(self, handler: Callable) -> Callable:
+        """Decorator recording the event, response and AWS calls of sampled invocations."""
+        if not self.enabled:
+            return handler
+
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            if random.random() >= self.sample_rate:
+                try:
+                    return handler(event, context)
+                finally:
+                    if self._buffer and time.monotonic() - self._buffer_started >= self.flush_seconds:
+                        self.flush()
+
+            self.calls = []
+            record = {
+                'kind': 'invocation',
+                'function': self.function_name,
+                'timestamp': datetime.now(timezone.utc).isoformat(),
+                'memory_limit_in_mb': int(getattr(context, 'memory_limit_in_mb', 0) or 0),
+                'event': encode(event)
+            }
+            start = perf_counter()
+            try:
+                response = handler(event, context)
+                record['response'] = encode(response)
+                return response
+            except Exception as e:
+                record['error'] = f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                record['duration_ms'] = round((perf_counter() - start) * 1000, 3)
+                record['calls'] = self.calls
+                self.calls = None
+                self._append(json.dumps(record, default=str))
+
+        return wrapper
+
+    def _append(self, line: str) -> None:
+        now = time.monotonic()
+        if not self._buffer:
+            self._buffer_started = now
+        self._buffer.append(line)
+        # The first sampled invocation of an instance, or one after a quiet spell, may be the last before the
+        # instance is recycled: write it now rather than wait for a later invocation that may never come
+        sparse = self._last_append is None or now - self._last_append >= self.flush_seconds
+        self._last_append = now
+        if (sparse or len(self._buffer) >= self.flush_invocations
+                or now - self._buffer_started >= self.flush_seconds):
+            self.flush()
+
+    def flush(self) -> None:
+        """Write buffered invocations as one gzip chunk; recording must never fail an invocation."""
+        if not self._buffer:
+            return
+        data = gzip.compress(('\n'.join(self._buffer) + '\n').encode('utf-8'))
+        self._buffer = []
+        try:
+            if self.path:
+                # Concatenated gzip members read back as a single stream
+                with open(self.path, 'ab') as chunk_file:
+                    chunk_file.write(data)
+            if self.bucket:
+                if self._upload_client is None:
+                    import boto3
+                    self._upload_client = boto3.client('s3')  # NOSONAR
+                key = (f"{self.prefix}{self.function_name}/{datetime.now(timezone.utc):%Y/%m/%d}/"
+                       f"{self._instance}-{self._chunk:06d}.jsonl.gz")
+                self._upload_client.put_object(Bucket=self.bucket, Key=key, Body=data,
+                                               ContentType='application/gzip')
+            self._chunk += 1
+        except Exception as e:
+            logger.warning(f"Dropping recorded invocations: {str(e)}")
@@ -0,0 +1,306 @@
+"""
+Cache shared by every instance of a function through a mounted file system.
+
+Instances of a function do not share memory or /tmp, so each one fetches and
+computes the same artifacts. With an EFS access point mounted through
+`file_system_config`, `SharedCache` lets them share the work: the first
+instance to miss computes the artifact and every other instance reads it.
+
+Content is stored once per content hash under `blobs/`, and each key names its
+blob through a small pointer file under `keys/`. Both are written to a
+temporary file in the same directory and renamed into place, so a reader sees
+the previous version or the new one, never a partial file, and needs no lock.
+`get_or_compute` takes an exclusive-create lease under `leases/` so one
+instance computes a missing key while the others wait for its result. Reads
+refresh a blob's modification time, and a sweep run by one instance at a time
+every SHARED_CACHE_SWEEP_SECONDS removes least recently used blobs once the
+cache holds more than SHARED_CACHE_MAX_MB.
+"""
+import errno
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+SHARED_CACHE_DIR = os.environ.get('SHARED_CACHE_DIR', '')
+SHARED_CACHE_MAX_MB = float(os.environ.get('SHARED_CACHE_MAX_MB', '1024'))
+SHARED_CACHE_SWEEP_SECONDS = float(os.environ.get('SHARED_CACHE_SWEEP_SECONDS', '300'))
+# Longer than any computation; a lease older than this was left by an instance that stopped
+SHARED_CACHE_LEASE_SECONDS = float(os.environ.get('SHARED_CACHE_LEASE_SECONDS', '30'))
+
+# A sweep removes blobs until the cache is below this share of its limit, so it does not run again at once
+LOW_WATERMARK = 0.8
+# Reads move a blob's modification time, the LRU clock, at most this often to save writes
+TOUCH_INTERVAL_SECONDS = 60
+TEMPORARY_PREFIX = '.tmp-'
+SWEEP_LEASE = 'sweep'
+SWEEP_MARKER = 'last-sweep'
+MAX_WAIT_POLL_SECONDS = 1.0
+COUNTERS = ('hits', 'misses', 'computes', 'waits', 'writes', 'evictions')
+
+logger = logging.getLogger(__name__)
+
+
+class SharedEntry(NamedTuple):
+    data: bytes
+    meta: Dict[str, Any]
+    stored_at: float
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.stored_at
+
+
+def _is_gone(error: OSError) -> bool:
+    # ESTALE: the file was removed by another client of the network file system
+    return error.errno in (errno.ENOENT, errno.ESTALE)
+
+
+class SharedCache:
+    """Content-addressed cache in a directory shared by concurrent instances or processes."""
+
+    def __init__(self, directory: str, max_bytes: int = int(SHARED_CACHE_MAX_MB * 1024 * 1024),
+                 sweep_seconds: float = SHARED_CACHE_SWEEP_SECONDS, lease_seconds: float = SHARED_CACHE_LEASE_SECONDS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.sweep_seconds = sweep_seconds
+        self.lease_seconds = lease_seconds
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self._lock = threading.Lock()
+        self._next_sweep_check = 0.0
+        for part in ('blobs', 'keys', 'leases'):
+            os.makedirs(os.path.join(directory, part), exist_ok=True)
+
+    def _count(self, counter: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counters[counter] += amount
+
+    @staticmethod
+    def _digest(value: bytes) -> str:
+        return hashlib.sha256(value).hexdigest()
+
+    def _path(self, kind: str, digest: str) -> str:
+        return os.path.join(self.directory, kind, digest[:2], digest)
+
+    def get(self, key: str) -> Optional[SharedEntry]:
+        """Return the stored entry for `key`, or None; never blocks on writers."""
+        entry = self._read(key)
+        self._count('misses' if entry is None else 'hits')
+        return entry
+
+    def _read(self, key: str) -> Optional[SharedEntry]:
+        try:
+            with open(self._path('keys', self._digest(key.encode('utf-8'))), 'rb') as file:
+                pointer = json.loads(file.read())
+            blob = self._path('blobs', pointer['blob'])
+            with open(blob, 'rb') as file:
+                data = file.read()
+                modified = os.fstat(file.fileno()).st_mtime
+        except OSError as e:
+            if _is_gone(e):
+                # Never written, or the blob was evicted after the pointer was read
+                return None
+            raise
+        except (ValueError, KeyError):
+            return None
+        if len(data) != pointer['size']:
+            return None
+        if time.time() - modified > TOUCH_INTERVAL_SECONDS:
+            try:
+                os.utime(blob)
+            except OSError:
+                pass
+        return SharedEntry(data, pointer.get('meta', {}), pointer['stored_at'])
+
+    def put(self, key: str, data: bytes, meta: Optional[Dict[str, Any]] = None) -> SharedEntry:
+        """Store `data` under `key`; content already stored under another key is not written again."""
+        entry = SharedEntry(data, meta or {}, time.time())
+        if len(data) > self.max_bytes * LOW_WATERMARK:
+            return entry
+        digest = self._digest(data)
+        blob = self._path('blobs', digest)
+        try:
+            # Refreshing the existing copy also keeps a sweep from removing it before the pointer is written
+            os.utime(blob)
+        except FileNotFoundError:
+            self._write(blob, data)
+            self._count('writes')
+        pointer = {'blob': digest, 'size': len(data), 'stored_at': entry.stored_at, 'meta': entry.meta}
+        self._write(self._path('keys', self._digest(key.encode('utf-8'))), json.dumps(pointer).encode('utf-8'))
+        self.maybe_sweep()
+        return entry
+
+    @staticmethod
+    def _write(path: str, data: bytes) -> None:
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(prefix=TEMPORARY_PREFIX, dir=directory)
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                file.write(data)
+            os.replace(temporary, path)
+        except BaseException:
+            try:
+                os.unlink(temporary)
+            except OSError:
+                pass
+            raise
+
+    def get_or_compute(self, key: str, compute: Callable[[Optional[SharedEntry]], Tuple[bytes, Dict[str, Any]]],
+                       max_age: Optional[float] = None, wait_seconds: Optional[float] = None) -> SharedEntry:
+        """Return the entry for `key`, computing it in one instance at a time when missing or stale.
+
+        `compute` receives the stale entry, if any, and returns the content and
+        metadata to store. Instances that find another one computing poll for
+        its result for up to `wait_seconds` (the lease duration by default),
+        then compute it themselves.
+        """
+        name = self._digest(key.encode('utf-8'))
+        deadline = time.monotonic() + (self.lease_seconds if wait_seconds is None else wait_seconds)
+        delay = 0.01
+        waited = False
+        while True:
+            entry = self._read(key)
+            if entry is not None and (max_age is None or entry.age < max_age):
+                self._count('hits')
+                return entry
+            leased = self._acquire(name)
+            if leased:
+                # Another instance may have finished between the read and the lease
+                entry = self._read(key) or entry
+                if entry is not None and (max_age is None or entry.age < max_age):
+                    self._release(name)
+                    self._count('hits')
+                    return entry
+                break
+            if time.monotonic() >= deadline:
+                logger.warning(f"Computing {key} although another instance holds its lease")
+                break
+            if not waited:
+                waited = True
+                self._count('waits')
+            time.sleep(delay)
+            delay = min(delay * 2, MAX_WAIT_POLL_SECONDS)
+
+        self._count('computes')
+        try:
+            data, meta = compute(entry)
+            return self.put(key, data, meta)
+        finally:
+            if leased:
+                self._release(name)
+
+    def _acquire(self, name: str) -> bool:
+        """Take the lease `name` by exclusive create, replacing one its holder abandoned."""
+        path = os.path.join(self.directory, 'leases', name)
+        for _ in range(2):
+            try:
+                descriptor = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                try:
+                    if time.time() - os.stat(path).st_mtime < self.lease_seconds:
+                        return False
+                    # Two instances can both remove an abandoned lease; the worst case is a second computation
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            os.close(descriptor)
+            return True
+        return False
+
+    def _release(self, name: str) -> None:
+        try:
+            os.unlink(os.path.join(self.directory, 'leases', name))
+        except FileNotFoundError:
+            pass
+
+    def maybe_sweep(self) -> Optional[Dict[str, int]]:
+        """Sweep if no instance has for `sweep_seconds`; returns the sweep's result if this one ran it."""
+        if time.monotonic() < self._next_sweep_check:
+            return None
+        self._next_sweep_check = time.monotonic() + min(self.sweep_seconds, TOUCH_INTERVAL_SECONDS)
+        marker = os.path.join(self.directory, SWEEP_MARKER)
+        try:
+            if time.time() - os.stat(marker).st_mtime < self.sweep_seconds:
+                return None
+        except FileNotFoundError:
+            pass
+        if not self._acquire(SWEEP_LEASE):
+            return None
+        try:
+            with open(marker, 'a'):
+                os.utime(marker)
+            return self.sweep()
+        finally:
+            self._release(SWEEP_LEASE)
+
+    def sweep(self) -> Dict[str, int]:
+        """Remove least recently used blobs past the size limit, and files abandoned by stopped writers."""
+        blobs: List[Tuple[float, int, str]] = []
+        total = 0
+        for path, stat in self._files('blobs'):
+            blobs.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        self._files('leases')
+
+        evicted = 0
+        evicted_bytes = 0
+        if total > self.max_bytes:
+            target = self.max_bytes * LOW_WATERMARK
+            for _, size, path in sorted(blobs):
+                if total <= target:
+                    break
+                try:
+                    os.unlink(path)
+                except OSError as e:
+                    if not _is_gone(e):
+                        raise
+                total -= size
+                evicted += 1
+                evicted_bytes += size
+            self._count('evictions', evicted)
+            self._prune_pointers()
+        return {'blobs': len(blobs) - evicted, 'bytes': total, 'evicted': evicted, 'evicted_bytes': evicted_bytes}
+
+    def _files(self, kind: str) -> List[Tuple[str, os.stat_result]]:
+        """Stat the files under `kind`, removing temporary files and leases older than the lease duration."""
+        files = []
+        now = time.time()
+        root = os.path.join(self.directory, kind)
+        for directory in [root] + [entry.path for entry in os.scandir(root) if entry.is_dir()]:
+            for entry in os.scandir(directory):
+                if entry.is_dir():
+                    continue
+                try:
+                    stat = entry.stat()
+                    if (entry.name.startswith(TEMPORARY_PREFIX) or kind == 'leases') \
+                            and now - stat.st_mtime > self.lease_seconds:
+                        os.unlink(entry.path)
+                        continue
+                except OSError as e:
+                    if _is_gone(e):
+                        continue
+                    raise
+                if not entry.name.startswith(TEMPORARY_PREFIX):
+                    files.append((entry.path, stat))
+        return files
+
+    def _prune_pointers(self) -> None:
+        """Remove pointers to evicted blobs; readers treat them as misses until then."""
+        for path, _ in self._files('keys'):
+            try:
+                with open(path, 'rb') as file:
+                    digest = json.loads(file.read())['blob']
+                if not os.path.exists(self._path('blobs', digest)):
+                    os.unlink(path)
+            except (OSError, ValueError, KeyError):
+                continue
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counters)
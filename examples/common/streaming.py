@@ -0,0 +1,263 @@
+"""
+Response streaming for Python handlers behind a RESPONSE_STREAM function URL.
+
+The managed Python runtime only returns buffered responses, so streaming needs
+its own runtime loop. With `AWS_LAMBDA_EXEC_WRAPPER` pointing at the bundled
+`stream_bootstrap` script, this module replaces the runtime interface client: it
+polls the Lambda Runtime API and hands function URL requests to the function
+named by STREAM_HANDLER together with a `ResponseStream`, whose chunks are sent
+as they are written. Every other event goes to the regular `_HANDLER` and is
+answered with a buffered response.
+
+A stream handler has the signature `handler(event, context, stream)`. Wrapped
+with `buffered()`, the same function also works in the standard runtime, where
+the stream is collected into an ordinary response subject to the 6 MB limit.
+"""
+import base64
+import http.client
+import importlib
+import json
+import os
+import sys
+import time
+import traceback
+from typing import Any, Callable, Dict, List, Optional
+
+RUNTIME_API_VERSION = '2018-06-01'
+HTTP_INTEGRATION_CONTENT_TYPE = 'application/vnd.awslambda.http-integration-response'
+# Separates the JSON prelude with status and headers from the body of a streamed function URL response
+PRELUDE_DELIMITER = b'\x00' * 8
+TEXT_CONTENT_TYPES = ('text/', 'application/json', 'application/x-ndjson')
+# Small writes are coalesced into chunks of at least this size unless flushed
+STREAM_FLUSH_BYTES = 64 * 1024
+
+StreamHandler = Callable[[Dict[str, Any], Any, 'ResponseStream'], None]
+
+
+def is_function_url_request(event: Any) -> bool:
+    """True for function URL (HTTP API payload v2) events."""
+    return isinstance(event, dict) and 'rawPath' in event and 'requestContext' in event
+
+
+class ResponseStream:
+    """Writable response body; status and headers can be set until the first write."""
+
+    def __init__(self, flush_bytes: int = STREAM_FLUSH_BYTES):
+        self.status_code = 200
+        self.headers: Dict[str, str] = {'Content-Type': 'application/octet-stream'}
+        self.flush_bytes = flush_bytes
+        self.bytes_written = 0
+        self.started = False
+        self.closed = False
+        self._pending: List[bytes] = []
+        self._pending_bytes = 0
+
+    def start(self, status_code: int = 200, headers: Optional[Dict[str, str]] = None) -> None:
+        if self.started:
+            raise RuntimeError('Response already started')
+        self.status_code = status_code
+        self.headers.update(headers or {})
+
+    def write(self, data: bytes) -> None:
+        if not self.started:
+            self.started = True
+            self._begin()
+        if data:
+            self._pending.append(data)
+            self._pending_bytes += len(data)
+            self.bytes_written += len(data)
+            if self._pending_bytes >= self.flush_bytes:
+                self.flush()
+
+    def flush(self) -> None:
+        """Send everything written so far."""
+        if self._pending:
+            self._write(b''.join(self._pending))
+            self._pending = []
+            self._pending_bytes = 0
+
+    def write_json_line(self, record: Dict[str, Any]) -> None:
+        """Write one NDJSON line."""
+        self.write((json.dumps(record, default=str) + '\n').encode('utf-8'))
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        if not self.started:
+            self.started = True
+            self._begin()
+        self.closed = True
+        self.flush()
+        self._end()
+
+    def _begin(self) -> None:
+        pass
+
+    def _write(self, data: bytes) -> None:
+        raise NotImplementedError
+
+    def _end(self) -> None:
+        pass
+
+
+class BufferedResponseStream(ResponseStream):
+    """Collects the stream into a function URL response dict."""
+
+    def __init__(self):
+        super().__init__(flush_bytes=0)
+        self._chunks: List[bytes] = []
+
+    def _write(self, data: bytes) -> None:
+        self._chunks.append(data)
+
+    def response(self) -> Dict[str, Any]:
+        body = b''.join(self._chunks)
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith(TEXT_CONTENT_TYPES):
+            return {'statusCode': self.status_code, 'headers': self.headers, 'body': body.decode('utf-8')}
+        return {
+            'statusCode': self.status_code,
+            'headers': self.headers,
+            'body': base64.b64encode(body).decode('ascii'),
+            'isBase64Encoded': True
+        }
+
+
+class RuntimeResponseStream(ResponseStream):
+    """Streams an invocation response to the Runtime API as chunked HTTP."""
+
+    def __init__(self, runtime_api: str, request_id: str, flush_bytes: int = STREAM_FLUSH_BYTES):
+        super().__init__(flush_bytes)
+        self._connection = http.client.HTTPConnection(runtime_api)
+        self._path = f"/{RUNTIME_API_VERSION}/runtime/invocation/{request_id}/response"
+
+    def _begin(self) -> None:
+        connection = self._connection
+        connection.putrequest('POST', self._path)
+        connection.putheader('Lambda-Runtime-Function-Response-Mode', 'streaming')
+        connection.putheader('Content-Type', HTTP_INTEGRATION_CONTENT_TYPE)
+        connection.putheader('Transfer-Encoding', 'chunked')
+        connection.putheader('Trailer', 'Lambda-Runtime-Function-Error-Type, Lambda-Runtime-Function-Error-Body')
+        connection.endheaders()
+        prelude = json.dumps({'statusCode': self.status_code, 'headers': self.headers, 'cookies': []})
+        self._write(prelude.encode('utf-8') + PRELUDE_DELIMITER)
+
+    def _write(self, data: bytes) -> None:
+        self._connection.send(b'%x\r\n' % len(data) + data + b'\r\n')
+
+    def _end(self, trailers: bytes = b'') -> None:
+        self._connection.send(b'0\r\n' + trailers + b'\r\n')
+        self._connection.getresponse().read()
+        self._connection.close()
+
+    def fail(self, error: BaseException) -> None:
+        """Abort a stream that already started, reporting the error in the trailers."""
+        self.closed = True
+        self._pending = []
+        body = base64.b64encode(json.dumps(error_payload(error)).encode('utf-8'))
+        self._end(b'Lambda-Runtime-Function-Error-Type: ' + type(error).__name__.encode('utf-8') + b'\r\n'
+                  b'Lambda-Runtime-Function-Error-Body: ' + body + b'\r\n')
+
+
+class RuntimeContext:
+    """Lambda context built from Runtime API headers and the runtime environment."""
+
+    def __init__(self, headers: Any):
+        self.aws_request_id = headers['Lambda-Runtime-Aws-Request-Id']
+        self.invoked_function_arn = headers.get('Lambda-Runtime-Invoked-Function-Arn', '')
+        self.function_name = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', '')
+        self.function_version = os.environ.get('AWS_LAMBDA_FUNCTION_VERSION', '$LATEST')
+        self.memory_limit_in_mb = int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', '128'))
+        self.log_group_name = os.environ.get('AWS_LAMBDA_LOG_GROUP_NAME', '')
+        self.log_stream_name = os.environ.get('AWS_LAMBDA_LOG_STREAM_NAME', '')
+        self._deadline_ms = int(headers.get('Lambda-Runtime-Deadline-Ms', '0'))
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(self._deadline_ms - int(time.time() * 1000), 0)
+
+
+def error_payload(error: BaseException) -> Dict[str, Any]:
+    return {
+        'errorMessage': str(error),
+        'errorType': type(error).__name__,
+        'stackTrace': traceback.format_exception(type(error), error, error.__traceback__)
+    }
+
+
+def buffered(stream_handler: StreamHandler) -> Callable[[Dict[str, Any], Any], Dict[str, Any]]:
+    """Adapt a stream handler to the buffered handler signature."""
+    def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        stream = BufferedResponseStream()
+        stream_handler(event, context, stream)
+        stream.close()
+        return stream.response()
+    return handler
+
+
+def _post(runtime_api: str, path: str, payload: Any, headers: Optional[Dict[str, str]] = None) -> None:
+    connection = http.client.HTTPConnection(runtime_api)
+    connection.request('POST', path, json.dumps(payload, default=str).encode('utf-8'),
+                       {'Content-Type': 'application/json', **(headers or {})})
+    connection.getresponse().read()
+    connection.close()
+
+
+def run(handler: Callable, stream_handler: Optional[StreamHandler] = None, runtime_api: Optional[str] = None,
+        invocations: Optional[int] = None) -> None:
+    """Serve invocations from the Runtime API; `invocations` bounds the loop for local runs."""
+    runtime_api = runtime_api or os.environ['AWS_LAMBDA_RUNTIME_API']
+    base = f"/{RUNTIME_API_VERSION}/runtime/invocation"
+    served = 0
+    connection = http.client.HTTPConnection(runtime_api)
+    while invocations is None or served < invocations:
+        connection.request('GET', f"{base}/next")
+        response = connection.getresponse()
+        event = json.loads(response.read() or b'null')
+        context = RuntimeContext(response.headers)
+        request_id = context.aws_request_id
+        if 'Lambda-Runtime-Trace-Id' in response.headers:
+            os.environ['_X_AMZN_TRACE_ID'] = response.headers['Lambda-Runtime-Trace-Id']
+        served += 1
+
+        if stream_handler is not None and is_function_url_request(event):
+            stream = RuntimeResponseStream(runtime_api, request_id)
+            try:
+                stream_handler(event, context, stream)
+                stream.close()
+            except Exception as e:
+                if stream.started:
+                    stream.fail(e)
+                else:
+                    _post(runtime_api, f"{base}/{request_id}/error", error_payload(e),
+                          {'Lambda-Runtime-Function-Error-Type': type(e).__name__})
+            continue
+
+        try:
+            result = handler(event, context)
+        except Exception as e:
+            _post(runtime_api, f"{base}/{request_id}/error", error_payload(e),
+                  {'Lambda-Runtime-Function-Error-Type': type(e).__name__})
+            continue
+        _post(runtime_api, f"{base}/{request_id}/response", result)
+    connection.close()
+
+
+def _resolve(name: str) -> Callable:
+    module_name, _, function_name = name.rpartition('.')
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def main() -> None:
+    sys.path.insert(0, os.environ.get('LAMBDA_TASK_ROOT', os.getcwd()))
+    try:
+        handler = _resolve(os.environ['_HANDLER'])
+        stream_handler = _resolve(os.environ['STREAM_HANDLER']) if os.environ.get('STREAM_HANDLER') else None
+    except Exception as e:
+        _post(os.environ['AWS_LAMBDA_RUNTIME_API'], f"/{RUNTIME_API_VERSION}/runtime/init/error", error_payload(e),
+              {'Lambda-Runtime-Function-Error-Type': 'Runtime.ImportModuleError'})
+        raise
+    run(handler, stream_handler)
+
+
+if __name__ == '__main__':
+    main()
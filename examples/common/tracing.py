@@ -0,0 +1,291 @@
+"""
+Lightweight per-invocation latency tracing for Lambda handlers.
+
+Whether an invocation is traced is decided when it starts: a TRACE_SAMPLE_RATE
+share of invocations, and every invocation sampled by X-Ray, record their spans
+with perf_counter_ns as tuples in a list that is reused across invocations.
+Only those invocations build the Server-Timing header and the CloudWatch EMF
+log line, and the ones sampled by X-Ray also send their spans to the X-Ray
+daemon as subsegments. The rest do not read the clock at all.
+"""
+import functools
+import json
+import os
+import socket
+import time
+from random import random
+from time import perf_counter_ns
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', 'true').lower() == 'true'
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.001'))
+
+XRAY_DAEMON_HEADER = b'{"format": "json", "version": 1}\n'
+
+# Client attributes that return helpers rather than performing an AWS call
+UNTRACED_CLIENT_ATTRIBUTES = frozenset({
+    'can_paginate', 'close', 'generate_presigned_post', 'generate_presigned_url',
+    'get_paginator', 'get_waiter'
+})
+
+
+class _Span:
+    """Reusable context manager recording one named span into its tracer."""
+
+    __slots__ = ('_tracer', '_name', '_category', '_starts')
+
+    def __init__(self, tracer: 'Tracer', name: str, category: str):
+        self._tracer = tracer
+        self._name = name
+        self._category = category
+        # A stack, so that the same span can be entered again while it is open
+        self._starts: List[int] = []
+
+    def __enter__(self):
+        self._starts.append(perf_counter_ns())
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._tracer.spans.append(
+            (self._name, self._category, self._starts.pop(), perf_counter_ns(), exc_type is not None)
+        )
+        return False
+
+
+class _NoopSpan:
+    """Span used while the invocation is not traced."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class _TracedClient:
+    """Proxy recording an 'aws' span around every operation of a boto3 client."""
+
+    def __init__(self, client: Any, tracer: 'Tracer', service: str):
+        self._client = client
+        self._tracer = tracer
+        self._service = service
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._client, name)
+        if name in UNTRACED_CLIENT_ATTRIBUTES or name.startswith('_') or not callable(attr):
+            return attr
+
+        tracer = self._tracer
+        span_name = f"{self._service}.{name}"
+
+        @functools.wraps(attr)
+        def traced(*args, **kwargs):
+            if not tracer.recording:
+                return attr(*args, **kwargs)
+            spans = tracer.spans
+            start = perf_counter_ns()
+            failed = True
+            try:
+                result = attr(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                spans.append((span_name, 'aws', start, perf_counter_ns(), failed))
+
+        # Cache the wrapper so later lookups bypass __getattr__
+        setattr(self, name, traced)
+        return traced
+
+
+class Tracer:
+    """Records spans for one invocation at a time and reports where the time went."""
+
+    def __init__(self, service: str, namespace: str, enabled: bool = TRACING_ENABLED,
+                 sample_rate: float = TRACE_SAMPLE_RATE):
+        self.service = service
+        self.namespace = namespace
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.spans: List[Tuple] = []
+        # Whether the current invocation is sampled, and so records its spans
+        self.recording = False
+        self._xray_sampled = False
+        self._start_ns = perf_counter_ns()
+        self._span_cache: Dict[Tuple[str, str], _Span] = {}
+        # The runtime only sets a daemon address when X-Ray tracing is active for the function
+        self._xray_active = bool(os.environ.get('AWS_XRAY_DAEMON_ADDRESS'))
+        self._xray_socket: Optional[socket.socket] = None
+
+    def start_invocation(self) -> None:
+        """Decide whether the invocation is sampled and, if it is, start recording its spans."""
+        if not self.enabled:
+            self.recording = False
+            return
+        if self._xray_active:
+            # The runtime sets the trace header per invocation
+            self._xray_sampled = 'Sampled=1' in os.environ.get('_X_AMZN_TRACE_ID', '')
+            self.recording = self._xray_sampled or random() < self.sample_rate
+        else:
+            self.recording = random() < self.sample_rate
+        # Unsampled invocations do not even read the clock
+        if self.recording:
+            self.spans.clear()
+            self._start_ns = perf_counter_ns()
+
+    def span(self, name: str, category: str = 'stage'):
+        """Return a context manager recording a span named `name`."""
+        if not self.recording:
+            return NOOP_SPAN
+        span = self._span_cache.get((name, category))
+        if span is None:
+            span = self._span_cache[(name, category)] = _Span(self, name, category)
+        return span
+
+    def trace(self, name: Optional[str] = None, category: str = 'stage') -> Callable:
+        """Decorator recording a span around every call of the wrapped function."""
+        def decorator(func: Callable) -> Callable:
+            span_name = name or func.__name__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.recording:
+                    return func(*args, **kwargs)
+                spans = self.spans
+                start = perf_counter_ns()
+                failed = True
+                try:
+                    result = func(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    spans.append((span_name, category, start, perf_counter_ns(), failed))
+
+            return wrapper
+        return decorator
+
+    def instrument(self, client: Any, service: str) -> Any:
+        """Wrap a boto3 client so that each of its calls is recorded as a span."""
+        return _TracedClient(client, self, service)
+
+    def elapsed_ms(self) -> float:
+        """Milliseconds since the invocation started."""
+        return (perf_counter_ns() - self._start_ns) / 1e6
+
+    def breakdown(self) -> Dict[str, float]:
+        """Total milliseconds spent per span name, plus the invocation total."""
+        totals: Dict[str, float] = {}
+        for name, _, start, end, _ in self.spans:
+            totals[name] = totals.get(name, 0) + (end - start)
+        result = {name: round(ns / 1e6, 3) for name, ns in totals.items()}
+        result['total'] = round(self.elapsed_ms(), 3)
+        return result
+
+    def start_epoch(self) -> float:
+        """Wall clock time at which the invocation started."""
+        return time.time() - (perf_counter_ns() - self._start_ns) / 1e9
+
+    def server_timing(self) -> str:
+        """Latency breakdown formatted as a Server-Timing header value, one entry per span."""
+        if not self.enabled:
+            return ''
+        entries = [f"{name};dur={(end - start) / 1e6:.3f}" for name, _, start, end, _ in self.spans]
+        entries.append(f"total;dur={(perf_counter_ns() - self._start_ns) / 1e6:.3f}")
+        return ', '.join(entries)
+
+    def finish_invocation(self, dimensions: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        """
+        Report a sampled invocation and stop recording.
+
+        Emits the EMF document and, for invocations sampled by X-Ray, the subsegments,
+        and returns the Server-Timing response header. Unsampled invocations get no header.
+        """
+        if not self.recording:
+            return {}
+        self.recording = False
+
+        if self._xray_sampled:
+            self._send_xray_subsegments(parse_trace_header(os.environ.get('_X_AMZN_TRACE_ID', '')))
+
+        print(json.dumps(self.emf_document(self.elapsed_ms(), dimensions or {})))
+        return {'Server-Timing': self.server_timing()}
+
+    def emf_document(self, total_ms: float, dimensions: Dict[str, str]) -> Dict[str, Any]:
+        """Build a CloudWatch Embedded Metric Format document for the current spans."""
+        category_totals: Dict[str, int] = {}
+        for _, category, start, end, _ in self.spans:
+            category_totals[category] = category_totals.get(category, 0) + (end - start)
+
+        metrics = {f"{category.capitalize()}Latency": round(ns / 1e6, 3) for category, ns in category_totals.items()}
+        metrics['TotalLatency'] = round(total_ms, 3)
+
+        return {
+            '_aws': {
+                'Timestamp': int(self.start_epoch() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [list(dimensions.keys())],
+                    'Metrics': [{'Name': name, 'Unit': 'Milliseconds'} for name in metrics]
+                }]
+            },
+            **dimensions,
+            **metrics,
+            'service': self.service,
+            'spans': [
+                {
+                    'name': name,
+                    'category': category,
+                    'start_ms': round((start - self._start_ns) / 1e6, 3),
+                    'duration_ms': round((end - start) / 1e6, 3),
+                    'error': error
+                }
+                for name, category, start, end, error in self.spans
+            ]
+        }
+
+    def xray_subsegments(self, trace_header: Dict[str, str]) -> List[Dict[str, Any]]:
+        """Build X-Ray subsegment documents parented to the Lambda function segment."""
+        start_epoch = self.start_epoch()
+        return [
+            {
+                'name': name,
+                'id': os.urandom(8).hex(),
+                'trace_id': trace_header['Root'],
+                'parent_id': trace_header['Parent'],
+                'type': 'subsegment',
+                'namespace': 'aws' if category == 'aws' else 'local',
+                'start_time': start_epoch + (start - self._start_ns) / 1e9,
+                'end_time': start_epoch + (end - self._start_ns) / 1e9,
+                'error': error
+            }
+            for name, category, start, end, error in self.spans
+        ]
+
+    def _send_xray_subsegments(self, trace_header: Dict[str, str]) -> None:
+        address = os.environ.get('AWS_XRAY_DAEMON_ADDRESS')
+        if not address or 'Root' not in trace_header or 'Parent' not in trace_header:
+            return
+
+        host, _, port = address.rpartition(':')
+        try:
+            if self._xray_socket is None:
+                self._xray_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            for subsegment in self.xray_subsegments(trace_header):
+                self._xray_socket.sendto(XRAY_DAEMON_HEADER + json.dumps(subsegment).encode('utf-8'), (host, int(port)))
+        except OSError:
+            # Tracing must never fail the invocation
+            pass
+
+
+def parse_trace_header(header: str) -> Dict[str, str]:
+    """Parse an X-Amzn-Trace-Id header such as 'Root=1-...;Parent=...;Sampled=1'."""
+    fields = {}
+    for part in header.split(';'):
+        key, _, value = part.partition('=')
+        if value:
+            fields[key.strip()] = value.strip()
+    return fields
@@ -30,3 +30,5 @@ data "aws_subnets" "private" {
 data "aws_kms_key" "sns" {
   key_id = "alias/aws/sns"
 }
+
+data "aws_caller_identity" "current" {}
@@ -2,8 +2,11 @@ import json
 import logging
 import os
 import socket
+import sys
+import tempfile
 import time
 import random
+import uuid
 import urllib.request
 import urllib.error
 from datetime import datetime
@@ -13,17 +16,61 @@ from datetime import datetime, timezone
 import boto3
 from botocore.exceptions import ClientError
 
-# Configure logging
+# Shared helpers sit next to this file in the deployment package and in examples/common in the source tree
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from recording import Recorder  # noqa: E402
+from tracing import Tracer  # noqa: E402
+from object_cache import OBJECT_CACHE_PREFETCH, ObjectCache, parse_references  # noqa: E402
+from shared_cache import SHARED_CACHE_DIR, SharedCache  # noqa: E402
+from breaker import BREAKER_SPOOL_DIR, Breakers, CircuitOpenError, Spool, is_service_failure  # noqa: E402
+from log_shipping import LogShipper  # noqa: E402
+from memory_profile import MemoryProfiler  # noqa: E402
+
+# Configure logging; JSON lines tagged with the request id, see log_shipping.py
 # sonar-ignore-start
+log_shipper = LogShipper('complete-lambda-example').install()
 logger = logging.getLogger()
-logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
 APPLICATION_JSON = "application/json"
+METRICS_NAMESPACE = 'Lambda/CompleteExample'
+
+# Latency tracing for AWS calls, handler stages and serialization
+tracer = Tracer('complete-lambda-example', METRICS_NAMESPACE)
+
+# Opt-in capture of events and AWS responses for offline replay
+recorder = Recorder('complete-lambda-example')
+
+# Opt-in tracemalloc profile per invocation and growth across warm invocations; see memory_profile.py
+memory_profiler = MemoryProfiler(METRICS_NAMESPACE, 'complete-lambda-example')
+
+# Per-service circuit breakers for SNS, SQS and CloudWatch, kept across warm invocations
+breakers = Breakers(METRICS_NAMESPACE, 'complete-lambda-example')
+
 # Initialize AWS clients
-s3_client = boto3.client('s3') # NOSONAR
-sns_client = boto3.client('sns') # NOSONAR
-sqs_client = boto3.client('sqs') # NOSONAR
-ssm_client = boto3.client('ssm') # NOSONAR
-cloudwatch_client = boto3.client('cloudwatch') # NOSONAR
+s3_client = tracer.instrument(recorder.instrument(boto3.client('s3'), 's3'), 's3') # NOSONAR
+sns_client = breakers.instrument(tracer.instrument(recorder.instrument(boto3.client('sns'), 'sns'), 'sns'), 'sns') # NOSONAR
+sqs_client = breakers.instrument(tracer.instrument(recorder.instrument(boto3.client('sqs'), 'sqs'), 'sqs'), 'sqs') # NOSONAR
+ssm_client = tracer.instrument(recorder.instrument(boto3.client('ssm'), 'ssm'), 'ssm') # NOSONAR
+cloudwatch_client = breakers.instrument(
+    tracer.instrument(recorder.instrument(boto3.client('cloudwatch'), 'cloudwatch'), 'cloudwatch'), 'cloudwatch'
+) # NOSONAR
+lambda_client = tracer.instrument(recorder.instrument(boto3.client('lambda'), 'lambda'), 'lambda') # NOSONAR
+
+# Reference data kept across warm invocations; OBJECT_CACHE_PREFETCH objects are loaded during init.
+# With the EFS mount, instances share what any of them fetched
+shared_cache = SharedCache(SHARED_CACHE_DIR) if SHARED_CACHE_DIR else None
+object_cache = ObjectCache(s3_client, METRICS_NAMESPACE, 'complete-lambda-example', shared=shared_cache)
+object_cache.prefetch(parse_references(OBJECT_CACHE_PREFETCH))
+
+# Notifications and forwarded messages wait here while SNS or SQS is failing
+SPOOL_DIR = BREAKER_SPOOL_DIR or os.path.join(tempfile.gettempdir(), 'breaker-spool')
+sns_spool = Spool(os.path.join(SPOOL_DIR, 'sns.jsonl'))
+sqs_spool = Spool(os.path.join(SPOOL_DIR, 'sqs.jsonl'))
+
+# Warmer configuration
+INSTANCE_ID = str(uuid.uuid4())
+INITIALIZATION_TYPE = os.environ.get('AWS_LAMBDA_INITIALIZATION_TYPE', 'on-demand')
+WARMER_DELAY_MS = int(os.environ.get('WARMER_DELAY_MS', '75'))
+WARMER_MAX_CONCURRENCY = 50
 
 def identify_event_source(event):
     """Identify the source of the Lambda invocation"""
@@ -61,12 +108,43 @@ def send_custom_metric(metric_name, value, unit='Count', dimensions=None):
             metric_data['Dimensions'] = dimensions
 
         cloudwatch_client.put_metric_data(
-            Namespace='Lambda/CompleteExample',
+            Namespace=METRICS_NAMESPACE,
             MetricData=[metric_data]
         )
         logger.debug(f"Custom metric sent: {metric_name} = {value}")
     except Exception as e:
-        logger.error(f"Error sending custom metric: {e}")
+        if not isinstance(e, CircuitOpenError):
+            logger.error(f"Error sending custom metric: {e}")
+        # CloudWatch Logs turns this line into the same metric without calling the CloudWatch API
+        print(json.dumps(emf_metric(metric_name, value, unit, dimensions)))
+
+def emf_metric(metric_name, value, unit='Count', dimensions=None):
+    """Build a CloudWatch Embedded Metric Format document for one metric"""
+    names = {dimension['Name']: dimension['Value'] for dimension in dimensions or []}
+    return {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [list(names)],
+                'Metrics': [{'Name': metric_name, 'Unit': unit}]
+            }]
+        },
+        **names,
+        metric_name: value
+    }
+
+def deliver(spool, send, **message):
+    """Send a message after those kept for its service, or keep it in /tmp while the service is failing"""
+    try:
+        if spool.drain(send):
+            send(**message)
+            return 'sent'
+    except Exception as e:
+        if not isinstance(e, CircuitOpenError) and not is_service_failure(e):
+            raise
+        logger.warning(f"Keeping message for a later invocation: {e}")
+    return 'spooled' if spool.append(message) else 'dropped'
 
 def get_ssm_parameters():
     """Retrieve all SSM parameters for the function"""
@@ -227,6 +305,7 @@ def test_all_permissions():
 
     return results
 
+@tracer.trace()
 def handle_s3_event(record):
     """Handle S3 event"""
     try:
@@ -262,8 +341,11 @@ def handle_s3_event(record):
         }
 
         topic_arn = os.environ.get('SNS_TOPIC_ARN')
+        notification = None
         if topic_arn:
-            sns_client.publish(
+            notification = deliver(
+                sns_spool,
+                sns_client.publish,
                 TopicArn=topic_arn,
                 Subject=f"S3 Event: {event_name}",
                 Message=json.dumps(sns_message)
@@ -277,6 +359,7 @@ def handle_s3_event(record):
             'object_size': object_size,
             'content_type': content_type,
             'last_modified': str(last_modified) if last_modified else None,
+            'notification': notification,
             'processed_at': datetime.now(timezone.utc).isoformat()
         }
 
@@ -284,6 +367,7 @@ def handle_s3_event(record):
         logger.error(f"Error handling S3 event: {e}")
         return {'error': str(e), 'source': 's3'}
 
+@tracer.trace()
 def handle_sns_event(record):
     """Handle SNS event"""
     try:
@@ -304,6 +388,7 @@ def handle_sns_event(record):
 
         # Forward to SQS for further processing
         sqs_queue_url = os.environ.get('SQS_QUEUE_URL')
+        forwarded = None
         if sqs_queue_url:
             sqs_message = {
                 'source': 'sns_forwarded',
@@ -312,7 +397,9 @@ def handle_sns_event(record):
                 'message': message_data,
                 'timestamp': datetime.now(timezone.utc).isoformat()
             }
-            sqs_client.send_message(
+            forwarded = deliver(
+                sqs_spool,
+                sqs_client.send_message,
                 QueueUrl=sqs_queue_url,
                 MessageBody=json.dumps(sqs_message)
             )
@@ -322,6 +409,7 @@ def handle_sns_event(record):
             'topic_arn': topic_arn,
             'subject': subject,
             'message': message_data,
+            'forwarded': forwarded,
             'processed_at': datetime.now(timezone.utc).isoformat()
         }
 
@@ -329,6 +417,7 @@ def handle_sns_event(record):
         logger.error(f"Error handling SNS event: {e}")
         return {'error': str(e), 'source': 'sns'}
 
+@tracer.trace()
 def handle_sqs_event(record):
     """Handle SQS event"""
     try:
@@ -357,6 +446,7 @@ def handle_sqs_event(record):
         logger.error(f"Error handling SQS event: {e}")
         return {'error': str(e), 'source': 'sqs'}
 
+@tracer.trace()
 def handle_api_gateway_event(event):
     """Handle API Gateway event"""
     try:
@@ -385,6 +475,9 @@ def handle_api_gateway_event(event):
             'message': 'API Gateway request processed successfully by complete Lambda example'
         }
 
+        with tracer.span('serialize', 'serialization'):
+            body = json.dumps(response_data)
+
         return {
             'statusCode': 200,
             'headers': {
@@ -392,7 +485,7 @@ def handle_api_gateway_event(event):
                 'Access-Control-Allow-Origin': '*',
                 'X-Lambda-Function': 'complete-lambda-example'
             },
-            'body': json.dumps(response_data)
+            'body': body
         }
 
     except Exception as e:
@@ -406,6 +499,7 @@ def handle_api_gateway_event(event):
             'body': json.dumps({'error': str(e), 'source': 'api_gateway'})
         }
 
+@tracer.trace()
 def handle_eventbridge_event(event):
     """Handle EventBridge event"""
     try:
@@ -438,6 +532,7 @@ def handle_eventbridge_event(event):
         logger.error(f"Error handling EventBridge event: {e}")
         return {'error': str(e), 'source': 'eventbridge'}
 
+@tracer.trace()
 def handle_direct_invocation(event):
     """Handle direct Lambda invocation with various actions"""
     try:
@@ -451,6 +546,7 @@ def handle_direct_invocation(event):
                 'vpc_test': test_vpc_connectivity(),
                 'database_test': test_database_connection(),
                 'ssm_parameters': get_ssm_parameters(),
+                'circuit_breakers': breakers.stats(),
                 'message': 'All features tested successfully'
             }
 
@@ -478,6 +574,9 @@ def handle_direct_invocation(event):
                 'parameters': get_ssm_parameters()
             }
 
+        elif action == 'get_reference_data':
+            return get_reference_data(event)
+
         elif action == 'test_via_alias':
             return {
                 'action': 'test_via_alias',
@@ -485,33 +584,13 @@ def handle_direct_invocation(event):
                 'alias_test': 'passed'
             }
 
-        elif action == 'performance_test':
-            # Simulate CPU and I/O intensive work
-            start_time = time.time()
-
-            # CPU intensive task
-            result = sum(i * i for i in range(10000))
-
-            # I/O simulation
-            time.sleep(0.1)
-
-            execution_time = time.time() - start_time
-
-            return {
-                'action': 'performance_test',
-                'execution_time_seconds': execution_time,
-                'cpu_result': result,
-                'message': 'Performance test completed'
-            }
-
         else:
             return {
                 'action': action,
                 'message': 'Direct invocation processed',
                 'available_actions': [
                     'test_all_features', 'test_permissions', 'test_vpc',
-                    'test_database', 'get_ssm_parameters', 'test_via_alias',
-                    'performance_test'
+                    'test_database', 'get_ssm_parameters', 'get_reference_data', 'test_via_alias'
                 ]
             }
 
@@ -519,6 +598,123 @@ def handle_direct_invocation(event):
         logger.error(f"Error handling direct invocation: {e}")
         return {'error': str(e), 'action': action}
 
+def get_reference_data(event):
+    """Read a reference object through the warm-instance cache"""
+    bucket_name = event.get('bucket') or os.environ.get('S3_BUCKET_NAME', '${s3_bucket_name}')
+    object_key = event.get('key')
+    if not object_key:
+        return {'action': 'get_reference_data', 'error': 'Missing required parameter: key'}
+
+    if object_key.endswith('.json'):
+        content = object_cache.get_json(bucket_name, object_key)
+        size = None
+    else:
+        content = None
+        size = len(object_cache.get(bucket_name, object_key))
+
+    return {
+        'action': 'get_reference_data',
+        'bucket': bucket_name,
+        'key': object_key,
+        'content': content,
+        'size': size,
+        'cache': object_cache.stats(),
+        'shared_cache': shared_cache.stats() if shared_cache else None
+    }
+
+def is_warmer_event(event):
+    """Check whether the event is a warm-up ping or a scheduled warmer trigger"""
+    return isinstance(event, dict) and event.get('warmer') is True
+
+def warm_instances(function_arn, concurrency):
+    """Concurrently invoke the function so that `concurrency` instances stay initialized"""
+    def ping(invocation):
+        response = lambda_client.invoke(
+            FunctionName=function_arn,
+            InvocationType='RequestResponse',
+            Payload=json.dumps({
+                'warmer': True,
+                'warmer_invocation': invocation,
+                'concurrency': concurrency
+            })
+        )
+        return json.loads(json.loads(response['Payload'].read())['body'])
+
+    results = []
+    errors = []
+    # The trigger invocation itself keeps one instance busy, so only fan out to the rest
+    with ThreadPoolExecutor(max_workers=max(concurrency - 1, 1)) as executor:
+        futures = [executor.submit(ping, invocation) for invocation in range(1, concurrency)]
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.error(f"Warmer invocation failed: {e}")
+                errors.append(str(e))
+
+    return results, errors
+
+def handle_warmer_event(event, context, is_cold_start):
+    """Handle warm-up pings and scheduled warmer triggers without running business logic"""
+    instance_report = {
+        'warmer': True,
+        'cold_start': is_cold_start,
+        'instance_id': INSTANCE_ID,
+        'initialization_type': INITIALIZATION_TYPE,
+        'request_id': context.aws_request_id
+    }
+
+    if 'warmer_invocation' in event:
+        # Hold the instance briefly so that concurrent pings cannot be served by the same instance
+        time.sleep(WARMER_DELAY_MS / 1000)
+        body = instance_report
+    else:
+        concurrency = min(max(int(event.get('concurrency', 1)), 1), WARMER_MAX_CONCURRENCY)
+        skip_when_provisioned = event.get('skip_when_provisioned', True)
+
+        if skip_when_provisioned and INITIALIZATION_TYPE == 'provisioned-concurrency':
+            # Provisioned instances are already initialized; pings would land on them and warm nothing
+            logger.info("Warmer skipped - invoked on a provisioned concurrency instance")
+            body = {**instance_report, 'skipped': True, 'reason': 'provisioned_concurrency'}
+        else:
+            results, errors = warm_instances(context.invoked_function_arn, concurrency)
+            results.append(instance_report)
+
+            instances = {result['instance_id'] for result in results}
+            cold_starts = sum(1 for result in results if result.get('cold_start'))
+            provisioned = sum(1 for result in results if result.get('initialization_type') == 'provisioned-concurrency')
+            cold_start_rate = round(cold_starts / len(results) * 100, 2)
+
+            # EMF lines, so the round does not wait on the CloudWatch API
+            print(json.dumps(emf_metric('WarmerInstancesWarmed', len(instances), 'Count')))
+            print(json.dumps(emf_metric('WarmerColdStarts', cold_starts, 'Count')))
+            print(json.dumps(emf_metric('WarmerColdStartRate', cold_start_rate, 'Percent')))
+
+            logger.info(f"Warmer round completed: {len(instances)}/{concurrency} instances, {cold_starts} cold")
+
+            body = {
+                **instance_report,
+                'concurrency': concurrency,
+                'instances_warmed': len(instances),
+                'cold_starts': cold_starts,
+                'cold_start_rate': cold_start_rate,
+                'provisioned_instances': provisioned,
+                'errors': errors
+            }
+
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': APPLICATION_JSON,
+            'X-Cold-Start': str(is_cold_start).lower(),
+            'X-Request-ID': context.aws_request_id
+        },
+        'body': json.dumps(body)
+    }
+
+@log_shipper.invocation
+@memory_profiler.profile
+@recorder.record
 def lambda_handler(event, context):
     """
     Complete Lambda handler demonstrating all features:
@@ -541,18 +737,32 @@ def lambda_handler(event, context):
     """
 
     start_time = time.time()
-    logger.info(f"Complete Lambda function invoked with event: {json.dumps(event)}")
+    tracer.start_invocation()
 
     # Check if this is a cold start
     is_cold_start = not hasattr(lambda_handler, '_initialized')
     if is_cold_start:
         lambda_handler._initialized = True
+
+    # Warm-up traffic short-circuits before any business logic or invocation metrics
+    if is_warmer_event(event):
+        return handle_warmer_event(event, context, is_cold_start)
+
+    logger.info(f"Complete Lambda function invoked with event: {json.dumps(event)}")
+
+    # Get environment information
+    environment = os.environ.get('ENVIRONMENT', 'unknown')
+
+    if is_cold_start:
         logger.info("Cold start detected - initializing complete Lambda function")
         # Send cold start metric
         send_custom_metric('ColdStarts', 1, 'Count')
 
-    # Get environment information
-    environment = os.environ.get('ENVIRONMENT', 'unknown')
+    # Average of this metric is the share of real invocations that paid a cold start; as it is sent on every
+    # invocation it goes out as an EMF line rather than as one more CloudWatch API call
+    print(json.dumps(emf_metric('ColdStartRate', 100 if is_cold_start else 0, 'Percent', [
+        {'Name': 'Environment', 'Value': environment}
+    ])))
     function_version = os.environ.get('FUNCTION_VERSION', '1.0.0')
 
     try:
@@ -574,7 +784,12 @@ def lambda_handler(event, context):
         elif source_type == 'sqs':
             result = handle_sqs_event(source_data)
         elif source_type == 'api_gateway':
-            return handle_api_gateway_event(event)  # API Gateway needs special response format
+            # API Gateway needs special response format
+            response = handle_api_gateway_event(event)
+            response['headers'].update(tracer.finish_invocation({'Source': source_type}))
+            object_cache.publish_metrics()
+            breakers.publish_metrics()
+            return response
         elif source_type == 'eventbridge':
             result = handle_eventbridge_event(event)
         elif source_type == 'direct':
@@ -628,7 +843,11 @@ def lambda_handler(event, context):
 
         logger.info(f"Successfully processed {source_type} event in {execution_time:.3f}s")
 
-        return {
+        with tracer.span('serialize', 'serialization'):
+            body = json.dumps(response_data, default=str)
+        server_timing = tracer.finish_invocation({'Source': source_type})
+
+        response = {
             'statusCode': 200,
             'headers': {
                 'Content-Type': APPLICATION_JSON,
@@ -637,10 +856,14 @@ def lambda_handler(event, context):
                 'X-Execution-Time-Ms': str(round(execution_time * 1000, 2)),
                 'X-Cold-Start': str(is_cold_start).lower(),
                 'X-Function-Version': context.function_version,
-                'X-Request-ID': context.aws_request_id
+                'X-Request-ID': context.aws_request_id,
+                **server_timing
             },
-            'body': json.dumps(response_data, default=str)
+            'body': body
         }
+        object_cache.publish_metrics()
+        breakers.publish_metrics()
+        return response
 
     except Exception as e:
         execution_time = time.time() - start_time
@@ -652,13 +875,18 @@ def lambda_handler(event, context):
             {'Name': 'Environment', 'Value': environment}
         ])
 
+        server_timing = tracer.finish_invocation({'Source': 'error'})
+        object_cache.publish_metrics()
+        breakers.publish_metrics()
+
         return {
             'statusCode': 500,
             'headers': {
                  'Content-Type': APPLICATION_JSON,
                 'Access-Control-Allow-Origin': '*',
                 'X-Execution-Time-Ms': str(round(execution_time * 1000, 2)),
-                'X-Error': 'true'
+                'X-Error': 'true',
+                **server_timing
             },
             'body': json.dumps({
                 'error': 'Complete Lambda function execution failed',
@@ -695,9 +923,9 @@ if __name__ == "__main__":
     test_events = [
         {"action": "test_all_features"},
         {"action": "test_permissions"},
-        {"action": "performance_test"},
         {"httpMethod": "POST", "path": "/lambda", "body": '{"test": "api_gateway"}'},
-        {"source": "aws.events", "detail-type": "Scheduled Event", "detail": {}}
+        {"source": "aws.events", "detail-type": "Scheduled Event", "detail": {}},
+        {"warmer": True, "warmer_invocation": 1, "concurrency": 1}
     ]
     # sonar-ignore-end
     for i, test_event in enumerate(test_events):
@@ -55,4 +55,7 @@ locals {
       }
     ]
   }
+
+  # Lambda requires EFS mount paths under /mnt
+  shared_cache_mount_path = "/mnt/cache"
 }
@@ -225,6 +225,44 @@ resource "aws_cloudwatch_event_target" "lambda_target" {
   })
 }
 
+# Warmer keeping on-demand instances initialized between traffic bursts
+resource "aws_cloudwatch_event_rule" "lambda_warmer" {
+  count = var.warmer_enabled ? 1 : 0
+
+  name                = "${var.function_name}-warmer"
+  description         = "Keeps ${var.warmer_concurrency} Lambda instances warm"
+  schedule_expression = var.warmer_schedule_expression
+
+  tags = {
+    Environment = var.environment
+    Project     = "lambda-terraform-module"
+  }
+}
+
+resource "aws_cloudwatch_event_target" "lambda_warmer" {
+  count = var.warmer_enabled ? 1 : 0
+
+  rule      = aws_cloudwatch_event_rule.lambda_warmer[0].name
+  target_id = "LambdaWarmer"
+  arn       = module.complete_lambda.alias_arn != null ? module.complete_lambda.alias_arn : module.complete_lambda.arn
+
+  input = jsonencode({
+    warmer      = true
+    concurrency = var.warmer_concurrency
+  })
+}
+
+resource "aws_lambda_permission" "allow_warmer_invoke" {
+  count = var.warmer_enabled ? 1 : 0
+
+  statement_id  = "AllowExecutionFromWarmerRule"
+  action        = "lambda:InvokeFunction"
+  function_name = module.complete_lambda.name
+  qualifier     = var.alias_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.lambda_warmer[0].arn
+}
+
 # =============================================================================
 # KMS KEY FOR ENCRYPTION
 # =============================================================================
@@ -263,6 +301,71 @@ resource "aws_ssm_parameter" "lambda_config" {
   }
 }
 
+# Allows the warmer to invoke its own function, alias and versions
+data "aws_iam_policy_document" "self_invoke" {
+  statement {
+    effect  = "Allow"
+    actions = ["lambda:InvokeFunction"]
+    resources = [
+      "arn:aws:lambda:${var.aws_region}:${data.aws_caller_identity.current.account_id}:function:${var.function_name}",
+      "arn:aws:lambda:${var.aws_region}:${data.aws_caller_identity.current.account_id}:function:${var.function_name}:*"
+    ]
+  }
+}
+
+# =============================================================================
+# EFS SHARED CACHE
+# =============================================================================
+
+# Cache shared by all instances of the function, see examples/common/shared_cache.py
+resource "aws_efs_file_system" "shared_cache" {
+  count = var.shared_cache_enabled ? 1 : 0
+
+  creation_token   = "${var.function_name}-shared-cache"
+  encrypted        = true
+  performance_mode = "generalPurpose"
+  throughput_mode  = "elastic"
+
+  lifecycle_policy {
+    transition_to_ia = "AFTER_7_DAYS"
+  }
+
+  tags = merge(module.tags.tags, {
+    Name = "${var.function_name}-shared-cache"
+  })
+}
+
+# The function runs in the first private subnet; the security group allows NFS from itself
+resource "aws_efs_mount_target" "shared_cache" {
+  count = var.shared_cache_enabled ? 1 : 0
+
+  file_system_id  = aws_efs_file_system.shared_cache[0].id
+  subnet_id       = data.aws_subnets.private.ids[0]
+  security_groups = [module.arc_security_group.id]
+}
+
+resource "aws_efs_access_point" "shared_cache" {
+  count = var.shared_cache_enabled ? 1 : 0
+
+  file_system_id = aws_efs_file_system.shared_cache[0].id
+
+  posix_user {
+    uid = 1000
+    gid = 1000
+  }
+
+  root_directory {
+    path = "/lambda-cache"
+    creation_info {
+      owner_uid   = 1000
+      owner_gid   = 1000
+      permissions = "750"
+    }
+  }
+
+  tags = module.tags.tags
+}
+
 # =============================================================================
 # LAMBDA FUNCTION CODE
 # =============================================================================
@@ -280,6 +383,34 @@ data "archive_file" "lambda_zip" {
     })
     filename = "lambda_function.py"
   }
+  source {
+    content  = file("${path.module}/../common/tracing.py")
+    filename = "tracing.py"
+  }
+  source {
+    content  = file("${path.module}/../common/recording.py")
+    filename = "recording.py"
+  }
+  source {
+    content  = file("${path.module}/../common/object_cache.py")
+    filename = "object_cache.py"
+  }
+  source {
+    content  = file("${path.module}/../common/shared_cache.py")
+    filename = "shared_cache.py"
+  }
+  source {
+    content  = file("${path.module}/../common/breaker.py")
+    filename = "breaker.py"
+  }
+  source {
+    content  = file("${path.module}/../common/log_shipping.py")
+    filename = "log_shipping.py"
+  }
+  source {
+    content  = file("${path.module}/../common/memory_profile.py")
+    filename = "memory_profile.py"
+  }
 }
 
 # =============================================================================
@@ -306,7 +437,7 @@ module "complete_lambda" {
   publish = true
 
   # Environment variables with KMS encryption
-  environment_variables = {
+  environment_variables = merge({
     ENVIRONMENT      = var.environment
     LOG_LEVEL        = var.log_level
     S3_BUCKET_NAME   = module.s3.bucket_id
@@ -318,7 +449,10 @@ module "complete_lambda" {
     VPC_ID           = data.aws_vpc.default.id
     API_GATEWAY_URL  = "https://${aws_api_gateway_rest_api.lambda_api.id}.execute-api.${var.aws_region}.amazonaws.com/${var.api_stage_name}"
     FUNCTION_VERSION = var.function_version
-  }
+  }, var.shared_cache_enabled ? {
+    SHARED_CACHE_DIR    = local.shared_cache_mount_path
+    SHARED_CACHE_MAX_MB = tostring(var.shared_cache_max_mb)
+  } : {})
   kms_key_arn = aws_kms_key.lambda_key.arn
 
   # VPC configuration
@@ -327,6 +461,12 @@ module "complete_lambda" {
     security_group_ids = [module.arc_security_group.id]
   }
 
+  # EFS mount for the shared cache
+  file_system_config = var.shared_cache_enabled ? {
+    arn              = aws_efs_access_point.shared_cache[0].arn
+    local_mount_path = local.shared_cache_mount_path
+  } : null
+
   # Dead Letter Queue
   create_dlq                    = true
   dlq_message_retention_seconds = var.dlq_retention_seconds
@@ -369,8 +509,10 @@ module "complete_lambda" {
     "arn:aws:iam::aws:policy/AmazonRDSReadOnlyAccess",
     "arn:aws:iam::aws:policy/AmazonSSMReadOnlyAccess",
     "arn:aws:iam::aws:policy/CloudWatchFullAccess",
-    "arn:aws:iam::aws:policy/service-role/AWSLambdaVPCAccessExecutionRole"
+    "arn:aws:iam::aws:policy/service-role/AWSLambdaVPCAccessExecutionRole",
+    "arn:aws:iam::aws:policy/AmazonElasticFileSystemClientReadWriteAccess"
   ]
+  additional_policy_docs = var.warmer_enabled ? [data.aws_iam_policy_document.self_invoke.json] : []
 
 
   # Function URL with CORS
@@ -395,7 +537,8 @@ module "complete_lambda" {
   tags = module.tags.tags
 
   depends_on = [
-    module.rds
+    module.rds,
+    aws_efs_mount_target.shared_cache
   ]
 }
 
@@ -556,6 +699,26 @@ resource "aws_cloudwatch_dashboard" "complete_lambda_dashboard" {
           period  = 300
         }
       },
+      {
+        type   = "metric"
+        x      = 12
+        y      = 6
+        width  = 12
+        height = 6
+
+        properties = {
+          metrics = [
+            ["Lambda/CompleteExample", "ColdStartRate", "Environment", var.environment, { stat = "Average" }],
+            [".", "WarmerColdStartRate", { stat = "Average" }],
+            [".", "WarmerInstancesWarmed", { stat = "Maximum" }]
+          ]
+          view    = "timeSeries"
+          stacked = false
+          region  = var.aws_region
+          title   = "Cold Starts and Warmer"
+          period  = 300
+        }
+      },
       {
         type   = "metric"
         x      = 0
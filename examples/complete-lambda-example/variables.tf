@@ -131,6 +131,52 @@ variable "schedule_expression" {
   }
 }
 
+# Warmer Configuration
+variable "warmer_enabled" {
+  description = "Whether to create a scheduled warmer that keeps on-demand instances initialized"
+  type        = bool
+  default     = false
+}
+
+variable "warmer_concurrency" {
+  description = "Number of concurrent instances the warmer keeps initialized"
+  type        = number
+  default     = 5
+
+  validation {
+    condition     = var.warmer_concurrency >= 1 && var.warmer_concurrency <= 50
+    error_message = "Warmer concurrency must be between 1 and 50."
+  }
+}
+
+variable "warmer_schedule_expression" {
+  description = "EventBridge schedule expression for the warmer"
+  type        = string
+  default     = "rate(5 minutes)"
+
+  validation {
+    condition     = can(regex("^(rate\\(.*\\)|cron\\(.*\\))$", var.warmer_schedule_expression))
+    error_message = "Schedule expression must be a valid EventBridge schedule expression (rate() or cron())."
+  }
+}
+
+variable "shared_cache_enabled" {
+  description = "Whether to mount an EFS file system as a cache shared by all instances of the function"
+  type        = bool
+  default     = false
+}
+
+variable "shared_cache_max_mb" {
+  description = "Size in MB above which the shared cache evicts least recently used entries"
+  type        = number
+  default     = 1024
+
+  validation {
+    condition     = var.shared_cache_max_mb > 0
+    error_message = "Shared cache size must be greater than 0."
+  }
+}
+
 # Function URL Configuration
 variable "enable_function_url" {
   description = "Whether to create a Lambda function URL"
@@ -9,14 +9,31 @@ import boto3
 import requests
 from botocore.exceptions import ClientError
 from pydantic import BaseModel, ValidationError
+from pythonjsonlogger.json import JsonFormatter
 
 
-# Configure structured logging
+class RequestIdFilter(logging.Filter):
+    """Tags records with the request id of the invocation being handled"""
+    request_id: Optional[str] = None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = self.request_id
+        return True
+
+
+# Configure structured logging: one JSON object per line, with the fields of the zip examples' log_shipping.py
 APPLICATION_JSON = "application/json"
-logging.basicConfig(
-    level=os.environ.get('LOG_LEVEL', 'INFO'),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+request_id_filter = RequestIdFilter()
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(JsonFormatter(
+    '%(levelname)s %(name)s %(message)s %(request_id)s',
+    rename_fields={'levelname': 'level', 'name': 'logger', 'exc_info': 'exception'},
+    static_fields={'function': os.environ.get('FUNCTION_NAME', 'container-lambda-example')},
+    timestamp=True
+))
+log_handler.addFilter(request_id_filter)
+# Replaces the Lambda runtime's handler on the root logger
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'), handlers=[log_handler], force=True)
 logger = logging.getLogger(__name__)
 
 # Initialize AWS clients
@@ -121,6 +138,7 @@ def lambda_handler(event: Dict[str, Any], context) -> Dict[str, Any]:
         dict: HTTP response
     """
 
+    request_id_filter.request_id = context.aws_request_id
     logger.info(f"Container Lambda function invoked with event: {json.dumps(event)}")
 
     try:
@@ -0,0 +1,171 @@
+"""
+Index and scheduling for draining the S3 processor's pending backlog.
+
+`BacklogIndex.build` lists the processing prefix and the processed prefix in
+parallel shards (see listing.py) and keeps only the keys whose processed copy is
+missing or older than the source, with their sizes. A copy older than its source
+may still hold the same input, as after a re-sync that uploads files again
+unchanged; those keys are passed to a check, such as a HEAD of the copy that
+compares its recorded fingerprint, and dropped when it confirms them, so no
+output has to be rewritten to look newer than its source.
+
+The handler keeps the index at module level, so warm invocations keep draining
+it without listing again until it expires; keys are removed as they are
+processed. Concurrent instances may pick the same keys, which is harmless
+because outputs are written conditionally: only one write of an output
+succeeds, and the instance that loses the race reports the key as skipped when
+the output holds the same input, or as a conflict error otherwise, which the
+next scan picks up again.
+
+`DrainEstimator` predicts how long a file of a given size takes from the files
+processed so far, so the drain loop only starts files that can finish before
+the invocation runs out of time.
+"""
+import itertools
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from listing import ObjectLister
+
+LARGEST_FIRST = 'largest_first'
+SIZE_BINS = 'size_bins'
+SCHEDULES = (LARGEST_FIRST, SIZE_BINS)
+# Files in a size bin are within a factor of this of each other
+SIZE_BIN_FACTOR = 4
+
+
+class BacklogIndex:
+    """Pending keys under a prefix and their sizes in bytes."""
+
+    def __init__(self, pending: Dict[str, int], scan: Optional[Dict[str, Any]] = None):
+        self.pending = pending
+        self.scan = scan or {}
+        self.built_at = time.monotonic()
+        self.initial_objects = len(pending)
+        self.initial_bytes = sum(pending.values())
+
+    @classmethod
+    def build(cls, client: Any, bucket: str, prefix: str, done_bucket: str, done_prefix: str,
+              source_key: Callable[[str], str], compacted: Iterable[Tuple[str, Any]] = (), keyspace: str = '',
+              delimiter: Optional[str] = '/', parallelism: int = 8, expected_owner: Optional[str] = None,
+              holds_input: Optional[Callable[[str, str], bool]] = None) -> 'BacklogIndex':
+        """List the backlog and drop the keys whose output under `done_prefix` is up to date.
+
+        `source_key` maps a processed key back to the pending key it was produced from.
+        `compacted` gives processed keys and their LastModified that were moved into
+        compacted objects (see compaction.py) and no longer appear in the listing.
+        `holds_input(key, done_key)` is called, `parallelism` at a time, for listed
+        outputs older than their source, and drops the key when it returns True.
+        """
+        start = time.monotonic()
+        # key -> (size, last modified) while the processed copies are matched up
+        listed: Dict[str, Tuple[int, Any]] = {}
+        sources = ObjectLister(client, bucket, prefix, delimiter=delimiter, keyspace=keyspace,
+                               parallelism=parallelism, expected_owner=expected_owner)
+        for page in sources.iter_pages():
+            for obj in page:
+                listed[obj['Key']] = (obj['Size'], obj['LastModified'])
+
+        outputs = ObjectLister(client, done_bucket, done_prefix, delimiter=delimiter, keyspace=keyspace,
+                               parallelism=parallelism, expected_owner=expected_owner)
+        up_to_date = 0
+        # Pending key -> listed output older than the source, to be checked once all outputs are matched up
+        older: Dict[str, str] = {}
+        done = ((obj['Key'], obj['LastModified'], True) for page in outputs.iter_pages() for obj in page)
+        # Compacted originals are no longer objects of their own that could be checked
+        moved = ((done_key, modified, False) for done_key, modified in compacted)
+        for done_key, modified, checkable in itertools.chain(done, moved):
+            key = source_key(done_key)
+            source = listed.get(key)
+            if source is None:
+                continue
+            if modified >= source[1]:
+                del listed[key]
+                older.pop(key, None)
+                up_to_date += 1
+            elif checkable:
+                older[key] = done_key
+
+        unchanged = 0
+        if holds_input is not None and older:
+            with ThreadPoolExecutor(max_workers=parallelism) as executor:
+                checks = executor.map(lambda item: holds_input(*item), older.items())
+                for key, holds in zip(list(older), checks):
+                    if holds:
+                        del listed[key]
+                        unchanged += 1
+
+        return cls({key: size for key, (size, _) in listed.items()}, {
+            'shards': len(sources.discover_shards()) + len(outputs.discover_shards()),
+            'pages_listed': sources.pages_listed + outputs.pages_listed,
+            'objects_scanned': sources.objects_scanned + outputs.objects_scanned,
+            'already_processed': up_to_date + unchanged,
+            'outputs_checked': len(older) if holds_input is not None else 0,
+            'unchanged_inputs': unchanged,
+            'seconds': round(time.monotonic() - start, 3)
+        })
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    @property
+    def age_seconds(self) -> float:
+        return time.monotonic() - self.built_at
+
+    @property
+    def pending_bytes(self) -> int:
+        return sum(self.pending.values())
+
+    def remove(self, key: str) -> None:
+        self.pending.pop(key, None)
+
+    def schedule(self, order: str = LARGEST_FIRST) -> Iterator[str]:
+        """Yield pending keys in drain order over a snapshot of the index."""
+        keys = sorted(self.pending, key=self.pending.__getitem__, reverse=True)
+        if order == LARGEST_FIRST:
+            yield from keys
+            return
+        if order != SIZE_BINS:
+            raise ValueError(f"Unknown backlog schedule: {order}")
+
+        # One key from each bin in turn, largest bin first, so big files make progress
+        # without starving the many small ones
+        bins: Dict[int, List[str]] = {}
+        for key in keys:
+            bins.setdefault(size_bin(self.pending[key]), []).append(key)
+        queues = [iter(bins[number]) for number in sorted(bins, reverse=True)]
+        while queues:
+            for queue in list(queues):
+                key = next(queue, None)
+                if key is None:
+                    queues.remove(queue)
+                else:
+                    yield key
+
+
+def size_bin(size: int) -> int:
+    return int(math.log(size, SIZE_BIN_FACTOR)) if size > 0 else -1
+
+
+class DrainEstimator:
+    """Per-file overhead and throughput learned from processed files."""
+
+    # Files below this size are dominated by per-request overhead
+    SMALL_FILE_BYTES = 64 * 1024
+
+    def __init__(self, overhead_ms: float = 50.0, bytes_per_ms: float = 10 * 1024, smoothing: float = 0.3):
+        self.overhead_ms = overhead_ms
+        self.bytes_per_ms = bytes_per_ms
+        self.smoothing = smoothing
+
+    def estimate_ms(self, size: int) -> float:
+        return self.overhead_ms + size / self.bytes_per_ms
+
+    def observe(self, size: int, elapsed_ms: float) -> None:
+        if size < self.SMALL_FILE_BYTES:
+            self.overhead_ms += self.smoothing * (elapsed_ms - self.overhead_ms)
+            return
+        transfer_ms = max(elapsed_ms - self.overhead_ms, 1.0)
+        self.bytes_per_ms += self.smoothing * (size / transfer_ms - self.bytes_per_ms)
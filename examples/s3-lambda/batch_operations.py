@@ -0,0 +1,100 @@
+"""
+S3 Batch Operations invocations of the S3 processor.
+
+A Batch Operations job with the "Invoke AWS Lambda function" operation calls
+the function with a manifest entry per task, in invocation schema 1.0 or 2.0,
+and expects a result code per task: Succeeded, TemporaryFailure (the task is
+retried) or PermanentFailure (the task fails and goes to the completion
+report). `run_tasks` processes the tasks of one invocation on a thread pool and
+classifies failures with `result_code`: throttling, server errors and network
+failures are temporary, anything else about the object is permanent. Tasks
+that would start with less than the margin left of the invocation are
+reported as temporary failures so S3 sends them again.
+"""
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+SUCCEEDED = 'Succeeded'
+TEMPORARY_FAILURE = 'TemporaryFailure'
+PERMANENT_FAILURE = 'PermanentFailure'
+# Error codes worth retrying; 5xx and 429 responses are retried whatever their code
+TEMPORARY_ERROR_CODES = frozenset((
+    'SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException',
+    'RequestTimeout', 'InternalError', 'ServiceUnavailable', 'OperationAborted', 'ConditionalRequestConflict'
+))
+# The completion report keeps result strings short
+MAX_RESULT_STRING = 1024
+
+
+class BatchTask(NamedTuple):
+    task_id: str
+    bucket: str
+    key: str
+    version_id: Optional[str]
+
+
+def is_batch_operations_event(event: Dict[str, Any]) -> bool:
+    return 'invocationSchemaVersion' in event and 'tasks' in event
+
+
+def parse_tasks(event: Dict[str, Any]) -> List[BatchTask]:
+    """Tasks of an invocation; schema 1.0 names the bucket by ARN, 2.0 by name. Keys arrive URL-encoded."""
+    tasks = []
+    for task in event['tasks']:
+        bucket = task.get('s3Bucket') or task['s3BucketArn'].split(':::', 1)[-1]
+        tasks.append(BatchTask(task['taskId'], bucket, urllib.parse.unquote_plus(task['s3Key']),
+                               task.get('s3VersionId')))
+    return tasks
+
+
+def user_arguments(event: Dict[str, Any]) -> Dict[str, Any]:
+    """The job's UserArguments (schema 2.0 only)."""
+    return event.get('job', {}).get('userArguments') or {}
+
+
+def result_code(error: BaseException) -> str:
+    if isinstance(error, ClientError):
+        response = error.response
+        code = response.get('Error', {}).get('Code', '')
+        status = response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        if code in TEMPORARY_ERROR_CODES or status >= 500 or status == 429:
+            return TEMPORARY_FAILURE
+        return PERMANENT_FAILURE
+    if isinstance(error, (BotoCoreError, OSError)):
+        # Connection failures and timeouts, and ephemeral storage filled by other work
+        return TEMPORARY_FAILURE
+    return PERMANENT_FAILURE
+
+
+def task_result(task: BatchTask, code: str, message: str) -> Dict[str, str]:
+    return {'taskId': task.task_id, 'resultCode': code, 'resultString': message[:MAX_RESULT_STRING]}
+
+
+def run_tasks(tasks: List[BatchTask], process: Callable[[BatchTask], str], concurrency: int,
+              remaining_ms: Callable[[], int], margin_ms: int) -> List[Dict[str, str]]:
+    """Run `process` for each task, which returns the result string, and return the results in task order."""
+
+    def run(task: BatchTask) -> Dict[str, str]:
+        if remaining_ms() < margin_ms:
+            return task_result(task, TEMPORARY_FAILURE, 'Not started: the invocation is out of time')
+        try:
+            return task_result(task, SUCCEEDED, process(task))
+        except Exception as e:
+            return task_result(task, result_code(e), f"{type(e).__name__}: {e}")
+
+    if len(tasks) == 1:
+        return [run(tasks[0])]
+    with ThreadPoolExecutor(max_workers=max(min(concurrency, len(tasks)), 1)) as pool:
+        return list(pool.map(run, tasks))
+
+
+def response(event: Dict[str, Any], results: List[Dict[str, str]]) -> Dict[str, Any]:
+    return {
+        'invocationSchemaVersion': event['invocationSchemaVersion'],
+        'treatMissingKeysAs': PERMANENT_FAILURE,
+        'invocationId': event['invocationId'],
+        'results': results
+    }
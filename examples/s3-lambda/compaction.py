@@ -0,0 +1,392 @@
+"""
+Compaction of small processed objects.
+
+Every upload becomes one object under the processed prefix, so downstream
+readers and the cleanup and backlog scans pay a request per file. `Compactor.plan`
+lists the processed prefix (see listing.py) and groups objects of up to
+`max_object_bytes` by partition, the prefix of their key, and by window of
+LastModified. Windows that ended less than `settle_seconds` ago are left for a
+later run, as are groups of fewer than `min_objects`, and a group is split
+before it exceeds `target_bytes`.
+
+`Compactor.compact` writes a group as one object under the compacted prefix,
+fetching the originals a few at a time and uploading the output as it is
+produced (see spill.upload_chunks), then an index next to it. Formats:
+
+    jsonl.gz  one JSON line per original with its key, source key,
+              LastModified and content (UTF-8 text, or base64 with
+              "encoding": "base64"), compressed in independent gzip members of
+              about BLOCK_BYTES, so a ranged GET of one member decompresses alone
+    parquet   the same fields as columns, one row group per block; needs
+              pyarrow, e.g. from the AWS SDK for pandas layer
+
+The index, `<object>.index.json`, gives for each original its key, source key,
+size, ETag and LastModified and where it is: the offset and length of its gzip
+member and its line in it, or its row group and row. `read_member` fetches one
+original back. The output is deterministic for a group, and originals are only
+deleted once the object has been read back with the length and SHA-256 that
+were written, so a run that stopped halfway is completed by the next one
+instead of writing a second copy.
+"""
+import base64
+import gzip
+import hashlib
+import io
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+from listing import ObjectFilter, ObjectLister
+from ranged import RangedFile, get_range
+from spill import upload_chunks
+
+try:
+    import pyarrow as arrow
+    import pyarrow.parquet as parquet
+except ImportError:  # Only needed for the parquet format
+    arrow = parquet = None
+
+JSONL_GZ = 'jsonl.gz'
+PARQUET = 'parquet'
+FORMATS = (JSONL_GZ, PARQUET)
+INDEX_SUFFIX = '.index.json'
+# Uncompressed content per gzip member or row group
+BLOCK_BYTES = 1024 * 1024
+# Originals removed per DeleteObjects request
+DELETE_BATCH = 1000
+READ_CHUNK_BYTES = 1024 * 1024
+
+
+class CompactionGroup:
+    """Small objects of one partition and window, written together."""
+
+    def __init__(self, partition: str, window: datetime):
+        self.partition = partition
+        self.window = window
+        self.members: List[Dict[str, Any]] = []
+        self.size = 0
+
+    def add(self, obj: Dict[str, Any]) -> None:
+        self.members.append(obj)
+        self.size += obj['Size']
+
+    def name(self) -> str:
+        """Object name from the window and the members, so a rerun of the same group writes the same key."""
+        digest = hashlib.sha256()
+        for member in self.members:
+            digest.update(f"{member['Key']}\0{member['ETag']}\0".encode('utf-8'))
+        return f"{self.partition}{self.window:%Y%m%dT%H%M%SZ}-{digest.hexdigest()[:16]}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'partition': self.partition,
+            'window': self.window.isoformat(),
+            'objects': len(self.members),
+            'bytes': self.size
+        }
+
+
+class _JsonLinesEncoder:
+    extension = '.jsonl.gz'
+    content_type = 'application/gzip'
+
+    def __init__(self):
+        self.offset = 0
+        self._lines: List[bytes] = []
+        self._entries: List[Dict[str, Any]] = []
+        self._size = 0
+
+    def add(self, entry: Dict[str, Any], content: bytes) -> Iterator[bytes]:
+        record = {key: entry[key] for key in ('key', 'source_key', 'last_modified')}
+        try:
+            record['content'] = content.decode('utf-8')
+        except UnicodeDecodeError:
+            record.update(content=base64.b64encode(content).decode('ascii'), encoding='base64')
+        line = json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n'
+        entry['line'] = len(self._lines)
+        self._lines.append(line)
+        self._entries.append(entry)
+        self._size += len(line)
+        if self._size >= BLOCK_BYTES:
+            yield self._flush()
+
+    def finish(self) -> Iterator[bytes]:
+        if self._lines:
+            yield self._flush()
+
+    def _flush(self) -> bytes:
+        # mtime=0 keeps the output identical across runs of the same group
+        member = gzip.compress(b''.join(self._lines), mtime=0)
+        for entry in self._entries:
+            entry.update(offset=self.offset, length=len(member))
+        self.offset += len(member)
+        self._lines, self._entries, self._size = [], [], 0
+        return member
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file that hands out what was written since the last drain, keeping its position."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class _ParquetEncoder:
+    extension = '.parquet'
+    content_type = 'application/vnd.apache.parquet'
+
+    def __init__(self):
+        if parquet is None:
+            raise RuntimeError('Compacting to Parquet needs pyarrow')
+        # Parquet records absolute offsets, so the sink keeps counting after each drain
+        self._sink = _Sink()
+        self._writer = None
+        self._rows: List[Dict[str, Any]] = []
+        self._size = 0
+        self._row_groups = 0
+
+    def add(self, entry: Dict[str, Any], content: bytes) -> Iterator[bytes]:
+        entry.update(row_group=self._row_groups, row=len(self._rows))
+        self._rows.append({'key': entry['key'], 'source_key': entry['source_key'],
+                           'last_modified': entry['last_modified'], 'content': content})
+        self._size += len(content)
+        if self._size >= BLOCK_BYTES:
+            yield self._flush()
+
+    def finish(self) -> Iterator[bytes]:
+        if self._rows:
+            yield self._flush()
+        if self._writer is not None:
+            self._writer.close()
+        yield self._sink.drain()
+
+    def _flush(self) -> bytes:
+        table = arrow.Table.from_pylist(self._rows, schema=arrow.schema([
+            ('key', arrow.string()), ('source_key', arrow.string()), ('last_modified', arrow.string()),
+            ('content', arrow.binary())
+        ]))
+        if self._writer is None:
+            self._writer = parquet.ParquetWriter(self._sink, table.schema, compression='zstd')
+        self._writer.write_table(table)
+        self._rows, self._size = [], 0
+        self._row_groups += 1
+        return self._sink.drain()
+
+
+ENCODERS = {JSONL_GZ: _JsonLinesEncoder, PARQUET: _ParquetEncoder}
+
+
+class Compactor:
+    """Plans and writes compacted objects for the small objects under a prefix."""
+
+    def __init__(self, client: Any, bucket: str, processed_prefix: str, compacted_prefix: str,
+                 source_key: Callable[[str], Optional[str]], output_format: str = JSONL_GZ,
+                 window_seconds: int = 3600, max_object_bytes: int = 1024 * 1024, min_objects: int = 10,
+                 target_bytes: int = 128 * 1024 * 1024, concurrency: int = 16, expected_owner: Optional[str] = None):
+        if output_format not in FORMATS:
+            raise ValueError(f"Unknown compaction format: {output_format}")
+        self.client = client
+        self.bucket = bucket
+        self.processed_prefix = processed_prefix
+        self.compacted_prefix = compacted_prefix
+        self.source_key = source_key
+        self.format = output_format
+        self.window_seconds = window_seconds
+        self.max_object_bytes = max_object_bytes
+        self.min_objects = min_objects
+        self.target_bytes = target_bytes
+        self.concurrency = max(concurrency, 1)
+        self.expected_owner = expected_owner
+        self.owner = {'ExpectedBucketOwner': expected_owner} if expected_owner else {}
+
+    def window(self, modified: datetime) -> datetime:
+        timestamp = modified.timestamp()
+        return datetime.fromtimestamp(timestamp - timestamp % self.window_seconds, timezone.utc)
+
+    def plan(self, prefix: str = '', settle_seconds: int = 900, now: Optional[datetime] = None,
+             parallelism: int = 8) -> List[CompactionGroup]:
+        """Groups of closed windows under `prefix` of the processed prefix, oldest window first."""
+        # Windows before the one holding this time ended at least settle_seconds ago
+        closed = self.window((now or datetime.now(timezone.utc)) - timedelta(seconds=settle_seconds))
+        candidates: Dict[Tuple[str, datetime], List[Dict[str, Any]]] = {}
+        lister = ObjectLister(self.client, self.bucket, self.processed_prefix + prefix,
+                              ObjectFilter(max_size=self.max_object_bytes, modified_before=closed), delimiter='/',
+                              parallelism=parallelism, expected_owner=self.expected_owner)
+        for obj in lister.iter_objects():
+            partition = obj['Key'][len(self.processed_prefix):].rpartition('/')[0]
+            partition = f"{partition}/" if partition else ''
+            candidates.setdefault((partition, self.window(obj['LastModified'])), []).append(obj)
+
+        planned = []
+        for (partition, window), objects in sorted(candidates.items(), key=lambda item: (item[0][1], item[0][0])):
+            # Shards are listed in parallel; key order makes the groups, and so their names, the same every run
+            chain = [CompactionGroup(partition, window)]
+            for obj in sorted(objects, key=lambda obj: obj['Key']):
+                if chain[-1].members and chain[-1].size + obj['Size'] > self.target_bytes:
+                    chain.append(CompactionGroup(partition, window))
+                chain[-1].add(obj)
+            planned.extend(group for group in chain if len(group.members) >= self.min_objects)
+        return planned
+
+    def _fetch(self, member: Dict[str, Any]) -> Optional[bytes]:
+        """Content of an original as planned, or None once it has been overwritten or removed."""
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=member['Key'], IfMatch=member['ETag'],  # NOSONAR
+                                              **self.owner)
+            return response['Body'].read()
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('PreconditionFailed', 'NoSuchKey', '404'):
+                return None
+            raise
+
+    def _contents(self, members: List[Dict[str, Any]]) -> Iterator[Tuple[Dict[str, Any], Optional[bytes]]]:
+        """Members with their content in order, with up to twice `concurrency` fetched ahead."""
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='compact') as pool:
+            pending: Deque[Tuple[Dict[str, Any], Any]] = deque()
+            for member in members:
+                if len(pending) >= 2 * self.concurrency:
+                    done, future = pending.popleft()
+                    yield done, future.result()
+                pending.append((member, pool.submit(self._fetch, member)))
+            while pending:
+                done, future = pending.popleft()
+                yield done, future.result()
+
+    def compact(self, group: CompactionGroup) -> Dict[str, Any]:
+        """Write `group` as one object and its index, then delete the originals."""
+        encoder = ENCODERS[self.format]()
+        key = f"{self.compacted_prefix}{group.name()}{encoder.extension}"
+        entries: List[Dict[str, Any]] = []
+        digest = hashlib.sha256()
+        written = {'bytes': 0, 'skipped': 0}
+
+        def chunks() -> Iterator[bytes]:
+            for member, content in self._contents(group.members):
+                if content is None:
+                    written['skipped'] += 1
+                    continue
+                entry = {
+                    'key': member['Key'],
+                    'source_key': self.source_key(member['Key']),
+                    'size': len(content),
+                    'etag': member['ETag'],
+                    'last_modified': member['LastModified'].isoformat()
+                }
+                entries.append(entry)
+                yield from encoder.add(entry, content)
+            yield from encoder.finish()
+
+        def counted() -> Iterator[bytes]:
+            for chunk in chunks():
+                digest.update(chunk)
+                written['bytes'] += len(chunk)
+                yield chunk
+
+        existing = False
+        try:
+            upload_chunks(self.client, self.bucket, key, counted(), size_hint=group.size,
+                          conditions={'IfNoneMatch': '*'}, ContentType=encoder.content_type,
+                          Metadata={'compacted-objects': str(len(group.members))}, **self.owner)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                raise
+            # Written by an earlier run that stopped before deleting, or by a concurrent one
+            existing = True
+
+        result = {**group.to_dict(), 'key': key, 'objects_written': len(entries), 'bytes_written': written['bytes'],
+                  'objects_skipped': written['skipped'], 'existing': existing, 'verified': False, 'deleted': 0}
+        if not entries:
+            return result
+        if not self.verify(key, written['bytes'], digest.hexdigest()):
+            return result
+        result['verified'] = True
+        self.client.put_object(Bucket=self.bucket, Key=key + INDEX_SUFFIX, ContentType='application/json',  # NOSONAR
+                               Body=json.dumps({
+                                   'object': key,
+                                   'format': self.format,
+                                   'bytes': written['bytes'],
+                                   'sha256': digest.hexdigest(),
+                                   'window': group.window.isoformat(),
+                                   'members': entries
+                               }).encode('utf-8'), **self.owner)
+        result['deleted'] = self.delete([entry['key'] for entry in entries])
+        return result
+
+    def verify(self, key: str, size: int, sha256: str) -> bool:
+        """Whether the stored object has the length and SHA-256 that were written."""
+        response = self.client.get_object(Bucket=self.bucket, Key=key, **self.owner)  # NOSONAR
+        if response['ContentLength'] != size:
+            return False
+        digest = hashlib.sha256()
+        body = response['Body']
+        for chunk in iter(lambda: body.read(READ_CHUNK_BYTES), b''):
+            digest.update(chunk)
+        return digest.hexdigest() == sha256
+
+    def delete(self, keys: List[str]) -> int:
+        deleted = 0
+        for offset in range(0, len(keys), DELETE_BATCH):
+            batch = keys[offset:offset + DELETE_BATCH]
+            response = self.client.delete_objects(Bucket=self.bucket, Delete={  # NOSONAR
+                'Objects': [{'Key': key} for key in batch], 'Quiet': True
+            }, **self.owner)
+            deleted += len(batch) - len(response.get('Errors', []))
+        return deleted
+
+    def indexes(self, parallelism: int = 8) -> Iterator[Dict[str, Any]]:
+        """Every index under the compacted prefix."""
+        lister = ObjectLister(self.client, self.bucket, self.compacted_prefix, ObjectFilter(suffixes=[INDEX_SUFFIX]),
+                              delimiter='/', parallelism=parallelism, expected_owner=self.expected_owner)
+        keys = [obj['Key'] for obj in lister.iter_objects()]
+
+        def read(key: str) -> Dict[str, Any]:
+            response = self.client.get_object(Bucket=self.bucket, Key=key, **self.owner)  # NOSONAR
+            return json.loads(response['Body'].read())
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='compact-index') as pool:
+            yield from pool.map(read, keys)
+
+    def compacted_outputs(self, parallelism: int = 8) -> Iterator[Tuple[str, datetime]]:
+        """Processed keys held in compacted objects with their LastModified, for the backlog scan."""
+        for index in self.indexes(parallelism):
+            for member in index['members']:
+                yield member['key'], datetime.fromisoformat(member['last_modified'])
+
+    def read_member(self, index: Dict[str, Any], member: Dict[str, Any]) -> bytes:
+        """Content of one original of a compacted object."""
+        if index['format'] == PARQUET:
+            if parquet is None:
+                raise RuntimeError('Reading compacted Parquet needs pyarrow')
+            file = RangedFile(self.client, self.bucket, index['object'], size=index['bytes'],
+                              expected_owner=self.expected_owner)
+            table = parquet.ParquetFile(file).read_row_group(member['row_group'], columns=['content'])
+            return table.column('content')[member['row']].as_py()
+        block = get_range(self.client, self.bucket, index['object'], member['offset'],
+                          member['offset'] + member['length'] - 1, self.expected_owner)
+        line = gzip.decompress(block).split(b'\n')[member['line']]
+        record = json.loads(line)
+        if record.get('encoding') == 'base64':
+            return base64.b64decode(record['content'])
+        return record['content'].encode('utf-8')
@@ -0,0 +1,225 @@
+"""
+Hedged S3 reads against slow first bytes.
+
+A small share of S3 requests wait far longer than usual for their first byte,
+and in a function that makes a few requests per invocation those stragglers
+set the tail latency. `Hedger` wraps the S3 client: a GetObject or HeadObject
+that has not returned after the S3_HEDGE_QUANTILE quantile of recent
+latencies of its operation is sent a second time, and whichever attempt
+returns first is used. The other is cancelled if it has not started, or its
+body is closed as soon as it returns. boto3 returns GetObject once the
+response headers arrive, so the latency tracked is the time to first byte.
+
+Latencies are tracked per operation with `StreamingQuantiles` (see
+quantiles.py), and no request is hedged before S3_HEDGE_MIN_SAMPLES have been
+seen. The delay is kept between S3_HEDGE_MIN_DELAY_MS and S3_HEDGE_MAX_DELAY_MS.
+Each request earns S3_HEDGE_BUDGET of a hedge, and a hedge is only sent while
+the earned balance covers it, so hedges stay below that share of requests even
+when S3 is slow for everyone and hedging would only add load. Requests,
+hedges, hedges that won and hedges refused by the budget are emitted per
+operation as a CloudWatch Embedded Metric Format log line by `publish_metrics`.
+Hedging is opt-in with S3_HEDGING=true.
+"""
+import functools
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional
+
+from quantiles import StreamingQuantiles
+
+S3_HEDGING = os.environ.get('S3_HEDGING', 'false').lower() == 'true'
+S3_HEDGE_QUANTILE = float(os.environ.get('S3_HEDGE_QUANTILE', '0.95'))
+S3_HEDGE_BUDGET = float(os.environ.get('S3_HEDGE_BUDGET', '0.05'))
+S3_HEDGE_MIN_DELAY_MS = float(os.environ.get('S3_HEDGE_MIN_DELAY_MS', '5'))
+S3_HEDGE_MAX_DELAY_MS = float(os.environ.get('S3_HEDGE_MAX_DELAY_MS', '2000'))
+S3_HEDGE_MIN_SAMPLES = int(os.environ.get('S3_HEDGE_MIN_SAMPLES', '50'))
+
+# Requests safe to send twice; responses are read-only
+HEDGED_OPERATIONS = frozenset(('get_object', 'head_object'))
+# Hedges that can be saved up while requests are fast, so a burst of slow ones can still be hedged
+MAX_BALANCE = 10.0
+# Attempt threads; every hedged request holds one or two of them until it returns
+MAX_ATTEMPTS_IN_FLIGHT = 128
+COUNTERS = ('requests', 'hedges', 'hedge_wins', 'budget_refusals')
+
+
+class _Operation:
+    """Latency estimate and counters of one operation; counters are guarded by the hedger's lock."""
+
+    def __init__(self):
+        self.latency = StreamingQuantiles()
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.published = dict(self.counters)
+
+
+class _HedgedClient:
+    """Proxy sending reads through the hedger and everything else straight to the client."""
+
+    def __init__(self, client: Any, hedger: 'Hedger'):
+        self._client = client
+        self._hedger = hedger
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._client, name)
+        if name not in HEDGED_OPERATIONS:
+            return attr
+
+        hedger = self._hedger
+
+        @functools.wraps(attr)
+        def hedged(**kwargs):
+            return hedger.call(name, attr, kwargs)
+
+        setattr(self, name, hedged)
+        return hedged
+
+
+class Hedger:
+    """Budgeted hedging of S3 reads, with latency estimates kept across warm invocations."""
+
+    def __init__(self, namespace: str, service: str, quantile: float = S3_HEDGE_QUANTILE,
+                 budget: float = S3_HEDGE_BUDGET, min_delay_ms: float = S3_HEDGE_MIN_DELAY_MS,
+                 max_delay_ms: float = S3_HEDGE_MAX_DELAY_MS, min_samples: int = S3_HEDGE_MIN_SAMPLES,
+                 enabled: bool = S3_HEDGING):
+        self.namespace = namespace
+        self.service = service
+        self.quantile = quantile
+        self.budget = budget
+        self.min_delay = min_delay_ms / 1000
+        self.max_delay = max_delay_ms / 1000
+        self.min_samples = min_samples
+        self.enabled = enabled
+        self._balance = MAX_BALANCE
+        self._operations: Dict[str, _Operation] = {name: _Operation() for name in HEDGED_OPERATIONS}
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def instrument(self, client: Any) -> Any:
+        """Wrap a client so that its reads are hedged; returns it unchanged when disabled."""
+        return _HedgedClient(client, self) if self.enabled else client
+
+    def _executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=MAX_ATTEMPTS_IN_FLIGHT, thread_name_prefix='hedge')
+            return self._pool
+
+    def delay(self, operation: str) -> Optional[float]:
+        """Seconds to wait before hedging `operation`, or None while too few latencies are known."""
+        latency = self._operations[operation].latency
+        if latency.observations < self.min_samples:
+            return None
+        return min(max(latency.quantile(self.quantile), self.min_delay), self.max_delay)
+
+    def _attempt(self, operation: str, method: Callable[..., Any], kwargs: Dict[str, Any]) -> Any:
+        start = time.monotonic()
+        response = method(**kwargs)
+        self._operations[operation].latency.add(time.monotonic() - start)
+        return response
+
+    def _spend(self, operation: str) -> bool:
+        """Take one hedge from the budget, counting a refusal when there is none."""
+        with self._lock:
+            if self._balance < 1:
+                self._operations[operation].counters['budget_refusals'] += 1
+                return False
+            self._balance -= 1
+            self._operations[operation].counters['hedges'] += 1
+            return True
+
+    def call(self, operation: str, method: Callable[..., Any], kwargs: Dict[str, Any]) -> Any:
+        """Run one read, hedging it once it is slower than the usual latency of its operation."""
+        with self._lock:
+            self._operations[operation].counters['requests'] += 1
+            self._balance = min(self._balance + self.budget, MAX_BALANCE)
+        delay = self.delay(operation)
+        if delay is None:
+            return self._attempt(operation, method, kwargs)
+
+        pool = self._executor()
+        primary = pool.submit(self._attempt, operation, method, kwargs)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._spend(operation):
+            return primary.result()
+
+        hedge = pool.submit(self._attempt, operation, method, kwargs)
+        attempts = [primary, hedge]
+        error: Optional[BaseException] = None
+        while attempts:
+            done, _ = wait(attempts, return_when=FIRST_COMPLETED)
+            for future in done:
+                attempts.remove(future)
+                if future.exception() is not None:
+                    # The other attempt may still succeed, e.g. after a connection reset
+                    error = error or future.exception()
+                    continue
+                if future is hedge:
+                    with self._lock:
+                        self._operations[operation].counters['hedge_wins'] += 1
+                for other in attempts:
+                    self._discard(other)
+                return future.result()
+        raise error
+
+    @staticmethod
+    def _discard(future: Future) -> None:
+        """Cancel the losing attempt, or release its connection once it returns."""
+        if future.cancel():
+            return
+
+        def close(done: Future) -> None:
+            if done.exception() is None:
+                body = done.result().get('Body')
+                if body is not None:
+                    body.close()
+        future.add_done_callback(close)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        stats = {}
+        with self._lock:
+            counters = {name: dict(operation.counters) for name, operation in self._operations.items()}
+        for name, values in counters.items():
+            delay = self.delay(name)
+            stats[name] = {**values, 'delay_ms': round(delay * 1000, 2) if delay is not None else None}
+        return stats
+
+    def publish_metrics(self, dimensions: Optional[Dict[str, str]] = None) -> None:
+        """Print the counters accumulated since the last call of each operation as EMF lines."""
+        if not self.enabled:
+            return
+        for name, operation in self._operations.items():
+            with self._lock:
+                deltas = {counter: operation.counters[counter] - operation.published[counter] for counter in COUNTERS}
+                operation.published = dict(operation.counters)
+            if deltas['requests']:
+                delay = self.delay(name)
+                print(json.dumps(self.emf_document(name, deltas, delay, dimensions or {})))
+
+    def emf_document(self, operation: str, deltas: Dict[str, int], delay: Optional[float],
+                     dimensions: Dict[str, str]) -> Dict[str, Any]:
+        metrics: Dict[str, Any] = {
+            'S3HedgeableRequests': deltas['requests'],
+            'S3Hedges': deltas['hedges'],
+            'S3HedgeWins': deltas['hedge_wins'],
+            'S3HedgeBudgetRefusals': deltas['budget_refusals']
+        }
+        units = {name: 'Count' for name in metrics}
+        if delay is not None:
+            metrics['S3HedgeDelay'] = round(delay * 1000, 2)
+            units['S3HedgeDelay'] = 'Milliseconds'
+        dimensions = {'Service': self.service, 'Operation': operation, **dimensions}
+        return {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [list(dimensions.keys())],
+                    'Metrics': [{'Name': name, 'Unit': unit} for name, unit in units.items()]
+                }]
+            },
+            **dimensions,
+            **metrics
+        }
@@ -0,0 +1,93 @@
+"""
+Destination key layouts for processed files.
+
+S3 scales request rates per key prefix, so outputs written under a single
+`processed/` prefix share one partition's PUT rate. KEY_LAYOUT inserts
+segments between the processed prefix and the key relative to the processing
+prefix:
+
+    flat      processed/reports/a.csv (the default)
+    hashed    processed/7/reports/a.csv: one of KEY_LAYOUT_SHARDS hex shards
+              chosen by a hash of the key, so writes spread over prefixes S3
+              can split into separate partitions
+    date      processed/2026/10/19/reports/a.csv, by the UTC date of the upload
+    hive      processed/year=2026/month=10/day=19/reports/a.csv, read as
+              partition columns by Athena, Glue and Spark
+
+Layouts combine left to right, e.g. "hive,hashed" spreads each day's outputs
+over shards. `source_key` reverses the mapping for the backlog scan and returns
+None for keys the layout does not produce, such as outputs written under a
+previous layout, so their sources are processed again under the current one.
+"""
+import re
+import zlib
+from datetime import datetime, timezone
+from typing import List, Optional
+
+FLAT = 'flat'
+HASHED = 'hashed'
+DATE = 'date'
+HIVE = 'hive'
+LAYOUTS = (FLAT, HASHED, DATE, HIVE)
+
+DATE_SEGMENTS = re.compile(r'^(\d{4})/(\d{2})/(\d{2})/')
+HIVE_SEGMENTS = re.compile(r'^year=(\d{4})/month=(\d{2})/day=(\d{2})/')
+
+
+class KeyLayout:
+    """Maps source keys to destination keys under a layout and back."""
+
+    def __init__(self, layout: str, source_prefix: str, destination_prefix: str, shards: int = 16):
+        self.parts: List[str] = []
+        for part in (part.strip() for part in layout.split(',')):
+            if part not in LAYOUTS:
+                raise ValueError(f"Unknown key layout: {part}")
+            if part != FLAT:
+                self.parts.append(part)
+        if shards < 1:
+            raise ValueError(f"Key layout shards must be positive, got {shards}")
+        self.source_prefix = source_prefix
+        self.destination_prefix = destination_prefix
+        self.shards = shards
+        self.shard_width = len(f"{shards - 1:x}")
+        self.hashed_segment = re.compile(rf'^[0-9a-f]{{{self.shard_width}}}/')
+
+    @property
+    def dated(self) -> bool:
+        """Whether destination keys depend on the upload time as well as the source key."""
+        return DATE in self.parts or HIVE in self.parts
+
+    def shard(self, relative_key: str) -> str:
+        return f"{zlib.crc32(relative_key.encode('utf-8')) % self.shards:0{self.shard_width}x}"
+
+    def destination_key(self, source_key: str, uploaded: Optional[datetime] = None) -> str:
+        """Destination key of `source_key`; dated layouts use `uploaded`, the source's LastModified."""
+        relative = source_key[len(self.source_prefix):] if source_key.startswith(self.source_prefix) else source_key
+        day = (uploaded or datetime.now(timezone.utc)).astimezone(timezone.utc)
+        segments = []
+        for part in self.parts:
+            if part == HASHED:
+                segments.append(f"{self.shard(relative)}/")
+            elif part == DATE:
+                segments.append(f"{day:%Y/%m/%d}/")
+            else:
+                segments.append(f"year={day:%Y}/month={day:%m}/day={day:%d}/")
+        return self.destination_prefix + ''.join(segments) + relative
+
+    def source_key(self, destination_key: str) -> Optional[str]:
+        """Source key `destination_key` was produced from, or None if this layout does not produce it."""
+        if not destination_key.startswith(self.destination_prefix):
+            return None
+        rest = destination_key[len(self.destination_prefix):]
+        shard = None
+        for part in self.parts:
+            pattern = self.hashed_segment if part == HASHED else DATE_SEGMENTS if part == DATE else HIVE_SEGMENTS
+            match = pattern.match(rest)
+            if match is None:
+                return None
+            if part == HASHED:
+                shard = match.group(0)[:-1]
+            rest = rest[match.end():]
+        if not rest or (shard is not None and shard != self.shard(rest)):
+            return None
+        return self.source_prefix + rest
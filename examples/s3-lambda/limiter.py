@@ -0,0 +1,308 @@
+"""
+Adaptive per-prefix concurrency for S3 requests.
+
+S3 scales request capacity per key prefix and answers 503 SlowDown while a
+prefix is over its rate. A fixed number of requests in flight either leaves
+capacity unused or keeps a throttled prefix saturated with retries.
+`AdaptiveLimiter` wraps the S3 client and bounds the requests in flight per
+bucket and prefix (the first S3_CONCURRENCY_PREFIX_DEPTH levels of the key's
+directory) with additive increase, multiplicative decrease: every request that
+completes while its prefix is at the limit raises the limit by 1/limit, about
+one per round of requests, and a throttled request, or one slower than
+S3_LATENCY_SPIKE_FACTOR times the usual latency of its operation on that prefix,
+cuts it. Only requests started after the last cut can cut again, so a burst of
+throttling halves the limit once instead of once per failed request.
+
+Throttled requests are retried with jittered backoff, up to S3_THROTTLE_RETRIES
+times, once a slot is free under the reduced limit. On a boto3 client, attempts
+that botocore retries itself are seen through its needs-retry event and cut the
+limit as well. Limits and counters per prefix are emitted as a CloudWatch
+Embedded Metric Format log line by `publish_metrics`.
+"""
+import functools
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+S3_ADAPTIVE_CONCURRENCY = os.environ.get('S3_ADAPTIVE_CONCURRENCY', 'true').lower() == 'true'
+S3_CONCURRENCY_INITIAL = int(os.environ.get('S3_CONCURRENCY_INITIAL', '8'))
+S3_CONCURRENCY_MIN = int(os.environ.get('S3_CONCURRENCY_MIN', '1'))
+S3_CONCURRENCY_MAX = int(os.environ.get('S3_CONCURRENCY_MAX', '64'))
+S3_CONCURRENCY_PREFIX_DEPTH = int(os.environ.get('S3_CONCURRENCY_PREFIX_DEPTH', '2'))
+S3_THROTTLE_RETRIES = int(os.environ.get('S3_THROTTLE_RETRIES', '4'))
+S3_LATENCY_SPIKE_FACTOR = float(os.environ.get('S3_LATENCY_SPIKE_FACTOR', '4'))
+
+THROTTLE_DECREASE = 0.5
+# Slow responses may have other causes than an overloaded prefix, so they cut less
+LATENCY_DECREASE = 0.8
+LATENCY_SMOOTHING = 0.05
+# Latencies observed for an operation before its spikes are acted on
+MIN_LATENCY_SAMPLES = 20
+BASE_BACKOFF_SECONDS = 0.05
+MAX_BACKOFF_SECONDS = 2.0
+# Idle prefixes are forgotten beyond this many
+MAX_PARTITIONS = 1024
+THROTTLE_ERROR_CODES = frozenset((
+    'SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException',
+    'RequestThrottled'
+))
+# Operations whose latency grows with the data they move, so it says nothing about the prefix's load
+PAYLOAD_OPERATIONS = frozenset((
+    'put_object', 'upload_part', 'upload_part_copy', 'copy_object', 'complete_multipart_upload',
+    'select_object_content'
+))
+# Client attributes that return helpers rather than performing an S3 request
+UNLIMITED_CLIENT_ATTRIBUTES = frozenset({
+    'can_paginate', 'close', 'generate_presigned_post', 'generate_presigned_url',
+    'get_paginator', 'get_waiter'
+})
+COUNTERS = ('requests', 'throttles', 'latency_spikes', 'retries')
+
+
+def is_throttle(code: str, status: int) -> bool:
+    return code in THROTTLE_ERROR_CODES or status in (429, 503)
+
+
+def partition_name(params: Dict[str, Any], depth: int) -> Optional[str]:
+    """Bucket and the first `depth` directory levels of the request's key or listing prefix."""
+    bucket = params.get('Bucket')
+    if not bucket:
+        return None
+    key = params.get('Key', params.get('Prefix', '')) or ''
+    directories = key.split('/')[:-1][:depth]
+    return f"{bucket}/" + ''.join(f"{directory}/" for directory in directories)
+
+
+class _Partition:
+    """Limit and counters of one prefix; all fields are guarded by `condition`."""
+
+    def __init__(self, name: str, limit: float):
+        self.name = name
+        self.limit = limit
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.last_used = time.monotonic()
+        self.latency: Dict[str, float] = {}
+        self.samples: Dict[str, int] = {}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.published = dict(self.counters)
+        self.condition = threading.Condition()
+
+
+class _LimitedClient:
+    """Proxy admitting each S3 request through the limiter of its prefix."""
+
+    def __init__(self, client: Any, limiter: 'AdaptiveLimiter', hooked: bool):
+        self._client = client
+        self._limiter = limiter
+        self._hooked = hooked
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._client, name)
+        if name in UNLIMITED_CLIENT_ATTRIBUTES or name.startswith('_') or not callable(attr):
+            return attr
+
+        limiter = self._limiter
+        hooked = self._hooked
+
+        @functools.wraps(attr)
+        def limited(**kwargs):
+            return limiter.call(name, attr, kwargs, hooked)
+
+        setattr(self, name, limited)
+        return limited
+
+
+class AdaptiveLimiter:
+    """AIMD limits on S3 requests in flight, kept per bucket and prefix across warm invocations."""
+
+    def __init__(self, namespace: str, service: str, initial: int = S3_CONCURRENCY_INITIAL,
+                 minimum: int = S3_CONCURRENCY_MIN, maximum: int = S3_CONCURRENCY_MAX,
+                 prefix_depth: int = S3_CONCURRENCY_PREFIX_DEPTH, retries: int = S3_THROTTLE_RETRIES,
+                 spike_factor: float = S3_LATENCY_SPIKE_FACTOR, enabled: bool = S3_ADAPTIVE_CONCURRENCY):
+        self.namespace = namespace
+        self.service = service
+        self.initial = max(min(initial, maximum), minimum)
+        self.minimum = max(minimum, 1)
+        self.maximum = maximum
+        self.prefix_depth = prefix_depth
+        self.retries = retries
+        self.spike_factor = spike_factor
+        self.enabled = enabled
+        self._partitions: Dict[str, _Partition] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def instrument(self, client: Any) -> Any:
+        """Wrap a client so that its requests are limited; returns it unchanged when disabled."""
+        if not self.enabled:
+            return client
+        events = getattr(getattr(client, 'meta', None), 'events', None)
+        if events is not None:
+            events.register('needs-retry.s3', self._on_needs_retry)
+        return _LimitedClient(client, self, events is not None)
+
+    def _partition(self, name: str) -> _Partition:
+        with self._lock:
+            partition = self._partitions.get(name)
+            if partition is None:
+                if len(self._partitions) >= MAX_PARTITIONS:
+                    self._forget_idle()
+                partition = self._partitions[name] = _Partition(name, float(self.initial))
+            partition.last_used = time.monotonic()
+            return partition
+
+    def _forget_idle(self) -> None:
+        idle = sorted((partition.last_used, name) for name, partition in self._partitions.items()
+                      if partition.in_flight == 0)
+        for _, name in idle[:max(len(idle) // 2, 1)]:
+            del self._partitions[name]
+
+    def call(self, operation: str, method: Callable[..., Any], kwargs: Dict[str, Any], hooked: bool = False) -> Any:
+        """Run one request under its prefix's limit, retrying it while it is throttled."""
+        name = partition_name(kwargs, self.prefix_depth)
+        if name is None:
+            return method(**kwargs)
+        partition = self._partition(name)
+        body = kwargs.get('Body')
+        position = body.tell() if hasattr(body, 'seek') and hasattr(body, 'tell') else None
+        attempt = 0
+        while True:
+            start, saturated = self._acquire(partition)
+            self._local.current = (partition, start)
+            try:
+                response = method(**kwargs)
+            except ClientError as e:
+                code = e.response.get('Error', {}).get('Code', '')
+                status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+                throttled = is_throttle(code, status)
+                # Attempts botocore made were already counted by the needs-retry hook
+                self._release(partition, start, saturated, operation, None, throttled and not hooked)
+                if not throttled or attempt >= self.retries or not self._rewind(body, position):
+                    raise
+            except BaseException:
+                self._release(partition, start, saturated, operation, None, False)
+                raise
+            else:
+                self._release(partition, start, saturated, operation, time.monotonic() - start, False)
+                return response
+            finally:
+                self._local.current = None
+            attempt += 1
+            self._count(partition, 'retries')
+            time.sleep(random.uniform(0, min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2 ** attempt)))
+
+    @staticmethod
+    def _rewind(body: Any, position: Optional[int]) -> bool:
+        """Put a streamed body back where the failed attempt started reading; False if it cannot be."""
+        if body is None or isinstance(body, (bytes, bytearray, str)):
+            return True
+        if position is None:
+            return False
+        body.seek(position)
+        return True
+
+    def _acquire(self, partition: _Partition) -> Tuple[float, bool]:
+        with partition.condition:
+            while partition.in_flight >= int(partition.limit):
+                partition.condition.wait()
+            partition.in_flight += 1
+            partition.counters['requests'] += 1
+            return time.monotonic(), partition.in_flight >= int(partition.limit)
+
+    def _release(self, partition: _Partition, start: float, saturated: bool, operation: str,
+                 elapsed: Optional[float], throttled: bool) -> None:
+        with partition.condition:
+            partition.in_flight -= 1
+            if throttled:
+                partition.counters['throttles'] += 1
+                self._decrease(partition, start, THROTTLE_DECREASE)
+            elif elapsed is not None:
+                if operation not in PAYLOAD_OPERATIONS and self._is_spike(partition, operation, elapsed):
+                    partition.counters['latency_spikes'] += 1
+                    self._decrease(partition, start, LATENCY_DECREASE)
+                elif saturated:
+                    partition.limit = min(partition.limit + 1 / partition.limit, float(self.maximum))
+            partition.condition.notify(max(int(partition.limit) - partition.in_flight, 1))
+
+    def _is_spike(self, partition: _Partition, operation: str, elapsed: float) -> bool:
+        baseline = partition.latency.get(operation)
+        samples = partition.samples.get(operation, 0)
+        partition.latency[operation] = elapsed if baseline is None else baseline + LATENCY_SMOOTHING * (
+            elapsed - baseline)
+        partition.samples[operation] = samples + 1
+        return baseline is not None and samples >= MIN_LATENCY_SAMPLES and elapsed > baseline * self.spike_factor
+
+    def _decrease(self, partition: _Partition, start: float, factor: float) -> None:
+        # Requests started before the last cut were admitted under the old limit and say nothing about the new one
+        if start < partition.last_decrease:
+            return
+        partition.limit = max(partition.limit * factor, float(self.minimum))
+        partition.last_decrease = time.monotonic()
+
+    def _on_needs_retry(self, response: Any = None, **kwargs: Any) -> None:
+        """botocore needs-retry handler: count throttled attempts; never changes botocore's decision."""
+        current = getattr(self._local, 'current', None)
+        if current is None or response is None:
+            return None
+        parsed = response[1] or {}
+        code = parsed.get('Error', {}).get('Code', '')
+        status = parsed.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        if is_throttle(code, status):
+            partition, start = current
+            with partition.condition:
+                partition.counters['throttles'] += 1
+                self._decrease(partition, start, THROTTLE_DECREASE)
+        return None
+
+    @staticmethod
+    def _count(partition: _Partition, counter: str) -> None:
+        with partition.condition:
+            partition.counters[counter] += 1
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            partitions = list(self._partitions.values())
+        stats = {}
+        for partition in partitions:
+            with partition.condition:
+                stats[partition.name] = {'limit': round(partition.limit, 2), 'in_flight': partition.in_flight,
+                                         **partition.counters}
+        return stats
+
+    def publish_metrics(self, dimensions: Optional[Dict[str, str]] = None) -> None:
+        """Print the limit and the counters accumulated since the last call of each active prefix as EMF lines."""
+        with self._lock:
+            partitions = list(self._partitions.values())
+        for partition in partitions:
+            with partition.condition:
+                deltas = {name: partition.counters[name] - partition.published[name] for name in COUNTERS}
+                partition.published = dict(partition.counters)
+                limit = partition.limit
+            if any(deltas.values()):
+                print(json.dumps(self.emf_document(partition.name, deltas, limit, dimensions or {})))
+
+    def emf_document(self, prefix: str, deltas: Dict[str, int], limit: float,
+                     dimensions: Dict[str, str]) -> Dict[str, Any]:
+        metrics = {f"S3{name.title().replace('_', '')}": value for name, value in deltas.items()}
+        dimensions = {'Service': self.service, 'Prefix': prefix, **dimensions}
+        return {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [list(dimensions.keys())],
+                    'Metrics': [{'Name': name, 'Unit': 'Count'} for name in metrics] + [
+                        {'Name': 'S3ConcurrencyLimit', 'Unit': 'Count'}
+                    ]
+                }]
+            },
+            **dimensions,
+            **metrics,
+            'S3ConcurrencyLimit': round(limit, 2)
+        }
@@ -0,0 +1,339 @@
+"""
+Paginated, filtered and optionally parallel S3 listing.
+
+`ObjectLister` walks every ListObjectsV2 page under a prefix and filters each page
+as it arrives, so memory stays bounded by the page size no matter how many keys
+match. With a delimiter the prefix is first split into shards, one per common
+prefix (recursively up to `shard_depth` levels); with a keyspace it is split
+into key ranges at each character of the keyspace instead, which suits flat
+prefixes with hashed or hex key names. Shards are listed by a thread pool and
+handed back through a bounded queue. Keys are in order within a shard but shards
+interleave.
+
+Progress is tracked per shard as the last key consumed, so an interrupted
+listing can be resumed from `cursor()` with StartAfter. Pages are requested
+with ContinuationToken directly rather than through a boto3 paginator so that
+recorded invocations capture every page.
+"""
+import base64
+import json
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+CURSOR_VERSION = 1
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_PARALLELISM = 8
+# Pages buffered per worker between the listing threads and the consumer
+PAGES_IN_FLIGHT_PER_WORKER = 2
+
+
+class ObjectFilter:
+    """Key suffix, size range and last-modified window applied to listed objects."""
+
+    def __init__(self, suffixes: Optional[List[str]] = None, min_size: Optional[int] = None,
+                 max_size: Optional[int] = None, modified_after: Optional[datetime] = None,
+                 modified_before: Optional[datetime] = None):
+        self.suffixes = tuple(suffixes or ())
+        self.min_size = min_size
+        self.max_size = max_size
+        self.modified_after = modified_after
+        self.modified_before = modified_before
+
+    @classmethod
+    def from_params(cls, params: Dict[str, Any]) -> 'ObjectFilter':
+        """Build a filter from event fields or query string parameters (all optional)."""
+        suffix = params.get('suffix') or []
+        return cls(
+            suffixes=suffix.split(',') if isinstance(suffix, str) else list(suffix),
+            min_size=int(params['min_size']) if params.get('min_size') not in (None, '') else None,
+            max_size=int(params['max_size']) if params.get('max_size') not in (None, '') else None,
+            modified_after=_parse_time(params.get('modified_after')),
+            modified_before=_parse_time(params.get('modified_before'))
+        )
+
+    def to_params(self) -> Dict[str, Any]:
+        params: Dict[str, Any] = {}
+        if self.suffixes:
+            params['suffix'] = list(self.suffixes)
+        if self.min_size is not None:
+            params['min_size'] = self.min_size
+        if self.max_size is not None:
+            params['max_size'] = self.max_size
+        if self.modified_after:
+            params['modified_after'] = self.modified_after.isoformat()
+        if self.modified_before:
+            params['modified_before'] = self.modified_before.isoformat()
+        return params
+
+    @property
+    def active(self) -> bool:
+        return bool(self.to_params())
+
+    def matches(self, obj: Dict[str, Any]) -> bool:
+        if self.suffixes and not obj['Key'].endswith(self.suffixes):
+            return False
+        size = obj.get('Size', 0)
+        if self.min_size is not None and size < self.min_size:
+            return False
+        if self.max_size is not None and size > self.max_size:
+            return False
+        modified = obj.get('LastModified')
+        if self.modified_after and modified and modified < self.modified_after:
+            return False
+        if self.modified_before and modified and modified >= self.modified_before:
+            return False
+        return True
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+class Shard:
+    """A key range listed by one worker.
+
+    A delimited shard lists only the objects directly under its prefix; the
+    sub-prefixes below it are shards of their own. A bounded shard covers the keys
+    after `start_after` up to and including `end`.
+    """
+
+    __slots__ = ('prefix', 'delimited', 'start_after', 'end')
+
+    def __init__(self, prefix: str, delimited: bool = False, start_after: str = '', end: Optional[str] = None):
+        self.prefix = prefix
+        self.delimited = delimited
+        self.start_after = start_after
+        self.end = end
+
+    def to_list(self) -> List[Any]:
+        return [self.prefix, self.delimited, self.start_after, self.end]
+
+
+class ObjectLister:
+    """Lists every object under a prefix that passes an `ObjectFilter`."""
+
+    def __init__(self, client: Any, bucket: str, prefix: str = '', object_filter: Optional[ObjectFilter] = None,
+                 delimiter: Optional[str] = None, shard_depth: int = 1, parallelism: int = DEFAULT_PARALLELISM,
+                 page_size: int = DEFAULT_PAGE_SIZE, expected_owner: Optional[str] = None,
+                 shards: Optional[List[Shard]] = None, keyspace: str = ''):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.filter = object_filter or ObjectFilter()
+        self.delimiter = delimiter
+        self.keyspace = keyspace
+        self.shard_depth = shard_depth
+        self.parallelism = max(parallelism, 1)
+        self.page_size = page_size
+        self.expected_owner = expected_owner
+        self.pages_listed = 0
+        self.objects_scanned = 0
+        self._shards = shards
+        self._positions: Dict[int, str] = {}
+        self._completed: set = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_cursor(cls, client: Any, cursor: str, **kwargs: Any) -> 'ObjectLister':
+        """Resume a listing from a token returned by `cursor()`."""
+        state = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if state.get('v') != CURSOR_VERSION:
+            raise ValueError('Unsupported listing cursor')
+        shards = [Shard(*entry) for entry in state['shards']]
+        return cls(client, state['bucket'], state['prefix'], ObjectFilter.from_params(state['filter']),
+                   state.get('delimiter'), shards=shards, **kwargs)
+
+    def cursor(self) -> Optional[str]:
+        """Token resuming after the last consumed key of every unfinished shard, or None when done."""
+        if self._shards is None:
+            return None
+        remaining = [
+            Shard(shard.prefix, shard.delimited, self._positions.get(index, shard.start_after), shard.end).to_list()
+            for index, shard in enumerate(self._shards) if index not in self._completed
+        ]
+        if not remaining:
+            return None
+        state = {
+            'v': CURSOR_VERSION,
+            'bucket': self.bucket,
+            'prefix': self.prefix,
+            'delimiter': self.delimiter,
+            'filter': self.filter.to_params(),
+            'shards': remaining
+        }
+        return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+    def _list(self, **kwargs: Any) -> Dict[str, Any]:
+        if self.expected_owner:
+            kwargs['ExpectedBucketOwner'] = self.expected_owner
+        response = self.client.list_objects_v2(Bucket=self.bucket, MaxKeys=self.page_size, **kwargs)  # NOSONAR
+        with self._lock:
+            self.pages_listed += 1
+        return response
+
+    def discover_shards(self) -> List[Shard]:
+        """Split the prefix into shards along the keyspace or the delimiter."""
+        if self._shards is not None:
+            return self._shards
+        if self.keyspace:
+            self._shards = keyspace_shards(self.prefix, self.keyspace)
+            return self._shards
+        if not self.delimiter:
+            self._shards = [Shard(self.prefix)]
+            return self._shards
+
+        shards: List[Shard] = []
+        level = [self.prefix]
+        for _ in range(self.shard_depth):
+            next_level = []
+            for prefix in level:
+                common_prefixes, has_objects = self._common_prefixes(prefix)
+                if has_objects:
+                    shards.append(Shard(prefix, delimited=True))
+                next_level.extend(common_prefixes)
+            level = next_level
+        shards.extend(Shard(prefix) for prefix in level)
+        self._shards = shards
+        return shards
+
+    def _common_prefixes(self, prefix: str) -> Tuple[List[str], bool]:
+        prefixes: List[str] = []
+        has_objects = False
+        kwargs: Dict[str, Any] = {'Prefix': prefix, 'Delimiter': self.delimiter}
+        while True:
+            response = self._list(**kwargs)
+            prefixes.extend(entry['Prefix'] for entry in response.get('CommonPrefixes', []))
+            has_objects = has_objects or bool(response.get('Contents'))
+            if not response.get('IsTruncated'):
+                return prefixes, has_objects
+            kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+    def _shard_pages(self, shard: Shard) -> Iterator[Tuple[List[Dict[str, Any]], bool]]:
+        """Yield (contents, last_page) for one shard."""
+        kwargs: Dict[str, Any] = {'Prefix': shard.prefix}
+        if shard.delimited:
+            kwargs['Delimiter'] = self.delimiter
+        if shard.start_after:
+            kwargs['StartAfter'] = shard.start_after
+        while True:
+            response = self._list(**kwargs)
+            contents = response.get('Contents', [])
+            last_page = not response.get('IsTruncated')
+            if shard.end is not None and contents and contents[-1]['Key'] > shard.end:
+                contents = [obj for obj in contents if obj['Key'] <= shard.end]
+                last_page = True
+            yield contents, last_page
+            if last_page:
+                return
+            kwargs.pop('StartAfter', None)
+            kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+    def _pages(self) -> Iterator[Tuple[int, List[Dict[str, Any]], bool]]:
+        """Yield (shard index, contents, last_page) from all shards, in parallel when there are several."""
+        shards = [(index, shard) for index, shard in enumerate(self.discover_shards()) if index not in self._completed]
+        if self.parallelism == 1 or len(shards) <= 1:
+            for index, shard in shards:
+                for contents, last_page in self._shard_pages(shard):
+                    yield index, contents, last_page
+            return
+
+        workers = min(self.parallelism, len(shards))
+        pages: 'queue.Queue' = queue.Queue(maxsize=workers * PAGES_IN_FLIGHT_PER_WORKER)
+        todo: 'queue.Queue' = queue.Queue()
+        for item in shards:
+            todo.put(item)
+        stop = threading.Event()
+        finished = object()
+
+        def put(item: Any) -> bool:
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def work() -> None:
+            try:
+                while not stop.is_set():
+                    try:
+                        index, shard = todo.get_nowait()
+                    except queue.Empty:
+                        return
+                    for contents, last_page in self._shard_pages(shard):
+                        if not put((index, contents, last_page)):
+                            return
+            except Exception as e:
+                put(e)
+            finally:
+                put(finished)
+
+        executor = ThreadPoolExecutor(max_workers=workers)
+        for _ in range(workers):
+            executor.submit(work)
+        try:
+            running = workers
+            while running:
+                item = pages.get()
+                if item is finished:
+                    running -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+        finally:
+            stop.set()
+            executor.shutdown(wait=False)
+
+    def iter_pages(self) -> Iterator[List[Dict[str, Any]]]:
+        """Yield the matching objects of each listed page; pages without matches are skipped."""
+        for index, contents, last_page in self._pages():
+            self.objects_scanned += len(contents)
+            if contents:
+                self._positions[index] = contents[-1]['Key']
+            if last_page:
+                self._completed.add(index)
+            matching = [obj for obj in contents if self.filter.matches(obj)] if self.filter.active else contents
+            if matching:
+                yield matching
+
+    def iter_objects(self) -> Iterator[Dict[str, Any]]:
+        """Yield matching objects one at a time, keeping the cursor exact when iteration stops early."""
+        matches = self.filter.matches if self.filter.active else None
+        for index, contents, last_page in self._pages():
+            for obj in contents:
+                self.objects_scanned += 1
+                self._positions[index] = obj['Key']
+                if matches is None or matches(obj):
+                    yield obj
+            if last_page:
+                self._completed.add(index)
+
+
+def keyspace_shards(prefix: str, keyspace: str) -> List[Shard]:
+    """Split a prefix into one key range per keyspace character.
+
+    Range boundaries are `prefix + character`; each boundary key belongs to the range
+    below it, so together the ranges cover every key under the prefix exactly once,
+    including keys that start with characters outside the keyspace.
+    """
+    boundaries = [prefix + character for character in sorted(set(keyspace))][1:]
+    starts = [''] + boundaries
+    ends: List[Optional[str]] = boundaries + [None]
+    return [Shard(prefix, start_after=start, end=end) for start, end in zip(starts, ends)]
+
+
+def describe(obj: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON-ready summary of a listed object."""
+    return {
+        'key': obj['Key'],
+        'size': obj['Size'],
+        'last_modified': obj['LastModified'].isoformat(),
+        'etag': obj['ETag'].strip('"')
+    }
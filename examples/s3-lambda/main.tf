@@ -43,8 +43,9 @@ module "s3" {
 
 # Create Lambda deployment package
 data "archive_file" "lambda_zip" {
-  type        = "zip"
-  output_path = "s3_processor_function.zip"
+  type             = "zip"
+  output_path      = "s3_processor_function.zip"
+  output_file_mode = "0755" # stream_bootstrap must be executable to serve as AWS_LAMBDA_EXEC_WRAPPER
   source {
     content = templatefile("${path.module}/s3_processor_function.py", {
       source_bucket      = module.s3["bucket2"].bucket_id
@@ -52,6 +53,94 @@ data "archive_file" "lambda_zip" {
     })
     filename = "lambda_function.py"
   }
+  source {
+    content  = file("${path.module}/listing.py")
+    filename = "listing.py"
+  }
+  source {
+    content  = file("${path.module}/backlog.py")
+    filename = "backlog.py"
+  }
+  source {
+    content  = file("${path.module}/ranged.py")
+    filename = "ranged.py"
+  }
+  source {
+    content  = file("${path.module}/query.py")
+    filename = "query.py"
+  }
+  source {
+    content  = file("${path.module}/spill.py")
+    filename = "spill.py"
+  }
+  source {
+    content  = file("${path.module}/batch_operations.py")
+    filename = "batch_operations.py"
+  }
+  source {
+    content  = file("${path.module}/limiter.py")
+    filename = "limiter.py"
+  }
+  source {
+    content  = file("${path.module}/layout.py")
+    filename = "layout.py"
+  }
+  source {
+    content  = file("${path.module}/compaction.py")
+    filename = "compaction.py"
+  }
+  source {
+    content  = file("${path.module}/hedging.py")
+    filename = "hedging.py"
+  }
+  source {
+    content  = file("${path.module}/transform_pool.py")
+    filename = "transform_pool.py"
+  }
+  source {
+    content  = file("${path.module}/result_sink.py")
+    filename = "result_sink.py"
+  }
+  source {
+    content  = file("${path.module}/../common/recording.py")
+    filename = "recording.py"
+  }
+  source {
+    content  = file("${path.module}/../common/quantiles.py")
+    filename = "quantiles.py"
+  }
+  source {
+    content  = file("${path.module}/../common/object_cache.py")
+    filename = "object_cache.py"
+  }
+  source {
+    content  = file("${path.module}/../common/shared_cache.py")
+    filename = "shared_cache.py"
+  }
+  source {
+    content  = file("${path.module}/../common/streaming.py")
+    filename = "streaming.py"
+  }
+  source {
+    content  = file("${path.module}/../common/stream_bootstrap")
+    filename = "stream_bootstrap"
+  }
+  source {
+    content  = file("${path.module}/../common/log_shipping.py")
+    filename = "log_shipping.py"
+  }
+  source {
+    content  = file("${path.module}/../common/memory_profile.py")
+    filename = "memory_profile.py"
+  }
+}
+
+locals {
+  # Replaces the runtime interface client with the streaming runtime loop in streaming.py
+  streaming_environment = {
+    AWS_LAMBDA_EXEC_WRAPPER = "/var/task/stream_bootstrap"
+    STREAM_HANDLER          = "lambda_function.stream_handler"
+  }
 }
 
 # Upload Lambda package to S3
@@ -79,6 +168,9 @@ module "s3_advanced_lambda" {
   memory_size   = 512
   timeout       = 300
 
+  # Room in /tmp for objects too large to process in memory
+  ephemeral_storage = var.ephemeral_storage
+
   # S3 deployment package
   s3_bucket         = module.s3["bucket1"].bucket_id
   s3_key            = aws_s3_object.lambda_package.key
@@ -86,13 +178,22 @@ module "s3_advanced_lambda" {
   source_code_hash  = data.archive_file.lambda_zip.output_base64sha256
 
   # Environment variables
-  environment_variables = {
+  environment_variables = merge({
     ENVIRONMENT        = var.environment
     LOG_LEVEL          = var.log_level
     SOURCE_BUCKET      = module.s3["bucket2"].bucket_id
     DESTINATION_BUCKET = module.s3["bucket3"].bucket_id
     DEPLOYMENT_BUCKET  = module.s3["bucket1"].bucket_id
     PROCESSING_PREFIX  = var.processing_prefix
+    KEY_LAYOUT         = var.key_layout
+    KEY_LAYOUT_SHARDS  = var.key_layout_shards
+  }, { for name, value in local.streaming_environment : name => value if var.enable_response_streaming })
+
+  # Function URL for listings and downloads; RESPONSE_STREAM sends the body as it is written
+  create_function_url = var.enable_function_url || var.enable_response_streaming
+  function_url_config = {
+    authorization_type = "AWS_IAM"
+    invoke_mode        = var.enable_response_streaming ? "RESPONSE_STREAM" : "BUFFERED"
   }
 
   # IAM permissions for comprehensive S3 access
@@ -145,6 +246,57 @@ resource "aws_lambda_permission" "allow_s3_invoke" {
   source_arn    = module.s3["bucket2"].bucket_arn
 }
 
+# Role S3 Batch Operations jobs assume to invoke the processor over a manifest
+data "aws_iam_policy_document" "batch_operations_assume" {
+  statement {
+    effect  = "Allow"
+    actions = ["sts:AssumeRole"]
+
+    principals {
+      type        = "Service"
+      identifiers = ["batchoperations.s3.amazonaws.com"]
+    }
+  }
+}
+
+data "aws_iam_policy_document" "batch_operations" {
+  statement {
+    effect    = "Allow"
+    actions   = ["lambda:InvokeFunction"]
+    resources = [module.s3_advanced_lambda.arn, "${module.s3_advanced_lambda.arn}:*"]
+  }
+
+  # Manifests are read from, and completion reports written to, the deployment bucket
+  statement {
+    effect    = "Allow"
+    actions   = ["s3:GetObject", "s3:GetObjectVersion"]
+    resources = ["${module.s3["bucket1"].bucket_arn}/batch-manifests/*"]
+  }
+
+  statement {
+    effect    = "Allow"
+    actions   = ["s3:PutObject"]
+    resources = ["${module.s3["bucket1"].bucket_arn}/batch-reports/*"]
+  }
+}
+
+resource "aws_iam_role" "batch_operations" {
+  count = var.enable_batch_operations ? 1 : 0
+
+  name               = "${var.function_name}-batch-operations"
+  assume_role_policy = data.aws_iam_policy_document.batch_operations_assume.json
+
+  tags = module.tags.tags
+}
+
+resource "aws_iam_role_policy" "batch_operations" {
+  count = var.enable_batch_operations ? 1 : 0
+
+  name   = "${var.function_name}-batch-operations"
+  role   = aws_iam_role.batch_operations[0].id
+  policy = data.aws_iam_policy_document.batch_operations.json
+}
+
 # CloudWatch Alarm for Lambda errors
 resource "aws_cloudwatch_metric_alarm" "lambda_error_alarm" {
   alarm_name          = "${var.function_name}-error-alarm"
@@ -32,3 +32,13 @@ output "alias_arn" {
   description = "ARN of the Lambda alias"
   value       = module.s3_advanced_lambda.alias_arn
 }
+
+output "function_url" {
+  description = "Function URL for /objects and /download, when enabled"
+  value       = module.s3_advanced_lambda.url
+}
+
+output "batch_operations_role_arn" {
+  description = "Role ARN for S3 Batch Operations jobs invoking the processor, when enabled"
+  value       = var.enable_batch_operations ? aws_iam_role.batch_operations[0].arn : null
+}
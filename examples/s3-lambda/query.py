@@ -0,0 +1,297 @@
+"""
+Filter and projection over CSV, JSON Lines and Parquet objects.
+
+A `Query` names the columns to keep, row conditions and an optional row limit.
+`run_query` sends it to S3 Select as SQL, so only the matching fields leave S3.
+Where S3 Select is unavailable (it is closed to new accounts) or `mode` is
+'local', the same query is evaluated in the function over the object streamed in
+ranged parts (see ranged.py); CSV and JSON are parsed line by line without
+holding the object, and Parquet is read through a seekable ranged file so only
+the footer and the needed column chunks are fetched. Local Parquet evaluation
+needs pyarrow, e.g. from the AWS SDK for pandas layer.
+
+Both engines yield records as dicts and count the bytes that reached the
+function in `QueryResult.bytes_transferred`.
+"""
+import csv
+import json
+import operator
+import zlib
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from botocore.exceptions import ClientError
+
+from ranged import DEFAULT_CONCURRENCY, DEFAULT_PART_SIZE, READ_AHEAD_BYTES, RangedFile, iter_ranges
+
+try:
+    import pyarrow.parquet as parquet
+except ImportError:  # Only needed to evaluate Parquet queries locally
+    parquet = None
+
+FORMATS = ('csv', 'json', 'parquet')
+MODES = ('auto', 'select', 'local')
+OPERATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'contains': lambda field, value: value in field
+}
+# Error codes meaning S3 Select cannot serve the request at all, rather than a bad query
+SELECT_UNAVAILABLE = ('MethodNotAllowed', 'NotImplemented', 'UnsupportedOperation', 'AccessDenied')
+PARQUET_BATCH_ROWS = 10000
+
+
+def detect_format(key: str, content_type: str = '') -> Optional[str]:
+    name = key.lower()
+    if name.endswith('.gz'):
+        name = name[:-3]
+    if name.endswith(('.csv', '.tsv')) or content_type == 'text/csv':
+        return 'csv'
+    if name.endswith(('.json', '.jsonl', '.ndjson')) or content_type in ('application/json', 'application/x-ndjson'):
+        return 'json'
+    if name.endswith('.parquet'):
+        return 'parquet'
+    return None
+
+
+class Query:
+    """Projection, conditions and limit applied to each record."""
+
+    def __init__(self, format: str, columns: Optional[List[str]] = None, where: Optional[List[List[Any]]] = None,
+                 limit: Optional[int] = None, header: bool = True, delimiter: str = ',', compressed: bool = False):
+        if format not in FORMATS:
+            raise ValueError(f"Unsupported query format: {format}")
+        for _, op, _ in where or []:
+            if op not in OPERATORS:
+                raise ValueError(f"Unsupported query operator: {op}")
+        self.format = format
+        self.columns = list(columns or [])
+        self.where = [tuple(condition) for condition in where or []]
+        self.limit = limit
+        self.header = header
+        self.delimiter = delimiter
+        self.compressed = compressed
+
+    @classmethod
+    def from_params(cls, params: Dict[str, Any], key: str, content_type: str = '') -> 'Query':
+        """Build a query from event fields or query string parameters.
+
+        `columns` is a list or comma-separated string and `where` a list of
+        [column, operator, value] triples or the same as a JSON string.
+        """
+        columns = params.get('columns') or []
+        where = params.get('where') or []
+        return cls(
+            params.get('format') or detect_format(key, content_type) or 'csv',
+            columns=columns.split(',') if isinstance(columns, str) else columns,
+            where=json.loads(where) if isinstance(where, str) else where,
+            limit=int(params['limit']) if params.get('limit') not in (None, '') else None,
+            header=str(params.get('header', True)).lower() not in ('false', '0', 'no'),
+            delimiter=params.get('delimiter', '\t' if key.lower().endswith(('.tsv', '.tsv.gz')) else ','),
+            compressed=key.lower().endswith('.gz')
+        )
+
+    def sql(self) -> str:
+        projection = ', '.join(_reference(column) for column in self.columns) or '*'
+        statement = f"SELECT {projection} FROM S3Object s"
+        if self.where:
+            statement += ' WHERE ' + ' AND '.join(_condition(*condition) for condition in self.where)
+        if self.limit is not None:
+            statement += f" LIMIT {self.limit}"
+        return statement
+
+    def input_serialization(self) -> Dict[str, Any]:
+        if self.format == 'csv':
+            serialization: Dict[str, Any] = {'CSV': {
+                'FileHeaderInfo': 'USE' if self.header else 'NONE',
+                'FieldDelimiter': self.delimiter
+            }}
+        elif self.format == 'json':
+            serialization = {'JSON': {'Type': 'LINES'}}
+        else:
+            serialization = {'Parquet': {}}
+        if self.format != 'parquet':
+            serialization['CompressionType'] = 'GZIP' if self.compressed else 'NONE'
+        return serialization
+
+    def matches(self, record: Dict[str, Any]) -> bool:
+        for column, op, value in self.where:
+            field = record.get(column)
+            if field is None:
+                return False
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                try:
+                    field = float(field)
+                except (TypeError, ValueError):
+                    return False
+            elif not isinstance(field, str):
+                field = str(field)
+            if not OPERATORS[op](field, value):
+                return False
+        return True
+
+    def project(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        if not self.columns:
+            return record
+        return {column: record.get(column) for column in self.columns}
+
+
+def _reference(column: str) -> str:
+    return 's."' + column.replace('"', '""') + '"'
+
+
+def _condition(column: str, op: str, value: Any) -> str:
+    reference = _reference(column)
+    if op == 'contains':
+        return f"{reference} LIKE '%" + str(value).replace("'", "''") + "%'"
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f"CAST({reference} AS FLOAT) {op} {value}"
+    return f"{reference} {op} '" + str(value).replace("'", "''") + "'"
+
+
+class QueryResult:
+    """Records of a query as they are produced, with the engine used and bytes moved."""
+
+    def __init__(self, engine: str):
+        self.engine = engine
+        self.records = 0
+        self.bytes_scanned = 0
+        self.bytes_transferred = 0
+        self._records: Iterator[Dict[str, Any]] = iter(())
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for record in self._records:
+            self.records += 1
+            yield record
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'engine': self.engine,
+            'records': self.records,
+            'bytes_scanned': self.bytes_scanned,
+            'bytes_transferred': self.bytes_transferred
+        }
+
+
+def run_query(client: Any, bucket: str, key: str, query: Query, size: int, mode: str = 'auto',
+              part_size: int = DEFAULT_PART_SIZE, concurrency: int = DEFAULT_CONCURRENCY,
+              expected_owner: Optional[str] = None) -> QueryResult:
+    """Run a query with S3 Select, falling back to local evaluation when mode is 'auto'."""
+    if mode not in MODES:
+        raise ValueError(f"Unsupported query mode: {mode}")
+    if mode != 'local':
+        try:
+            return _select(client, bucket, key, query, expected_owner)
+        except ClientError as e:
+            if mode == 'select' or e.response['Error']['Code'] not in SELECT_UNAVAILABLE:
+                raise
+
+    result = QueryResult('local')
+    if query.format == 'parquet':
+        result._records = _evaluate_parquet(RangedFile(client, bucket, key, size, expected_owner), query, result)
+        return result
+    if query.limit is not None:
+        # Records near the start of the object are enough; fetch small parts one at a time
+        part_size, concurrency = READ_AHEAD_BYTES, 1
+    chunks = iter_ranges(client, bucket, key, size, part_size=part_size, concurrency=concurrency,
+                         expected_owner=expected_owner)
+    result._records = _evaluate(_counted(chunks, result), query)
+    return result
+
+
+def _select(client: Any, bucket: str, key: str, query: Query, expected_owner: Optional[str]) -> QueryResult:
+    kwargs = {'ExpectedBucketOwner': expected_owner} if expected_owner else {}
+    response = client.select_object_content(  # NOSONAR
+        Bucket=bucket,
+        Key=key,
+        Expression=query.sql(),
+        ExpressionType='SQL',
+        InputSerialization=query.input_serialization(),
+        OutputSerialization={'JSON': {'RecordDelimiter': '\n'}},
+        **kwargs
+    )
+    result = QueryResult('select')
+
+    def records() -> Iterator[Dict[str, Any]]:
+        remainder = b''
+        for event in response['Payload']:
+            if 'Records' in event:
+                lines = (remainder + event['Records']['Payload']).split(b'\n')
+                remainder = lines.pop()
+                for line in lines:
+                    if line:
+                        yield json.loads(line)
+            elif 'Stats' in event:
+                details = event['Stats']['Details']
+                result.bytes_scanned = details.get('BytesScanned', 0)
+                result.bytes_transferred = details.get('BytesReturned', 0)
+        if remainder.strip():
+            yield json.loads(remainder)
+
+    result._records = records()
+    return result
+
+
+def _counted(chunks: Iterator[bytes], result: QueryResult) -> Iterator[bytes]:
+    for chunk in chunks:
+        result.bytes_scanned += len(chunk)
+        result.bytes_transferred += len(chunk)
+        yield chunk
+
+
+def _lines(chunks: Iterator[bytes], compressed: bool) -> Iterator[str]:
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32) if compressed else None
+    remainder = b''
+    for chunk in chunks:
+        if decompressor is not None:
+            chunk = decompressor.decompress(chunk)
+        lines = (remainder + chunk).split(b'\n')
+        remainder = lines.pop()
+        for line in lines:
+            yield line.decode('utf-8')
+    if remainder:
+        yield remainder.decode('utf-8')
+
+
+def _evaluate(chunks: Iterator[bytes], query: Query) -> Iterator[Dict[str, Any]]:
+    lines = _lines(chunks, query.compressed)
+    if query.format == 'csv':
+        reader = csv.reader(lines, delimiter=query.delimiter)
+        header = next(reader, None) if query.header else None
+        records: Iterator[Dict[str, Any]] = (
+            dict(zip(header, row)) if header else {f"_{index}": field for index, field in enumerate(row, 1)}
+            for row in reader if row
+        )
+    else:
+        records = (json.loads(line) for line in lines if line.strip())
+
+    yield from _limited(query, records)
+
+
+def _limited(query: Query, records: Iterator[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """Filter and project records, stopping as soon as the limit is reached."""
+    if query.limit is not None and query.limit <= 0:
+        return
+    emitted = 0
+    for record in records:
+        if query.matches(record):
+            yield query.project(record)
+            emitted += 1
+            if query.limit is not None and emitted >= query.limit:
+                return
+
+
+def _evaluate_parquet(file: RangedFile, query: Query, result: QueryResult) -> Iterator[Dict[str, Any]]:
+    if parquet is None:
+        raise RuntimeError('Evaluating Parquet queries without S3 Select needs pyarrow')
+    needed = None
+    if query.columns:
+        needed = list(dict.fromkeys(query.columns + [column for column, _, _ in query.where]))
+    batches = parquet.ParquetFile(file).iter_batches(batch_size=PARQUET_BATCH_ROWS, columns=needed)
+    try:
+        yield from _limited(query, (record for batch in batches for record in batch.to_pylist()))
+    finally:
+        result.bytes_scanned = result.bytes_transferred = file.bytes_fetched
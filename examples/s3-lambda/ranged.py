@@ -0,0 +1,288 @@
+"""
+Byte-range reads of S3 objects.
+
+A single GetObject stream tops out well below the network bandwidth of a Lambda
+function, so large objects are fetched as byte ranges over several connections.
+`RangedDownloader` splits an object into `part_size` parts and fetches up to
+`concurrency` of them at once on a thread pool kept for the life of the
+instance. It can hand them back in object order (`iter_chunks`), fill a
+preallocated buffer (`read`) or write them straight into a preallocated,
+memory-mapped file in /tmp (`download_to_file`). Ordered iteration holds at most
+`max_buffered_bytes` of fetched but unconsumed parts, so a slow consumer slows
+the fetching instead of growing memory. Every part is requested with the ETag of
+the first, so an object replaced mid-download fails instead of mixing versions.
+
+`RangedFile` is a seekable read-only file over ranged GETs for readers that only
+touch part of an object, such as a Parquet footer and the column chunks it
+points to.
+"""
+import errno
+import io
+import mmap
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from botocore.exceptions import BotoCoreError
+
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+DEFAULT_CONCURRENCY = 8
+# Sequential reads through RangedFile fetch at least this much per request
+READ_AHEAD_BYTES = 1024 * 1024
+# Part bodies are copied into their destination in pieces of this size
+COPY_CHUNK_BYTES = 1024 * 1024
+
+
+def get_range(client: Any, bucket: str, key: str, start: int, end: int,
+              expected_owner: Optional[str] = None) -> bytes:
+    """Fetch bytes start..end inclusive."""
+    kwargs = {'ExpectedBucketOwner': expected_owner} if expected_owner else {}
+    response = client.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end}", **kwargs)  # NOSONAR
+    return response['Body'].read()
+
+
+def object_size(client: Any, bucket: str, key: str, expected_owner: Optional[str] = None) -> int:
+    kwargs = {'ExpectedBucketOwner': expected_owner} if expected_owner else {}
+    return client.head_object(Bucket=bucket, Key=key, **kwargs)['ContentLength']  # NOSONAR
+
+
+def byte_ranges(start: int, end: int, part_size: int) -> List[Tuple[int, int]]:
+    """Split start..end (exclusive end) into inclusive (first, last) ranges of part_size bytes."""
+    return [(offset, min(offset + part_size, end) - 1) for offset in range(start, end, part_size)]
+
+
+class DownloadStats:
+    """Counters for one download."""
+
+    def __init__(self):
+        self.bytes = 0
+        self.parts = 0
+        self.retries = 0
+        self.peak_buffered_bytes = 0
+        self.started = time.monotonic()
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add_part(self, length: int) -> None:
+        with self._lock:
+            self.bytes += length
+            self.parts += 1
+
+    def add_retry(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    def finish(self) -> None:
+        self.seconds = time.monotonic() - self.started
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'bytes': self.bytes,
+            'parts': self.parts,
+            'retries': self.retries,
+            'peak_buffered_bytes': self.peak_buffered_bytes,
+            'seconds': round(self.seconds, 3),
+            'mib_per_second': round(self.bytes / self.seconds / 1024 / 1024, 1) if self.seconds else None
+        }
+
+
+class RangedDownloader:
+    """Concurrent ranged GETs sharing one thread pool across downloads."""
+
+    def __init__(self, client: Any, part_size: int = DEFAULT_PART_SIZE, concurrency: int = DEFAULT_CONCURRENCY,
+                 max_buffered_bytes: Optional[int] = None, retries: int = 2, expected_owner: Optional[str] = None):
+        self.client = client
+        self.part_size = part_size
+        self.concurrency = max(concurrency, 1)
+        self.max_buffered_bytes = max_buffered_bytes or part_size * self.concurrency
+        self.retries = retries
+        self.expected_owner = expected_owner
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def window(self) -> int:
+        """Parts fetched or held ahead of the consumer of `iter_chunks`."""
+        return max(1, min(self.concurrency, self.max_buffered_bytes // self.part_size))
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='ranged')
+        return self._executor
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def head(self, bucket: str, key: str) -> Tuple[int, str]:
+        kwargs = {'ExpectedBucketOwner': self.expected_owner} if self.expected_owner else {}
+        response = self.client.head_object(Bucket=bucket, Key=key, **kwargs)  # NOSONAR
+        return response['ContentLength'], response.get('ETag', '')
+
+    def _fetch(self, bucket: str, key: str, first: int, last: int, etag: Optional[str],
+               stats: DownloadStats, target: Optional[memoryview] = None) -> Optional[bytes]:
+        """Fetch one part, into `target` when given; retries failures while reading the body."""
+        kwargs: Dict[str, Any] = {'Range': f"bytes={first}-{last}"}
+        if etag:
+            kwargs['IfMatch'] = etag
+        if self.expected_owner:
+            kwargs['ExpectedBucketOwner'] = self.expected_owner
+        for attempt in range(self.retries + 1):
+            try:
+                body = self.client.get_object(Bucket=bucket, Key=key, **kwargs)['Body']  # NOSONAR
+                if target is None:
+                    data = body.read()
+                    stats.add_part(len(data))
+                    return data
+                offset = 0
+                for chunk in body.iter_chunks(COPY_CHUNK_BYTES):
+                    target[offset:offset + len(chunk)] = chunk
+                    offset += len(chunk)
+                stats.add_part(offset)
+                return None
+            except (BotoCoreError, OSError):
+                if attempt == self.retries:
+                    raise
+                stats.add_retry()
+        return None
+
+    def iter_chunks(self, bucket: str, key: str, size: Optional[int] = None, etag: Optional[str] = None,
+                    start: int = 0, end: Optional[int] = None,
+                    stats: Optional[DownloadStats] = None) -> Iterator[bytes]:
+        """Yield the parts of start..end (exclusive) in object order."""
+        if size is None:
+            size, etag = self.head(bucket, key)
+        stats = stats or DownloadStats()
+        ranges = byte_ranges(start, size if end is None else min(end, size), self.part_size)
+        pool = self._pool()
+        pending: List[Future] = []
+        next_range = 0
+        try:
+            while pending or next_range < len(ranges):
+                while next_range < len(ranges) and len(pending) < self.window:
+                    first, last = ranges[next_range]
+                    pending.append(pool.submit(self._fetch, bucket, key, first, last, etag, stats))
+                    next_range += 1
+                part = pending.pop(0).result()
+                buffered = len(part) + sum(len(future.result()) for future in pending if future.done())
+                stats.peak_buffered_bytes = max(stats.peak_buffered_bytes, buffered)
+                yield part
+        finally:
+            for future in pending:
+                future.cancel()
+            stats.finish()
+
+    def _fill(self, bucket: str, key: str, size: int, etag: Optional[str], target: memoryview,
+              stats: DownloadStats) -> None:
+        futures = [
+            self._pool().submit(self._fetch, bucket, key, first, last, etag, stats, target[first:last + 1])
+            for first, last in byte_ranges(0, size, self.part_size)
+        ]
+        try:
+            for future in futures:
+                future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+            wait(futures)
+            stats.finish()
+
+    def read(self, bucket: str, key: str, size: Optional[int] = None, etag: Optional[str] = None,
+             stats: Optional[DownloadStats] = None) -> bytearray:
+        """Fetch the whole object into one preallocated buffer, parts landing in place."""
+        if size is None:
+            size, etag = self.head(bucket, key)
+        buffer = bytearray(size)
+        with memoryview(buffer) as view:
+            self._fill(bucket, key, size, etag, view, stats or DownloadStats())
+        return buffer
+
+    def download_to_file(self, bucket: str, key: str, path: str, size: Optional[int] = None,
+                         etag: Optional[str] = None, stats: Optional[DownloadStats] = None) -> int:
+        """Write the object to `path` through a preallocated memory-mapped file; returns its size.
+
+        The file is allocated up front so running out of ephemeral storage fails
+        before any part is fetched.
+        """
+        if size is None:
+            size, etag = self.head(bucket, key)
+        with open(path, 'w+b') as file:
+            if size == 0:
+                return 0
+            try:
+                os.posix_fallocate(file.fileno(), 0, size)
+            except AttributeError:
+                file.truncate(size)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    raise
+                # Filesystems without fallocate support still take a sparse file
+                file.truncate(size)
+            with mmap.mmap(file.fileno(), size) as mapped, memoryview(mapped) as view:
+                self._fill(bucket, key, size, etag, view, stats or DownloadStats())
+        return size
+
+
+def iter_ranges(client: Any, bucket: str, key: str, size: int, start: int = 0, end: Optional[int] = None,
+                part_size: int = DEFAULT_PART_SIZE, concurrency: int = DEFAULT_CONCURRENCY,
+                expected_owner: Optional[str] = None) -> Iterator[bytes]:
+    """Yield the parts of start..end in order with a downloader of its own."""
+    downloader = RangedDownloader(client, part_size, concurrency, expected_owner=expected_owner)
+    try:
+        yield from downloader.iter_chunks(bucket, key, size, start=start, end=end)
+    finally:
+        downloader.close()
+
+
+class RangedFile(io.RawIOBase):
+    """Seekable, read-only view of an S3 object backed by ranged GETs."""
+
+    def __init__(self, client: Any, bucket: str, key: str, size: Optional[int] = None,
+                 expected_owner: Optional[str] = None, read_ahead: int = READ_AHEAD_BYTES):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.expected_owner = expected_owner
+        self.size = object_size(client, bucket, key, expected_owner) if size is None else size
+        self.read_ahead = read_ahead
+        self.bytes_fetched = 0
+        self.requests = 0
+        self._position = 0
+        self._buffer = b''
+        self._buffer_start = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._position = max(offset, 0)
+        return self._position
+
+    def readinto(self, buffer: Any) -> int:
+        if self._position >= self.size:
+            return 0
+        wanted = min(len(buffer), self.size - self._position)
+        offset = self._position - self._buffer_start
+        if offset < 0 or offset + wanted > len(self._buffer):
+            last = min(self._position + max(wanted, self.read_ahead), self.size) - 1
+            self._buffer = get_range(self.client, self.bucket, self.key, self._position, last, self.expected_owner)
+            self._buffer_start = self._position
+            self.bytes_fetched += len(self._buffer)
+            self.requests += 1
+            offset = 0
+        wanted = min(wanted, len(self._buffer) - offset)
+        buffer[:wanted] = self._buffer[offset:offset + wanted]
+        self._position += wanted
+        return wanted
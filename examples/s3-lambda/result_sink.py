@@ -0,0 +1,215 @@
+"""
+Per-item results of large invocations, offloaded to a manifest.
+
+Handlers that process many items return a result per item. Lambda caps a
+synchronous response at 6 MB, and serializing thousands of results takes time
+while callers mostly read the counts. `ResultSink` counts results and errors
+and keeps the first `sample_size` of each for the response. Once an invocation
+has more than that, every result, including those already seen, is written as
+it arrives to a gzip-compressed JSON Lines manifest, one record per line with a
+`status` of `processed` or `error`, and `summary` points to it. Invocations
+that stay within the sample write no manifest.
+
+The manifest goes to S3 through `S3Manifest`, which uploads the compressed
+stream in parts as they fill, so memory holds one part whatever the number of
+results, or to a file with `LocalManifest` where S3 is not wanted, such as in
+local runs. A manifest that cannot be written does not fail the invocation; the
+summary carries the error instead of the pointer.
+"""
+import gzip
+import json
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional
+
+from spill import MIN_PART_SIZE
+
+logger = logging.getLogger(__name__)
+
+COMPRESS_LEVEL = 6
+
+
+class S3Manifest:
+    """Write-only file object storing what is written as one S3 object, in a multipart upload once past a part."""
+
+    def __init__(self, client: Any, bucket: str, key: str, part_size: int = MIN_PART_SIZE,
+                 expected_owner: Optional[str] = None, **kwargs: Any):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.bytes = 0
+        self._owner = {'ExpectedBucketOwner': expected_owner} if expected_owner else {}
+        self._kwargs = kwargs
+        self._buffer = bytearray()
+        self._upload_id: Optional[str] = None
+        self._parts: List[Dict[str, Any]] = []
+
+    @property
+    def uri(self) -> str:
+        return f"s3://{self.bucket}/{self.key}"
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        self.bytes += len(data)
+        while len(self._buffer) >= self.part_size:
+            self._upload_part(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def _upload_part(self, body: bytes) -> None:
+        if self._upload_id is None:
+            self._upload_id = self.client.create_multipart_upload(  # NOSONAR
+                Bucket=self.bucket, Key=self.key, **self._owner, **self._kwargs)['UploadId']
+        number = len(self._parts) + 1
+        response = self.client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,  # NOSONAR
+                                           PartNumber=number, Body=body, **self._owner)
+        self._parts.append({'PartNumber': number, 'ETag': response['ETag']})
+
+    def close(self) -> None:
+        if self._upload_id is None:
+            self.client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer),  # NOSONAR
+                                   **self._owner, **self._kwargs)
+            return
+        if self._buffer:
+            self._upload_part(bytes(self._buffer))
+        self.client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,  # NOSONAR
+                                              MultipartUpload={'Parts': self._parts}, **self._owner)
+
+    def abort(self) -> None:
+        if self._upload_id is not None:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key,  # NOSONAR
+                                               UploadId=self._upload_id, **self._owner)
+
+
+class LocalManifest:
+    """Write-only file object storing what is written in a local file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.bytes = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._file = open(path, 'wb')
+
+    @property
+    def uri(self) -> str:
+        return f"file://{self.path}"
+
+    def write(self, data: bytes) -> int:
+        self.bytes += len(data)
+        return self._file.write(data)
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def abort(self) -> None:
+        self._file.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class ResultSink:
+    """Counts and a bounded sample of an invocation's results, with all of them in a manifest when they overflow it."""
+
+    def __init__(self, open_manifest: Optional[Callable[[], Any]], sample_size: int = 100):
+        self.open_manifest = open_manifest
+        self.sample_size = sample_size
+        self.processed = 0
+        self.errors = 0
+        self.records = 0
+        self._results: List[Dict[str, Any]] = []
+        self._error_details: List[str] = []
+        # Records held until the sample overflows and the manifest is opened
+        self._pending: Optional[List[Dict[str, Any]]] = []
+        self._manifest: Any = None
+        self._stream: Optional[gzip.GzipFile] = None
+        self._failure: Optional[str] = None
+
+    def add(self, result: Dict[str, Any]) -> None:
+        """Record the result of an item processed."""
+        self.processed += 1
+        if len(self._results) < self.sample_size:
+            self._results.append(result)
+        self._record({'status': 'processed', **result}, self.processed > self.sample_size)
+
+    def error(self, item: str, message: str) -> None:
+        """Record an item that failed, with its error message."""
+        self.errors += 1
+        if len(self._error_details) < self.sample_size:
+            self._error_details.append(message)
+        self._record({'status': 'error', 'item': item, 'error': message}, self.errors > self.sample_size)
+
+    @property
+    def truncated(self) -> bool:
+        """Whether the sample leaves results out."""
+        return self.processed > self.sample_size or self.errors > self.sample_size
+
+    def _record(self, record: Dict[str, Any], overflow: bool) -> None:
+        if self._pending is not None:
+            self._pending.append(record)
+            if not overflow:
+                return
+            records, self._pending = self._pending, None
+            self._open(records)
+        elif self._stream is not None:
+            self._write([record])
+
+    def _open(self, records: List[Dict[str, Any]]) -> None:
+        if self.open_manifest is None:
+            return
+        try:
+            self._manifest = self.open_manifest()
+            self._stream = gzip.GzipFile(fileobj=self._manifest, mode='wb', compresslevel=COMPRESS_LEVEL, mtime=0)
+        except Exception as e:
+            self._fail(e)
+            return
+        self._write(records)
+
+    def _write(self, records: List[Dict[str, Any]]) -> None:
+        try:
+            self._stream.write(b''.join(json.dumps(record, default=str).encode('utf-8') + b'\n'
+                                        for record in records))
+            self.records += len(records)
+        except Exception as e:
+            self._fail(e)
+
+    def _fail(self, error: Exception) -> None:
+        logger.error(f"Result manifest not written: {error}")
+        self._failure = str(error)
+        self._stream = None
+        if self._manifest is not None:
+            try:
+                self._manifest.abort()
+            except Exception as e:
+                logger.warning(f"Could not discard the result manifest: {e}")
+
+    def _close(self) -> Optional[Dict[str, Any]]:
+        if self._failure is not None:
+            return {'error': self._failure}
+        if self._stream is None:
+            return None
+        try:
+            self._stream.close()
+            self._manifest.close()
+        except Exception as e:
+            self._fail(e)
+            return {'error': self._failure}
+        self._stream = None
+        return {'uri': self._manifest.uri, 'records': self.records, 'bytes': self._manifest.bytes}
+
+    def summary(self) -> Dict[str, Any]:
+        """Finish the manifest; returns the samples, whether they are truncated and the manifest written, if any."""
+        return {
+            'results': self._results,
+            'error_details': self._error_details,
+            'truncated': self.truncated,
+            'manifest': self._close()
+        }
@@ -1,22 +1,65 @@
+import hashlib
 import json
 import boto3
+from botocore.exceptions import ClientError
 import logging
 import os
+import sys
+import tempfile
+import time
 import urllib.parse
 from datetime import datetime
 from typing import Dict, Any, List, Optional
 from datetime import datetime, timezone
 
-# Configure logging
+# Shared helpers sit next to this file in the deployment package and in examples/common in the source tree
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from recording import Recorder  # noqa: E402
+from streaming import ResponseStream, buffered, is_function_url_request  # noqa: E402
+from listing import ObjectFilter, ObjectLister, describe  # noqa: E402
+from backlog import SCHEDULES, BacklogIndex, DrainEstimator  # noqa: E402
+from query import Query, detect_format, run_query  # noqa: E402
+from ranged import RangedDownloader, get_range  # noqa: E402
+from spill import SpilledObject, iter_text, spill_threshold, upload_chunks  # noqa: E402
+from batch_operations import (  # noqa: E402
+    SUCCEEDED, BatchTask, is_batch_operations_event, parse_tasks, response as batch_response, run_tasks,
+    user_arguments
+)
+from limiter import AdaptiveLimiter  # noqa: E402
+from hedging import Hedger  # noqa: E402
+from layout import KeyLayout  # noqa: E402
+from compaction import Compactor  # noqa: E402
+from transform_pool import TransformPool, worker_count  # noqa: E402
+from result_sink import LocalManifest, ResultSink, S3Manifest  # noqa: E402
+from object_cache import OBJECT_CACHE_PREFETCH, ObjectCache, parse_references  # noqa: E402
+from log_shipping import LogShipper  # noqa: E402
+from memory_profile import MemoryProfiler  # noqa: E402
+
+# Configure logging; JSON lines tagged with the request id, see log_shipping.py. Installed once the transform
+# pool has forked, as with LOG_ASYNC=true installing starts the listener thread
 # sonarignore:start
-log_level = os.environ.get('LOG_LEVEL', 'INFO')
-logging.basicConfig(level=getattr(logging, log_level))
+log_shipper = LogShipper('s3-processor')
 logger = logging.getLogger(__name__)
 
-# Initialize AWS clients
-s3_client = boto3.client('s3') # NOSONAR
+# Opt-in capture of events and AWS responses for offline replay
+recorder = Recorder('s3-processor')
+
 APPLICATION_JSON = "application/json"
+METRICS_NAMESPACE = 'Lambda/S3Processor'
+
+# Opt-in tracemalloc profile per invocation and growth across warm invocations; see memory_profile.py
+memory_profiler = MemoryProfiler(METRICS_NAMESPACE, 's3-processor')
+
+# Bounds S3 requests in flight per prefix and backs off on SlowDown; see limiter.py
+limiter = AdaptiveLimiter(METRICS_NAMESPACE, 's3-processor')
+# Opt-in second attempt for GET and HEAD requests slower than usual; see hedging.py
+hedger = Hedger(METRICS_NAMESPACE, 's3-processor')
+
+# Initialize AWS clients
+s3_client = hedger.instrument(limiter.instrument(recorder.instrument(boto3.client('s3'), 's3'))) # NOSONAR
 PROCESSED_PREFIX = "processed/"
+COMPACTED_PREFIX = "compacted/"
+MANIFEST_PREFIX = "manifests/"
 # Environment variables
 SOURCE_BUCKET = os.environ.get('SOURCE_BUCKET', '${source_bucket}')
 DESTINATION_BUCKET = os.environ.get('DESTINATION_BUCKET', '${destination_bucket}')
@@ -24,8 +67,94 @@ DEPLOYMENT_BUCKET = os.environ.get('DEPLOYMENT_BUCKET', '')
 PROCESSING_PREFIX = os.environ.get('PROCESSING_PREFIX', 'incoming/')
 ENVIRONMENT = os.environ.get('ENVIRONMENT', 'dev')
 EXPECTED_OWNER = os.environ.get('EXPECTED_OWNER', 'dev')
-
-
+# Where outputs go under the processed prefix: flat, hashed, date, hive or a combination; see layout.py
+KEY_LAYOUT = os.environ.get('KEY_LAYOUT', 'flat')
+KEY_LAYOUT_SHARDS = int(os.environ.get('KEY_LAYOUT_SHARDS', '16'))
+NDJSON = "application/x-ndjson"
+MAX_LIST_KEYS = 1000
+MAX_LIST_PARALLELISM = 16
+# Backlog drain for invocations without an action; see backlog.py
+BACKLOG_KEYSPACE = os.environ.get('BACKLOG_KEYSPACE', '')
+BACKLOG_PARALLELISM = int(os.environ.get('BACKLOG_PARALLELISM', '8'))
+BACKLOG_SCHEDULE = os.environ.get('BACKLOG_SCHEDULE', 'largest_first')
+BACKLOG_INDEX_TTL_SECONDS = int(os.environ.get('BACKLOG_INDEX_TTL_SECONDS', '300'))
+BACKLOG_TIME_MARGIN_MS = int(os.environ.get('BACKLOG_TIME_MARGIN_MS', '5000'))
+# Per-item results returned inline; beyond this many, all of them go to a manifest instead
+MAX_REPORTED_FILES = 100
+# Where result manifests are written: s3 (the destination bucket), local (RESULT_MANIFEST_DIR) or off
+RESULT_MANIFEST = os.environ.get('RESULT_MANIFEST', 's3')
+RESULT_MANIFEST_DIR = os.environ.get('RESULT_MANIFEST_DIR', '')
+# Ranged reads and queries; see ranged.py and query.py
+RANGE_PART_SIZE = int(os.environ.get('RANGE_PART_SIZE_MB', '8')) * 1024 * 1024
+RANGE_CONCURRENCY = int(os.environ.get('RANGE_CONCURRENCY', '8'))
+# Objects from this size on are downloaded as parallel byte ranges
+RANGE_THRESHOLD = int(os.environ.get('RANGE_THRESHOLD_MB', '16')) * 1024 * 1024
+# Fetched parts held ahead of a slow consumer, e.g. a streamed download
+RANGE_BUFFER_BYTES = int(os.environ.get('RANGE_BUFFER_MB', '64')) * 1024 * 1024
+QUERY_MODE = os.environ.get('QUERY_MODE', 'auto')
+# Optional query applied to CSV, JSON and Parquet uploads instead of copying them whole, e.g.
+# {"columns": ["id", "total"], "where": [["status", "=", "paid"]]}, or an s3:// reference to an object
+# holding one, which is read through the object cache so edits apply without a deployment
+PROCESSING_QUERY = os.environ.get('PROCESSING_QUERY', '')
+# Objects from SPILL_THRESHOLD_MB on are processed from ephemeral storage instead of memory; when unset,
+# the threshold is SPILL_MEMORY_FRACTION of the function's memory, since a text transform holds about
+# four copies of the object in memory
+SPILL_THRESHOLD = int(os.environ.get('SPILL_THRESHOLD_MB', '0')) * 1024 * 1024
+SPILL_MEMORY_FRACTION = float(os.environ.get('SPILL_MEMORY_FRACTION', '0.2'))
+SPILL_DIR = os.environ.get('SPILL_DIR', '')
+# Outputs record a fingerprint of their input; an upload whose output already holds its fingerprint is
+# not processed again unless the request sets force
+SKIP_UNCHANGED = os.environ.get('SKIP_UNCHANGED', 'true').lower() == 'true'
+# Part of every fingerprint; change it with the transform so existing outputs are redone
+PROCESSING_VERSION = '1'
+FINGERPRINT_METADATA = 'source-fingerprint'
+# Checksums S3 returns with ChecksumMode, most specific first; the ETag is used without one
+SOURCE_CHECKSUMS = ('ChecksumSHA256', 'ChecksumCRC64NVME', 'ChecksumCRC32C', 'ChecksumCRC32', 'ChecksumSHA1')
+# S3 Batch Operations invocations; see batch_operations.py
+BATCH_TASK_CONCURRENCY = int(os.environ.get('BATCH_TASK_CONCURRENCY', '8'))
+# Tasks are not started with less than this left of the invocation and are retried by S3 instead
+BATCH_TASK_MARGIN_MS = int(os.environ.get('BATCH_TASK_MARGIN_MS', '10000'))
+# Compaction of small outputs into objects under the compacted prefix; see compaction.py
+COMPACTION_FORMAT = os.environ.get('COMPACTION_FORMAT', 'jsonl.gz')
+COMPACTION_WINDOW_MINUTES = int(os.environ.get('COMPACTION_WINDOW_MINUTES', '60'))
+COMPACTION_MAX_OBJECT_KB = int(os.environ.get('COMPACTION_MAX_OBJECT_KB', '1024'))
+COMPACTION_MIN_OBJECTS = int(os.environ.get('COMPACTION_MIN_OBJECTS', '10'))
+COMPACTION_TARGET_MB = int(os.environ.get('COMPACTION_TARGET_MB', '128'))
+COMPACTION_CONCURRENCY = int(os.environ.get('COMPACTION_CONCURRENCY', '16'))
+# Groups are not started with less than this left of the invocation
+COMPACTION_TIME_MARGIN_MS = int(os.environ.get('COMPACTION_TIME_MARGIN_MS', '30000'))
+MAX_QUERY_RECORDS = 1000
+MAX_PEEK_BYTES = 1024 * 1024
+STREAM_CHUNK_BYTES = int(os.environ.get('STREAM_CHUNK_BYTES', str(256 * 1024)))
+# Processes upper-casing text objects from TRANSFORM_POOL_THRESHOLD_MB on over several cores: a number,
+# or auto for one per vCPU when the function has more than one
+TRANSFORM_WORKERS = os.environ.get('TRANSFORM_WORKERS', '0')
+TRANSFORM_POOL_THRESHOLD = int(os.environ.get('TRANSFORM_POOL_THRESHOLD_MB', '16')) * 1024 * 1024
+
+key_layout = KeyLayout(KEY_LAYOUT, PROCESSING_PREFIX, PROCESSED_PREFIX, KEY_LAYOUT_SHARDS)
+
+# Forked here, before any thread is started, and kept across warm invocations; see transform_pool.py
+transform_pool = TransformPool(worker_count(TRANSFORM_WORKERS))
+log_shipper.install()
+
+# Keeps its connection threads across warm invocations
+downloader = RangedDownloader(s3_client, RANGE_PART_SIZE, RANGE_CONCURRENCY, RANGE_BUFFER_BYTES,
+                              expected_owner=EXPECTED_OWNER)
+
+# Reference objects kept across warm invocations; see object_cache.py
+object_cache = ObjectCache(s3_client, METRICS_NAMESPACE, 's3-processor', expected_owner=EXPECTED_OWNER)
+object_cache.prefetch(parse_references(OBJECT_CACHE_PREFETCH) + (
+    parse_references(PROCESSING_QUERY) if PROCESSING_QUERY.startswith('s3://') else []
+))
+
+# Reused by warm invocations until it expires or is drained
+backlog_index: Optional[BacklogIndex] = None
+drain_estimator = DrainEstimator()
+
+
+@log_shipper.invocation
+@memory_profiler.profile
+@recorder.record
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Advanced S3 file processor Lambda function.
@@ -35,6 +164,7 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     2. Manual invocations with custom actions
     3. Batch processing operations
     4. File transformations and metadata operations
+    5. S3 Batch Operations jobs over a manifest of existing objects
     """
 
     request_id = context.aws_request_id
@@ -46,7 +176,13 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 
     try:
         # Determine the type of invocation
-        if 'Records' in event:
+        if is_function_url_request(event):
+            # Function URL request in BUFFERED mode; the streaming runtime calls stream_handler directly
+            return buffered(stream_handler)(event, context)
+        elif is_batch_operations_event(event):
+            # S3 Batch Operations job; the response carries a result code per task
+            return handle_batch_operations(event, context)
+        elif 'Records' in event:
             # S3 event-triggered invocation
             return handle_s3_event(event, context)
         elif 'action' in event:
@@ -72,15 +208,19 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'function_version': function_version
             })
         }
+    finally:
+        object_cache.publish_metrics()
+        limiter.publish_metrics()
+        hedger.publish_metrics()
 
 
 def handle_s3_event(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """Handle S3 event-triggered processing."""
 
-    processed_files = []
-    errors = []
+    results = result_sink(context)
 
     for record in event['Records']:
+        object_key = ''
         try:
             # Extract S3 event information
             bucket_name = record['s3']['bucket']['name']
@@ -90,31 +230,34 @@ def handle_s3_event(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             logger.info(f"Processing S3 event: {event_name} for {bucket_name}/{object_key}")
 
             if event_name.startswith('ObjectCreated'):
-                result = process_uploaded_file(bucket_name, object_key)
-                processed_files.append(result)
+                results.add(process_uploaded_file(bucket_name, object_key, context))
             elif event_name.startswith('ObjectRemoved'):
-                result = handle_file_deletion(bucket_name, object_key)
-                processed_files.append(result)
+                event_time = record.get('eventTime')
+                deleted_at = datetime.fromisoformat(event_time.replace('Z', '+00:00')) if event_time else None
+                results.add(handle_file_deletion(bucket_name, object_key, deleted_at))
             else:
                 logger.warning(f"Unhandled event type: {event_name}")
 
         except Exception as e:
             error_msg = f"Error processing record: {str(e)}"
             logger.error(error_msg, exc_info=True)
-            errors.append(error_msg)
+            results.error(object_key, error_msg)
 
+    summary = results.summary()
     return {
-        'statusCode': 200 if not errors else 207,  # 207 for partial success
+        'statusCode': 200 if not results.errors else 207,  # 207 for partial success
         'headers': {
             'Content-Type': APPLICATION_JSON,
             'Access-Control-Allow-Origin': "ACCESS_CONTROL_ALLOW_ORIGIN"
         },
         'body': json.dumps({
             'message': 'S3 event processing completed',
-            'processed_files': len(processed_files),
-            'errors': len(errors),
-            'results': processed_files,
-            'error_details': errors,
+            'processed_files': results.processed,
+            'errors': results.errors,
+            'results': summary['results'],
+            'error_details': summary['error_details'],
+            'results_truncated': summary['truncated'],
+            'results_manifest': summary['manifest'],
             'request_id': context.aws_request_id,
             'function_name': context.function_name,
             'timestamp': datetime.now(timezone.utc).isoformat()
@@ -122,6 +265,25 @@ def handle_s3_event(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     }
 
 
+def handle_batch_operations(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """Process the tasks of an S3 Batch Operations invocation and report a result code for each."""
+
+    # A job can set {"force": "true"} in its user arguments (schema 2.0, string values) to reprocess current outputs
+    force = str(user_arguments(event).get('force', 'false')).lower() == 'true'
+
+    def process(task: BatchTask) -> str:
+        # Tasks process the current version of their key, as uploads do
+        result = process_uploaded_file(task.bucket, task.key, context, force)
+        return json.dumps({'processed_file': result['processed_file'], 'skipped': result['skipped']})
+
+    tasks = parse_tasks(event)
+    results = run_tasks(tasks, process, BATCH_TASK_CONCURRENCY, context.get_remaining_time_in_millis,
+                        BATCH_TASK_MARGIN_MS)
+    succeeded = sum(1 for result in results if result['resultCode'] == SUCCEEDED)
+    logger.info(f"Batch Operations job {event.get('job', {}).get('id')}: {succeeded} of {len(tasks)} tasks succeeded")
+    return batch_response(event, results)
+
+
 def handle_manual_action(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """Handle manual invocations with specific actions."""
 
@@ -135,10 +297,16 @@ def handle_manual_action(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         return process_batch_files(event, context)
     elif action == 'cleanup':
         return cleanup_processed_files(event, context)
+    elif action == 'compact':
+        return compact_processed_files(event, context)
     elif action == 'health_check':
         return perform_health_check(event, context)
     elif action == 'copy_file':
         return copy_file_between_buckets(event, context)
+    elif action == 'query_file':
+        return query_file(event, context)
+    elif action == 'peek_file':
+        return peek_file(event, context)
     else:
         return {
             'statusCode': 400,
@@ -151,7 +319,7 @@ def handle_manual_action(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'message': f'Unknown action: {action}',
                 'available_actions': [
                     'list_buckets', 'list_objects', 'process_batch',
-                    'cleanup', 'health_check', 'copy_file'
+                    'cleanup', 'compact', 'health_check', 'copy_file', 'query_file', 'peek_file'
                 ],
                 'request_id': context.aws_request_id
             })
@@ -159,27 +327,73 @@ def handle_manual_action(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 
 
 def handle_default_processing(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    """Handle default processing - list and process pending files."""
+    """
+    Drain pending files under the processing prefix until the invocation runs out of time.
 
-    try:
-        # List objects in the source bucket with the processing prefix
-        response = s3_client.list_objects_v2(  # NOSONAR
-            Bucket=SOURCE_BUCKET,
-            Prefix=PROCESSING_PREFIX,
-            MaxKeys=10,
-            ExpectedBucketOwner=EXPECTED_OWNER
-        )
+    Files are taken from the backlog index largest first (or round-robin over size
+    bins with schedule=size_bins) and only started when the estimated processing
+    time fits in the remaining time less BACKLOG_TIME_MARGIN_MS.
+    """
 
-        objects = response.get('Contents', [])
-        processed_files = []
+    global backlog_index
+    schedule = event.get('schedule', BACKLOG_SCHEDULE)
+    if schedule not in SCHEDULES:
+        raise ValueError(f"Unknown backlog schedule: {schedule}")
 
-        for obj in objects:
+    try:
+        index_reused = (backlog_index is not None and len(backlog_index) > 0
+                        and backlog_index.age_seconds < BACKLOG_INDEX_TTL_SECONDS)
+        if not index_reused:
+            backlog_index = BacklogIndex.build(
+                s3_client,
+                SOURCE_BUCKET,
+                PROCESSING_PREFIX,
+                DESTINATION_BUCKET,
+                PROCESSED_PREFIX,
+                key_layout.source_key,
+                compacted=output_compactor().compacted_outputs(BACKLOG_PARALLELISM),
+                keyspace=BACKLOG_KEYSPACE,
+                parallelism=BACKLOG_PARALLELISM,
+                expected_owner=EXPECTED_OWNER,
+                holds_input=output_holds_input if SKIP_UNCHANGED else None
+            )
+        index = backlog_index
+        backlog_objects = len(index)
+        backlog_bytes = index.pending_bytes
+
+        results = result_sink(context)
+        deferred_files = 0
+        bytes_processed = 0
+        start = time.monotonic()
+
+        for key in index.schedule(schedule):
+            size = index.pending.get(key)
+            if size is None:
+                continue
+            remaining_ms = context.get_remaining_time_in_millis() - BACKLOG_TIME_MARGIN_MS
+            if remaining_ms < drain_estimator.overhead_ms:
+                break
+            if drain_estimator.estimate_ms(size) > remaining_ms:
+                # Too large for the time left; a smaller file may still fit
+                deferred_files += 1
+                continue
+
+            file_start = time.monotonic()
             try:
-                result = process_uploaded_file(SOURCE_BUCKET, obj['Key'])
-                processed_files.append(result)
+                results.add(process_uploaded_file(SOURCE_BUCKET, key, context))
+                bytes_processed += size
             except Exception as e:
-                logger.error(f"Error processing {obj['Key']}: {str(e)}")
-
+                error_msg = f"Error processing {key}: {str(e)}"
+                logger.error(error_msg)
+                results.error(key, error_msg)
+            drain_estimator.observe(size, (time.monotonic() - file_start) * 1000)
+            # Failed keys leave the index too and are picked up again by the next scan
+            index.remove(key)
+
+        elapsed = max(time.monotonic() - start, 1e-6)
+        remaining_objects = len(index)
+        bytes_per_second = bytes_processed / elapsed
+        summary = results.summary()
         return {
             'statusCode': 200,
             'headers': {
@@ -194,9 +408,27 @@ def handle_default_processing(event: Dict[str, Any], context: Any) -> Dict[str,
                 'request_id': context.aws_request_id,
                 'source_bucket': SOURCE_BUCKET,
                 'destination_bucket': DESTINATION_BUCKET,
-                'objects_found': len(objects),
-                'objects_processed': len(processed_files),
-                'processed_files': processed_files,
+                'objects_found': backlog_objects,
+                'objects_processed': results.processed,
+                'objects_failed': results.errors,
+                'processed_files': summary['results'],
+                'error_details': summary['error_details'],
+                'results_truncated': summary['truncated'],
+                'results_manifest': summary['manifest'],
+                'backlog': {
+                    'schedule': schedule,
+                    'index_reused': index_reused,
+                    'index_age_seconds': round(index.age_seconds, 3),
+                    'scan': index.scan,
+                    'objects': backlog_objects,
+                    'bytes': backlog_bytes,
+                    'remaining_objects': remaining_objects,
+                    'remaining_bytes': index.pending_bytes,
+                    'deferred_objects': deferred_files,
+                    'drain_objects_per_second': round(results.processed / elapsed, 2),
+                    'drain_bytes_per_second': round(bytes_per_second),
+                    'estimated_seconds_to_drain': round(index.pending_bytes / bytes_per_second, 1) if bytes_processed else None
+                },
                 'timestamp': datetime.now(timezone.utc).isoformat()
             })
         }
@@ -206,72 +438,227 @@ def handle_default_processing(event: Dict[str, Any], context: Any) -> Dict[str,
         raise
 
 
-def process_uploaded_file(bucket_name: str, object_key: str) -> Dict[str, Any]:
-    """Process an uploaded file from S3."""
+def process_uploaded_file(bucket_name: str, object_key: str, context: Any = None,
+                          force: bool = False) -> Dict[str, Any]:
+    """Process an uploaded file from S3, unless its output already holds a fingerprint of the same input."""
 
     logger.info(f"Processing file: {bucket_name}/{object_key}")
 
-    # Get object metadata
-    head_response = s3_client.head_object(Bucket=bucket_name, Key=object_key, ExpectedBucketOwner=EXPECTED_OWNER)
+    # Get object metadata, with the checksum stored at upload if there is one
+    head_response = s3_client.head_object(Bucket=bucket_name, Key=object_key, ExpectedBucketOwner=EXPECTED_OWNER,
+                                           ChecksumMode='ENABLED')
     file_size = head_response['ContentLength']
     last_modified = head_response['LastModified']
     content_type = head_response.get('ContentType', 'unknown')
 
-    # Read the file content
-    get_response = s3_client.get_object(Bucket=bucket_name, Key=object_key, ExpectedBucketOwner=EXPECTED_OWNER)
-    content = get_response['Body'].read()
+    # Generate destination key
+    destination_key = key_layout.destination_key(object_key, last_modified)
 
-    # Process the content (example: convert to uppercase for text files)
-    if content_type.startswith('text/') or object_key.endswith('.txt'):
-        processed_content = content.decode('utf-8').upper()
-        processed_content_bytes = processed_content.encode('utf-8')
-    else:
-        # For non-text files, just copy as-is
-        processed_content_bytes = content
+    result = {
+        'original_file': f"{bucket_name}/{object_key}",
+        'processed_file': f"{DESTINATION_BUCKET}/{destination_key}",
+        'file_size': file_size,
+        'content_type': content_type,
+        'storage': None,
+        'skipped': False,
+        'last_modified': last_modified.isoformat()
+    }
 
-    # Generate destination key
-    destination_key = object_key.replace(PROCESSING_PREFIX, PROCESSED_PREFIX)
-    if not destination_key.startswith(PROCESSED_PREFIX):
-        destination_key = f"processed/{destination_key}"
+    query_params = processing_query()
+    fingerprint = processing_fingerprint(head_response, query_params)
+    conditions: Dict[str, str] = {}
+    if SKIP_UNCHANGED and not force:
+        existing = processed_head(destination_key)
+        if existing is not None and existing['Metadata'].get(FINGERPRINT_METADATA) == fingerprint:
+            logger.info(f"Skipping {result['original_file']}: {DESTINATION_BUCKET}/{destination_key} "
+                        "holds the same input")
+            result.update(skipped=True, processing_time=datetime.now(timezone.utc).isoformat())
+            return result
+        # Replace only the output checked here, so a concurrent invocation's output is not overwritten
+        conditions = {'IfMatch': existing['ETag']} if existing is not None else {'IfNoneMatch': '*'}
+
+    try:
+        result.update(transform_to_destination(bucket_name, object_key, destination_key, head_response,
+                                               query_params, fingerprint, conditions, context))
+    except ClientError as e:
+        if not is_write_conflict(e):
+            raise
+        existing = processed_head(destination_key)
+        if existing is None or existing['Metadata'].get(FINGERPRINT_METADATA) != fingerprint:
+            raise
+        logger.info(f"{DESTINATION_BUCKET}/{destination_key} was written by a concurrent invocation")
+        result['skipped'] = True
+
+    logger.info(f"File processed and saved to: {DESTINATION_BUCKET}/{destination_key}")
+    result['processing_time'] = datetime.now(timezone.utc).isoformat()
+    return result
+
+
+def transform_to_destination(bucket_name: str, object_key: str, destination_key: str, head_response: Dict[str, Any],
+                             query_params: Optional[Dict[str, Any]], fingerprint: str, conditions: Dict[str, str],
+                             context: Any) -> Dict[str, Any]:
+    """Read, transform and write one upload; returns the storage used and the output content type."""
+    file_size = head_response['ContentLength']
+    content_type = head_response.get('ContentType', 'unknown')
+    storage = 'memory'
+    query_format = detect_format(object_key, content_type) if query_params else None
+    if query_format:
+        # Keep only the configured columns and rows; the rest of the object is never downloaded
+        # when S3 Select is available
+        query = Query.from_params(dict(query_params, format=query_format), object_key, content_type)
+        result = run_query(s3_client, bucket_name, object_key, query, file_size, QUERY_MODE,
+                           RANGE_PART_SIZE, RANGE_CONCURRENCY, EXPECTED_OWNER)
+        processed_content_bytes = b''.join(
+            json.dumps(record, default=str).encode('utf-8') + b'\n' for record in result
+        )
+        content_type = NDJSON
+    elif file_size >= processing_spill_threshold(context):
+        # Too large to hold next to its processed copy: transform from ephemeral storage and upload
+        # the result in parts as it is produced
+        storage = 'ephemeral'
+        processed_content_bytes = None
+        with SpilledObject(downloader, bucket_name, object_key, file_size, head_response.get('ETag'),
+                           SPILL_DIR or None) as spilled:
+            chunks = spilled.chunks()
+            if is_text_file(object_key, content_type):
+                if uses_transform_pool(file_size):
+                    chunks = transform_pool.transform('upper', spilled.mapped())
+                else:
+                    chunks = iter_text(chunks, str.upper)
+            upload_chunks(s3_client, DESTINATION_BUCKET, destination_key, chunks, RANGE_PART_SIZE,
+                          RANGE_CONCURRENCY, size_hint=file_size, conditions=conditions,
+                          **processed_object_args(bucket_name, object_key, content_type, fingerprint))
+    else:
+        # Read the file content; large objects arrive as byte ranges over several connections
+        if file_size >= RANGE_THRESHOLD:
+            content = downloader.read(bucket_name, object_key, file_size, head_response.get('ETag'))
+        else:
+            get_response = s3_client.get_object(Bucket=bucket_name, Key=object_key, ExpectedBucketOwner=EXPECTED_OWNER)
+            content = get_response['Body'].read()
+
+        # Process the content (example: convert to uppercase for text files)
+        if is_text_file(object_key, content_type) and uses_transform_pool(file_size):
+            processed_content_bytes = b''.join(transform_pool.transform('upper', content))
+        elif is_text_file(object_key, content_type):
+            processed_content = content.decode('utf-8').upper()
+            processed_content_bytes = processed_content.encode('utf-8')
+        else:
+            # For non-text files, just copy as-is
+            processed_content_bytes = content
 
     # Upload processed file to destination bucket
-    s3_client.put_object(
-        Bucket=DESTINATION_BUCKET,
-        Key=destination_key,
-        Body=processed_content_bytes,
-        ContentType=content_type,
-        ExpectedBucketOwner=EXPECTED_OWNER,
-        Metadata={
+    if processed_content_bytes is not None:
+        s3_client.put_object(
+            Bucket=DESTINATION_BUCKET,
+            Key=destination_key,
+            Body=processed_content_bytes,
+            **processed_object_args(bucket_name, object_key, content_type, fingerprint),
+            **conditions
+        )
+    return {'storage': storage, 'content_type': content_type}
+
+
+def processing_fingerprint(head_response: Dict[str, Any], query_params: Optional[Dict[str, Any]]) -> str:
+    """Identify the input of a processed copy: the source content, the query and the processing version."""
+    checksum = next((f"{name}:{head_response[name]}" for name in SOURCE_CHECKSUMS if head_response.get(name)),
+                    f"ETag:{head_response.get('ETag', '')}:{head_response['ContentLength']}")
+    identity = json.dumps([PROCESSING_VERSION, checksum, query_params], sort_keys=True, default=str)
+    return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+
+def processed_head(destination_key: str) -> Optional[Dict[str, Any]]:
+    """HeadObject of a processed copy, or None when there is none."""
+    try:
+        return s3_client.head_object(Bucket=DESTINATION_BUCKET, Key=destination_key, ExpectedBucketOwner=EXPECTED_OWNER)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+
+
+def is_write_conflict(error: ClientError) -> bool:
+    """A conditional write lost to another writer (412) or raced one still in progress (409)."""
+    return error.response.get('Error', {}).get('Code') in ('PreconditionFailed', 'ConditionalRequestConflict')
+
+
+def output_holds_input(object_key: str, destination_key: str) -> bool:
+    """Whether a processed copy older than its upload holds the fingerprint of the upload, for the backlog scan."""
+    try:
+        existing = processed_head(destination_key)
+        if existing is None or FINGERPRINT_METADATA not in existing['Metadata']:
+            return False
+        head_response = s3_client.head_object(Bucket=SOURCE_BUCKET, Key=object_key, ExpectedBucketOwner=EXPECTED_OWNER,
+                                               ChecksumMode='ENABLED')
+    except ClientError as e:
+        # Left pending; processing the file checks the fingerprint again
+        logger.warning(f"Could not compare {object_key} with its processed copy: {e}")
+        return False
+    return existing['Metadata'][FINGERPRINT_METADATA] == processing_fingerprint(head_response, processing_query())
+
+
+def processing_query() -> Optional[Dict[str, Any]]:
+    """The query applied to uploads, if any; an s3:// reference is revalidated as the cache TTL expires."""
+    if not PROCESSING_QUERY:
+        return None
+    if PROCESSING_QUERY.startswith('s3://'):
+        return object_cache.get_json(*parse_references(PROCESSING_QUERY)[0])
+    return json.loads(PROCESSING_QUERY)
+
+
+def is_text_file(object_key: str, content_type: str) -> bool:
+    return content_type.startswith('text/') or object_key.endswith('.txt')
+
+
+def processed_object_args(bucket_name: str, object_key: str, content_type: str, fingerprint: str) -> Dict[str, Any]:
+    """PutObject arguments shared by every processed copy."""
+    return {
+        'ContentType': content_type,
+        'ExpectedBucketOwner': EXPECTED_OWNER,
+        'Metadata': {
             'original-bucket': bucket_name,
             'original-key': object_key,
             'processed-by': 'lambda-s3-processor',
             'processed-at': datetime.now(timezone.utc).isoformat(),
-            'environment': ENVIRONMENT
+            'environment': ENVIRONMENT,
+            FINGERPRINT_METADATA: fingerprint
         },
-        Tagging=f'Environment={ENVIRONMENT}&ProcessedBy=lambda&OriginalBucket={bucket_name}'
-    )
+        'Tagging': f'Environment={ENVIRONMENT}&ProcessedBy=lambda&OriginalBucket={bucket_name}'
+    }
 
-    logger.info(f"File processed and saved to: {DESTINATION_BUCKET}/{destination_key}")
 
-    return {
-        'original_file': f"{bucket_name}/{object_key}",
-        'processed_file': f"{DESTINATION_BUCKET}/{destination_key}",
-        'file_size': file_size,
-        'content_type': content_type,
-        'last_modified': last_modified.isoformat(),
-        'processing_time': datetime.now(timezone.utc).isoformat()
-    }
+def result_sink(context: Any) -> ResultSink:
+    """Sink for the per-item results of one invocation, with its manifest named after the request."""
+    day = datetime.now(timezone.utc).strftime('%Y/%m/%d')
+    name = f"{MANIFEST_PREFIX}{context.function_name}/{day}/{context.aws_request_id}.jsonl.gz"
+    if RESULT_MANIFEST == 's3':
+        return ResultSink(lambda: S3Manifest(s3_client, DESTINATION_BUCKET, name, expected_owner=EXPECTED_OWNER,
+                                             ContentType='application/gzip'), MAX_REPORTED_FILES)
+    if RESULT_MANIFEST == 'local':
+        path = os.path.join(RESULT_MANIFEST_DIR or tempfile.gettempdir(), name)
+        return ResultSink(lambda: LocalManifest(path), MAX_REPORTED_FILES)
+    return ResultSink(None, MAX_REPORTED_FILES)
+
+
+def uses_transform_pool(file_size: int) -> bool:
+    """Whether a text object is large enough to transform on the pool's workers."""
+    return transform_pool.workers > 0 and file_size >= TRANSFORM_POOL_THRESHOLD
 
 
-def handle_file_deletion(bucket_name: str, object_key: str) -> Dict[str, Any]:
+def processing_spill_threshold(context: Any) -> int:
+    """Object size from which processing runs from ephemeral storage, from the memory of this function."""
+    if SPILL_THRESHOLD:
+        return SPILL_THRESHOLD
+    memory_mb = getattr(context, 'memory_limit_in_mb', None) or os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', '128')
+    return spill_threshold(int(memory_mb), SPILL_MEMORY_FRACTION)
+
+
+def handle_file_deletion(bucket_name: str, object_key: str, deleted_at: Optional[datetime] = None) -> Dict[str, Any]:
     """Handle file deletion events."""
 
     logger.info(f"Handling deletion of: {bucket_name}/{object_key}")
 
     # Optionally clean up corresponding processed file
-    destination_key = object_key.replace(PROCESSING_PREFIX, PROCESSED_PREFIX)
-    if not destination_key.startswith(PROCESSED_PREFIX):
-        destination_key = f"processed/{destination_key}"
+    destination_key = deleted_file_destination(bucket_name, object_key, deleted_at)
 
     try:
         s3_client.delete_object(Bucket=DESTINATION_BUCKET, Key=destination_key, ExpectedBucketOwner=EXPECTED_OWNER)
@@ -289,6 +676,30 @@ def handle_file_deletion(bucket_name: str, object_key: str) -> Dict[str, Any]:
     }
 
 
+def deleted_file_destination(bucket_name: str, object_key: str, deleted_at: Optional[datetime]) -> str:
+    """
+    Destination key of a deleted upload.
+
+    Dated layouts need the time of the upload, which the deletion event does not
+    carry. In a versioned bucket it is the LastModified of the key's latest
+    version; otherwise the deletion time is used, which finds outputs of files
+    deleted on the day they were uploaded.
+    """
+    if not key_layout.dated:
+        return key_layout.destination_key(object_key)
+    uploaded = deleted_at
+    try:
+        response = s3_client.list_object_versions(Bucket=bucket_name, Prefix=object_key, MaxKeys=10,
+                                                  ExpectedBucketOwner=EXPECTED_OWNER)
+        versions = [version['LastModified'] for version in response.get('Versions', [])
+                    if version['Key'] == object_key]
+        if versions:
+            uploaded = max(versions)
+    except ClientError as e:
+        logger.warning(f"Could not list versions of {bucket_name}/{object_key}: {str(e)}")
+    return key_layout.destination_key(object_key, uploaded)
+
+
 def list_all_buckets(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """List all accessible S3 buckets."""
 
@@ -328,29 +739,39 @@ def list_all_buckets(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
 
 
 def list_bucket_objects(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    """List objects in specified bucket or default buckets."""
+    """
+    List objects in the specified bucket, walking every page until max_keys matches are found.
 
-    bucket_name = event.get('bucket', SOURCE_BUCKET)
-    prefix = event.get('prefix', '')
-    max_keys = min(event.get('max_keys', 10), 100)  # Limit to 100
+    Optional event fields: suffix, min_size, max_size, modified_after, modified_before
+    (filters), delimiter and parallelism (list sub-prefixes concurrently) and cursor
+    (resume a previous listing from its next_cursor).
+    """
 
-    try:
-        response = s3_client.list_objects_v2( # NOSONAR
-            Bucket=bucket_name,
-            Prefix=prefix,
-            MaxKeys=max_keys,
-            ExpectedBucketOwner=EXPECTED_OWNER
+    max_keys = min(int(event.get('max_keys', 10)), MAX_LIST_KEYS)
+    parallelism = min(int(event.get('parallelism', 1)), MAX_LIST_PARALLELISM)
+
+    if event.get('cursor'):
+        lister = ObjectLister.from_cursor(s3_client, event['cursor'], parallelism=parallelism,
+                                          expected_owner=EXPECTED_OWNER)
+    else:
+        lister = ObjectLister(
+            s3_client,
+            event.get('bucket', SOURCE_BUCKET),
+            event.get('prefix', ''),
+            ObjectFilter.from_params(event),
+            delimiter=event.get('delimiter'),
+            parallelism=parallelism,
+            expected_owner=EXPECTED_OWNER
         )
+    bucket_name = lister.bucket
 
-        objects = [
-            {
-                'key': obj['Key'],
-                'size': obj['Size'],
-                'last_modified': obj['LastModified'].isoformat(),
-                'etag': obj['ETag'].strip('"')
-            }
-            for obj in response.get('Contents', [])
-        ]
+    try:
+        objects = []
+        for obj in lister.iter_objects():
+            objects.append(describe(obj))
+            if len(objects) >= max_keys:
+                break
+        next_cursor = lister.cursor()
 
         return {
             'statusCode': 200,
@@ -361,9 +782,12 @@ def list_bucket_objects(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({
                 'message': 'Objects listed successfully',
                 'bucket': bucket_name,
-                'prefix': prefix,
+                'prefix': lister.prefix,
                 'object_count': len(objects),
-                'is_truncated': response.get('IsTruncated', False),
+                'is_truncated': next_cursor is not None,
+                'next_cursor': next_cursor,
+                'objects_scanned': lister.objects_scanned,
+                'pages_listed': lister.pages_listed,
                 'objects': objects,
                 'request_id': context.aws_request_id,
                 'timestamp': datetime.now(timezone.utc).isoformat()
@@ -375,11 +799,146 @@ def list_bucket_objects(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         raise
 
 
+@log_shipper.invocation
+def stream_handler(event: Dict[str, Any], context: Any, stream: ResponseStream) -> None:
+    """
+    Function URL entry point writing the response body as it is produced.
+
+    GET /objects?bucket=&prefix=   every object as one NDJSON line, then a summary line; accepts the
+                                   list_objects filters plus delimiter and parallelism
+    GET /download?bucket=&key=     the raw object bytes
+    GET /query?bucket=&key=        query_file records as NDJSON, then a summary line; columns, where,
+                                   limit, format and mode as query parameters
+    """
+
+    path = event.get('rawPath', '/')
+    params = event.get('queryStringParameters') or {}
+    logger.info(f"Streaming {path} for request {context.aws_request_id}")
+
+    if path == '/objects':
+        stream_object_listing(params.get('bucket', SOURCE_BUCKET), params.get('prefix', ''), params, stream)
+    elif path == '/download' and params.get('key'):
+        stream_object_download(params.get('bucket', SOURCE_BUCKET), params['key'], stream)
+    elif path == '/query' and params.get('key'):
+        stream_query_results(params.get('bucket', SOURCE_BUCKET), params['key'], params, stream)
+    else:
+        stream.start(404, {'Content-Type': APPLICATION_JSON})
+        stream.write(json.dumps({
+            'error': 'Not found',
+            'message': f'Unknown path: {path}',
+            'available_paths': ['/objects?bucket=&prefix=', '/download?bucket=&key=', '/query?bucket=&key='],
+            'request_id': context.aws_request_id
+        }).encode('utf-8'))
+    stream.close()
+
+
+def stream_object_listing(bucket_name: str, prefix: str, params: Dict[str, Any], stream: ResponseStream) -> None:
+    """Write every matching object under the prefix as NDJSON, sending each page as soon as it is filtered."""
+
+    lister = ObjectLister(
+        s3_client,
+        bucket_name,
+        prefix,
+        ObjectFilter.from_params(params),
+        delimiter=params.get('delimiter'),
+        parallelism=min(int(params.get('parallelism', MAX_LIST_PARALLELISM)), MAX_LIST_PARALLELISM),
+        expected_owner=EXPECTED_OWNER
+    )
+    stream.start(200, {'Content-Type': NDJSON})
+    object_count = 0
+
+    for page in lister.iter_pages():
+        for obj in page:
+            stream.write_json_line(describe(obj))
+        object_count += len(page)
+        stream.flush()
+
+    stream.write_json_line({
+        'summary': {
+            'bucket': bucket_name,
+            'prefix': prefix,
+            'object_count': object_count,
+            'objects_scanned': lister.objects_scanned,
+            'page_count': lister.pages_listed,
+            'timestamp': datetime.now(timezone.utc).isoformat()
+        }
+    })
+
+
+def stream_object_download(bucket_name: str, object_key: str, stream: ResponseStream) -> None:
+    """
+    Copy the object body to the response in STREAM_CHUNK_BYTES pieces.
+
+    The first part is requested as a byte range, which also reveals the object size;
+    anything beyond it is fetched as parallel ranges and written in order.
+    """
+
+    try:
+        response = s3_client.get_object(Bucket=bucket_name, Key=object_key, Range=f"bytes=0-{RANGE_PART_SIZE - 1}",
+                                        ExpectedBucketOwner=EXPECTED_OWNER) # NOSONAR
+    except ClientError as e:
+        code = e.response['Error']['Code']
+        if code == 'InvalidRange':
+            # Empty objects have no satisfiable range
+            response = s3_client.get_object(Bucket=bucket_name, Key=object_key, ExpectedBucketOwner=EXPECTED_OWNER) # NOSONAR
+        elif code in ('NoSuchKey', '404'):
+            stream.start(404, {'Content-Type': APPLICATION_JSON})
+            stream.write(json.dumps({'error': 'Not found', 'bucket': bucket_name, 'key': object_key}).encode('utf-8'))
+            return
+        else:
+            raise
+
+    content_range = response.get('ContentRange')
+    size = int(content_range.rsplit('/', 1)[1]) if content_range else response['ContentLength']
+    stream.start(200, {
+        'Content-Type': response.get('ContentType', 'application/octet-stream'),
+        'Content-Length': str(size),
+        'ETag': response.get('ETag', '')
+    })
+    for chunk in response['Body'].iter_chunks(STREAM_CHUNK_BYTES):
+        stream.write(chunk)
+    if size > RANGE_PART_SIZE:
+        for part in downloader.iter_chunks(bucket_name, object_key, size, response.get('ETag'), start=RANGE_PART_SIZE):
+            stream.write(part)
+
+
+def stream_query_results(bucket_name: str, object_key: str, params: Dict[str, Any], stream: ResponseStream) -> None:
+    """Write each query record as an NDJSON line as soon as it is produced, then a summary line."""
+
+    try:
+        head_response = s3_client.head_object(Bucket=bucket_name, Key=object_key, ExpectedBucketOwner=EXPECTED_OWNER)
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+            raise
+        stream.start(404, {'Content-Type': APPLICATION_JSON})
+        stream.write(json.dumps({'error': 'Not found', 'bucket': bucket_name, 'key': object_key}).encode('utf-8'))
+        return
+
+    query = Query.from_params(params, object_key, head_response.get('ContentType', ''))
+    result = run_query(s3_client, bucket_name, object_key, query, head_response['ContentLength'],
+                       params.get('mode', QUERY_MODE), RANGE_PART_SIZE, RANGE_CONCURRENCY, EXPECTED_OWNER)
+    stream.start(200, {'Content-Type': NDJSON})
+    for record in result:
+        stream.write_json_line(record)
+
+    stream.write_json_line({
+        'summary': {
+            'bucket': bucket_name,
+            'key': object_key,
+            'expression': query.sql(),
+            **result.stats(),
+            'timestamp': datetime.now(timezone.utc).isoformat()
+        }
+    })
+
+
 def process_batch_files(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """Process multiple files in batch."""
 
     file_keys = event.get('file_keys', [])
     bucket_name = event.get('bucket', SOURCE_BUCKET)
+    # Reprocess files whose output is already current, e.g. after changing the transform
+    force = bool(event.get('force', False))
 
     if not file_keys:
         # If no specific files provided, process all files with the prefix
@@ -391,20 +950,19 @@ def process_batch_files(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         )
         file_keys = [obj['Key'] for obj in response.get('Contents', [])]
 
-    processed_files = []
-    errors = []
+    results = result_sink(context)
 
     for file_key in file_keys:
         try:
-            result = process_uploaded_file(bucket_name, file_key)
-            processed_files.append(result)
+            results.add(process_uploaded_file(bucket_name, file_key, context, force))
         except Exception as e:
             error_msg = f"Error processing {file_key}: {str(e)}"
             logger.error(error_msg)
-            errors.append(error_msg)
+            results.error(file_key, error_msg)
 
+    summary = results.summary()
     return {
-        'statusCode': 200 if not errors else 207,
+        'statusCode': 200 if not results.errors else 207,
         'headers': {
             'Content-Type': APPLICATION_JSON,
             'Access-Control-Allow-Origin': "ACCESS_CONTROL_ALLOW_ORIGIN"
@@ -412,10 +970,12 @@ def process_batch_files(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         'body': json.dumps({
             'message': 'Batch processing completed',
             'total_files': len(file_keys),
-            'processed_successfully': len(processed_files),
-            'errors': len(errors),
-            'processed_files': processed_files,
-            'error_details': errors,
+            'processed_successfully': results.processed,
+            'errors': results.errors,
+            'processed_files': summary['results'],
+            'error_details': summary['error_details'],
+            'results_truncated': summary['truncated'],
+            'results_manifest': summary['manifest'],
             'request_id': context.aws_request_id,
             'timestamp': datetime.now(timezone.utc).isoformat()
         })
@@ -429,19 +989,21 @@ def cleanup_processed_files(event: Dict[str, Any], context: Any) -> Dict[str, An
     dry_run = event.get('dry_run', True)
 
     try:
-        # List objects in destination bucket
-        response = s3_client.list_objects_v2( # NOSONAR
-            Bucket=DESTINATION_BUCKET,
-            ExpectedBucketOwner=EXPECTED_OWNER,
-            Prefix=PROCESSED_PREFIX
-        )
-
         objects_to_delete = []
         cutoff_date = datetime.now(timezone.utc).timestamp() - (days_old * 24 * 60 * 60)
 
-        for obj in response.get('Contents', []):
-            if obj['LastModified'].timestamp() < cutoff_date:
-                objects_to_delete.append(obj['Key'])
+        # Compacted objects and their indexes age out like the processed files they hold, and result
+        # manifests like the files they list
+        for prefix in (PROCESSED_PREFIX, COMPACTED_PREFIX, MANIFEST_PREFIX):
+            response = s3_client.list_objects_v2( # NOSONAR
+                Bucket=DESTINATION_BUCKET,
+                ExpectedBucketOwner=EXPECTED_OWNER,
+                Prefix=prefix
+            )
+
+            for obj in response.get('Contents', []):
+                if obj['LastModified'].timestamp() < cutoff_date:
+                    objects_to_delete.append(obj['Key'])
 
         deleted_count = 0
         if not dry_run and objects_to_delete:
@@ -480,6 +1042,88 @@ def cleanup_processed_files(event: Dict[str, Any], context: Any) -> Dict[str, An
         raise
 
 
+def output_compactor(event: Optional[Dict[str, Any]] = None) -> Compactor:
+    """Compactor for the processed prefix, with settings from the environment unless `event` overrides them."""
+    event = event or {}
+    return Compactor(
+        s3_client,
+        DESTINATION_BUCKET,
+        PROCESSED_PREFIX,
+        COMPACTED_PREFIX,
+        key_layout.source_key,
+        output_format=event.get('format', COMPACTION_FORMAT),
+        window_seconds=int(event.get('window_minutes', COMPACTION_WINDOW_MINUTES)) * 60,
+        max_object_bytes=int(event.get('max_object_kb', COMPACTION_MAX_OBJECT_KB)) * 1024,
+        min_objects=int(event.get('min_objects', COMPACTION_MIN_OBJECTS)),
+        target_bytes=COMPACTION_TARGET_MB * 1024 * 1024,
+        concurrency=COMPACTION_CONCURRENCY,
+        expected_owner=EXPECTED_OWNER
+    )
+
+
+def compact_processed_files(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Combine small processed files into large objects under the compacted prefix.
+
+    Processed files of up to max_object_kb are grouped by partition (the prefix
+    of their key) and window_minutes of their modification time. Windows that
+    closed more than settle_minutes ago become one object per group of at least
+    min_objects, plus an index of where each file is; the originals are deleted
+    once the object has been read back intact. dry_run (the default) only
+    reports the groups.
+    """
+
+    dry_run = event.get('dry_run', True)
+    prefix = event.get('prefix', '')
+    settle_minutes = int(event.get('settle_minutes', 15))
+
+    try:
+        compactor = output_compactor(event)
+        groups = compactor.plan(prefix, settle_seconds=settle_minutes * 60, parallelism=BACKLOG_PARALLELISM)
+        results = []
+        remaining = len(groups)
+        if not dry_run:
+            for group in groups:
+                if context.get_remaining_time_in_millis() < COMPACTION_TIME_MARGIN_MS:
+                    break
+                results.append(compactor.compact(group))
+                remaining -= 1
+        unverified = [result['key'] for result in results if result['objects_written'] and not result['verified']]
+        if unverified:
+            logger.error(f"Compacted objects did not read back as written, originals kept: {unverified}")
+
+        return {
+            'statusCode': 200 if not unverified else 207,
+            'headers': {
+                'Content-Type': APPLICATION_JSON,
+                'Access-Control-Allow-Origin': "ACCESS_CONTROL_ALLOW_ORIGIN"
+            },
+            'body': json.dumps({
+                'message': 'Compaction completed',
+                'dry_run': dry_run,
+                'format': compactor.format,
+                'groups_found': len(groups),
+                'objects_found': sum(len(group.members) for group in groups),
+                'groups_compacted': sum(1 for result in results if result['verified']),
+                # Written by an earlier run that stopped before deleting the originals
+                'groups_resumed': sum(1 for result in results if result['existing']),
+                'groups_remaining': remaining,
+                'objects_compacted': sum(result['objects_written'] for result in results if result['verified']),
+                'objects_deleted': sum(result['deleted'] for result in results),
+                'bytes_found': sum(group.size for group in groups),
+                'bytes_written': sum(result['bytes_written'] for result in results),
+                'unverified': unverified,
+                'groups': results[:10] if not dry_run else [group.to_dict() for group in groups[:10]],
+                'request_id': context.aws_request_id,
+                'timestamp': datetime.now(timezone.utc).isoformat()
+            })
+        }
+
+    except Exception as e:
+        logger.error(f"Error during compaction: {str(e)}", exc_info=True)
+        raise
+
+
 def copy_file_between_buckets(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """Copy file between buckets."""
 
@@ -539,6 +1183,128 @@ def copy_file_between_buckets(event: Dict[str, Any], context: Any) -> Dict[str,
         raise
 
 
+def query_file(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Run a filter and projection over a CSV, JSON Lines or Parquet object.
+
+    Event fields: key (required), bucket, format (from the key by default), columns,
+    where ([column, operator, value] triples), limit, mode (auto, select or local)
+    and output_key. With output_key the records are written to the destination
+    bucket as NDJSON; otherwise up to 1000 are returned inline.
+    """
+
+    bucket_name = event.get('bucket', SOURCE_BUCKET)
+    object_key = event.get('key')
+    if not object_key:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': APPLICATION_JSON,
+                'Access-Control-Allow-Origin': "ACCESS_CONTROL_ALLOW_ORIGIN"
+            },
+            'body': json.dumps({
+                'error': 'Missing required parameter',
+                'message': 'key is required',
+                'request_id': context.aws_request_id
+            })
+        }
+
+    try:
+        head_response = s3_client.head_object(Bucket=bucket_name, Key=object_key, ExpectedBucketOwner=EXPECTED_OWNER)
+        query = Query.from_params(event, object_key, head_response.get('ContentType', ''))
+        result = run_query(s3_client, bucket_name, object_key, query, head_response['ContentLength'],
+                           event.get('mode', QUERY_MODE), RANGE_PART_SIZE, RANGE_CONCURRENCY, EXPECTED_OWNER)
+
+        output_key = event.get('output_key')
+        records = []
+        if output_key:
+            s3_client.put_object(
+                Bucket=DESTINATION_BUCKET,
+                Key=output_key,
+                Body=b''.join(json.dumps(record, default=str).encode('utf-8') + b'\n' for record in result),
+                ContentType=NDJSON,
+                ExpectedBucketOwner=EXPECTED_OWNER
+            )
+        else:
+            for record in result:
+                records.append(record)
+                if len(records) >= MAX_QUERY_RECORDS:
+                    break
+
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': APPLICATION_JSON,
+                'Access-Control-Allow-Origin': "ACCESS_CONTROL_ALLOW_ORIGIN"
+            },
+            'body': json.dumps({
+                'message': 'Query completed',
+                'source': f"{bucket_name}/{object_key}",
+                'output': f"{DESTINATION_BUCKET}/{output_key}" if output_key else None,
+                'expression': query.sql(),
+                'object_size': head_response['ContentLength'],
+                'query_stats': result.stats(),
+                'records': records,
+                'request_id': context.aws_request_id,
+                'timestamp': datetime.now(timezone.utc).isoformat()
+            }, default=str)
+        }
+
+    except Exception as e:
+        logger.error(f"Error querying {bucket_name}/{object_key}: {str(e)}", exc_info=True)
+        raise
+
+
+def peek_file(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """Return the first bytes of an object (default 4 KiB) with a ranged GET, plus the CSV header if any."""
+
+    bucket_name = event.get('bucket', SOURCE_BUCKET)
+    object_key = event.get('key')
+    if not object_key:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': APPLICATION_JSON,
+                'Access-Control-Allow-Origin': "ACCESS_CONTROL_ALLOW_ORIGIN"
+            },
+            'body': json.dumps({
+                'error': 'Missing required parameter',
+                'message': 'key is required',
+                'request_id': context.aws_request_id
+            })
+        }
+
+    try:
+        length = min(int(event.get('bytes', 4096)), MAX_PEEK_BYTES)
+        data = get_range(s3_client, bucket_name, object_key, 0, length - 1, EXPECTED_OWNER)
+        text = data.decode('utf-8', errors='replace')
+        columns = None
+        if detect_format(object_key) == 'csv' and '\n' in text:
+            delimiter = '\t' if object_key.lower().endswith('.tsv') else ','
+            columns = text.split('\n', 1)[0].rstrip('\r').split(delimiter)
+
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': APPLICATION_JSON,
+                'Access-Control-Allow-Origin': "ACCESS_CONTROL_ALLOW_ORIGIN"
+            },
+            'body': json.dumps({
+                'message': 'File peeked successfully',
+                'source': f"{bucket_name}/{object_key}",
+                'bytes_read': len(data),
+                'columns': columns,
+                'preview': text,
+                'request_id': context.aws_request_id,
+                'timestamp': datetime.now(timezone.utc).isoformat()
+            })
+        }
+
+    except Exception as e:
+        logger.error(f"Error peeking {bucket_name}/{object_key}: {str(e)}", exc_info=True)
+        raise
+
+
 def perform_health_check(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """Perform health check on the Lambda function and S3 access."""
 
@@ -590,6 +1356,10 @@ def perform_health_check(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'function_version': context.function_version,
             'environment': ENVIRONMENT,
             'health_details': health_status,
+            'object_cache': object_cache.stats(),
+            's3_concurrency': limiter.stats(),
+            's3_hedging': hedger.stats(),
+            'transform_pool': transform_pool.stats(),
             'configured_buckets': {
                 'source': SOURCE_BUCKET,
                 'destination': DESTINATION_BUCKET,
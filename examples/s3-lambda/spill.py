@@ -0,0 +1,196 @@
+"""
+Processing objects too large for memory from ephemeral storage.
+
+`SpilledObject` downloads an object with ranged GETs into a preallocated file in
+/tmp (see ranged.py) and maps it read-only, so transforms read it a chunk at a
+time without copying it into the Python heap. `upload_chunks` sends the
+transformed chunks as a multipart upload while they are produced, so only the
+input takes space in /tmp and memory holds a few parts whatever the object
+size. Pages of the mapped file are page cache that the kernel can drop under
+memory pressure, unlike heap memory.
+
+`spill_threshold` derives the size from which objects are spilled from the
+memory of the function, so one deployment adapts to its `memory_size`.
+"""
+import codecs
+import errno
+import glob
+import itertools
+import mmap
+import os
+import shutil
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+
+from ranged import DEFAULT_CONCURRENCY, DEFAULT_PART_SIZE, DownloadStats, RangedDownloader
+
+SPILL_PREFIX = 'spill-'
+# Slices of the mapped file handed to a transform
+TRANSFORM_CHUNK_BYTES = 8 * 1024 * 1024
+# Multipart upload limits
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+
+# Files of spills still open in this process; any other spill file is left over from a
+# timed-out invocation and only takes space
+_live_paths: Set[str] = set()
+
+
+def spill_threshold(memory_limit_mb: int, fraction: float) -> int:
+    """Object size in bytes from which processing should run from ephemeral storage."""
+    return max(int(memory_limit_mb * 1024 * 1024 * fraction), 1)
+
+
+def remove_stale(directory: str) -> int:
+    """Delete spill files not in use by this process; returns the bytes freed."""
+    freed = 0
+    for path in glob.glob(os.path.join(directory, SPILL_PREFIX + '*')):
+        if path in _live_paths:
+            continue
+        try:
+            freed += os.path.getsize(path)
+            os.unlink(path)
+        except OSError:
+            pass
+    return freed
+
+
+class SpilledObject:
+    """An S3 object downloaded into ephemeral storage and mapped read-only; removed on exit."""
+
+    def __init__(self, downloader: RangedDownloader, bucket: str, key: str, size: Optional[int] = None,
+                 etag: Optional[str] = None, directory: Optional[str] = None):
+        self.downloader = downloader
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.etag = etag
+        self.directory = directory or tempfile.gettempdir()
+        self.path = ''
+        self.stats = DownloadStats()
+        self.stale_bytes_removed = 0
+        self._map: Optional[mmap.mmap] = None
+
+    def __enter__(self) -> 'SpilledObject':
+        if self.size is None:
+            self.size, self.etag = self.downloader.head(self.bucket, self.key)
+        self.stale_bytes_removed = remove_stale(self.directory)
+        free = shutil.disk_usage(self.directory).free
+        if self.size > free:
+            raise OSError(errno.ENOSPC, f"{self.key} needs {self.size} bytes of ephemeral storage, "
+                                        f"{free} are free", self.directory)
+
+        descriptor, self.path = tempfile.mkstemp(prefix=SPILL_PREFIX, dir=self.directory)
+        os.close(descriptor)
+        _live_paths.add(self.path)
+        try:
+            self.downloader.download_to_file(self.bucket, self.key, self.path, self.size, self.etag, self.stats)
+            if self.size:
+                with open(self.path, 'rb') as file:
+                    self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                    self._map.madvise(mmap.MADV_SEQUENTIAL)
+        except BaseException:
+            self._remove()
+            raise
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._remove()
+
+    def _remove(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self.path:
+            _live_paths.discard(self.path)
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+    def mapped(self) -> Any:
+        """The object as a read-only map for transforms that cut their own chunks; b'' when it is empty."""
+        return self._map if self._map is not None else b''
+
+    def chunks(self, chunk_size: int = TRANSFORM_CHUNK_BYTES) -> Iterator[bytes]:
+        """Yield the object in order, `chunk_size` bytes at a time."""
+        for offset in range(0, self.size or 0, chunk_size):
+            yield self._map[offset:offset + chunk_size]
+
+
+def iter_text(chunks: Iterator[bytes], transform: Callable[[str], str], encoding: str = 'utf-8') -> Iterator[bytes]:
+    """Decode chunks, apply `transform` and encode again; characters split across chunks are kept whole."""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield transform(text).encode(encoding)
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield transform(tail).encode(encoding)
+
+
+def _parts(chunks: Iterator[bytes], part_size: int) -> Iterator[bytes]:
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= part_size:
+            yield bytes(buffer[:part_size])
+            del buffer[:part_size]
+    if buffer:
+        yield bytes(buffer)
+
+
+def upload_chunks(client: Any, bucket: str, key: str, chunks: Iterator[bytes], part_size: int = DEFAULT_PART_SIZE,
+                  concurrency: int = DEFAULT_CONCURRENCY, size_hint: int = 0,
+                  conditions: Optional[Dict[str, str]] = None, **kwargs: Any) -> Dict[str, int]:
+    """Upload chunks as one object while they are produced; returns the bytes and parts sent.
+
+    Content of a single part goes up with PutObject, anything larger as a
+    multipart upload with up to `concurrency` parts in flight, which is aborted
+    on failure. `size_hint` raises the part size so an object of about that size
+    fits in the parts a multipart upload allows. `conditions` (IfMatch or
+    IfNoneMatch) make the write conditional and go on the request that creates
+    the object. `kwargs` are PutObject arguments such as ContentType, Metadata
+    and Tagging.
+    """
+    part_size = max(part_size, MIN_PART_SIZE, -(-size_hint // MAX_PARTS))
+    parts = _parts(chunks, part_size)
+    first = next(parts, b'')
+    second = next(parts, None)
+    if second is None:
+        client.put_object(Bucket=bucket, Key=key, Body=first, **kwargs, **(conditions or {}))  # NOSONAR
+        return {'bytes': len(first), 'parts': 1}
+
+    owner = {'ExpectedBucketOwner': kwargs['ExpectedBucketOwner']} if kwargs.get('ExpectedBucketOwner') else {}
+    upload_id = client.create_multipart_upload(Bucket=bucket, Key=key, **kwargs)['UploadId']  # NOSONAR
+
+    def upload(number: int, body: bytes) -> Dict[str, Any]:
+        response = client.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=number,  # NOSONAR
+                                      Body=body, **owner)
+        return {'PartNumber': number, 'ETag': response['ETag']}
+
+    completed: List[Dict[str, Any]] = []
+    pending: List[Future] = []
+    sent = 0
+    pool = ThreadPoolExecutor(max_workers=max(concurrency, 1), thread_name_prefix='upload')
+    try:
+        for number, body in enumerate(itertools.chain((first, second), parts), 1):
+            if len(pending) >= concurrency:
+                completed.append(pending.pop(0).result())
+            pending.append(pool.submit(upload, number, body))
+            sent += len(body)
+        completed.extend(future.result() for future in pending)
+        client.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,  # NOSONAR
+                                         MultipartUpload={'Parts': completed}, **owner, **(conditions or {}))
+    except BaseException:
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=True)
+        client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id, **owner)  # NOSONAR
+        raise
+    finally:
+        pool.shutdown(wait=True)
+    return {'bytes': sent, 'parts': len(completed)}
@@ -0,0 +1,220 @@
+"""
+Text transforms on several cores from a process pool that works in Lambda.
+
+Python runs one thread at a time, so a CPU-bound transform such as upper-casing
+a large object uses one core whatever the memory size, while Lambda gives
+functions up to 6 vCPUs. `multiprocessing.Pool` and `multiprocessing.Queue`
+need POSIX semaphores in /dev/shm, which the Lambda sandbox does not provide.
+`TransformPool` instead forks worker processes that each talk to the function
+over their own `multiprocessing.Pipe`, a socket pair, and exchange text through
+anonymous shared memory mapped before the fork: the function copies a chunk of
+the object into a worker's input slot and sends the slot number, and the worker
+writes the transformed chunk to the matching output slot and replies with its
+length. Only a few integers cross the pipe per chunk; an output too large for
+its slot is sent through the pipe instead.
+
+Each worker has SLOTS_PER_WORKER slots, so the next chunk is waiting while a
+worker transforms the current one. Chunks go to workers in turn and come back in
+order. Chunks are cut on UTF-8 character boundaries and transformed
+independently, so a transform must only change characters one at a time, as
+`str.upper` does. Workers are forked when the pool is created and serve warm
+invocations until the function exits; create the pool while the module is
+imported, before any thread has started, so that no worker inherits a lock
+held by another thread. Transforms are named in TRANSFORMS, as workers cannot
+receive new code after the fork.
+"""
+import collections
+import logging
+import mmap
+import multiprocessing
+import os
+import threading
+from typing import Any, Callable, Deque, Dict, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+TRANSFORMS: Dict[str, Callable[[str], str]] = {
+    'upper': str.upper
+}
+# Text handed to a worker at a time; the pool maps 2 * workers * SLOTS_PER_WORKER of these
+DEFAULT_CHUNK_BYTES = 4 * 1024 * 1024
+SLOTS_PER_WORKER = 2
+ENCODING = 'utf-8'
+
+
+def available_cpus() -> int:
+    """CPUs this process may run on, which in Lambda follows the memory size."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def worker_count(setting: str) -> int:
+    """Workers for a TRANSFORM_WORKERS setting: a number, or `auto` for one per CPU when there are several."""
+    if setting == 'auto':
+        cpus = available_cpus()
+        return cpus if cpus > 1 else 0
+    return max(int(setting), 0)
+
+
+def _boundary(data: Any, end: int) -> int:
+    """Move `end` back to the start of the UTF-8 character it falls in."""
+    if end >= len(data):
+        return len(data)
+    # Continuation bytes are 10xxxxxx; a character has at most 3 of them
+    for _ in range(3):
+        if data[end] & 0xC0 != 0x80:
+            break
+        end -= 1
+    return end
+
+
+def _serve(connection: Any, inherited: List[Any], inputs: mmap.mmap, outputs: mmap.mmap, chunk_bytes: int) -> None:
+    """Worker loop: transform chunks named by slot until the function closes the pipe."""
+    # Ends of pipes belonging to the function, which must close when it exits
+    for other in inherited:
+        other.close()
+    while True:
+        try:
+            message = connection.recv()
+        except (EOFError, OSError):
+            return
+        if message is None:
+            return
+        slot, length, name = message
+        start = slot * chunk_bytes
+        try:
+            text = str(memoryview(inputs)[start:start + length], ENCODING)
+            result = TRANSFORMS[name](text).encode(ENCODING)
+            if len(result) <= chunk_bytes:
+                outputs[start:start + len(result)] = result
+                reply: Any = len(result)
+            else:
+                reply = result
+        except Exception as e:
+            reply = ('error', e)
+        try:
+            connection.send(reply)
+        except OSError:
+            return
+        except Exception as e:
+            # An exception that cannot be pickled; keep its message
+            connection.send(('error', RuntimeError(f"{type(e).__name__}: {e}")))
+
+
+class TransformPool:
+    """Worker processes, kept across warm invocations, that transform text chunks in parallel."""
+
+    def __init__(self, workers: int, chunk_bytes: int = DEFAULT_CHUNK_BYTES):
+        self.chunk_bytes = chunk_bytes
+        self.chunks = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self._connections: List[Any] = []
+        self._processes: List[Any] = []
+        self._inputs = self._outputs = None
+        if workers <= 0:
+            return
+        slots = workers * SLOTS_PER_WORKER
+        self._inputs = mmap.mmap(-1, slots * chunk_bytes)
+        self._outputs = mmap.mmap(-1, slots * chunk_bytes)
+        context = multiprocessing.get_context('fork')
+        for index in range(workers):
+            connection, worker_end = context.Pipe()
+            process = context.Process(target=_serve, name=f"transform-{index}", daemon=True,
+                                      args=(worker_end, self._connections + [connection], self._inputs,
+                                            self._outputs, chunk_bytes))
+            process.start()
+            worker_end.close()
+            self._connections.append(connection)
+            self._processes.append(process)
+
+    @property
+    def workers(self) -> int:
+        """Live workers; 0 when the pool is disabled or has been closed."""
+        return len(self._connections)
+
+    def transform(self, name: str, data: Any) -> Iterator[bytes]:
+        """Yield `data`, UTF-8 bytes or a mapped file, transformed by TRANSFORMS[name] chunk by chunk, in order.
+
+        One transform runs at a time; others wait for it. A worker that exits
+        closes the pool, and later calls raise RuntimeError.
+        """
+        if name not in TRANSFORMS:
+            raise ValueError(f"Unknown transform {name}")
+        with self._lock:
+            if not self._connections:
+                raise RuntimeError("Transform pool has no workers")
+            pending: Deque[Tuple[int, int]] = collections.deque()
+            try:
+                offset = sent = 0
+                workers = len(self._connections)
+                while offset < len(data) or pending:
+                    while offset < len(data) and len(pending) < workers * SLOTS_PER_WORKER:
+                        end = _boundary(data, offset + self.chunk_bytes)
+                        worker = sent % workers
+                        slot = worker * SLOTS_PER_WORKER + (sent // workers) % SLOTS_PER_WORKER
+                        start = slot * self.chunk_bytes
+                        self._inputs[start:start + end - offset] = data[offset:end]
+                        self._send(worker, (slot, end - offset, name))
+                        pending.append((worker, slot))
+                        self.bytes += end - offset
+                        offset = end
+                        sent += 1
+                    worker, slot = pending.popleft()
+                    yield self._result(worker, slot)
+                    self.chunks += 1
+            finally:
+                # Read the replies still due, so the next transform starts with empty pipes
+                while pending and self._connections:
+                    worker, _ = pending.popleft()
+                    try:
+                        self._receive(worker)
+                    except RuntimeError:
+                        break
+
+    def _send(self, worker: int, message: Tuple[int, int, str]) -> None:
+        try:
+            self._connections[worker].send(message)
+        except OSError as e:
+            self._broken(worker)
+            raise RuntimeError(f"Transform worker {worker} has exited") from e
+
+    def _receive(self, worker: int) -> Any:
+        try:
+            return self._connections[worker].recv()
+        except (EOFError, OSError) as e:
+            self._broken(worker)
+            raise RuntimeError(f"Transform worker {worker} has exited") from e
+
+    def _result(self, worker: int, slot: int) -> bytes:
+        reply = self._receive(worker)
+        if isinstance(reply, int):
+            start = slot * self.chunk_bytes
+            return self._outputs[start:start + reply]
+        if isinstance(reply, tuple):
+            raise reply[1]
+        return reply
+
+    def _broken(self, worker: int) -> None:
+        logger.warning(f"Transform worker {worker} exited (code {self._processes[worker].exitcode}); "
+                       f"closing the transform pool")
+        self.close()
+
+    def close(self) -> None:
+        """Stop the workers; the pool serves no transform afterwards."""
+        connections, self._connections = self._connections, []
+        for connection in connections:
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+            connection.close()
+        for process in self._processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+
+    def stats(self) -> Dict[str, Any]:
+        return {'workers': self.workers, 'chunks': self.chunks, 'bytes': self.bytes}
@@ -46,6 +46,25 @@ variable "processing_prefix" {
   default     = "incoming/"
 }
 
+variable "key_layout" {
+  description = "Layout of output keys under processed/: flat, hashed, date, hive, or a comma-separated combination"
+  type        = string
+  default     = "flat"
+
+  validation {
+    condition = alltrue([
+      for part in split(",", var.key_layout) : contains(["flat", "hashed", "date", "hive"], trimspace(part))
+    ])
+    error_message = "Key layout must be flat, hashed, date, hive or a comma-separated combination of them."
+  }
+}
+
+variable "key_layout_shards" {
+  description = "Number of hex-named prefixes the hashed key layout spreads outputs over"
+  type        = number
+  default     = 16
+}
+
 variable "file_extension_filter" {
   description = "File extension filter for S3 events"
   type        = string
@@ -58,6 +77,30 @@ variable "enable_lambda_insights" {
   default     = true
 }
 
+variable "enable_function_url" {
+  description = "Create an IAM-authenticated function URL serving /objects listings and /download in BUFFERED mode"
+  type        = bool
+  default     = false
+}
+
+variable "enable_response_streaming" {
+  description = "Serve the function URL in RESPONSE_STREAM mode through the streaming runtime loop"
+  type        = bool
+  default     = false
+}
+
+variable "ephemeral_storage" {
+  description = "Size of /tmp in MB (512-10240); objects too large for memory are processed from there"
+  type        = number
+  default     = 10240
+}
+
+variable "enable_batch_operations" {
+  description = "Create a role S3 Batch Operations jobs can use to run the processor over a manifest"
+  type        = bool
+  default     = false
+}
+
 variable "sns_topic_arn" {
   description = "SNS topic ARN for CloudWatch alarms (optional)"
   type        = string
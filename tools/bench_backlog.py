@@ -0,0 +1,135 @@
+"""
+Drain a seeded backlog through the S3 processor's default processing.
+
+The source bucket is seeded with --objects pending files under the processing
+prefix, with hex key names and log-normally distributed sizes, and every S3 call
+is delayed by --latency-ms. Each scenario loads a fresh copy of the handler and
+invokes it without an action, with a --timeout-seconds deadline per invocation,
+until the backlog is empty. The report lists, per scenario, the invocations
+needed, total and scan time, and the drain rate; `fixed_batch_invocations` is
+what the previous ten-files-per-invocation loop would have needed. The `scan`
+section times building the backlog index alone over --scan-objects keys for
+each keyspace setting.
+
+    delimiter      the flat prefix listed as a single shard
+    hex_keyspace   the prefix split into 16 key ranges listed in parallel
+    size_bins      hex keyspace, scheduled round-robin over size bins
+
+    python tools/bench_backlog.py --objects 2000 --latency-ms 5 --timeout-seconds 10
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import math
+import os
+import random
+import sys
+import time
+import uuid
+from typing import Any, Dict
+
+from bench_handlers import BENCHMARKS, DESTINATION_BUCKET, SOURCE_BUCKET
+from local_aws import LocalAWS, LocalContext, load_handler
+
+SCENARIOS = {
+    'delimiter': {'BACKLOG_KEYSPACE': '', 'BACKLOG_SCHEDULE': 'largest_first'},
+    'hex_keyspace': {'BACKLOG_KEYSPACE': '0123456789abcdef', 'BACKLOG_SCHEDULE': 'largest_first'},
+    'size_bins': {'BACKLOG_KEYSPACE': '0123456789abcdef', 'BACKLOG_SCHEDULE': 'size_bins'}
+}
+
+
+def seed(local: LocalAWS, objects: int, median_kib: float, seed_value: int) -> int:
+    rng = random.Random(seed_value)
+    total = 0
+    for _ in range(objects):
+        size = min(int(rng.lognormvariate(math.log(median_kib * 1024), 1.2)), 64 * 1024 * 1024)
+        key = f"incoming/{uuid.UUID(int=rng.getrandbits(128)).hex}.txt"
+        local.clients['s3'].put(SOURCE_BUCKET, key, b'x' * size, 'text/plain')
+        total += size
+    return total
+
+
+def scan(args: argparse.Namespace) -> Dict[str, Any]:
+    benchmark = BENCHMARKS['s3-lambda']()
+    local = LocalAWS(latency_ms=args.latency_ms)
+    benchmark.seed(local, 0, 0)
+    rng = random.Random(args.seed)
+    for _ in range(args.scan_objects):
+        local.clients['s3'].put(SOURCE_BUCKET, f"incoming/{uuid.UUID(int=rng.getrandbits(128)).hex}.txt", b'x')
+    load_handler(benchmark.example, benchmark.filename, local, 's3_processor_backlog_scan')
+    import backlog
+
+    results = {}
+    for name, keyspace in (('delimiter', ''), ('hex_keyspace', '0123456789abcdef')):
+        index = backlog.BacklogIndex.build(local.client('s3'), SOURCE_BUCKET, 'incoming/', DESTINATION_BUCKET,
+                                           'processed/', lambda key: 'incoming/' + key[len('processed/'):],
+                                           keyspace=keyspace, parallelism=args.parallelism)
+        results[name] = dict(index.scan, pending=len(index))
+    return results
+
+
+def drain(name: str, environment: Dict[str, str], args: argparse.Namespace) -> Dict[str, Any]:
+    benchmark = BENCHMARKS['s3-lambda']()
+    os.environ.update(benchmark.environment)
+    os.environ.update(environment)
+    os.environ['BACKLOG_PARALLELISM'] = str(args.parallelism)
+    os.environ['BACKLOG_TIME_MARGIN_MS'] = str(args.margin_ms)
+    local = LocalAWS(latency_ms=args.latency_ms)
+    benchmark.seed(local, 0, 0)
+    seed(local, args.objects, args.median_kib, args.seed)
+    module = load_handler(benchmark.example, benchmark.filename, local, f"s3_processor_backlog_{name}")
+    logging.getLogger().setLevel(logging.WARNING)
+
+    invocations = 0
+    scan_seconds = 0.0
+    processed = 0
+    start = time.perf_counter()
+    while invocations < args.max_invocations:
+        context = LocalContext('s3-processor', timeout_seconds=args.timeout_seconds)
+        body = json.loads(module.lambda_handler({}, context)['body'])
+        invocations += 1
+        backlog = body['backlog']
+        if not backlog['index_reused']:
+            scan_seconds += backlog['scan']['seconds']
+        processed += body['objects_processed']
+        if backlog['remaining_objects'] == 0:
+            break
+    elapsed = time.perf_counter() - start
+    return {
+        'invocations': invocations,
+        'objects_processed': processed,
+        'seconds': round(elapsed, 2),
+        'scan_seconds': round(scan_seconds, 3),
+        'objects_per_second': round(processed / elapsed, 1),
+        'requests': dict(local.clients['s3'].request_counts)
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--objects', type=int, default=2000)
+    parser.add_argument('--median-kib', type=float, default=16)
+    parser.add_argument('--latency-ms', type=float, default=5, help='delay added to every S3 call')
+    parser.add_argument('--timeout-seconds', type=float, default=10, help='deadline of each invocation')
+    parser.add_argument('--margin-ms', type=int, default=1000, help='BACKLOG_TIME_MARGIN_MS for the handler')
+    parser.add_argument('--parallelism', type=int, default=8)
+    parser.add_argument('--scan-objects', type=int, default=50000, help='keys in the index build comparison')
+    parser.add_argument('--max-invocations', type=int, default=1000)
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help='default: all')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    os.environ['LOG_LEVEL'] = 'WARNING'
+    results: Dict[str, Any] = {'scan': scan(args), 'fixed_batch_invocations': math.ceil(args.objects / 10)}
+    # The handler prints EMF metric lines; keep them out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        for name in args.scenario or SCENARIOS:
+            results[name] = drain(name, SCENARIOS[name], args)
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
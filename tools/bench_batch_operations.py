@@ -0,0 +1,205 @@
+"""
+Run an S3 Batch Operations job through the S3 processor against local fixtures.
+
+--objects small text files are seeded with keys containing spaces and
+non-ASCII characters, and a CSV manifest (bucket and URL-encoded key per line,
+as Batch Operations expects) is written for them plus --missing-percent keys
+that do not exist. The job is then run as S3 runs one: every --tasks-per-
+invocation tasks become an invocation in schema --schema, --concurrency
+invocations run at once, TemporaryFailure tasks are sent again up to
+--retries times, and every task ends in the completion report. GetObject
+fails with SlowDown for --throttle-percent of calls, and every S3 call is
+delayed by --latency-ms.
+
+The report lists, per --tasks-per-invocation setting, invocations, wall time,
+tasks per second, retries and the final count of each result code, which
+must be Succeeded for every seeded key and PermanentFailure for every missing
+one. --manifest keeps the manifest and --report writes the completion report
+as CSV.
+
+    python tools/bench_batch_operations.py --objects 20000 --concurrency 64 --tasks-per-invocation 1 \\
+        --tasks-per-invocation 16 --throttle-percent 2
+"""
+import argparse
+import contextlib
+import csv
+import io
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from bench_handlers import BENCHMARKS, SOURCE_BUCKET
+from local_aws import LocalAWS, LocalContext, client_error, load_handler
+
+KEY_NAMES = ('quarterly report', 'résumé', 'données brutes', 'log+archive')
+
+
+def write_manifest(path: str, entries: List[Tuple[str, str]]) -> None:
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        for bucket, key in entries:
+            writer.writerow([bucket, urllib.parse.quote_plus(key, safe='/')])
+
+
+def read_manifest(path: str) -> List[Tuple[str, str]]:
+    with open(path, newline='') as file:
+        return [(row[0], row[1]) for row in csv.reader(file) if row]
+
+
+def seed(local: LocalAWS, args: argparse.Namespace) -> Tuple[List[Tuple[str, str]], int]:
+    rng = random.Random(args.seed)
+    entries = []
+    for index in range(args.objects):
+        key = f"incoming/batch/{index:07d} {KEY_NAMES[index % len(KEY_NAMES)]}.txt"
+        local.clients['s3'].put(SOURCE_BUCKET, key, f"{key}\n".encode('utf-8') * (args.object_kib * 16), 'text/plain')
+        entries.append((SOURCE_BUCKET, key))
+    missing = int(args.objects * args.missing_percent / 100)
+    entries += [(SOURCE_BUCKET, f"incoming/batch/missing {index}.txt") for index in range(missing)]
+    rng.shuffle(entries)
+    return entries, missing
+
+
+def throttle(local: LocalAWS, percent: float) -> None:
+    """Make GetObject answer SlowDown for `percent` of calls, as a hot prefix does."""
+    s3 = local.clients['s3']
+    get_object = s3.get_object
+
+    def flaky(**kwargs: Any) -> Dict[str, Any]:
+        if random.random() * 100 < percent:
+            raise client_error('SlowDown', 'Please reduce your request rate.', 'GetObject', 503)
+        return get_object(**kwargs)
+    s3.get_object = flaky
+
+
+def invocation(tasks: List[Dict[str, Any]], schema: str, job_id: str) -> Dict[str, Any]:
+    event: Dict[str, Any] = {
+        'invocationSchemaVersion': schema,
+        'invocationId': uuid.uuid4().hex,
+        'job': {'id': job_id},
+        'tasks': []
+    }
+    if schema == '2.0':
+        event['job']['userArguments'] = {}
+    for task in tasks:
+        entry = {'taskId': task['taskId'], 's3Key': task['key'], 's3VersionId': None}
+        if schema == '2.0':
+            entry['s3Bucket'] = task['bucket']
+        else:
+            entry['s3BucketArn'] = f"arn:aws:s3:::{task['bucket']}"
+        event['tasks'].append(entry)
+    return event
+
+
+def run_job(module: Any, manifest: List[Tuple[str, str]], tasks_per_invocation: int,
+            args: argparse.Namespace) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    job_id = uuid.uuid4().hex
+    pending = [{'taskId': uuid.uuid4().hex, 'bucket': bucket, 'key': key, 'attempts': 0} for bucket, key in manifest]
+    finished: List[Dict[str, Any]] = []
+    lock = threading.Lock()
+    invocations = 0
+    retries = 0
+
+    def invoke(batch: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], Dict[str, str]]]:
+        context = LocalContext('s3-processor', timeout_seconds=args.timeout_seconds)
+        response = module.lambda_handler(invocation(batch, args.schema, job_id), context)
+        results = {result['taskId']: result for result in response.get('results', [])}
+        # A response without a result for a task, such as an error envelope, fails that task
+        return [(task, results.get(task['taskId'], {'resultCode': 'TemporaryFailure',
+                                                    'resultString': json.dumps(response)[:200]}))
+                for task in batch]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        while pending:
+            batches = [pending[offset:offset + tasks_per_invocation]
+                       for offset in range(0, len(pending), tasks_per_invocation)]
+            pending = []
+            for outcomes in pool.map(invoke, batches):
+                with lock:
+                    invocations += 1
+                    for task, result in outcomes:
+                        task['attempts'] += 1
+                        if result['resultCode'] == 'TemporaryFailure' and task['attempts'] <= args.retries:
+                            retries += 1
+                            pending.append(task)
+                        else:
+                            finished.append(dict(task, **result))
+    elapsed = time.perf_counter() - start
+
+    codes: Dict[str, int] = {}
+    for task in finished:
+        codes[task['resultCode']] = codes.get(task['resultCode'], 0) + 1
+    return {
+        'invocations': invocations,
+        'seconds': round(elapsed, 2),
+        'tasks_per_second': round(len(finished) / elapsed, 1),
+        'retries': retries,
+        'result_codes': codes
+    }, finished
+
+
+def write_report(path: str, finished: List[Dict[str, Any]]) -> None:
+    """Completion report in the Batch Operations CSV layout."""
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        for task in finished:
+            status = 'succeeded' if task['resultCode'] == 'Succeeded' else 'failed'
+            writer.writerow([task['bucket'], task['key'], '', status, task['resultCode'], 200,
+                             task.get('resultString', '')])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--objects', type=int, default=5000)
+    parser.add_argument('--object-kib', type=int, default=4)
+    parser.add_argument('--missing-percent', type=float, default=1)
+    parser.add_argument('--throttle-percent', type=float, default=2, help='GetObject calls answered with SlowDown')
+    parser.add_argument('--latency-ms', type=float, default=5, help='delay added to every S3 call')
+    parser.add_argument('--concurrency', type=int, default=32, help='invocations in flight')
+    parser.add_argument('--tasks-per-invocation', type=int, action='append', help='default: 1')
+    parser.add_argument('--schema', choices=('1.0', '2.0'), default='2.0')
+    parser.add_argument('--retries', type=int, default=3, help='attempts after a TemporaryFailure')
+    parser.add_argument('--timeout-seconds', type=float, default=300)
+    parser.add_argument('--manifest', help='where to keep the generated manifest')
+    parser.add_argument('--report', help='where to write the completion report of the last run')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    benchmark = BENCHMARKS['s3-lambda']()
+    os.environ.update(benchmark.environment)
+    # Later runs would find current outputs and skip them, which would flatter their throughput
+    os.environ['SKIP_UNCHANGED'] = 'false'
+    local = LocalAWS(latency_ms=args.latency_ms)
+    benchmark.seed(local, 0, 0)
+    entries, missing = seed(local, args)
+    manifest_path = args.manifest or os.path.join(tempfile.mkdtemp(prefix='bench-batch-'), 'manifest.csv')
+    write_manifest(manifest_path, entries)
+    manifest = read_manifest(manifest_path)
+    throttle(local, args.throttle_percent)
+    module = load_handler(benchmark.example, benchmark.filename, local)
+    logging.getLogger().setLevel(logging.ERROR)
+
+    results: Dict[str, Any] = {'tasks': len(manifest), 'missing_keys': missing, 'manifest': manifest_path}
+    finished: Optional[List[Dict[str, Any]]] = None
+    # The handler prints EMF metric lines; keep them out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        for tasks_per_invocation in args.tasks_per_invocation or [1]:
+            results[f"tasks_per_invocation_{tasks_per_invocation}"], finished = run_job(
+                module, manifest, tasks_per_invocation, args)
+    if args.report and finished is not None:
+        write_report(args.report, finished)
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
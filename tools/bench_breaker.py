@@ -0,0 +1,138 @@
+"""
+Measure the complete example through an SNS and CloudWatch outage with and without circuit breakers.
+
+--invocations S3 events, one record each, go to one warm instance of the
+complete example, --interval-ms apart. From --outage-start to --outage-end
+(invocation numbers) every SNS and CloudWatch call fails with a read timeout
+after --timeout-ms, as calls to a degraded endpoint do. Scenarios:
+
+    off     BREAKER_ENABLED=false: every call waits for its timeout
+    on      breakers open after BREAKER_FAILURE_THRESHOLD failures and let a
+            trial call through every --open-seconds
+
+Notifications that fail are kept in the /tmp spool in both scenarios and sent
+once SNS answers. For each scenario the report lists invocation latency before,
+during and after the outage, calls made to the failing services, breaker
+transitions, and notifications published, still spooled or dropped. The tool
+exits 1 if a notification was lost in the `on` scenario.
+
+    python tools/bench_breaker.py --invocations 600 --outage-start 100 --outage-end 400 --timeout-ms 500
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from bench_handlers import BENCHMARKS, COMPLETE_BUCKET, percentile, s3_record
+from local_aws import LocalAWS, LocalContext, OutageProxy, load_handler
+
+SCENARIOS = ('off', 'on')
+FAILING_SERVICES = ('sns', 'cloudwatch')
+TRANSITIONS = {'CircuitBreakerOpened': 'opened', 'CircuitBreakerHalfOpened': 'half_opened',
+               'CircuitBreakerClosed': 'closed'}
+
+
+def phase_latency(latencies: List[float]) -> Dict[str, Any]:
+    latencies = sorted(latencies)
+    if not latencies:
+        return {}
+    return {
+        'invocations': len(latencies),
+        'mean_ms': round(sum(latencies) / len(latencies), 1),
+        'p50_ms': round(percentile(latencies, 0.50), 1),
+        'p99_ms': round(percentile(latencies, 0.99), 1)
+    }
+
+
+def run(scenario: str, args: argparse.Namespace, spool_dir: str) -> Dict[str, Any]:
+    benchmark = BENCHMARKS['complete-lambda-example']()
+    os.environ.update(benchmark.environment)
+    os.environ.update({
+        'BREAKER_ENABLED': 'true' if scenario == 'on' else 'false',
+        'BREAKER_OPEN_SECONDS': str(args.open_seconds),
+        'BREAKER_SPOOL_DIR': spool_dir,
+        'TRACING_ENABLED': 'false'
+    })
+    # breaker.py reads its settings on import; import it afresh for each scenario
+    sys.modules.pop('breaker', None)
+    local = LocalAWS()
+    benchmark.seed(local, args.objects, 1024)
+    sns = local.clients['sns']
+    proxies = {service: OutageProxy(local.clients[service], service, args.timeout_ms) for service in FAILING_SERVICES}
+    local.clients.update(proxies)
+    module = load_handler(benchmark.example, benchmark.filename, local, f"complete_breaker_{scenario}")
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    phases: Dict[str, List[float]] = {'before': [], 'during': [], 'after': []}
+    transitions: Dict[str, int] = {}
+    outcomes: Dict[str, int] = {}
+    calls_during = 0
+    for invocation in range(args.invocations):
+        if invocation == args.outage_start:
+            calls_before = sum(proxy.calls for proxy in proxies.values())
+            for proxy in proxies.values():
+                proxy.outage.set()
+        if invocation == args.outage_end:
+            calls_during = sum(proxy.calls for proxy in proxies.values()) - calls_before
+            for proxy in proxies.values():
+                proxy.outage.clear()
+        phase = ('before' if invocation < args.outage_start else
+                 'during' if invocation < args.outage_end else 'after')
+        event = {'Records': [s3_record('ObjectCreated:Put', COMPLETE_BUCKET,
+                                       f"uploads/file-{invocation % args.objects:06d}.txt")]}
+        output = io.StringIO()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(output):
+            response = module.lambda_handler(event, LocalContext('complete-lambda-example'))
+        phases[phase].append((time.perf_counter() - start) * 1000)
+        notification = json.loads(response['body'])['result'].get('notification')
+        outcomes[notification] = outcomes.get(notification, 0) + 1
+        for line in output.getvalue().splitlines():
+            if '"CircuitBreakerState"' in line:
+                document = json.loads(line)
+                for name, transition in TRANSITIONS.items():
+                    key = f"{document['Dependency']}_{transition}"
+                    transitions[key] = transitions.get(key, 0) + document[name]
+        time.sleep(args.interval_ms / 1000)
+
+    published = len(sns.messages)
+    spooled = len(module.sns_spool)
+    return {
+        'latency': {name: phase_latency(latencies) for name, latencies in phases.items()},
+        'calls_to_failing_services_during_outage': calls_during,
+        'breaker_transitions': transitions,
+        'notification_outcomes': outcomes,
+        'notifications_published': published,
+        'notifications_spooled': spooled,
+        'notifications_lost': args.invocations - published - spooled
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--invocations', type=int, default=400)
+    parser.add_argument('--outage-start', type=int, default=100)
+    parser.add_argument('--outage-end', type=int, default=200)
+    parser.add_argument('--timeout-ms', type=float, default=100, help='time a failing call takes')
+    parser.add_argument('--open-seconds', type=float, default=1, help='BREAKER_OPEN_SECONDS')
+    parser.add_argument('--interval-ms', type=float, default=10, help='pause between invocations')
+    parser.add_argument('--objects', type=int, default=100)
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='default: both')
+    args = parser.parse_args()
+
+    results = {}
+    for scenario in args.scenario or SCENARIOS:
+        with tempfile.TemporaryDirectory(prefix='bench-breaker-') as spool_dir:
+            results[scenario] = run(scenario, args, spool_dir)
+    print(json.dumps(results, indent=2))
+    return 1 if results.get('on', {}).get('notifications_lost') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
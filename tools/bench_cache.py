@@ -0,0 +1,106 @@
+"""
+Measure the warm-instance object cache on repeatedly read reference data.
+
+Every simulated invocation reads the same --objects reference objects (JSON
+config, a schema and a larger dictionary, cycling) from the local S3 stand-in,
+with --latency-ms added to every call and bodies throttled to --stream-mib per
+second. Every --update-every invocations one object is rewritten, as when
+reference data is edited. Scenarios:
+
+    uncached       a GetObject per read, as the handlers did before
+    revalidate     the cache with a TTL of 0: a conditional GET per read that
+                   transfers nothing while the object is unchanged
+    cached         the cache with --ttl-seconds; reads within the TTL make no request
+    tmp_tier       as cached, with a memory tier smaller than the objects so most
+                   are served from the /tmp tier
+
+The report lists wall time, requests, bytes transferred and the cache counters.
+
+    python tools/bench_cache.py --invocations 500 --latency-ms 15
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+
+from local_aws import COMMON_DIR, LocalAWS
+
+sys.path.append(str(COMMON_DIR))
+from object_cache import ObjectCache  # noqa: E402
+
+BUCKET = 'bench-reference'
+SIZES = {'json': 4 * 1024, 'schema': 64 * 1024, 'dictionary': 2 * 1024 * 1024}
+
+
+def seed(local: LocalAWS, objects: int) -> List[Tuple[str, str]]:
+    s3 = local.clients['s3']
+    s3.buckets[BUCKET] = {}
+    references = []
+    kinds = list(SIZES)
+    for index in range(objects):
+        kind = kinds[index % len(kinds)]
+        key = f"reference/{kind}-{index}.{'json' if kind == 'json' else 'bin'}"
+        body = json.dumps({'version': 0, 'pad': 'x' * SIZES[kind]}).encode('utf-8') if kind == 'json' \
+            else os.urandom(SIZES[kind])
+        s3.put(BUCKET, key, body)
+        references.append((BUCKET, key))
+    return references
+
+
+def run(name: str, args: argparse.Namespace) -> Dict[str, Any]:
+    local = LocalAWS(latency_ms=args.latency_ms, stream_mib_per_second=args.stream_mib)
+    references = seed(local, args.objects)
+    s3 = local.clients['s3']
+    client = local.client('s3')
+    directory = tempfile.mkdtemp(prefix='bench-cache-') if name == 'tmp_tier' else ''
+    cache = None
+    if name != 'uncached':
+        cache = ObjectCache(client, 'Bench', 'bench-cache', ttl_seconds=0 if name == 'revalidate' else args.ttl_seconds,
+                            max_bytes=512 * 1024 if name == 'tmp_tier' else 64 * 1024 * 1024,
+                            directory=directory)
+
+    start = time.perf_counter()
+    for invocation in range(args.invocations):
+        if args.update_every and invocation and invocation % args.update_every == 0:
+            bucket, key = references[invocation // args.update_every % len(references)]
+            s3.put(bucket, key, s3.buckets[bucket][key].body[:-1] + b' ')
+        for bucket, key in references:
+            if cache is None:
+                client.get_object(Bucket=bucket, Key=key)['Body'].read()
+            else:
+                cache.get(bucket, key)
+    elapsed = time.perf_counter() - start
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return {
+        'seconds': round(elapsed, 3),
+        'ms_per_invocation': round(elapsed * 1000 / args.invocations, 3),
+        'requests': sum(s3.request_counts.values()),
+        'bytes_transferred': s3.bytes_sent,
+        **({'cache': cache.stats()} if cache else {})
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--invocations', type=int, default=500)
+    parser.add_argument('--objects', type=int, default=6)
+    parser.add_argument('--latency-ms', type=float, default=15, help='delay added to every S3 call')
+    parser.add_argument('--stream-mib', type=float, default=80, help='per-connection throughput; 0 is unthrottled')
+    parser.add_argument('--ttl-seconds', type=float, default=300)
+    parser.add_argument('--update-every', type=int, default=100, help='invocations between object rewrites; 0 never')
+    parser.add_argument('--scenario', action='append', choices=('uncached', 'revalidate', 'cached', 'tmp_tier'))
+    args = parser.parse_args()
+
+    results = {name: run(name, args) for name in args.scenario or ('uncached', 'revalidate', 'cached', 'tmp_tier')}
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,199 @@
+"""
+Compact small processed files with the S3 processor's `compact` action and compare reading them before and after.
+
+--objects small text outputs are seeded under processed/ in --partitions
+sub-prefixes, with modification times spread over the last --hours hours, next
+to the sources they were produced from. Every S3 call is delayed by
+--latency-ms. The report lists:
+
+    before      a reader fetching every output with --reader-threads
+                connections: requests, seconds and listing pages
+    compaction  `compact` invocations until no group remains: seconds,
+                compacted objects written, originals deleted, bytes in and out
+    after       the same reader fetching every compacted object whole
+
+Checks follow, and the tool exits 1 if one fails. They cover the originals of
+the groups the compactor plans before the first run; outputs it leaves alone,
+in groups of fewer than COMPACTION_MIN_OBJECTS or in windows not yet settled,
+are only counted. Every planned original must read back from its compacted
+object through the index, with one ranged GET, exactly as seeded; none may
+remain under processed/; a default-processing invocation must find no pending
+files, as the backlog scan reads the indexes; and a second `compact` run must
+find nothing to do. With --interrupt the first
+run fails while deleting its first group's originals, and the next run must
+finish that group from the object already written.
+
+    python tools/bench_compaction.py --objects 20000 --partitions 8 --latency-ms 15 --interrupt
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict
+
+from bench_handlers import BENCHMARKS, DESTINATION_BUCKET, SOURCE_BUCKET
+from local_aws import LatencyProxy, LocalAWS, LocalContext, load_handler
+
+WORDS = ('order', 'shipped', 'paid', 'refund', 'customer', 'invoice', 'pending', 'warehouse', 'total', 'status')
+
+
+def seed(local: LocalAWS, args: argparse.Namespace) -> Dict[str, bytes]:
+    """Sources and their processed copies; returns the content of each processed key."""
+    rng = random.Random(args.seed)
+    store = local.clients['s3']
+    now = datetime.now(timezone.utc)
+    outputs = {}
+    for index in range(args.objects):
+        relative = f"part-{index % args.partitions:02d}/file-{index:07d}.txt"
+        lines = [' '.join(rng.choice(WORDS) for _ in range(8)) + f" {rng.randrange(10 ** 6)}"
+                 for _ in range(max(args.object_bytes // 64, 1))]
+        body = '\n'.join(lines).upper().encode('utf-8')
+        # Old enough that every window is closed and past the action's default settle time
+        modified = now - timedelta(hours=args.hours * rng.random(), minutes=args.window_minutes + 15)
+        store.put(SOURCE_BUCKET, f"incoming/{relative}", body, 'text/plain')
+        store.buckets[SOURCE_BUCKET][f"incoming/{relative}"].last_modified = modified - timedelta(seconds=1)
+        store.put(DESTINATION_BUCKET, f"processed/{relative}", body, 'text/plain')
+        store.buckets[DESTINATION_BUCKET][f"processed/{relative}"].last_modified = modified
+        outputs[f"processed/{relative}"] = body
+    return outputs
+
+
+def read_all(local: LocalAWS, prefix: str, threads: int, accept: Callable[[str], bool]) -> Dict[str, Any]:
+    """List `prefix` and GET every accepted object, as a downstream reader would."""
+    store = local.clients['s3']
+    client = LatencyProxy(store, local.latency_ms)
+    store.request_counts.clear()
+    start = time.perf_counter()
+    keys, pages, token = [], 0, None
+    while True:
+        response = client.list_objects_v2(Bucket=DESTINATION_BUCKET, Prefix=prefix,
+                                          **({'ContinuationToken': token} if token else {}))
+        pages += 1
+        keys += [obj['Key'] for obj in response.get('Contents', []) if accept(obj['Key'])]
+        token = response.get('NextContinuationToken')
+        if not response.get('IsTruncated'):
+            break
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        read = sum(pool.map(lambda key: len(client.get_object(Bucket=DESTINATION_BUCKET, Key=key)['Body'].read()),
+                            keys))
+    return {
+        'objects': len(keys),
+        'listing_pages': pages,
+        'requests': sum(store.request_counts.values()),
+        'bytes': read,
+        'seconds': round(time.perf_counter() - start, 2)
+    }
+
+
+def compact(module: Any, local: LocalAWS) -> Dict[str, Any]:
+    """Run `compact` until no group remains."""
+    totals = {'invocations': 0, 'groups_compacted': 0, 'groups_resumed': 0, 'objects_compacted': 0,
+              'objects_deleted': 0, 'bytes_found': 0, 'bytes_written': 0, 'unverified': []}
+    while True:
+        context = LocalContext('s3-processor', timeout_seconds=900)
+        body = json.loads(module.lambda_handler({'action': 'compact', 'dry_run': False}, context)['body'])
+        if 'groups_compacted' not in body:
+            raise RuntimeError(body.get('message', body))
+        totals['invocations'] += 1
+        for name in ('groups_compacted', 'groups_resumed', 'objects_compacted', 'objects_deleted', 'bytes_written'):
+            totals[name] += body[name]
+        totals['unverified'] += body['unverified']
+        if totals['invocations'] == 1:
+            totals['bytes_found'] = body['bytes_found']
+        if not body['groups_remaining']:
+            return totals
+
+
+def interrupt_first_delete(local: LocalAWS) -> None:
+    """Fail the first DeleteObjects call, as an invocation timing out after writing its object would."""
+    store = local.clients['s3']
+    delete_objects = store.delete_objects
+    failed = []
+
+    def failing_once(**kwargs: Any) -> Dict[str, Any]:
+        if not failed:
+            failed.append(kwargs)
+            raise TimeoutError('Invocation timed out before deleting the originals')
+        return delete_objects(**kwargs)
+    store.delete_objects = failing_once
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--objects', type=int, default=5000)
+    parser.add_argument('--object-bytes', type=int, default=2048)
+    parser.add_argument('--partitions', type=int, default=4)
+    parser.add_argument('--hours', type=float, default=6, help='span of the outputs\' modification times')
+    parser.add_argument('--format', default='jsonl.gz', help='COMPACTION_FORMAT')
+    parser.add_argument('--window-minutes', type=int, default=60)
+    parser.add_argument('--latency-ms', type=float, default=10, help='delay added to every S3 call')
+    parser.add_argument('--reader-threads', type=int, default=16)
+    parser.add_argument('--interrupt', action='store_true', help='fail the first run after its first object')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    benchmark = BENCHMARKS['s3-lambda']()
+    os.environ.update(benchmark.environment)
+    os.environ.update({'COMPACTION_FORMAT': args.format, 'COMPACTION_WINDOW_MINUTES': str(args.window_minutes)})
+    local = LocalAWS(latency_ms=args.latency_ms)
+    benchmark.seed(local, 0, 0)
+    outputs = seed(local, args)
+    module = load_handler(benchmark.example, benchmark.filename, local)
+    logging.getLogger().setLevel(logging.CRITICAL)
+    store = local.clients['s3']
+
+    results: Dict[str, Any] = {'before': read_all(local, 'processed/', args.reader_threads, lambda key: True)}
+    # Originals the action should compact, with its default settle time; the rest are left in place on purpose
+    planned = {member['Key'] for group in module.output_compactor().plan(settle_seconds=15 * 60)
+               for member in group.members}
+    start = time.perf_counter()
+    # The handler prints EMF metric lines; keep them out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        interrupted = None
+        if args.interrupt:
+            interrupt_first_delete(local)
+            try:
+                compact(module, local)
+            except RuntimeError as e:
+                interrupted = str(e)
+        results['compaction'] = compact(module, local)
+        results['compaction']['seconds'] = round(time.perf_counter() - start, 2)
+        results['compaction']['interrupted_run'] = interrupted
+        drain = json.loads(module.lambda_handler({}, LocalContext('s3-processor'))['body'])
+        again = json.loads(module.lambda_handler({'action': 'compact', 'dry_run': False},
+                                                 LocalContext('s3-processor', timeout_seconds=900))['body'])
+    results['after'] = read_all(local, 'compacted/', args.reader_threads, lambda key: not key.endswith('.index.json'))
+
+    compactor = module.output_compactor()
+    members = [(index, member) for index in compactor.indexes() for member in index['members']]
+    with ThreadPoolExecutor(max_workers=args.reader_threads) as pool:
+        contents = pool.map(lambda item: compactor.read_member(*item), members)
+        mismatched = [member['key'] for (_, member), content in zip(members, contents)
+                      if content != outputs[member['key']]]
+    recovered = sum(1 for _, member in members if member['key'] in planned)
+    remaining = sum(1 for key in planned if key in store.buckets[DESTINATION_BUCKET])
+    results['checks'] = {
+        'originals_planned': len(planned),
+        'originals_recovered': recovered,
+        'mismatched': mismatched[:10],
+        'originals_left': remaining,
+        'left_uncompacted': len(outputs) - len(planned),
+        'unverified': results['compaction']['unverified'],
+        'pending_after_compaction': drain['objects_found'],
+        'groups_found_by_second_run': again['groups_found']
+    }
+    print(json.dumps(results, indent=2))
+    failed = (mismatched or recovered != len(planned) or remaining or results['compaction']['unverified']
+              or drain['objects_found'] or again['groups_found'])
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,356 @@
+"""
+Load-generation benchmark for the example handlers.
+
+Each handler runs in its own worker process (so peak RSS is per handler) and is
+driven in-process through the local AWS stand-ins with a weighted mix of
+events. The report lists throughput, latency percentiles, peak RSS and
+allocation figures per handler. Results can be saved as a baseline and later
+runs compared against it to catch regressions without network access.
+
+    python tools/bench_handlers.py --invocations 500 --batch-size 10
+    python tools/bench_handlers.py --handler s3-lambda --mix s3_put=3,list_objects=1
+    python tools/bench_handlers.py --save-baseline tools/baselines/handlers.json
+    python tools/bench_handlers.py --compare tools/baselines/handlers.json --tolerance 15
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+from local_aws import LocalAWS, LocalContext, load_handler
+
+SOURCE_BUCKET = 'bench-source'
+DESTINATION_BUCKET = 'bench-destination'
+DEPLOYMENT_BUCKET = 'bench-deployment'
+COMPLETE_BUCKET = 'bench-complete'
+SNS_TOPIC_ARN = 'arn:aws:sns:us-east-1:123456789012:bench-topic'
+SQS_QUEUE_URL = 'https://sqs.us-east-1.amazonaws.com/123456789012/bench-queue'
+
+# Latency, throughput and memory figures compared against a baseline, and whether higher is better
+COMPARED_METRICS = {
+    'throughput_per_second': True,
+    'p50_ms': False,
+    'p95_ms': False,
+    'p99_ms': False,
+    'peak_rss_mib': False
+}
+
+# Builds an event from (rng, batch_size, seeded_objects)
+EventFactory = Callable[[random.Random, int, int], Dict[str, Any]]
+
+
+def s3_record(event_name: str, bucket: str, key: str) -> Dict[str, Any]:
+    """Build one S3 notification record."""
+    return {
+        'eventSource': 'aws:s3',
+        'eventName': event_name,
+        's3': {'bucket': {'name': bucket}, 'object': {'key': key}}
+    }
+
+
+def seeded_key(rng: random.Random, prefix: str, objects: int) -> str:
+    return f"{prefix}file-{rng.randrange(objects):06d}.txt"
+
+
+class HandlerBenchmark:
+    """How to seed, import and drive one example handler."""
+
+    def __init__(self, example: str, filename: str, environment: Dict[str, str],
+                 mix: Dict[str, Tuple[float, EventFactory]]):
+        self.example = example
+        self.filename = filename
+        self.environment = environment
+        self.mix = mix
+
+    def seed(self, local: LocalAWS, objects: int, object_size: int) -> None:
+        """Populate the stand-ins with the objects and parameters the events refer to."""
+        body = (b'lorem ipsum dolor sit amet ' * (object_size // 27 + 1))[:object_size]
+        for bucket in (SOURCE_BUCKET, DESTINATION_BUCKET, DEPLOYMENT_BUCKET, COMPLETE_BUCKET):
+            local.clients['s3'].buckets.setdefault(bucket, {})
+        for index in range(objects):
+            local.clients['s3'].put(SOURCE_BUCKET, f"incoming/file-{index:06d}.txt", body, 'text/plain')
+            local.clients['s3'].put(COMPLETE_BUCKET, f"uploads/file-{index:06d}.txt", body, 'application/json')
+        local.clients['ssm'].put_parameter(Name='/complete-lambda-example/config/batch_size', Value='10')
+
+    def events(self, mix: Dict[str, float], rng: random.Random, batch_size: int, objects: int):
+        """Yield (event_type, event) pairs drawn from the weighted mix forever."""
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        while True:
+            name = rng.choices(names, weights)[0]
+            yield name, self.mix[name][1](rng, batch_size, objects)
+
+
+def s3_processor_benchmark() -> HandlerBenchmark:
+    def s3_put(rng, batch, objects):
+        return {'Records': [
+            s3_record('ObjectCreated:Put', SOURCE_BUCKET, seeded_key(rng, 'incoming/', objects)) for _ in range(batch)
+        ]}
+
+    def s3_delete(rng, batch, objects):
+        return {'Records': [
+            s3_record('ObjectRemoved:Delete', SOURCE_BUCKET, seeded_key(rng, 'incoming/', objects)) for _ in range(batch)
+        ]}
+
+    return HandlerBenchmark('s3-lambda', 's3_processor_function.py', {
+        'SOURCE_BUCKET': SOURCE_BUCKET,
+        'DESTINATION_BUCKET': DESTINATION_BUCKET,
+        'DEPLOYMENT_BUCKET': DEPLOYMENT_BUCKET,
+        'PROCESSING_PREFIX': 'incoming/'
+    }, {
+        's3_put': (6, s3_put),
+        's3_delete': (1, s3_delete),
+        'list_objects': (1, lambda rng, batch, objects: {'action': 'list_objects', 'prefix': 'incoming/', 'max_keys': 100}),
+        'process_batch': (1, lambda rng, batch, objects: {
+            'action': 'process_batch',
+            'file_keys': [seeded_key(rng, 'incoming/', objects) for _ in range(batch)]
+        }),
+        'health_check': (1, lambda rng, batch, objects: {'action': 'health_check'})
+    })
+
+
+def complete_benchmark() -> HandlerBenchmark:
+    def sns(rng, batch, objects):
+        return {'Records': [{
+            'EventSource': 'aws:sns',
+            'Sns': {'TopicArn': SNS_TOPIC_ARN, 'Subject': 'bench', 'Message': json.dumps({'index': index})}
+        } for index in range(batch)]}
+
+    def sqs(rng, batch, objects):
+        return {'Records': [{
+            'eventSource': 'aws:sqs',
+            'body': json.dumps({'index': index}),
+            'receiptHandle': f"handle-{index}"
+        } for index in range(batch)]}
+
+    return HandlerBenchmark('complete-lambda-example', 'lambda_function.py', {
+        'S3_BUCKET_NAME': COMPLETE_BUCKET,
+        'SNS_TOPIC_ARN': SNS_TOPIC_ARN,
+        'SQS_QUEUE_URL': SQS_QUEUE_URL,
+        'ENVIRONMENT': 'bench'
+    }, {
+        's3': (3, lambda rng, batch, objects: {'Records': [
+            s3_record('ObjectCreated:Put', COMPLETE_BUCKET, seeded_key(rng, 'uploads/', objects)) for _ in range(batch)
+        ]}),
+        'sns': (2, sns),
+        'sqs': (3, sqs),
+        'api_gateway': (2, lambda rng, batch, objects: {
+            'httpMethod': 'POST', 'path': '/lambda', 'body': json.dumps({'items': list(range(batch))})
+        }),
+        'eventbridge': (1, lambda rng, batch, objects: {
+            'source': 'aws.events', 'detail-type': 'Scheduled Event', 'detail': {}
+        }),
+        'direct': (1, lambda rng, batch, objects: {'action': 'get_ssm_parameters'})
+    })
+
+
+def basic_benchmark() -> HandlerBenchmark:
+    return HandlerBenchmark('basic-lambda', 'lambda_function.py', {'ENVIRONMENT': 'bench'}, {
+        'api_gateway': (1, lambda rng, batch, objects: {
+            'httpMethod': 'GET', 'path': '/', 'queryStringParameters': {str(i): str(i) for i in range(batch)}
+        }),
+        'direct': (1, lambda rng, batch, objects: {'items': list(range(batch))})
+    })
+
+
+def container_benchmark() -> HandlerBenchmark:
+    return HandlerBenchmark('container-lambda', 'app.py', {'ENVIRONMENT': 'bench', 'FUNCTION_NAME': 'bench'}, {
+        'health': (2, lambda rng, batch, objects: {'action': 'health'}),
+        'echo': (3, lambda rng, batch, objects: {'action': 'echo', 'payload': {str(i): i for i in range(batch)}}),
+        'parameter_demo': (1, lambda rng, batch, objects: {'action': 'parameter_demo'}),
+        'invalid': (1, lambda rng, batch, objects: {'payload': {}})
+    })
+
+
+BENCHMARKS = {
+    'basic-lambda': basic_benchmark,
+    's3-lambda': s3_processor_benchmark,
+    'complete-lambda-example': complete_benchmark,
+    'container-lambda': container_benchmark
+}
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(int(fraction * len(sorted_values) + 0.5), len(sorted_values)) - 1
+    return sorted_values[max(index, 0)]
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """Parse 'name=weight,name=weight' into a dict."""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def run_worker(args: argparse.Namespace) -> Dict[str, Any]:
+    """Benchmark one handler inside this process."""
+    benchmark = BENCHMARKS[args.worker]()
+    os.environ.update(benchmark.environment)
+    os.environ['LOG_LEVEL'] = args.log_level
+
+    mix = parse_mix(args.mix) if args.mix else {name: weight for name, (weight, _) in benchmark.mix.items()}
+    unknown = set(mix) - set(benchmark.mix)
+    if unknown:
+        raise SystemExit(f"Unknown event types for {args.worker}: {', '.join(sorted(unknown))}")
+
+    local = LocalAWS()
+    benchmark.seed(local, args.objects, args.object_size)
+    module = load_handler(benchmark.example, benchmark.filename, local)
+    handler = module.lambda_handler
+    rng = random.Random(args.seed)
+    events = benchmark.events(mix, rng, args.batch_size, args.objects)
+
+    latencies: List[float] = []
+    per_type: Dict[str, List[float]] = {}
+    errors = 0
+
+    # Handlers print EMF and log lines; keep stdout free for the report
+    with contextlib.redirect_stdout(io.StringIO()) as captured:
+        for _ in range(args.warmup):
+            _, event = next(events)
+            handler(event, LocalContext(args.worker))
+
+        blocks_before = sys.getallocatedblocks()
+        gc_before = sum(stats['collections'] for stats in gc.get_stats())
+        started = time.perf_counter()
+        for _ in range(args.invocations):
+            event_type, event = next(events)
+            context = LocalContext(args.worker)
+            start = time.perf_counter_ns()
+            response = handler(event, context)
+            elapsed_ms = (time.perf_counter_ns() - start) / 1e6
+            latencies.append(elapsed_ms)
+            per_type.setdefault(event_type, []).append(elapsed_ms)
+            if isinstance(response, dict) and response.get('statusCode', 200) >= 500:
+                errors += 1
+            captured.seek(0)
+            captured.truncate()
+        duration = time.perf_counter() - started
+        blocks_after = sys.getallocatedblocks()
+        gc_after = sum(stats['collections'] for stats in gc.get_stats())
+
+        # Allocation profile on a separate, shorter pass since tracemalloc slows everything down
+        tracemalloc.start()
+        peaks = []
+        for _ in range(max(args.invocations // 10, 1)):
+            _, event = next(events)
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+            handler(event, LocalContext(args.worker))
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+            captured.seek(0)
+            captured.truncate()
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'handler': args.worker,
+        'invocations': args.invocations,
+        'batch_size': args.batch_size,
+        'mix': mix,
+        'errors': errors,
+        'throughput_per_second': round(args.invocations / duration, 2),
+        'records_per_second': round(args.invocations * args.batch_size / duration, 2),
+        'mean_ms': round(sum(latencies) / len(latencies), 4),
+        'p50_ms': round(percentile(latencies, 0.50), 4),
+        'p95_ms': round(percentile(latencies, 0.95), 4),
+        'p99_ms': round(percentile(latencies, 0.99), 4),
+        'max_ms': round(latencies[-1], 4),
+        'p50_ms_by_event': {
+            name: round(percentile(sorted(values), 0.50), 4) for name, values in sorted(per_type.items())
+        },
+        'peak_rss_mib': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2),
+        'retained_blocks_per_invocation': round((blocks_after - blocks_before) / args.invocations, 2),
+        'gc_collections': gc_after - gc_before,
+        'peak_allocated_kib_per_invocation': round(sorted(peaks)[len(peaks) // 2] / 1024, 2)
+    }
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], tolerance: float) -> List[str]:
+    """Return a description of every metric that regressed beyond `tolerance` percent."""
+    regressions = []
+    for handler, result in results.items():
+        previous = baseline.get(handler)
+        if not previous:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            old, new = previous.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            if (change < -tolerance) if higher_is_better else (change > tolerance):
+                regressions.append(f"{handler} {metric}: {old} -> {new} ({change:+.1f}%)")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--handler', action='append', choices=sorted(BENCHMARKS),
+                        help='handler to benchmark (repeatable, default: all)')
+    parser.add_argument('--mix', help='weighted event mix, e.g. s3_put=3,list_objects=1 (single handler only)')
+    parser.add_argument('--invocations', type=int, default=500)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=5, help='records or keys per event')
+    parser.add_argument('--objects', type=int, default=200, help='objects seeded into the S3 stand-in')
+    parser.add_argument('--object-size', type=int, default=4096, help='bytes per seeded object')
+    parser.add_argument('--log-level', default='INFO')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save-baseline', help='write results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to compare against')
+    parser.add_argument('--tolerance', type=float, default=10.0, help='allowed regression in percent')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args)))
+        return 0
+
+    handlers = args.handler or list(BENCHMARKS)
+    if args.mix and len(handlers) != 1:
+        parser.error('--mix requires exactly one --handler')
+
+    results = {}
+    for handler in handlers:
+        command = [sys.executable, os.path.abspath(__file__), '--worker', handler] + [
+            f"--{name.replace('_', '-')}={value}" for name, value in (
+                ('invocations', args.invocations), ('warmup', args.warmup), ('batch_size', args.batch_size),
+                ('objects', args.objects), ('object_size', args.object_size), ('log_level', args.log_level),
+                ('seed', args.seed)
+            )
+        ] + ([f"--mix={args.mix}"] if args.mix else [])
+        # Handler log output goes to stderr; discard it so that only the report is printed
+        completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True)
+        results[handler] = json.loads(completed.stdout)
+
+    print(json.dumps(results, indent=2))
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""
+Measure the S3 processor's tail latency with and without hedged GET and HEAD requests.
+
+--invocations S3 upload events, one record each, are sent from --concurrency
+threads to one warm instance, after --warmup invocations that are not measured
+and let the latency estimates settle. S3 is the SlowFirstByteS3 stand-in: GET
+and HEAD requests take --latency-ms, varied by --jitter, and --slow-percent of
+them take --slow-ms. Scenarios:
+
+    off     S3_HEDGING=false, every read waits for its only attempt
+    on      S3_HEDGING=true with --quantile and --budget, so a read slower than
+            that quantile of recent reads is sent again and the first
+            response wins
+
+For each scenario the report lists invocation latency percentiles, GET and HEAD
+requests sent per invocation, the share of extra requests and, for `on`, the
+hedger's counters and current delay per operation.
+
+    python tools/bench_hedging.py --invocations 4000 --slow-percent 2 --slow-ms 800 --budget 0.03
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from bench_handlers import BENCHMARKS, SOURCE_BUCKET, percentile
+from local_aws import LocalAWS, LocalContext, SlowFirstByteS3, load_handler
+
+SCENARIOS = ('off', 'on')
+
+
+def upload_event(key: str) -> Dict[str, Any]:
+    return {'Records': [{
+        'eventName': 'ObjectCreated:Put',
+        's3': {'bucket': {'name': SOURCE_BUCKET}, 'object': {'key': key}}
+    }]}
+
+
+def invoke(module: Any, key: str) -> float:
+    start = time.perf_counter()
+    module.lambda_handler(upload_event(key), LocalContext('s3-processor'))
+    return (time.perf_counter() - start) * 1000
+
+
+def run(scenario: str, args: argparse.Namespace) -> Dict[str, Any]:
+    benchmark = BENCHMARKS['s3-lambda']()
+    os.environ.update(benchmark.environment)
+    os.environ.update({
+        'S3_HEDGING': 'true' if scenario == 'on' else 'false',
+        'S3_HEDGE_QUANTILE': str(args.quantile),
+        'S3_HEDGE_BUDGET': str(args.budget),
+        'SKIP_UNCHANGED': 'false'
+    })
+    # hedging.py reads its settings on import; import it afresh for each scenario
+    sys.modules.pop('hedging', None)
+    local = LocalAWS()
+    benchmark.seed(local, args.objects, args.object_kib * 1024)
+    s3 = local.clients['s3'] = SlowFirstByteS3(local.clients['s3'], latency_ms=args.latency_ms, jitter=args.jitter,
+                                               slow_fraction=args.slow_percent / 100, slow_ms=args.slow_ms,
+                                               seed=args.seed)
+    module = load_handler(benchmark.example, benchmark.filename, local, f"s3_processor_hedging_{scenario}")
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    rng = random.Random(args.seed)
+    keys = [f"incoming/file-{rng.randrange(args.objects):06d}.txt" for _ in range(args.warmup + args.invocations)]
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(lambda key: invoke(module, key), keys[:args.warmup]))
+        requests_before = s3.requests
+        start = time.perf_counter()
+        latencies: List[float] = sorted(pool.map(lambda key: invoke(module, key), keys[args.warmup:]))
+        elapsed = time.perf_counter() - start
+    requests = s3.requests - requests_before
+    result = {
+        'invocations_per_second': round(args.invocations / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50), 1),
+        'p95_ms': round(percentile(latencies, 0.95), 1),
+        'p99_ms': round(percentile(latencies, 0.99), 1),
+        'p999_ms': round(percentile(latencies, 0.999), 1),
+        'max_ms': round(latencies[-1], 1),
+        'reads_per_invocation': round(requests / args.invocations, 3)
+    }
+    if scenario == 'on':
+        result['hedging'] = module.hedger.stats()
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--invocations', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8, help='invocations in flight')
+    parser.add_argument('--objects', type=int, default=500)
+    parser.add_argument('--object-kib', type=int, default=4)
+    parser.add_argument('--latency-ms', type=float, default=10, help='usual time to first byte')
+    parser.add_argument('--jitter', type=float, default=0.3, help='relative spread of the usual latency')
+    parser.add_argument('--slow-percent', type=float, default=1, help='reads that take --slow-ms')
+    parser.add_argument('--slow-ms', type=float, default=500)
+    parser.add_argument('--quantile', type=float, default=0.95, help='S3_HEDGE_QUANTILE')
+    parser.add_argument('--budget', type=float, default=0.05, help='S3_HEDGE_BUDGET')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='default: both')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    results = {}
+    # The handler prints EMF metric lines from every invocation thread; keep them out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        for scenario in args.scenario or SCENARIOS:
+            results[scenario] = run(scenario, args)
+    if 'off' in results and 'on' in results:
+        off_reads = results['off']['reads_per_invocation']
+        results['extra_requests_percent'] = round(
+            (results['on']['reads_per_invocation'] - off_reads) / off_reads * 100, 2)
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+Compare destination key layouts of the S3 processor under per-prefix write limits.
+
+--objects text files are processed as an S3 Batch Operations job (see
+bench_throttling.py) with --concurrency task threads, once per KEY_LAYOUT given
+with --layout. S3 is the ThrottledS3 stand-in: each prefix, the bucket plus
+--partition-depth directory levels, admits --write-rps PUT requests and
+--read-rps GET/HEAD requests per second and answers SlowDown beyond that. Every
+request takes --latency-ms. The adaptive limiter keeps each prefix at its rate,
+so the write rate of the job is bounded by the prefixes its outputs go to.
+
+For each layout the report lists wall time, objects per second, PUT requests
+per second, SlowDown responses and the destination prefixes written with their
+requests. Two checks follow: a default-processing invocation must find no
+pending files, as the backlog scan maps every output back to its source, and
+deleting --deletes sources must remove their outputs through the reverse mapping.
+
+    python tools/bench_layout.py --objects 4000 --write-rps 200 --layout flat --layout hashed --layout hive,hashed
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+from typing import Any, Dict, List
+
+from bench_handlers import BENCHMARKS, DESTINATION_BUCKET, SOURCE_BUCKET
+from bench_throttling import run_job
+from local_aws import LocalAWS, LocalContext, ThrottledS3, load_handler
+
+DEFAULT_LAYOUTS = ('flat', 'date', 'hashed', 'hive,hashed')
+
+
+def deletion_event(keys: List[str]) -> Dict[str, Any]:
+    return {'Records': [{
+        'eventName': 'ObjectRemoved:Delete',
+        's3': {'bucket': {'name': SOURCE_BUCKET}, 'object': {'key': key}}
+    } for key in keys]}
+
+
+def run(layout: str, args: argparse.Namespace) -> Dict[str, Any]:
+    benchmark = BENCHMARKS['s3-lambda']()
+    os.environ.update(benchmark.environment)
+    os.environ.update({
+        'KEY_LAYOUT': layout,
+        'KEY_LAYOUT_SHARDS': str(args.shards),
+        'BATCH_TASK_CONCURRENCY': str(args.concurrency),
+        'S3_CONCURRENCY_MAX': str(args.concurrency),
+        # The limiter's prefixes must reach the shard level to give each shard its own limit
+        'S3_CONCURRENCY_PREFIX_DEPTH': str(args.partition_depth),
+        'SKIP_UNCHANGED': 'false'
+    })
+    # limiter.py reads its settings on import; import it afresh for each layout
+    sys.modules.pop('limiter', None)
+    local = LocalAWS()
+    benchmark.seed(local, args.objects, args.object_kib * 1024)
+    store = local.clients['s3']
+    s3 = local.clients['s3'] = ThrottledS3(store, read_rps=args.read_rps, write_rps=args.write_rps,
+                                           depth=args.partition_depth, latency_ms=args.latency_ms)
+    module = load_handler(benchmark.example, benchmark.filename, local,
+                          f"s3_processor_layout_{layout.replace(',', '_')}")
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    keys = [f"incoming/file-{index:06d}.txt" for index in range(args.objects)]
+    store.request_counts.clear()
+    job = run_job(module, keys, args.tasks_per_invocation, args.retries)
+    puts = store.request_counts.get('PutObject', 0)
+    written = {prefix: count for prefix, count in s3.admitted.items() if prefix.startswith(DESTINATION_BUCKET)}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        drain = json.loads(module.lambda_handler({}, LocalContext('s3-processor'))['body'])
+        deleted = keys[:args.deletes]
+        for key in deleted:
+            store.delete_object(Bucket=SOURCE_BUCKET, Key=key)
+        module.lambda_handler(deletion_event(deleted), LocalContext('s3-processor'))
+    outputs = store.buckets[DESTINATION_BUCKET]
+    return {
+        **job,
+        'puts_per_second': round(puts / job['seconds'], 1),
+        'throttled': sum(s3.throttled.values()),
+        'destination_prefixes': len(written),
+        'busiest_prefixes': dict(sorted(written.items(), key=lambda item: -item[1])[:4]),
+        'pending_after_processing': drain['objects_found'],
+        'outputs_left_after_deletes': len(outputs) - (args.objects - len(deleted))
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--objects', type=int, default=3000)
+    parser.add_argument('--object-kib', type=int, default=4)
+    parser.add_argument('--layout', action='append', help=f"KEY_LAYOUT values; default: {', '.join(DEFAULT_LAYOUTS)}")
+    parser.add_argument('--shards', type=int, default=16)
+    parser.add_argument('--concurrency', type=int, default=64, help='task threads of the instance')
+    parser.add_argument('--tasks-per-invocation', type=int, default=1000)
+    parser.add_argument('--read-rps', type=float, default=2000, help='GET/HEAD/LIST requests per second per prefix')
+    parser.add_argument('--write-rps', type=float, default=200, help='other requests per second per prefix')
+    parser.add_argument('--partition-depth', type=int, default=5,
+                        help='directory levels S3 and the limiter split prefixes at')
+    parser.add_argument('--latency-ms', type=float, default=10)
+    parser.add_argument('--retries', type=int, default=10, help='rounds resending temporary failures')
+    parser.add_argument('--deletes', type=int, default=100)
+    args = parser.parse_args()
+
+    results = {layout: run(layout, args) for layout in args.layout or DEFAULT_LAYOUTS}
+    print(json.dumps(results, indent=2))
+    failed = any(result['pending_after_processing'] or result['outputs_left_after_deletes'] or result['unfinished']
+                 for result in results.values())
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
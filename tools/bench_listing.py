@@ -0,0 +1,131 @@
+"""
+Benchmark the S3 processor's listing engine against a large local bucket.
+
+The bucket is seeded with --objects keys spread over --shards sub-prefixes and
+listed through examples/s3-lambda/listing.py with every ListObjectsV2 call
+delayed by --latency-ms. Each scenario consumes the listing page by page without
+keeping it, as the streamed /objects route does, and reports wall time, pages
+requested, matches and the peak of Python allocations:
+
+    sequential   one ContinuationToken chain over the whole prefix
+    sharded      one chain per sub-prefix, listed by --parallelism threads
+    filtered     sharded, keeping only --suffix keys of at least --min-size bytes
+
+The resume check lists --page-keys matches per call through the handler's
+list_objects action, following next_cursor until it is null, and fails unless
+every key was returned exactly once.
+
+    python tools/bench_listing.py --objects 100000 --latency-ms 20 --parallelism 16
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict
+
+from bench_handlers import BENCHMARKS, SOURCE_BUCKET
+from local_aws import LocalAWS, LocalContext, load_handler
+
+PREFIX = 'archive/'
+SUFFIXES = ('.json', '.csv', '.parquet', '.txt')
+
+
+def seed(local: LocalAWS, objects: int, shards: int) -> None:
+    s3 = local.clients['s3']
+    for index in range(objects):
+        key = f"{PREFIX}{index % shards:04x}/{index:09d}{SUFFIXES[index % len(SUFFIXES)]}"
+        s3.put(SOURCE_BUCKET, key, b'x' * (index % 2048))
+
+
+def measure(listing: Any, client: Any, parallelism: int, delimiter: str = None,
+            object_filter: Any = None) -> Dict[str, Any]:
+    lister = listing.ObjectLister(client, SOURCE_BUCKET, PREFIX, object_filter, delimiter=delimiter,
+                                  parallelism=parallelism)
+    matches = 0
+    tracemalloc.start()
+    start = time.perf_counter()
+    for page in lister.iter_pages():
+        matches += len(page)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'seconds': round(elapsed, 3),
+        'pages_listed': lister.pages_listed,
+        'objects_scanned': lister.objects_scanned,
+        'matches': matches,
+        'objects_per_second': round(lister.objects_scanned / elapsed),
+        'peak_allocated_kib': round(peak / 1024, 1)
+    }
+
+
+def resume_check(module: Any, objects: int, page_keys: int, parallelism: int) -> Dict[str, Any]:
+    seen: Counter = Counter()
+    event: Dict[str, Any] = {
+        'action': 'list_objects',
+        'prefix': PREFIX,
+        'delimiter': '/',
+        'parallelism': parallelism,
+        'max_keys': page_keys
+    }
+    calls = 0
+    while True:
+        body = json.loads(module.lambda_handler(event, LocalContext('s3-processor'))['body'])
+        calls += 1
+        seen.update(obj['key'] for obj in body['objects'])
+        if not body['next_cursor']:
+            break
+        event = {'action': 'list_objects', 'cursor': body['next_cursor'], 'parallelism': parallelism,
+                 'max_keys': page_keys}
+    return {
+        'invocations': calls,
+        'distinct_keys': len(seen),
+        'duplicates': sum(count - 1 for count in seen.values()),
+        'missing': objects - len(seen),
+        'ok': len(seen) == objects and all(count == 1 for count in seen.values())
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--objects', type=int, default=100000)
+    parser.add_argument('--shards', type=int, default=64, help='sub-prefixes the keys are spread over')
+    parser.add_argument('--latency-ms', type=float, default=20, help='delay added to every ListObjectsV2 call')
+    parser.add_argument('--parallelism', type=int, default=16)
+    parser.add_argument('--suffix', default='.json')
+    parser.add_argument('--min-size', type=int, default=1024)
+    parser.add_argument('--page-keys', type=int, default=1000, help='max_keys per call in the resume check')
+    args = parser.parse_args()
+
+    benchmark = BENCHMARKS['s3-lambda']()
+    os.environ.update(benchmark.environment)
+    os.environ['LOG_LEVEL'] = 'WARNING'
+    local = LocalAWS(latency_ms=args.latency_ms)
+    seed(local, args.objects, args.shards)
+
+    module = load_handler(benchmark.example, benchmark.filename, local)
+    logging.getLogger().setLevel(logging.WARNING)
+    import listing
+
+    client = local.client('s3')
+    object_filter = listing.ObjectFilter([args.suffix], min_size=args.min_size)
+    results = {
+        'sequential': measure(listing, client, 1),
+        'sharded': measure(listing, client, args.parallelism, '/'),
+        'filtered': measure(listing, client, args.parallelism, '/', object_filter)
+    }
+    # The handler prints EMF metric lines; keep them out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        results['resume'] = resume_check(module, args.objects, args.page_keys, args.parallelism)
+    print(json.dumps(results, indent=2))
+    return 0 if results['resume']['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,170 @@
+"""
+Measure what logging costs the thread handling an invocation, written in place or by a background thread.
+
+Log lines go to a `cat` process through a pipe, as a function's stderr goes to
+the Lambda runtime, or to a file with --sink file. Scenarios:
+
+    basic         logging.basicConfig: plain text formatted and written by the
+                  calling thread, as the handlers logged before log_shipping.py
+    sync_text     LogShipper with LOG_ASYNC=false LOG_FORMAT=text
+    sync_json     LogShipper as the handlers install it: JSON lines written by
+                  the calling thread
+    async_json    LogShipper with LOG_ASYNC=true: JSON lines written by a
+                  QueueListener thread, flushed at the end of the invocation
+
+Two runs are made per scenario. The first logs --records INFO lines in
+invocations of --records-per-invocation, with --wait-ms of idle time after each
+line standing in for the AWS call a handler makes per record, and reports the
+time the calling thread spends in a logger call, the flush at the end of the
+invocation, and the invocation time. The second runs --invocations S3 events of
+--batch-size records through the S3 processor and reports the handler latency.
+
+    python tools/bench_logging.py --records 50000 --records-per-invocation 50 --wait-ms 0.2 --sink file
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, TextIO
+
+from bench_handlers import BENCHMARKS, SOURCE_BUCKET, percentile, s3_record
+from local_aws import COMMON_DIR, LocalAWS, LocalContext, load_handler
+
+sys.path.append(str(COMMON_DIR))
+from log_shipping import LogShipper  # noqa: E402
+
+SCENARIOS = ('basic', 'sync_text', 'sync_json', 'async_json')
+ENVIRONMENT = {
+    'basic': {'LOG_ASYNC': 'false', 'LOG_FORMAT': 'text'},
+    'sync_text': {'LOG_ASYNC': 'false', 'LOG_FORMAT': 'text'},
+    'sync_json': {'LOG_ASYNC': 'false', 'LOG_FORMAT': 'json'},
+    'async_json': {'LOG_ASYNC': 'true', 'LOG_FORMAT': 'json'}
+}
+
+
+@contextlib.contextmanager
+def sink(kind: str, directory: str):
+    """A text stream log lines are written to."""
+    if kind == 'file':
+        with tempfile.TemporaryFile('w', dir=directory) as file:
+            yield file
+        return
+    reader = subprocess.Popen(['cat'], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+    stream = io.TextIOWrapper(reader.stdin, encoding='utf-8', line_buffering=False)
+    try:
+        yield stream
+    finally:
+        stream.close()
+        reader.wait()
+
+
+def configure(scenario: str, stream: TextIO) -> Optional[LogShipper]:
+    """Set up the root logger for a scenario; None for `basic`, which has no shipper."""
+    if scenario == 'basic':
+        logging.basicConfig(level=logging.INFO, stream=stream, force=True)
+        return None
+    settings = ENVIRONMENT[scenario]
+    return LogShipper('bench-logging', enabled=settings['LOG_ASYNC'] == 'true', log_format=settings['LOG_FORMAT'],
+                      level='INFO').install(stream)
+
+
+def summary(values: List[float]) -> Dict[str, float]:
+    values = sorted(values)
+    return {
+        'mean': round(sum(values) / len(values), 2),
+        'p50': round(percentile(values, 0.50), 2),
+        'p99': round(percentile(values, 0.99), 2)
+    }
+
+
+def run_records(scenario: str, args: argparse.Namespace) -> Dict[str, Any]:
+    logger = logging.getLogger('s3_processor_function')
+    calls: List[float] = []
+    flushes: List[float] = []
+    invocations: List[float] = []
+    with sink(args.sink, args.dir) as stream:
+        shipper = configure(scenario, stream)
+        flush = shipper.flush if shipper else stream.flush
+        for invocation in range(args.records // args.records_per_invocation):
+            start = time.perf_counter()
+            for index in range(args.records_per_invocation):
+                key = f"incoming/file-{invocation:06d}-{index:03d}.txt"
+                before = time.perf_counter()
+                logger.info(f"Processing file: s3://{SOURCE_BUCKET}/{key}")
+                calls.append((time.perf_counter() - before) * 1e6)
+                if args.wait_ms:
+                    time.sleep(args.wait_ms / 1000)
+            before = time.perf_counter()
+            flush()
+            flushes.append((time.perf_counter() - before) * 1e6)
+            invocations.append((time.perf_counter() - start) * 1000)
+        if shipper:
+            shipper.stop()
+    return {
+        'logger_call_us': summary(calls),
+        'flush_us': summary(flushes),
+        'invocation_ms': summary(invocations)
+    }
+
+
+def run_handler(scenario: str, args: argparse.Namespace) -> Dict[str, Any]:
+    benchmark = BENCHMARKS['s3-lambda']()
+    os.environ.update(benchmark.environment)
+    os.environ.update(ENVIRONMENT[scenario])
+    os.environ['LOG_LEVEL'] = 'INFO'
+    # log_shipping.py reads its settings on import; import it afresh for each scenario
+    sys.modules.pop('log_shipping', None)
+    local = LocalAWS()
+    benchmark.seed(local, args.objects, 1024)
+    latencies: List[float] = []
+    with sink(args.sink, args.dir) as stream:
+        # The handler's log handler keeps the stream that is stderr when it is imported
+        with contextlib.redirect_stderr(stream):
+            module = load_handler(benchmark.example, benchmark.filename, local, f"s3_processor_logging_{scenario}")
+        if scenario == 'basic':
+            module.log_shipper.stop()
+            configure(scenario, stream)
+        with contextlib.redirect_stdout(io.StringIO()) as captured:
+            for invocation in range(args.invocations):
+                event = {'Records': [
+                    s3_record('ObjectCreated:Put', SOURCE_BUCKET,
+                              f"incoming/file-{(invocation * args.batch_size + index) % args.objects:06d}.txt")
+                    for index in range(args.batch_size)
+                ]}
+                start = time.perf_counter()
+                module.lambda_handler(event, LocalContext('s3-lambda'))
+                latencies.append((time.perf_counter() - start) * 1000)
+                captured.seek(0)
+                captured.truncate()
+        module.log_shipper.stop()
+    return {'handler_ms': summary(latencies[len(latencies) // 10:])}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=20000)
+    parser.add_argument('--records-per-invocation', type=int, default=20)
+    parser.add_argument('--wait-ms', type=float, default=0.1, help='idle time after each logged record')
+    parser.add_argument('--invocations', type=int, default=300, help='S3 processor invocations')
+    parser.add_argument('--batch-size', type=int, default=10, help='records per S3 event')
+    parser.add_argument('--objects', type=int, default=200)
+    parser.add_argument('--sink', choices=('pipe', 'file'), default='pipe')
+    parser.add_argument('--dir', default=tempfile.gettempdir(), help='where --sink file writes')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='default: all')
+    args = parser.parse_args()
+
+    results = {}
+    for scenario in args.scenario or SCENARIOS:
+        results[scenario] = {**run_records(scenario, args), **run_handler(scenario, args)}
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
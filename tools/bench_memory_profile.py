@@ -0,0 +1,133 @@
+"""
+Measure the S3 processor with the memory profile off and on, and check that it finds a leak.
+
+--invocations S3 events of --batch-size records go to one warm instance of the
+S3 processor. With --leak-kib, each processed record also appends that many
+KiB to a list kept across invocations, as an unbounded module-level cache does.
+Scenarios:
+
+    off     MEMORY_PROFILE_ENABLED=false: the handler is not wrapped and
+            nothing is traced
+    on      MEMORY_PROFILE_ENABLED=true with a snapshot every --interval
+            invocations
+
+For each scenario the report lists handler latency after --warmup invocations
+and whether tracemalloc was tracing; for `on`, also the memory metrics of the
+last snapshot, the allocation sites it reports as growing, and whether the
+leaking line is among them. The tool exits 1 if the leak was not found or if
+the `off` scenario traced anything.
+
+    python tools/bench_memory_profile.py --invocations 500 --leak-kib 1 --growth-snapshots 10
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List
+
+from bench_handlers import BENCHMARKS, SOURCE_BUCKET, percentile, s3_record
+from local_aws import LocalAWS, LocalContext, load_handler
+
+SCENARIOS = ('off', 'on')
+# Kept across invocations, like a module-level cache that is never trimmed
+leaked: List[bytes] = []
+
+
+def leaking(process, leak_bytes: int):
+    def process_and_leak(*args, **kwargs):
+        leaked.append(bytes(leak_bytes))
+        return process(*args, **kwargs)
+
+    return process_and_leak
+
+
+# Line of the allocation the `on` scenario should report as growing
+LEAK_SITE = f"{os.path.abspath(__file__)}:{leaking.__code__.co_firstlineno + 2}"
+
+
+def run(scenario: str, args: argparse.Namespace) -> Dict[str, Any]:
+    benchmark = BENCHMARKS['s3-lambda']()
+    os.environ.update(benchmark.environment)
+    os.environ.update({
+        'MEMORY_PROFILE_ENABLED': 'true' if scenario == 'on' else 'false',
+        'MEMORY_PROFILE_INTERVAL': str(args.interval),
+        'MEMORY_PROFILE_GROWTH_SNAPSHOTS': str(args.growth_snapshots),
+        'LOG_LEVEL': 'ERROR'
+    })
+    # memory_profile.py reads its settings on import; import it afresh for each scenario
+    sys.modules.pop('memory_profile', None)
+    leaked.clear()
+    local = LocalAWS()
+    benchmark.seed(local, args.objects, 1024)
+    with contextlib.redirect_stderr(io.StringIO()):
+        module = load_handler(benchmark.example, benchmark.filename, local, f"s3_processor_memory_{scenario}")
+    logging.getLogger().setLevel(logging.CRITICAL)
+    if args.leak_kib:
+        module.process_uploaded_file = leaking(module.process_uploaded_file, int(args.leak_kib * 1024))
+
+    latencies: List[float] = []
+    document: Dict[str, Any] = {}
+    for invocation in range(args.invocations):
+        event = {'Records': [
+            s3_record('ObjectCreated:Put', SOURCE_BUCKET,
+                      f"incoming/file-{(invocation * args.batch_size + index) % args.objects:06d}.txt")
+            for index in range(args.batch_size)
+        ]}
+        output = io.StringIO()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(output):
+            module.lambda_handler(event, LocalContext('s3-lambda'))
+        latencies.append((time.perf_counter() - start) * 1000)
+        for line in output.getvalue().splitlines():
+            if '"MemoryTracedKiB"' in line:
+                emitted = json.loads(line)
+                if 'MemoryGrowingSites' in emitted or not document:
+                    document = emitted
+
+    tracing = tracemalloc.is_tracing()
+    tracemalloc.stop()
+    module.log_shipper.stop()
+    measured = sorted(latencies[args.warmup:])
+    result: Dict[str, Any] = {
+        'handler_ms': {
+            'mean': round(sum(measured) / len(measured), 3),
+            'p50': round(percentile(measured, 0.50), 3),
+            'p99': round(percentile(measured, 0.99), 3)
+        },
+        'tracing': tracing
+    }
+    if scenario == 'on':
+        result['last_metrics'] = {name: value for name, value in document.items()
+                                  if name.startswith('Memory') or name == 'Invocation'}
+        result['growing_sites'] = document.get('GrowingAllocators', [])
+        result['leak_found'] = any(site['site'] == LEAK_SITE for site in result['growing_sites'])
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--invocations', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=10, help='records per S3 event')
+    parser.add_argument('--objects', type=int, default=200)
+    parser.add_argument('--leak-kib', type=float, default=4, help='retained per processed record; 0 for none')
+    parser.add_argument('--interval', type=int, default=10, help='MEMORY_PROFILE_INTERVAL')
+    parser.add_argument('--growth-snapshots', type=int, default=5, help='MEMORY_PROFILE_GROWTH_SNAPSHOTS')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='default: both')
+    args = parser.parse_args()
+
+    results = {}
+    for scenario in args.scenario or SCENARIOS:
+        results[scenario] = run(scenario, args)
+    print(json.dumps(results, indent=2))
+    missed = args.leak_kib and results.get('on', {}).get('leak_found') is False
+    return 1 if results.get('off', {}).get('tracing') or missed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
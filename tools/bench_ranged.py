@@ -0,0 +1,197 @@
+"""
+Benchmark ranged reads and partial-object queries of the S3 processor.
+
+Objects are generated on read by the local S3 stand-in, so multi-GB objects cost
+no memory, and every GetObject body is throttled to --stream-mib per second to
+emulate the per-connection throughput limit. Scenarios:
+
+    full_get       one GetObject of the --object-gb object, read in 1 MiB chunks
+    ranged         the same object as --part-mb parts over --concurrency connections,
+                   reassembled in order (examples/s3-lambda/ranged.py)
+    ranged_tmp     the same parts written in place into a preallocated, memory-mapped
+                   file under --tmp-dir
+    slow_consumer  ordered parts of the first 256 MiB consumed at --consumer-mib per
+                   second; the peak of buffered parts stays within --buffer-mb
+    query_local    a filter and projection over the --query-mb CSV object evaluated in
+                   the function from ranged parts, as when S3 Select is unavailable
+    query_select   the same query answered by a select-capable stand-in; only the
+                   matching fields are transferred
+    query_limit    the first 10 matching records, evaluated locally
+    peek           the first 4 KiB with one ranged GET
+
+Each scenario reports wall time, throughput over the bytes that reached the
+function and, for queries, the records returned. --sweep instead reports ranged
+throughput for each combination of part size and concurrency.
+
+    python tools/bench_ranged.py --object-gb 2 --query-mb 256 --stream-mib 80 --concurrency 8
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, Iterator
+
+from bench_handlers import BENCHMARKS, SOURCE_BUCKET
+from local_aws import LocalAWS, SyntheticBody, load_handler
+
+BLOB_KEY = 'large/blob.bin'
+CSV_KEY = 'large/orders.csv'
+CSV_HEADER = b'order_id,customer,status,total,region,notes\n'
+CSV_ROWS = b''.join(
+    b'%d,customer-%04d,%s,%d.%02d,%s,lorem ipsum dolor sit amet\n'
+    % (index, index % 977, (b'paid', b'pending', b'refunded')[index % 3], index % 500, index % 100,
+       (b'eu', b'us', b'ap')[index % 7 % 3])
+    for index in range(1000)
+)
+QUERY = {'columns': ['order_id', 'total'], 'where': [['status', '=', 'refunded'], ['total', '>', 400]]}
+
+
+def select_stand_in(query_module: Any) -> Callable[[Any, Dict[str, Any]], Iterator[Dict[str, Any]]]:
+    """Server-side S3 Select for the stand-in, evaluating the request with the same code as the local fallback."""
+    def select(body: Any, request: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        query = query_module.Query.from_params(QUERY, CSV_KEY)
+        chunks = (body[offset:offset + 1024 * 1024] for offset in range(0, len(body), 1024 * 1024))
+        returned = 0
+        for record in query_module._evaluate(chunks, query):
+            payload = (json.dumps(record) + '\n').encode('utf-8')
+            returned += len(payload)
+            yield {'Records': {'Payload': payload}}
+        yield {'Stats': {'Details': {'BytesScanned': len(body), 'BytesProcessed': len(body), 'BytesReturned': returned}}}
+        yield {'End': {}}
+    return select
+
+
+def timed(local: LocalAWS, run: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    s3 = local.clients['s3']
+    sent = s3.bytes_sent
+    requests = sum(s3.request_counts.values())
+    start = time.perf_counter()
+    result = run()
+    elapsed = time.perf_counter() - start
+    transferred = result.pop('bytes_transferred', s3.bytes_sent - sent)
+    return {
+        'seconds': round(elapsed, 3),
+        'bytes_transferred': transferred,
+        'mib_per_second': round(transferred / elapsed / 1024 / 1024, 1),
+        'requests': sum(s3.request_counts.values()) - requests,
+        **result
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--object-gb', type=float, default=2)
+    parser.add_argument('--query-mb', type=float, default=256)
+    parser.add_argument('--stream-mib', type=float, default=80, help='per-connection throughput; 0 is unthrottled')
+    parser.add_argument('--latency-ms', type=float, default=10, help='delay added to every S3 call')
+    parser.add_argument('--part-mb', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--buffer-mb', type=int, default=64, help='fetched parts held ahead of the consumer')
+    parser.add_argument('--consumer-mib', type=float, default=40, help='consumer speed in the slow_consumer scenario')
+    parser.add_argument('--tmp-dir', default=tempfile.gettempdir())
+    parser.add_argument('--sweep', action='store_true', help='ranged throughput over part sizes and concurrency')
+    parser.add_argument('--scenario', action='append', help='run only these scenarios')
+    args = parser.parse_args()
+
+    benchmark = BENCHMARKS['s3-lambda']()
+    os.environ.update(benchmark.environment)
+    os.environ['LOG_LEVEL'] = 'WARNING'
+    local = LocalAWS(latency_ms=args.latency_ms, stream_mib_per_second=args.stream_mib)
+    benchmark.seed(local, 0, 0)
+    s3 = local.clients['s3']
+    s3.put(SOURCE_BUCKET, BLOB_KEY, SyntheticBody(int(args.object_gb * 1024 ** 3), os.urandom(1024 * 1024 + 7)))
+    s3.put(SOURCE_BUCKET, CSV_KEY, SyntheticBody(int(args.query_mb * 1024 ** 2), CSV_ROWS, CSV_HEADER), 'text/csv')
+
+    load_handler(benchmark.example, benchmark.filename, local)
+    logging.getLogger().setLevel(logging.WARNING)
+    import query
+    import ranged
+
+    client = local.client('s3')
+    blob_size = len(s3.buckets[SOURCE_BUCKET][BLOB_KEY].body)
+    csv_size = len(s3.buckets[SOURCE_BUCKET][CSV_KEY].body)
+    part_size = args.part_mb * 1024 * 1024
+
+    def full_get() -> Dict[str, Any]:
+        body = client.get_object(Bucket=SOURCE_BUCKET, Key=BLOB_KEY)['Body']
+        return {'bytes_read': sum(len(chunk) for chunk in body.iter_chunks(1024 * 1024))}
+
+    downloader = ranged.RangedDownloader(client, part_size, args.concurrency, args.buffer_mb * 1024 * 1024)
+
+    def ranged_get() -> Dict[str, Any]:
+        stats = ranged.DownloadStats()
+        read = sum(len(part) for part in downloader.iter_chunks(SOURCE_BUCKET, BLOB_KEY, blob_size, stats=stats))
+        return {'bytes_read': read, 'peak_buffered_bytes': stats.peak_buffered_bytes}
+
+    def ranged_tmp() -> Dict[str, Any]:
+        path = os.path.join(args.tmp_dir, 'bench-ranged.bin')
+        try:
+            return {'bytes_written': downloader.download_to_file(SOURCE_BUCKET, BLOB_KEY, path, blob_size)}
+        finally:
+            os.unlink(path)
+
+    def slow_consumer() -> Dict[str, Any]:
+        stats = ranged.DownloadStats()
+        read = 0
+        for part in downloader.iter_chunks(SOURCE_BUCKET, BLOB_KEY, blob_size, end=256 * 1024 * 1024, stats=stats):
+            read += len(part)
+            time.sleep(len(part) / (args.consumer_mib * 1024 * 1024))
+        return {'bytes_read': read, 'peak_buffered_bytes': stats.peak_buffered_bytes,
+                'buffer_limit_bytes': downloader.window * part_size}
+
+    def run_query(mode: str, params: Dict[str, Any]) -> Callable[[], Dict[str, Any]]:
+        def run() -> Dict[str, Any]:
+            result = query.run_query(client, SOURCE_BUCKET, CSV_KEY, query.Query.from_params(params, CSV_KEY),
+                                     csv_size, mode, part_size, args.concurrency)
+            records = sum(1 for _ in result)
+            return {'records': records, 'engine': result.engine, 'bytes_transferred': result.bytes_transferred}
+        return run
+
+    def peek() -> Dict[str, Any]:
+        return {'bytes_read': len(ranged.get_range(client, SOURCE_BUCKET, CSV_KEY, 0, 4095))}
+
+    def query_select() -> Dict[str, Any]:
+        s3.select = select_stand_in(query)
+        try:
+            return run_query('select', QUERY)()
+        finally:
+            s3.select = None
+
+    if args.sweep:
+        sweep = []
+        for part_mb in (4, 8, 16, 32):
+            for concurrency in (1, 2, 4, 8, 16):
+                candidate = ranged.RangedDownloader(client, part_mb * 1024 * 1024, concurrency,
+                                                    part_mb * 1024 * 1024 * concurrency)
+                stats = ranged.DownloadStats()
+                for _ in candidate.iter_chunks(SOURCE_BUCKET, BLOB_KEY, blob_size, stats=stats):
+                    pass
+                candidate.close()
+                sweep.append({'part_mb': part_mb, 'concurrency': concurrency, **stats.to_dict()})
+        print(json.dumps(sweep, indent=2))
+        return 0
+
+    scenarios = {
+        'full_get': full_get,
+        'ranged': ranged_get,
+        'ranged_tmp': ranged_tmp,
+        'slow_consumer': slow_consumer,
+        'query_local': run_query('local', QUERY),
+        'query_select': query_select,
+        'query_limit': run_query('local', dict(QUERY, limit=10)),
+        'peek': peek
+    }
+    results = {
+        'object_bytes': blob_size,
+        'query_object_bytes': csv_size,
+        **{name: timed(local, run) for name, run in scenarios.items() if not args.scenario or name in args.scenario}
+    }
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""
+Re-sync a processed dataset through the S3 processor, with and without the unchanged-input skip.
+
+--objects text files are seeded under the processing prefix and processed
+once with process_batch. Every file is then uploaded again, with
+--changed-percent of them holding new content, as a bulk re-sync job does, and
+processed again. Every S3 call is delayed by --latency-ms and object bodies are
+read at --stream-mib per connection. Scenarios:
+
+    skip          SKIP_UNCHANGED=true: outputs holding the fingerprint of the same
+                  input are left alone
+    reprocess     SKIP_UNCHANGED=false, every file is read, transformed and written
+
+For each pass the report lists wall time, requests by operation and bytes read
+from the source. After the re-sync, a default-processing invocation reports the
+files the backlog scan still finds pending, and the outputs older than their
+upload it checked and found holding the same input. The `duplicates` pass delivers
+every changed file to two concurrent invocations, as a duplicated event would,
+and reports errors, files skipped because the other invocation had written or
+won the conditional write, and how many outputs hold the latest content.
+
+    python tools/bench_resync.py --objects 1000 --changed-percent 5 --latency-ms 15
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from typing import Any, Dict, List
+
+from bench_handlers import BENCHMARKS, DESTINATION_BUCKET, SOURCE_BUCKET
+from local_aws import LocalAWS, LocalContext, load_handler
+
+SCENARIOS = ('skip', 'reprocess')
+BATCH_SIZE = 100
+
+
+def upload(local: LocalAWS, keys: List[str], version: int, size: int) -> None:
+    for key in keys:
+        body = (f"{key} version {version} ".encode('utf-8') * (size // 32 + 1))[:size]
+        local.clients['s3'].put(SOURCE_BUCKET, key, body, 'text/plain')
+
+
+def process(module: Any, keys: List[str], local: LocalAWS) -> Dict[str, Any]:
+    s3 = local.clients['s3']
+    s3.request_counts.clear()
+    s3.bytes_sent = 0
+    skipped = 0
+    errors = 0
+    start = time.perf_counter()
+    for offset in range(0, len(keys), BATCH_SIZE):
+        event = {'action': 'process_batch', 'file_keys': keys[offset:offset + BATCH_SIZE]}
+        body = json.loads(module.lambda_handler(event, LocalContext('s3-processor'))['body'])
+        skipped += sum(1 for result in body['processed_files'] if result['skipped'])
+        errors += body['errors']
+    return {
+        'seconds': round(time.perf_counter() - start, 2),
+        'skipped': skipped,
+        'errors': errors,
+        'bytes_read': s3.bytes_sent,
+        'requests': dict(s3.request_counts)
+    }
+
+
+def duplicates(module: Any, keys: List[str], local: LocalAWS) -> Dict[str, Any]:
+    results: List[Dict[str, Any]] = []
+
+    def deliver() -> None:
+        results.append(process(module, keys, local))
+
+    threads = [threading.Thread(target=deliver) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {
+        'errors': sum(result['errors'] for result in results),
+        'skipped': sum(result['skipped'] for result in results),
+        'processed': 2 * len(keys) - sum(result['skipped'] for result in results)
+    }
+
+
+def run(scenario: str, args: argparse.Namespace) -> Dict[str, Any]:
+    benchmark = BENCHMARKS['s3-lambda']()
+    os.environ.update(benchmark.environment)
+    os.environ['SKIP_UNCHANGED'] = 'true' if scenario == 'skip' else 'false'
+    local = LocalAWS(latency_ms=args.latency_ms, stream_mib_per_second=args.stream_mib)
+    benchmark.seed(local, 0, 0)
+    keys = [f"incoming/{index:06d}.txt" for index in range(args.objects)]
+    upload(local, keys, 0, args.object_kib * 1024)
+    module = load_handler(benchmark.example, benchmark.filename, local, f"s3_processor_resync_{scenario}")
+    logging.getLogger().setLevel(logging.ERROR)
+
+    results: Dict[str, Any] = {'initial': process(module, keys, local)}
+    changed = random.Random(args.seed).sample(keys, int(len(keys) * args.changed_percent / 100))
+    time.sleep(0.01)
+    upload(local, keys, 0, args.object_kib * 1024)
+    upload(local, changed, 1, args.object_kib * 1024)
+    results['resync'] = process(module, keys, local)
+    drain = json.loads(module.lambda_handler({}, LocalContext('s3-processor'))['body'])
+    results['pending_after_resync'] = drain['objects_found']
+    results['backlog_outputs_checked'] = drain['backlog']['scan']['outputs_checked']
+    results['backlog_unchanged_inputs'] = drain['backlog']['scan']['unchanged_inputs']
+
+    upload(local, changed, 2, args.object_kib * 1024)
+    results['duplicates'] = duplicates(module, changed, local)
+    outputs = local.clients['s3'].buckets[DESTINATION_BUCKET]
+    results['outputs_current'] = sum(
+        1 for key in changed
+        if bytes(outputs[key.replace('incoming/', 'processed/')].body).startswith(f"{key} version 2".upper().encode())
+    )
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--objects', type=int, default=1000)
+    parser.add_argument('--object-kib', type=int, default=1024)
+    parser.add_argument('--changed-percent', type=float, default=5)
+    parser.add_argument('--latency-ms', type=float, default=5, help='delay added to every S3 call')
+    parser.add_argument('--stream-mib', type=float, default=80, help='per-connection throughput; 0 is unthrottled')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='default: both')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    # The handler prints EMF metric lines; keep them out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = {scenario: run(scenario, args) for scenario in args.scenario or SCENARIOS}
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""
+Hammer the shared cache tier from concurrent processes in a local directory.
+
+--workers processes stand in for concurrent instances sharing an EFS mount.
+They start together and each makes --reads get_or_compute calls over --keys
+keys, chosen with a Zipf-like skew so hot keys are contended. A computation
+sleeps --compute-ms and produces content derived from the key, and every read
+is checked against it. --max-mb below the working set makes eviction sweeps
+run while other processes read and write. Scenarios:
+
+    private    every worker has its own directory, as instances without a
+               shared mount each compute every key
+    shared     all workers use one directory
+
+The report lists wall time, computations (ideally one per key while nothing
+is evicted), lease waits, evictions, corrupt reads (must be 0) and what is
+left in the directory: its size, and temporary files or leases that were not
+cleaned up.
+
+    python tools/bench_shared_cache.py --workers 16 --keys 200 --reads 500 --max-mb 32
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict
+
+from local_aws import COMMON_DIR
+
+sys.path.append(str(COMMON_DIR))
+from shared_cache import TEMPORARY_PREFIX, SharedCache  # noqa: E402
+
+SCENARIOS = ('private', 'shared')
+
+
+def expected_content(key: str, size: int) -> bytes:
+    block = hashlib.sha256(key.encode('utf-8')).digest()
+    return (block * (size // len(block) + 1))[:size]
+
+
+def key_size(index: int, size_kb: int) -> int:
+    # 1 to 4 times --size-kb, so blobs of different sizes compete for space
+    return size_kb * 1024 * (1 + index % 4)
+
+
+def run_worker(args: argparse.Namespace) -> Dict[str, Any]:
+    cache = SharedCache(args.directory, max_bytes=int(args.max_mb * 1024 * 1024), sweep_seconds=args.sweep_seconds,
+                        lease_seconds=args.lease_seconds)
+    generator = random.Random(args.seed)
+    weights = [1 / (index + 1) for index in range(args.keys)]
+    corrupt = 0
+
+    def compute(index: int) -> Any:
+        def run(_stale: Any) -> Any:
+            time.sleep(args.compute_ms / 1000)
+            return expected_content(f"artifact-{index}", key_size(index, args.size_kb)), {'index': index}
+        return run
+
+    time.sleep(max(args.start_at - time.time(), 0))
+    start = time.perf_counter()
+    for index in generator.choices(range(args.keys), weights, k=args.reads):
+        key = f"artifact-{index}"
+        entry = cache.get_or_compute(key, compute(index))
+        if entry.data != expected_content(key, key_size(index, args.size_kb)) or entry.meta.get('index') != index:
+            corrupt += 1
+    return {'seconds': time.perf_counter() - start, 'corrupt': corrupt, **cache.stats()}
+
+
+def directory_report(directory: str) -> Dict[str, int]:
+    report = {'bytes': 0, 'blobs': 0, 'temporary_files': 0, 'leases': 0}
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.startswith(TEMPORARY_PREFIX):
+                report['temporary_files'] += 1
+            elif os.path.basename(root) == 'leases':
+                report['leases'] += 1
+            elif os.sep + 'blobs' + os.sep in os.path.join(root, ''):
+                report['blobs'] += 1
+                report['bytes'] += os.path.getsize(os.path.join(root, name))
+    return report
+
+
+def run(scenario: str, args: argparse.Namespace) -> Dict[str, Any]:
+    root = tempfile.mkdtemp(prefix='bench-shared-cache-')
+    start_at = time.time() + 1 + args.workers * 0.05
+    workers = []
+    for number in range(args.workers):
+        directory = os.path.join(root, str(number) if scenario == 'private' else 'shared')
+        command = [sys.executable, __file__, '--worker', '--directory', directory, '--start-at', str(start_at),
+                   '--seed', str(number)] + [f"--{name.replace('_', '-')}={getattr(args, name)}" for name in
+                                             ('keys', 'reads', 'size_kb', 'compute_ms', 'max_mb', 'sweep_seconds',
+                                              'lease_seconds')]
+        workers.append(subprocess.Popen(command, stdout=subprocess.PIPE, text=True))
+    results = []
+    for worker in workers:
+        output = worker.communicate()[0]
+        if worker.returncode:
+            raise SystemExit(f"worker exited with {worker.returncode}")
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    directories = [os.path.join(root, name) for name in os.listdir(root)]
+    remaining = [directory_report(directory) for directory in directories]
+    shutil.rmtree(root, ignore_errors=True)
+    totals = {name: sum(result[name] for result in results)
+              for name in ('hits', 'computes', 'waits', 'writes', 'evictions', 'corrupt')}
+    return {
+        'seconds': round(max(result['seconds'] for result in results), 2),
+        **totals,
+        'computes_per_key': round(totals['computes'] / args.keys, 2),
+        'largest_directory_mb': round(max(report['bytes'] for report in remaining) / 1024 / 1024, 1),
+        'temporary_files_left': sum(report['temporary_files'] for report in remaining),
+        'leases_left': sum(report['leases'] for report in remaining)
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--keys', type=int, default=100)
+    parser.add_argument('--reads', type=int, default=300, help='get_or_compute calls per worker')
+    parser.add_argument('--size-kb', type=int, default=64)
+    parser.add_argument('--compute-ms', type=float, default=50)
+    parser.add_argument('--max-mb', type=float, default=1024, help='below the working set to exercise eviction')
+    parser.add_argument('--sweep-seconds', type=float, default=0.2)
+    parser.add_argument('--lease-seconds', type=float, default=5)
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='default: both')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--directory', help=argparse.SUPPRESS)
+    parser.add_argument('--start-at', type=float, default=0, help=argparse.SUPPRESS)
+    parser.add_argument('--seed', type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args)))
+        return 0
+
+    results: Dict[str, Any] = {'working_set_mb': round(sum(key_size(index, args.size_kb)
+                                                           for index in range(args.keys)) / 1024 / 1024, 1)}
+    for scenario in args.scenario or SCENARIOS:
+        results[scenario] = run(scenario, args)
+    print(json.dumps(results, indent=2))
+    return 1 if any(results[name]['corrupt'] for name in SCENARIOS if name in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
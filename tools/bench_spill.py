@@ -0,0 +1,123 @@
+"""
+Process an oversized object in memory and from ephemeral storage.
+
+A text object of --object-mb is processed by the S3 processor (process_batch on
+one key) at --memory-mb, once with the spill threshold out of reach so the
+whole object and its uppercased copy are held in memory, and once with the
+threshold derived from the memory size so it is spilled to /tmp and
+transformed through a memory map. Each scenario runs in a fresh worker
+process against the local S3 stand-in, which discards written content so only
+the handler's memory is measured.
+
+The report lists duration, peak RSS, the peak of anonymous (heap) memory,
+sampled from /proc every 10 ms, and the peak size of the scratch directory
+used as /tmp. Pages of the mapped file count towards RSS as page cache, which
+the kernel can drop under memory pressure; anonymous memory cannot be dropped.
+
+    python tools/bench_spill.py --object-mb 1024 --memory-mb 1024
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict
+
+from bench_handlers import BENCHMARKS, SOURCE_BUCKET
+from local_aws import LocalAWS, LocalContext, SyntheticBody, load_handler
+
+OBJECT_KEY = 'incoming/large/report.txt'
+# Multi-byte characters land on chunk and part boundaries somewhere in the object
+TEXT_BLOCK = 'naïve café entry %d: lorem ipsum dolor sit amet, consectetur adipiscing elit\n'
+SCENARIOS = ('memory', 'spill')
+
+
+def anonymous_kib() -> int:
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('RssAnon:'):
+                return int(line.split()[1])
+    return 0
+
+
+def run_worker(args: argparse.Namespace) -> Dict[str, Any]:
+    benchmark = BENCHMARKS['s3-lambda']()
+    os.environ.update(benchmark.environment)
+    os.environ['LOG_LEVEL'] = 'WARNING'
+    scratch = tempfile.mkdtemp(prefix='bench-spill-')
+    os.environ['SPILL_DIR'] = scratch
+    # A threshold no object reaches keeps processing in memory
+    os.environ['SPILL_THRESHOLD_MB'] = str(1024 * 1024) if args.worker == 'memory' else '0'
+
+    local = LocalAWS(discard_writes=True)
+    benchmark.seed(local, 0, 0)
+    block = ''.join(TEXT_BLOCK % index for index in range(997)).encode('utf-8')
+    local.clients['s3'].put(SOURCE_BUCKET, OBJECT_KEY, SyntheticBody(int(args.object_mb * 1024 * 1024), block),
+                            'text/plain')
+    module = load_handler(benchmark.example, benchmark.filename, local)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    peaks = {'anonymous_kib': anonymous_kib(), 'tmp_bytes': 0}
+    done = threading.Event()
+
+    def sample() -> None:
+        while not done.wait(0.01):
+            peaks['anonymous_kib'] = max(peaks['anonymous_kib'], anonymous_kib())
+            used = sum(entry.stat().st_blocks * 512 for entry in os.scandir(scratch))
+            peaks['tmp_bytes'] = max(peaks['tmp_bytes'], used)
+
+    baseline_anonymous = anonymous_kib()
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    response = module.lambda_handler({'action': 'process_batch', 'file_keys': [OBJECT_KEY]},
+                                     LocalContext('s3-processor', memory_limit_in_mb=args.memory_mb))
+    elapsed = time.perf_counter() - start
+    done.set()
+    sampler.join()
+    shutil.rmtree(scratch, ignore_errors=True)
+
+    body = json.loads(response['body'])
+    written = local.clients['s3'].buckets[benchmark.environment['DESTINATION_BUCKET']]
+    return {
+        'storage': body['processed_files'][0]['storage'] if body['processed_files'] else None,
+        'errors': body['error_details'],
+        'seconds': round(elapsed, 2),
+        'output_bytes': sum(len(obj.body) for obj in written.values()),
+        'peak_rss_mib': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'peak_anonymous_mib': round((peaks['anonymous_kib'] - baseline_anonymous) / 1024, 1),
+        'peak_tmp_mib': round(peaks['tmp_bytes'] / 1024 / 1024, 1),
+        'requests': dict(local.clients['s3'].request_counts)
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--object-mb', type=float, default=1024)
+    parser.add_argument('--memory-mb', type=int, default=1024, help='memory_limit_in_mb of the invocation')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='default: both')
+    parser.add_argument('--worker', choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args)))
+        return 0
+
+    results: Dict[str, Any] = {'object_mb': args.object_mb, 'memory_mb': args.memory_mb}
+    for scenario in args.scenario or SCENARIOS:
+        command = [sys.executable, __file__, '--worker', scenario, '--object-mb', str(args.object_mb),
+                   '--memory-mb', str(args.memory_mb)]
+        output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True).stdout
+        results[scenario] = json.loads(output.strip().splitlines()[-1])
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
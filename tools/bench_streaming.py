@@ -0,0 +1,104 @@
+"""
+Compare streamed and buffered function URL responses of the S3 processor.
+
+The handler runs under the streaming runtime loop from examples/common/streaming.py
+against a local Runtime API, once with STREAM_HANDLER set (chunks are sent as
+they are written) and once without it (the stream is collected and returned as
+one buffered response, as in the standard runtime). Each scenario reports the
+median time to first body byte, total duration, response size and the peak of
+Python allocations during the invocation.
+
+    python tools/bench_streaming.py --objects 20000 --object-mb 32
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import tracemalloc
+from typing import Any, Dict
+
+from bench_handlers import BENCHMARKS, SOURCE_BUCKET
+from local_aws import LocalAWS, LocalRuntimeAPI, load_handler
+
+DOWNLOAD_KEY = 'large/blob.bin'
+
+
+def function_url_event(path: str, params: Dict[str, str]) -> Dict[str, Any]:
+    query = '&'.join(f"{name}={value}" for name, value in params.items())
+    return {
+        'version': '2.0',
+        'rawPath': path,
+        'rawQueryString': query,
+        'queryStringParameters': params,
+        'headers': {},
+        'requestContext': {'http': {'method': 'GET', 'path': path}, 'requestId': 'local'},
+        'isBase64Encoded': False
+    }
+
+
+def measure(module: Any, streaming: Any, event: Dict[str, Any], stream: bool, repeat: int) -> Dict[str, Any]:
+    ttfb, durations, peaks = [], [], []
+    invocation = None
+    with LocalRuntimeAPI() as runtime:
+        for _ in range(repeat):
+            invocation = runtime.enqueue(event)
+            tracemalloc.start()
+            streaming.run(module.lambda_handler, module.stream_handler if stream else None,
+                          runtime.address, invocations=1)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            invocation.done.wait(30)
+            if invocation.error:
+                break
+            ttfb.append(invocation.ttfb_ms)
+            durations.append(invocation.duration_ms)
+    return {
+        'mode': invocation.mode,
+        'status_code': invocation.status_code,
+        'error': invocation.error,
+        'response_bytes': invocation.body_bytes,
+        'chunks': invocation.chunks,
+        'ttfb_ms': round(statistics.median(ttfb), 3) if ttfb else None,
+        'duration_ms': round(statistics.median(durations), 3) if durations else None,
+        'peak_allocated_kib': round(statistics.median(peaks) / 1024, 1)
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--objects', type=int, default=20000, help='keys returned by the listing scenario')
+    parser.add_argument('--object-mb', type=float, default=32, help='size of the object in the download scenario')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    benchmark = BENCHMARKS['s3-lambda']()
+    os.environ.update(benchmark.environment)
+    os.environ['LOG_LEVEL'] = 'WARNING'
+    local = LocalAWS()
+    for index in range(args.objects):
+        local.clients['s3'].put(SOURCE_BUCKET, f"listing/{index:08d}.txt", b'x' * 128)
+    local.clients['s3'].put(SOURCE_BUCKET, DOWNLOAD_KEY, os.urandom(int(args.object_mb * 1024 * 1024)))
+
+    module = load_handler(benchmark.example, benchmark.filename, local)
+    logging.getLogger().setLevel(logging.WARNING)
+    import streaming
+
+    scenarios = {
+        'listing': function_url_event('/objects', {'bucket': SOURCE_BUCKET, 'prefix': 'listing/'}),
+        'download': function_url_event('/download', {'bucket': SOURCE_BUCKET, 'key': DOWNLOAD_KEY})
+    }
+    results = {
+        name: {
+            'buffered': measure(module, streaming, event, False, args.repeat),
+            'streaming': measure(module, streaming, event, True, args.repeat)
+        }
+        for name, event in scenarios.items()
+    }
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""
+Simulate the S3 processor against per-prefix S3 throttling, with fixed and adaptive concurrency.
+
+--objects text files are processed as one S3 Batch Operations job: invocations
+of --tasks-per-invocation tasks run one after another on a single warm
+instance with --concurrency tasks in flight, and tasks that end in
+TemporaryFailure are sent again in the next round, up to --retries rounds. S3 is
+the ThrottledS3 stand-in: each prefix admits --read-rps GET/HEAD/LIST and
+--write-rps PUT/COPY/DELETE requests per second and answers SlowDown beyond
+that, and requests take --latency-ms, longer once more than --knee are in
+flight on a prefix. Scenarios:
+
+    fixed       S3_ADAPTIVE_CONCURRENCY=false, every task thread sends its
+                requests as soon as it has them
+    adaptive    requests pass through the AIMD limiter in limiter.py
+
+For each scenario the report lists wall time, objects per second, requests S3
+admitted and throttled, temporary task failures, job rounds, and per prefix the
+requests admitted and throttled, the peak in flight and, for `adaptive`, the
+limiter's final limit and the range it moved in, sampled every --sample-ms.
+
+    python tools/bench_throttling.py --objects 5000 --concurrency 128 --write-rps 300 --latency-ms 20
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from typing import Any, Dict, List
+
+from bench_batch_operations import invocation
+from bench_handlers import BENCHMARKS, SOURCE_BUCKET
+from local_aws import LocalAWS, LocalContext, ThrottledS3, load_handler
+
+SCENARIOS = ('fixed', 'adaptive')
+
+
+def sample_limits(module: Any, stop: threading.Event, interval: float, samples: Dict[str, List[float]]) -> None:
+    while not stop.wait(interval):
+        for prefix, stats in module.limiter.stats().items():
+            samples.setdefault(prefix, []).append(stats['limit'])
+
+
+def run_job(module: Any, keys: List[str], tasks_per_invocation: int, retries: int) -> Dict[str, Any]:
+    """Process `keys` of the source bucket as a Batch Operations job, resending temporary failures."""
+    pending = [{'taskId': uuid.uuid4().hex, 'bucket': SOURCE_BUCKET, 'key': key} for key in keys]
+    temporary_failures = 0
+    rounds = 0
+    succeeded = 0
+    start = time.perf_counter()
+    while pending and rounds <= retries:
+        rounds += 1
+        retry = []
+        for offset in range(0, len(pending), tasks_per_invocation):
+            batch = pending[offset:offset + tasks_per_invocation]
+            context = LocalContext('s3-processor', timeout_seconds=900)
+            # Keep the handler's EMF lines out of the report
+            with contextlib.redirect_stdout(io.StringIO()):
+                response = module.lambda_handler(invocation(batch, '2.0', 'throttling'), context)
+            codes = {result['taskId']: result['resultCode'] for result in response.get('results', [])}
+            for task in batch:
+                code = codes.get(task['taskId'], 'TemporaryFailure')
+                if code == 'Succeeded':
+                    succeeded += 1
+                elif code == 'TemporaryFailure':
+                    temporary_failures += 1
+                    retry.append(task)
+        pending = retry
+    elapsed = time.perf_counter() - start
+    return {
+        'seconds': round(elapsed, 2),
+        'objects_per_second': round(succeeded / elapsed, 1),
+        'succeeded': succeeded,
+        'unfinished': len(pending),
+        'temporary_failures': temporary_failures,
+        'rounds': rounds
+    }
+
+
+def run(scenario: str, args: argparse.Namespace) -> Dict[str, Any]:
+    benchmark = BENCHMARKS['s3-lambda']()
+    os.environ.update(benchmark.environment)
+    os.environ.update({
+        'S3_ADAPTIVE_CONCURRENCY': 'true' if scenario == 'adaptive' else 'false',
+        'S3_CONCURRENCY_MAX': str(args.concurrency),
+        'BATCH_TASK_CONCURRENCY': str(args.concurrency),
+        'SKIP_UNCHANGED': 'false'
+    })
+    # limiter.py reads its settings on import; import it afresh for each scenario
+    sys.modules.pop('limiter', None)
+    local = LocalAWS()
+    benchmark.seed(local, args.objects, args.object_kib * 1024)
+    s3 = local.clients['s3'] = ThrottledS3(local.clients['s3'], read_rps=args.read_rps, write_rps=args.write_rps,
+                                           latency_ms=args.latency_ms, knee=args.knee)
+    module = load_handler(benchmark.example, benchmark.filename, local, f"s3_processor_throttling_{scenario}")
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    samples: Dict[str, List[float]] = {}
+    stop = threading.Event()
+    sampler = threading.Thread(target=sample_limits, args=(module, stop, args.sample_ms / 1000, samples))
+    sampler.start()
+    keys = [f"incoming/file-{index:06d}.txt" for index in range(args.objects)]
+    job = run_job(module, keys, args.tasks_per_invocation, args.retries)
+    stop.set()
+    sampler.join()
+
+    limits = module.limiter.stats()
+    prefixes = {}
+    for prefix in sorted(set(s3.admitted) | set(s3.throttled)):
+        prefixes[prefix] = {
+            'admitted': s3.admitted.get(prefix, 0),
+            'throttled': s3.throttled.get(prefix, 0),
+            'peak_in_flight': s3.peak_in_flight.get(prefix, 0)
+        }
+        if prefix in limits:
+            prefixes[prefix].update({
+                'final_limit': limits[prefix]['limit'],
+                'limit_range': [min(samples.get(prefix, [0])), max(samples.get(prefix, [0]))],
+                'latency_spikes': limits[prefix]['latency_spikes'],
+                'retries': limits[prefix]['retries']
+            })
+    return {
+        **job,
+        'admitted': sum(s3.admitted.values()),
+        'throttled': sum(s3.throttled.values()),
+        'prefixes': prefixes
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--objects', type=int, default=2000)
+    parser.add_argument('--object-kib', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=64, help='task threads of the instance')
+    parser.add_argument('--tasks-per-invocation', type=int, default=500)
+    parser.add_argument('--read-rps', type=float, default=1000, help='GET/HEAD/LIST requests per second per prefix')
+    parser.add_argument('--write-rps', type=float, default=400, help='other requests per second per prefix')
+    parser.add_argument('--latency-ms', type=float, default=10)
+    parser.add_argument('--knee', type=int, default=16, help='requests in flight per prefix before latency grows')
+    parser.add_argument('--retries', type=int, default=10, help='rounds resending temporary failures')
+    parser.add_argument('--sample-ms', type=float, default=100)
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='default: both')
+    args = parser.parse_args()
+
+    results = {scenario: run(scenario, args) for scenario in args.scenario or SCENARIOS}
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
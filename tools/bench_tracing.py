@@ -0,0 +1,84 @@
+"""
+Measure the overhead of latency tracing on a no-op invocation of the complete example.
+
+The tracing cost is measured in-process against zero-latency stand-ins. Tracing
+is switched on and off between consecutive invocations, alternating which of
+the two comes first, so that drift and the host's frequency changes affect
+both sides equally. Each invocation is timed on its own and those slower than
+--outlier times the median no-op invocation, which were interrupted by the
+host, are left out of both means. The run fails when tracing costs more than
+--budget percent of the no-op invocation with tracing disabled. Sampled
+invocations, which record their spans and build the Server-Timing header and
+the EMF document, are part of the mean at the configured TRACE_SAMPLE_RATE.
+
+    python tools/bench_tracing.py --invocations 2000 --rounds 10
+"""
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+from time import perf_counter_ns
+
+from local_aws import LocalAWS, LocalContext, load_handler
+
+NOOP_EVENT = {'action': 'noop'}
+
+
+def trimmed_mean(samples, limit: float) -> float:
+    """Mean of the samples below `limit`."""
+    kept = [sample for sample in samples if sample < limit]
+    return sum(kept) / len(kept)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--invocations', type=int, default=2000,
+                        help='invocations per round with tracing on, and as many off')
+    parser.add_argument('--rounds', type=int, default=10, help='rounds of interleaved invocations')
+    parser.add_argument('--outlier', type=float, default=3.0,
+                        help='leave out invocations slower than this multiple of the median')
+    parser.add_argument('--budget', type=float, default=1.0, help='maximum overhead in percent')
+    args = parser.parse_args()
+
+    context = LocalContext('complete-lambda-example', memory_limit_in_mb=1024)
+    local = LocalAWS()
+    # The handler's log handler keeps the stream that is stderr when it is imported, for the rest of the run
+    devnull = open(os.devnull, 'w')
+    with contextlib.redirect_stderr(devnull):
+        module = load_handler('complete-lambda-example', 'lambda_function.py', local, 'complete_traced')
+    tracer = module.tracer
+    handler = module.lambda_handler
+
+    timings = {False: [], True: []}
+    # Sampled EMF lines go to stdout; keep them out of the report
+    with contextlib.redirect_stdout(devnull):
+        handler(NOOP_EVENT, context)  # absorb the cold start
+        for _ in range(args.rounds):
+            for i in range(args.invocations):
+                for enabled in ((False, True) if i % 2 else (True, False)):
+                    tracer.enabled = enabled
+                    start = perf_counter_ns()
+                    handler(NOOP_EVENT, context)
+                    timings[enabled].append(perf_counter_ns() - start)
+            local.clients['cloudwatch'].metric_data.clear()
+    tracer.enabled = True
+
+    limit = statistics.median(timings[False]) * args.outlier
+    untraced_ns = trimmed_mean(timings[False], limit)
+    overhead_ns = max(trimmed_mean(timings[True], limit) - untraced_ns, 0)
+    overhead = overhead_ns / untraced_ns * 100
+    print(json.dumps({
+        'tracing_overhead_us': round(overhead_ns / 1000, 2),
+        'noop_invocation_us': round(untraced_ns / 1000, 2),
+        'overhead_percent': round(overhead, 3),
+        'budget_percent': args.budget,
+        'sample_rate': tracer.sample_rate,
+        'outliers': sum(sample >= limit for samples in timings.values() for sample in samples)
+    }, indent=2))
+    return 0 if overhead <= args.budget else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""
+Measure how the S3 processor's text transform scales over worker processes.
+
+A text file of --gib GiB, mostly ASCII with some multi-byte characters, is
+written to --dir and mapped read-only, as the processor maps an object spilled
+to ephemeral storage. It is upper-cased by each scenario, and the output is
+counted as it is produced:
+
+    inline      iter_text in the calling process, as with TRANSFORM_WORKERS=0
+    N workers   a TransformPool of N worker processes, for N from 1 to
+                --max-workers
+
+The report lists the CPUs available, and for each scenario seconds, MB/s and
+the speedup over inline. Each scenario's output is then checked against the
+inline output, outside the timed run, and the tool exits 1 if one differs.
+Speedup is bounded by the CPUs available: a Lambda function has 6 vCPUs from
+10240 MB of memory.
+
+    python tools/bench_transform_pool.py --gib 4 --max-workers 6 --chunk-mib 8
+"""
+import argparse
+import json
+import mmap
+import os
+import random
+import sys
+import tempfile
+import time
+import zlib
+from typing import Any, Callable, Dict, Iterator
+
+from local_aws import EXAMPLES_DIR
+
+sys.path.append(str(EXAMPLES_DIR / 's3-lambda'))
+from spill import iter_text  # noqa: E402
+from transform_pool import TransformPool, available_cpus  # noqa: E402
+
+WORDS = ('order', 'shipped', 'paid', 'refund', 'customer', 'invoice', 'pending', 'warehouse', 'total', 'status',
+         'café', 'straße', 'naïve', 'größe', 'déjà', 'ŉ')
+INLINE_CHUNK_BYTES = 8 * 1024 * 1024
+
+
+def write_text(path: str, size: int, seed: int) -> None:
+    """Write `size` bytes of text lines; a few of the words need more than one byte per character."""
+    rng = random.Random(seed)
+    block = '\n'.join(' '.join(rng.choice(WORDS) for _ in range(12)) for _ in range(20000)).encode('utf-8') + b'\n'
+    with open(path, 'wb') as file:
+        written = 0
+        while written < size:
+            piece = block[:size - written]
+            file.write(piece)
+            written += len(piece)
+
+
+def inline_chunks(data: mmap.mmap) -> Iterator[bytes]:
+    for offset in range(0, len(data), INLINE_CHUNK_BYTES):
+        yield data[offset:offset + INLINE_CHUNK_BYTES]
+
+
+def measure(produce: Callable[[], Iterator[bytes]]) -> Dict[str, Any]:
+    start = time.perf_counter()
+    produced = sum(len(chunk) for chunk in produce())
+    return {'seconds': time.perf_counter() - start, 'bytes': produced}
+
+
+def checksum(produce: Callable[[], Iterator[bytes]]) -> int:
+    value = 0
+    for chunk in produce():
+        value = zlib.crc32(chunk, value)
+    return value
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--gib', type=float, default=2, help='size of the text file')
+    parser.add_argument('--max-workers', type=int, default=6)
+    parser.add_argument('--chunk-mib', type=int, default=4, help='text handed to a worker at a time')
+    parser.add_argument('--dir', default=tempfile.gettempdir(), help='where the text file is written')
+    parser.add_argument('--no-verify', action='store_true', help='skip comparing outputs with the inline output')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    descriptor, path = tempfile.mkstemp(prefix='bench-transform-', dir=args.dir)
+    os.close(descriptor)
+    pools = []
+    try:
+        write_text(path, int(args.gib * 1024 ** 3), args.seed)
+        # Workers are forked before the file is mapped or any thread is started
+        for workers in range(1, args.max_workers + 1):
+            pools.append(TransformPool(workers, args.chunk_mib * 1024 * 1024))
+        with open(path, 'rb') as file:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        scenarios: Dict[str, Callable[[], Iterator[bytes]]] = {
+            'inline': lambda: iter_text(inline_chunks(data), str.upper)
+        }
+        for pool in pools:
+            scenarios[f"{pool.workers}_workers"] = lambda pool=pool: pool.transform('upper', data)
+
+        results: Dict[str, Any] = {'available_cpus': available_cpus(), 'input_bytes': len(data), 'scenarios': {}}
+        for name, produce in scenarios.items():
+            run = measure(produce)
+            results['scenarios'][name] = {
+                'seconds': round(run['seconds'], 2),
+                'mb_per_second': round(len(data) / run['seconds'] / 1e6, 1),
+                'output_bytes': run['bytes']
+            }
+        inline_seconds = results['scenarios']['inline']['seconds']
+        for scenario in results['scenarios'].values():
+            scenario['speedup'] = round(inline_seconds / scenario['seconds'], 2)
+
+        mismatched = []
+        if not args.no_verify:
+            expected = checksum(scenarios['inline'])
+            mismatched = [name for name, produce in scenarios.items()
+                          if name != 'inline' and checksum(produce) != expected]
+            results['mismatched'] = mismatched
+        print(json.dumps(results, indent=2))
+        data.close()
+        return 1 if mismatched else 0
+    finally:
+        for pool in pools:
+            pool.close()
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,243 @@
+"""
+Build and inspect recorded invocation corpora.
+
+A corpus is gzip-compressed JSON Lines. The first line is the content index
+(counts per function, event source and AWS operation, time range and
+deduplication figures), followed by `blob` lines holding each distinct large
+payload once and `invocation` lines that refer to blobs as {"$ref": id}. The
+chunks written by examples/common/recording.py use the same invocation lines
+with payloads inline, so they can be read directly or packed.
+
+    python tools/corpus.py pack chunks/*.jsonl.gz -o s3-processor.jsonl.gz
+    python tools/corpus.py record --handler s3-lambda --invocations 500 -o s3-synthetic.jsonl.gz
+    python tools/corpus.py info s3-processor.jsonl.gz
+"""
+import argparse
+import contextlib
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from local_aws import LocalAWS, LocalContext, load_handler
+
+CORPUS_VERSION = 1
+# Payloads smaller than this stay inline; a reference would not save space
+MIN_BLOB_BYTES = 128
+
+
+def event_source(event: Any) -> str:
+    """Classify an event the way the handlers route it."""
+    if not isinstance(event, dict):
+        return 'other'
+    records = event.get('Records')
+    if records and isinstance(records[0], dict):
+        return records[0].get('eventSource') or records[0].get('EventSource') or 'records'
+    if 'httpMethod' in event or 'requestContext' in event:
+        return 'api_gateway'
+    if event.get('source') == 'aws.events':
+        return 'eventbridge'
+    if 'action' in event:
+        return f"action:{event['action']}"
+    return 'other'
+
+
+def read_lines(path: str) -> Iterator[Dict[str, Any]]:
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as corpus:
+        for line in corpus:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def read_index(path: str) -> Optional[Dict[str, Any]]:
+    """Return the content index of a packed corpus, decompressing only its first line."""
+    for entry in read_lines(path):
+        return entry if isinstance(entry, dict) and entry.get('kind') == 'index' else None
+    return None
+
+
+def _resolve(value: Any, blobs: Dict[str, Any]) -> Any:
+    if isinstance(value, dict) and len(value) == 1 and '$ref' in value:
+        return blobs[value['$ref']]
+    return value
+
+
+def read_invocations(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield invocation records with blob references resolved.
+
+    Plain event files, one event per line, are accepted as invocations without
+    recorded responses.
+    """
+    blobs: Dict[str, Any] = {}
+    for entry in read_lines(path):
+        kind = entry.get('kind') if isinstance(entry, dict) else None
+        if kind == 'index':
+            continue
+        if kind == 'blob':
+            blobs[entry['id']] = entry['data']
+            continue
+        if kind != 'invocation':
+            yield {'kind': 'invocation', 'event': entry, 'calls': []}
+            continue
+        entry['event'] = _resolve(entry['event'], blobs)
+        if 'response' in entry:
+            entry['response'] = _resolve(entry['response'], blobs)
+        for call in entry.get('calls') or []:
+            call['params'] = _resolve(call['params'], blobs)
+            if 'response' in call:
+                call['response'] = _resolve(call['response'], blobs)
+        yield entry
+
+
+def read_events(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield only the events of a corpus."""
+    for invocation in read_invocations(path):
+        yield invocation['event']
+
+
+def build_index(invocations: List[Dict[str, Any]]) -> Dict[str, Any]:
+    functions: Counter = Counter()
+    sources: Counter = Counter()
+    operations: Counter = Counter()
+    errors = 0
+    for invocation in invocations:
+        functions[invocation.get('function', 'unknown')] += 1
+        sources[event_source(invocation['event'])] += 1
+        errors += 'error' in invocation
+        for call in invocation.get('calls') or []:
+            operations[f"{call['service']}.{call['operation']}"] += 1
+    timestamps = [invocation['timestamp'] for invocation in invocations if invocation.get('timestamp')]
+    return {
+        'kind': 'index',
+        'version': CORPUS_VERSION,
+        'invocations': len(invocations),
+        'errors': errors,
+        'first_timestamp': min(timestamps) if timestamps else None,
+        'last_timestamp': max(timestamps) if timestamps else None,
+        'functions': dict(functions),
+        'event_sources': dict(sources.most_common()),
+        'operations': dict(operations.most_common())
+    }
+
+
+def pack(sources: Iterable[str], output: str) -> Dict[str, Any]:
+    """Merge corpora or recorder chunks into one deduplicated corpus ordered by timestamp."""
+    invocations = [invocation for source in sources for invocation in read_invocations(source)]
+    invocations.sort(key=lambda invocation: invocation.get('timestamp') or '')
+    index = build_index(invocations)
+
+    blob_ids: Dict[str, str] = {}
+    references = 0
+
+    def reference(value: Any, lines: List[str]) -> Any:
+        nonlocal references
+        serialized = json.dumps(value, sort_keys=True, separators=(',', ':'))
+        if len(serialized) < MIN_BLOB_BYTES:
+            return value
+        digest = hashlib.sha256(serialized.encode('utf-8')).hexdigest()[:20]
+        if digest not in blob_ids:
+            blob_ids[digest] = digest
+            lines.append(json.dumps({'kind': 'blob', 'id': digest, 'data': value}, separators=(',', ':')))
+        references += 1
+        return {'$ref': digest}
+
+    body: List[str] = []
+    for invocation in invocations:
+        invocation['event'] = reference(invocation['event'], body)
+        if 'response' in invocation:
+            invocation['response'] = reference(invocation['response'], body)
+        for call in invocation.get('calls') or []:
+            call['params'] = reference(call['params'], body)
+            if 'response' in call:
+                call['response'] = reference(call['response'], body)
+        body.append(json.dumps(invocation, separators=(',', ':')))
+
+    index['blobs'] = len(blob_ids)
+    index['blob_references'] = references
+    with gzip.open(output, 'wt', encoding='utf-8') as corpus:
+        corpus.write(json.dumps(index) + '\n')
+        for line in body:
+            corpus.write(line + '\n')
+    index['compressed_bytes'] = os.path.getsize(output)
+    return index
+
+
+def record_synthetic(handler: str, invocations: int, output: str, batch_size: int, objects: int,
+                     object_size: int, seed: int) -> Dict[str, Any]:
+    """Record a handler against the local stand-ins under its benchmark mix, then pack the result."""
+    from bench_handlers import BENCHMARKS
+
+    benchmark = BENCHMARKS[handler]()
+    chunk = tempfile.NamedTemporaryFile(suffix='.jsonl.gz', delete=False)
+    chunk.close()
+    os.environ.update(benchmark.environment)
+    os.environ['RECORD_FILE'] = chunk.name
+    logging.disable(logging.CRITICAL)
+    try:
+        local = LocalAWS()
+        benchmark.seed(local, objects, object_size)
+        with contextlib.redirect_stdout(io.StringIO()):
+            module = load_handler(benchmark.example, benchmark.filename, local)
+            recorder = getattr(module, 'recorder', None)
+            if recorder is None:
+                # Handlers without AWS calls only need their events captured
+                from recording import Recorder
+                recorder = Recorder(handler, path=chunk.name)
+                module.lambda_handler = recorder.record(module.lambda_handler)
+
+            rng = random.Random(seed)
+            mix = {name: weight for name, (weight, _) in benchmark.mix.items()}
+            events = benchmark.events(mix, rng, batch_size, objects)
+            for _ in range(invocations):
+                _, event = next(events)
+                module.lambda_handler(event, LocalContext(handler))
+            recorder.flush()
+        return pack([chunk.name], output)
+    finally:
+        logging.disable(logging.NOTSET)
+        os.unlink(chunk.name)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    pack_parser = commands.add_parser('pack', help='merge recorder chunks or corpora into one corpus')
+    pack_parser.add_argument('sources', nargs='+')
+    pack_parser.add_argument('-o', '--output', required=True)
+
+    record_parser = commands.add_parser('record', help='record a handler against the local stand-ins')
+    record_parser.add_argument('--handler', required=True)
+    record_parser.add_argument('--invocations', type=int, default=500)
+    record_parser.add_argument('--batch-size', type=int, default=5)
+    record_parser.add_argument('--objects', type=int, default=200)
+    record_parser.add_argument('--object-size', type=int, default=4096)
+    record_parser.add_argument('--seed', type=int, default=42)
+    record_parser.add_argument('-o', '--output', required=True)
+
+    info_parser = commands.add_parser('info', help='print the content index of a corpus')
+    info_parser.add_argument('corpus')
+
+    args = parser.parse_args()
+    if args.command == 'pack':
+        index = pack(args.sources, args.output)
+    elif args.command == 'record':
+        index = record_synthetic(args.handler, args.invocations, args.output, args.batch_size,
+                                 args.objects, args.object_size, args.seed)
+    else:
+        index = read_index(args.corpus) or build_index(list(read_invocations(args.corpus)))
+    print(json.dumps(index, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1036 @@
+"""
+In-process stand-ins for the AWS services used by the example handlers.
+
+Handlers create their boto3 clients at import time, so `load_handler` imports a
+handler module while `boto3.client` hands out the stand-ins registered on a
+`LocalAWS` instance. Objects can be `SyntheticBody` instances generated on read,
+so ranged reads of multi-GB objects need no memory. `LocalRuntimeAPI` serves the
+Lambda Runtime API on localhost; nothing here leaves the machine.
+"""
+import bisect
+import contextlib
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import boto3
+from botocore.exceptions import ClientError, ReadTimeoutError
+from botocore.response import StreamingBody
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+EXAMPLES_DIR = REPO_ROOT / 'examples'
+COMMON_DIR = EXAMPLES_DIR / 'common'
+
+
+def client_error(code: str, message: str, operation: str, status: int = 400) -> ClientError:
+    """Build a botocore ClientError the way a real client would raise it."""
+    return ClientError(
+        {'Error': {'Code': code, 'Message': message}, 'ResponseMetadata': {'HTTPStatusCode': status}},
+        operation
+    )
+
+
+class UnavailableService:
+    """Stand-in for a service without a local implementation; every call fails."""
+
+    def __init__(self, service_name: str):
+        self.service_name = service_name
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def unavailable(*args, **kwargs):
+            raise client_error('EndpointUnavailable', f"No local stand-in for {self.service_name}", name, 503)
+        return unavailable
+
+
+class LocalCloudWatch:
+    """Records metric data instead of publishing it."""
+
+    def __init__(self):
+        self.metric_data: List[Dict[str, Any]] = []
+
+    def put_metric_data(self, Namespace: str, MetricData: List[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
+        for datum in MetricData:
+            self.metric_data.append({'Namespace': Namespace, **datum})
+        return {}
+
+
+class SyntheticBody:
+    """Object content of any size generated by repeating a block, for multi-GB objects that do not fit in memory.
+
+    An optional header is written once before the repeated block, e.g. a CSV header line.
+    """
+
+    def __init__(self, size: int, block: bytes, header: bytes = b''):
+        self.size = size
+        self.block = block
+        self.header = header
+        digest = hashlib.md5(header + block, usedforsecurity=False).hexdigest()
+        self.digest = hashlib.md5(f"{size}:{digest}".encode('ascii'), usedforsecurity=False).hexdigest()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, item: slice) -> bytes:
+        start, stop, _ = item.indices(self.size)
+        if stop <= start:
+            return b''
+        parts = []
+        if start < len(self.header):
+            parts.append(self.header[start:stop])
+            start = len(self.header)
+        if start < stop:
+            offset = (start - len(self.header)) % len(self.block)
+            length = stop - start
+            repeats = (offset + length) // len(self.block) + 1
+            parts.append((self.block * repeats)[offset:offset + length])
+        return b''.join(parts)
+
+
+class BodyReader(io.RawIOBase):
+    """Reads a byte range of an object body lazily, optionally throttled to a per-stream bandwidth."""
+
+    def __init__(self, body: Any, start: int, end: int, mib_per_second: float = 0, on_read: Any = None):
+        self._body = body
+        self._position = start
+        self._end = end
+        self._seconds_per_byte = 1 / (mib_per_second * 1024 * 1024) if mib_per_second else 0
+        self._on_read = on_read
+        self._started = time.monotonic()
+        self._sent = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        length = min(len(buffer), self._end - self._position)
+        if length <= 0:
+            return 0
+        data = self._body[self._position:self._position + length]
+        buffer[:length] = data
+        self._position += length
+        self._sent += length
+        if self._on_read:
+            self._on_read(length)
+        if self._seconds_per_byte:
+            delay = self._started + self._sent * self._seconds_per_byte - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        return length
+
+
+class LocalObject:
+    """One stored S3 object."""
+
+    __slots__ = ('body', 'content_type', 'metadata', 'last_modified', 'etag')
+
+    def __init__(self, body: Any, content_type: str = 'binary/octet-stream', metadata: Optional[Dict[str, str]] = None,
+                 etag: Optional[str] = None):
+        self.body = body
+        self.content_type = content_type
+        self.metadata = dict(metadata or {})
+        self.last_modified = datetime.now(timezone.utc)
+        if etag:
+            self.etag = etag
+        elif isinstance(body, SyntheticBody):
+            self.etag = f'"{body.digest}"'
+        else:
+            self.etag = f'"{hashlib.md5(body, usedforsecurity=False).hexdigest()}"'
+
+
+def parse_range(header: str, size: int) -> Optional[range]:
+    """Resolve a single `bytes=` Range header against the object size; None when unsatisfiable."""
+    unit, _, spec = header.partition('=')
+    first, _, last = spec.partition('-')
+    if unit.strip() != 'bytes' or ',' in spec:
+        return None
+    if not first:
+        suffix = int(last)
+        return range(max(size - suffix, 0), size) if suffix and size else None
+    start = int(first)
+    end = min(int(last) + 1, size) if last else size
+    return range(start, end) if start < size and start < end else None
+
+
+class LocalS3:
+    """In-memory S3 with the subset of operations the handlers use.
+
+    `stream_mib_per_second` throttles every GetObject body to emulate the per-connection
+    throughput limit; `bytes_sent` counts the body bytes actually read. SelectObjectContent
+    fails with MethodNotAllowed, as for accounts without S3 Select, unless `select` is set
+    to a callable taking (body, request) and returning the event stream. GetObject honours
+    IfMatch and IfNoneMatch against the stored ETag, and PutObject and CompleteMultipartUpload
+    honour IfNoneMatch='*' and IfMatch as conditional writes. With `discard_writes`,
+    written objects keep their size and ETag but read back as zeros, so benchmarks writing
+    multi-GB objects do not hold them in memory.
+    """
+
+    def __init__(self, *bucket_names: str, stream_mib_per_second: float = 0, discard_writes: bool = False):
+        self.buckets: Dict[str, Dict[str, LocalObject]] = {name: {} for name in bucket_names}
+        self.creation_date = datetime.now(timezone.utc)
+        self.request_counts: Dict[str, int] = {}
+        self.stream_mib_per_second = stream_mib_per_second
+        self.bytes_sent = 0
+        self.select = None
+        self.discard_writes = discard_writes
+        self.uploads: Dict[str, Dict[str, Any]] = {}
+        self._sorted_keys: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+
+    def _count(self, operation: str) -> None:
+        with self._lock:
+            self.request_counts[operation] = self.request_counts.get(operation, 0) + 1
+
+    def _bucket(self, bucket: str, operation: str) -> Dict[str, LocalObject]:
+        self._count(operation)
+        if bucket not in self.buckets:
+            raise client_error('NoSuchBucket', f"The specified bucket does not exist: {bucket}", operation, 404)
+        return self.buckets[bucket]
+
+    def _object(self, bucket: str, key: str, operation: str) -> LocalObject:
+        objects = self._bucket(bucket, operation)
+        if key not in objects:
+            code = '404' if operation == 'HeadObject' else 'NoSuchKey'
+            raise client_error(code, f"The specified key does not exist: {key}", operation, 404)
+        return objects[key]
+
+    def _keys(self, bucket: str) -> List[str]:
+        """Sorted keys of a bucket, kept until the next write so large listings stay cheap per page."""
+        keys = self._sorted_keys.get(bucket)
+        if keys is None:
+            keys = self._sorted_keys[bucket] = sorted(self.buckets[bucket])
+        return keys
+
+    def _store_if(self, bucket: str, key: str, obj: 'LocalObject', operation: str, if_match: Optional[str] = None,
+                  if_none_match: Optional[str] = None) -> None:
+        """Store `obj` if the conditional write headers hold for the current object, atomically."""
+        with self._lock:
+            current = self.buckets[bucket].get(key)
+            if if_match and current is None:
+                raise client_error('NoSuchKey', f"The specified key does not exist: {key}", operation, 404)
+            if (if_none_match == '*' and current is not None) or (if_match and if_match != current.etag):
+                raise client_error('PreconditionFailed',
+                                   'At least one of the pre-conditions you specified did not hold', operation, 412)
+            self._store(bucket, key, obj)
+
+    def _store(self, bucket: str, key: str, obj: 'LocalObject') -> None:
+        objects = self.buckets.setdefault(bucket, {})
+        if key not in objects:
+            self._sorted_keys.pop(bucket, None)
+        objects[key] = obj
+
+    def _remove(self, bucket: str, key: str) -> None:
+        if self.buckets[bucket].pop(key, None) is not None:
+            self._sorted_keys.pop(bucket, None)
+
+    def _count_sent(self, length: int) -> None:
+        with self._lock:
+            self.bytes_sent += length
+
+    def _written(self, body: Any, content_type: str, metadata: Optional[Dict[str, str]],
+                 etag: Optional[str] = None) -> LocalObject:
+        if self.discard_writes:
+            etag = etag or f'"{hashlib.md5(body, usedforsecurity=False).hexdigest()}"'
+            body = SyntheticBody(len(body), b'\0')
+        return LocalObject(body, content_type, metadata, etag)
+
+    def put(self, bucket: str, key: str, body: Any, content_type: str = 'binary/octet-stream') -> None:
+        """Seed an object without counting it as a request."""
+        self._store(bucket, key, LocalObject(body, content_type))
+
+    def list_buckets(self, **kwargs) -> Dict[str, Any]:
+        self._count('ListBuckets')
+        return {'Buckets': [{'Name': name, 'CreationDate': self.creation_date} for name in sorted(self.buckets)]}
+
+    def head_bucket(self, Bucket: str, **kwargs) -> Dict[str, Any]:
+        self._bucket(Bucket, 'HeadBucket')
+        return {}
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> Dict[str, Any]:
+        obj = self._object(Bucket, Key, 'HeadObject')
+        return {
+            'AcceptRanges': 'bytes',
+            'ContentLength': len(obj.body),
+            'ContentType': obj.content_type,
+            'LastModified': obj.last_modified,
+            'ETag': obj.etag,
+            'Metadata': dict(obj.metadata)
+        }
+
+    def get_object(self, Bucket: str, Key: str, Range: Optional[str] = None, IfMatch: Optional[str] = None,
+                   IfNoneMatch: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        obj = self._object(Bucket, Key, 'GetObject')
+        if IfMatch and IfMatch != obj.etag:
+            raise client_error('PreconditionFailed', 'At least one of the pre-conditions you specified did not hold',
+                               'GetObject', 412)
+        if IfNoneMatch and IfNoneMatch == obj.etag:
+            raise client_error('304', 'Not Modified', 'GetObject', 304)
+        size = len(obj.body)
+        span = range(0, size)
+        if Range:
+            span = parse_range(Range, size)
+            if span is None:
+                raise client_error('InvalidRange', 'The requested range is not satisfiable', 'GetObject', 416)
+        reader = BodyReader(obj.body, span.start, span.stop, self.stream_mib_per_second, self._count_sent)
+        response = {
+            'Body': StreamingBody(io.BufferedReader(reader, buffer_size=256 * 1024), len(span)),
+            'AcceptRanges': 'bytes',
+            'ContentLength': len(span),
+            'ContentType': obj.content_type,
+            'LastModified': obj.last_modified,
+            'ETag': obj.etag,
+            'Metadata': dict(obj.metadata),
+            'ResponseMetadata': {'HTTPStatusCode': 206 if Range else 200}
+        }
+        if Range:
+            response['ContentRange'] = f"bytes {span.start}-{span.stop - 1}/{size}"
+        return response
+
+    def select_object_content(self, Bucket: str, Key: str, **kwargs) -> Dict[str, Any]:
+        obj = self._object(Bucket, Key, 'SelectObjectContent')
+        if self.select is None:
+            raise client_error('MethodNotAllowed', 'S3 Select is not available for this account',
+                               'SelectObjectContent', 405)
+        return {'Payload': self.select(obj.body, kwargs)}
+
+    def put_object(self, Bucket: str, Key: str, Body: Any = b'', ContentType: str = 'binary/octet-stream',
+                   Metadata: Optional[Dict[str, str]] = None, IfMatch: Optional[str] = None,
+                   IfNoneMatch: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        self._bucket(Bucket, 'PutObject')
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        elif hasattr(Body, 'read'):
+            Body = Body.read()
+        obj = self._written(bytes(Body), ContentType, Metadata)
+        self._store_if(Bucket, Key, obj, 'PutObject', IfMatch, IfNoneMatch)
+        return {'ETag': obj.etag}
+
+    def create_multipart_upload(self, Bucket: str, Key: str, ContentType: str = 'binary/octet-stream',
+                                Metadata: Optional[Dict[str, str]] = None, **kwargs) -> Dict[str, Any]:
+        self._bucket(Bucket, 'CreateMultipartUpload')
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self.uploads[upload_id] = {'key': Key, 'content_type': ContentType, 'metadata': Metadata, 'parts': {}}
+        return {'Bucket': Bucket, 'Key': Key, 'UploadId': upload_id}
+
+    def _upload(self, upload_id: str, key: str, operation: str) -> Dict[str, Any]:
+        upload = self.uploads.get(upload_id)
+        if upload is None or upload['key'] != key:
+            raise client_error('NoSuchUpload', 'The specified upload does not exist', operation, 404)
+        return upload
+
+    def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body: Any = b'',
+                    **kwargs) -> Dict[str, Any]:
+        self._bucket(Bucket, 'UploadPart')
+        upload = self._upload(UploadId, Key, 'UploadPart')
+        body = bytes(Body.read() if hasattr(Body, 'read') else Body)
+        digest = hashlib.md5(body, usedforsecurity=False).digest()
+        upload['parts'][PartNumber] = (digest, len(body) if self.discard_writes else body)
+        return {'ETag': f'"{digest.hex()}"'}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: Dict[str, Any],
+                                  IfMatch: Optional[str] = None, IfNoneMatch: Optional[str] = None,
+                                  **kwargs) -> Dict[str, Any]:
+        self._bucket(Bucket, 'CompleteMultipartUpload')
+        upload = self._upload(UploadId, Key, 'CompleteMultipartUpload')
+        numbers = [part['PartNumber'] for part in MultipartUpload['Parts']]
+        if numbers != sorted(numbers) or any(number not in upload['parts'] for number in numbers):
+            raise client_error('InvalidPart', 'One or more of the specified parts could not be found',
+                               'CompleteMultipartUpload', 400)
+        parts = [upload['parts'][number] for number in numbers]
+        combined = hashlib.md5(b''.join(digest for digest, _ in parts), usedforsecurity=False).hexdigest()
+        etag = f'"{combined}-{len(parts)}"'
+        if self.discard_writes:
+            body: Any = SyntheticBody(sum(length for _, length in parts), b'\0')
+        else:
+            body = b''.join(content for _, content in parts)
+        obj = LocalObject(body, upload['content_type'], upload['metadata'], etag)
+        self._store_if(Bucket, Key, obj, 'CompleteMultipartUpload', IfMatch, IfNoneMatch)
+        del self.uploads[UploadId]
+        return {'Bucket': Bucket, 'Key': Key, 'ETag': etag}
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str, **kwargs) -> Dict[str, Any]:
+        self._bucket(Bucket, 'AbortMultipartUpload')
+        self._upload(UploadId, Key, 'AbortMultipartUpload')
+        del self.uploads[UploadId]
+        return {}
+
+    def copy_object(self, CopySource: Dict[str, str], Bucket: str, Key: str,
+                    Metadata: Optional[Dict[str, str]] = None, MetadataDirective: str = 'COPY',
+                    ContentType: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        source = self._object(CopySource['Bucket'], CopySource['Key'], 'CopyObject')
+        if Bucket not in self.buckets:
+            raise client_error('NoSuchBucket', f"The specified bucket does not exist: {Bucket}", 'CopyObject', 404)
+        replace = MetadataDirective == 'REPLACE'
+        metadata = Metadata if replace else source.metadata
+        content_type = ContentType if replace and ContentType else source.content_type
+        obj = LocalObject(source.body, content_type, metadata, source.etag)
+        self._store(Bucket, Key, obj)
+        return {'CopyObjectResult': {'ETag': obj.etag, 'LastModified': obj.last_modified}}
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs) -> Dict[str, Any]:
+        self._bucket(Bucket, 'DeleteObject')
+        self._remove(Bucket, Key)
+        return {}
+
+    def delete_objects(self, Bucket: str, Delete: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        self._bucket(Bucket, 'DeleteObjects')
+        for item in Delete['Objects']:
+            self._remove(Bucket, item['Key'])
+        return {'Deleted': [{'Key': item['Key']} for item in Delete['Objects']]}
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = '', MaxKeys: int = 1000, ContinuationToken: str = None,
+                        StartAfter: str = '', Delimiter: str = None, **kwargs) -> Dict[str, Any]:
+        objects = self._bucket(Bucket, 'ListObjectsV2')
+        keys = self._keys(Bucket)
+        after = ContinuationToken or StartAfter or ''
+        contents, prefixes = [], []
+        last_key = None
+        truncated = False
+        position = bisect.bisect_right(keys, after) if after >= Prefix else bisect.bisect_left(keys, Prefix)
+        while position < len(keys):
+            key = keys[position]
+            if not key.startswith(Prefix):
+                break
+            if len(contents) + len(prefixes) >= MaxKeys:
+                truncated = True
+                break
+            if Delimiter and Delimiter in key[len(Prefix):]:
+                common = key[:key.index(Delimiter, len(Prefix)) + len(Delimiter)]
+                prefixes.append({'Prefix': common})
+                last_key = common + '\uffff'
+                position = bisect.bisect_right(keys, last_key, position)
+                continue
+            obj = objects[key]
+            contents.append({
+                'Key': key,
+                'Size': len(obj.body),
+                'LastModified': obj.last_modified,
+                'ETag': obj.etag,
+                'StorageClass': 'STANDARD'
+            })
+            last_key = key
+            position += 1
+
+        response = {
+            'Name': Bucket,
+            'Prefix': Prefix,
+            'KeyCount': len(contents) + len(prefixes),
+            'MaxKeys': MaxKeys,
+            'IsTruncated': truncated
+        }
+        if contents:
+            response['Contents'] = contents
+        if prefixes:
+            response['CommonPrefixes'] = prefixes
+        if truncated:
+            response['NextContinuationToken'] = last_key
+        return response
+
+    def list_object_versions(self, Bucket: str, Prefix: str = '', MaxKeys: int = 1000, **kwargs) -> Dict[str, Any]:
+        """Versions as an unversioned bucket reports them: the current objects only, with VersionId null."""
+        objects = self._bucket(Bucket, 'ListObjectVersions')
+        keys = self._keys(Bucket)
+        position = bisect.bisect_left(keys, Prefix)
+        versions = []
+        while position < len(keys) and keys[position].startswith(Prefix) and len(versions) < MaxKeys:
+            obj = objects[keys[position]]
+            versions.append({'Key': keys[position], 'VersionId': 'null', 'IsLatest': True, 'Size': len(obj.body),
+                             'LastModified': obj.last_modified, 'ETag': obj.etag})
+            position += 1
+        truncated = position < len(keys) and keys[position].startswith(Prefix)
+        return {'Name': Bucket, 'Prefix': Prefix, 'Versions': versions, 'IsTruncated': truncated}
+
+    def get_paginator(self, operation_name: str) -> 'LocalPaginator':
+        if operation_name != 'list_objects_v2':
+            raise NotImplementedError(f"No local paginator for {operation_name}")
+        return LocalPaginator(self.list_objects_v2)
+
+
+class LocalPaginator:
+    """Paginator following NextContinuationToken like the botocore one."""
+
+    def __init__(self, operation):
+        self._operation = operation
+
+    def paginate(self, PaginationConfig: Optional[Dict[str, Any]] = None, **kwargs) -> Iterator[Dict[str, Any]]:
+        config = PaginationConfig or {}
+        if config.get('PageSize'):
+            kwargs['MaxKeys'] = config['PageSize']
+        if config.get('StartingToken'):
+            kwargs['ContinuationToken'] = config['StartingToken']
+        while True:
+            page = self._operation(**kwargs)
+            yield page
+            if not page.get('IsTruncated'):
+                return
+            kwargs['ContinuationToken'] = page['NextContinuationToken']
+
+
+class LocalSNS:
+    """Records published messages."""
+
+    def __init__(self):
+        self.messages: List[Dict[str, Any]] = []
+
+    def publish(self, TopicArn: str, Message: str, **kwargs) -> Dict[str, Any]:
+        message_id = str(uuid.uuid4())
+        self.messages.append({'TopicArn': TopicArn, 'Message': Message, 'MessageId': message_id, **kwargs})
+        return {'MessageId': message_id}
+
+    def get_topic_attributes(self, TopicArn: str) -> Dict[str, Any]:
+        return {'Attributes': {'TopicArn': TopicArn}}
+
+
+class LocalSQS:
+    """In-memory queues keyed by queue URL, with visibility timeouts, receive counts and long polling."""
+
+    def __init__(self):
+        self.queues: Dict[str, List[Dict[str, Any]]] = {}
+        # Received and not deleted: queue URL -> receipt handle -> (time it becomes visible again, message)
+        self.in_flight: Dict[str, Dict[str, Tuple[float, Dict[str, Any]]]] = {}
+        self._lock = threading.Condition()
+
+    def _message(self, body: str, attributes: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'MessageId': str(uuid.uuid4()),
+            'ReceiptHandle': uuid.uuid4().hex,
+            'Body': body,
+            'MD5OfBody': hashlib.md5(body.encode('utf-8'), usedforsecurity=False).hexdigest(),
+            'Attributes': {},
+            'MessageAttributes': attributes
+        }
+
+    def send_message(self, QueueUrl: str, MessageBody: str, **kwargs) -> Dict[str, Any]:
+        message = self._message(MessageBody, kwargs.get('MessageAttributes', {}))
+        with self._lock:
+            self.queues.setdefault(QueueUrl, []).append(message)
+            self._lock.notify_all()
+        return {'MessageId': message['MessageId'], 'MD5OfMessageBody': message['MD5OfBody']}
+
+    def send_message_batch(self, QueueUrl: str, Entries: List[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
+        self._check_batch(Entries, 'SendMessageBatch')
+        messages = [self._message(entry['MessageBody'], entry.get('MessageAttributes', {})) for entry in Entries]
+        with self._lock:
+            self.queues.setdefault(QueueUrl, []).extend(messages)
+            self._lock.notify_all()
+        return {'Successful': [
+            {'Id': entry['Id'], 'MessageId': message['MessageId'], 'MD5OfMessageBody': message['MD5OfBody']}
+            for entry, message in zip(Entries, messages)
+        ], 'Failed': []}
+
+    def _expire(self, QueueUrl: str) -> None:
+        """Make messages whose visibility timeout has passed visible again."""
+        now = time.monotonic()
+        in_flight = self.in_flight.get(QueueUrl, {})
+        for handle in [handle for handle, (visible_at, _) in in_flight.items() if visible_at <= now]:
+            self.queues.setdefault(QueueUrl, []).append(in_flight.pop(handle)[1])
+
+    def receive_message(self, QueueUrl: str, MaxNumberOfMessages: int = 1, VisibilityTimeout: float = 30,
+                        WaitTimeSeconds: float = 0, **kwargs) -> Dict[str, Any]:
+        deadline = time.monotonic() + WaitTimeSeconds
+        with self._lock:
+            while True:
+                self._expire(QueueUrl)
+                visible = self.queues.get(QueueUrl, [])
+                remaining = deadline - time.monotonic()
+                if visible or remaining <= 0:
+                    break
+                # Woken by a send; messages coming back from in flight are noticed within 50 ms
+                self._lock.wait(min(remaining, 0.05))
+            batch, self.queues[QueueUrl] = visible[:MaxNumberOfMessages], visible[MaxNumberOfMessages:]
+            visible_at = time.monotonic() + VisibilityTimeout
+            received = []
+            for message in batch:
+                count = int(message['Attributes'].get('ApproximateReceiveCount', '0')) + 1
+                message['Attributes']['ApproximateReceiveCount'] = str(count)
+                message['ReceiptHandle'] = uuid.uuid4().hex
+                self.in_flight.setdefault(QueueUrl, {})[message['ReceiptHandle']] = (visible_at, message)
+                received.append({**message, 'Attributes': dict(message['Attributes'])})
+        return {'Messages': received} if received else {}
+
+    def delete_message(self, QueueUrl: str, ReceiptHandle: str, **kwargs) -> Dict[str, Any]:
+        with self._lock:
+            self.in_flight.get(QueueUrl, {}).pop(ReceiptHandle, None)
+        return {}
+
+    def delete_message_batch(self, QueueUrl: str, Entries: List[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
+        self._check_batch(Entries, 'DeleteMessageBatch')
+        with self._lock:
+            for entry in Entries:
+                self.in_flight.get(QueueUrl, {}).pop(entry['ReceiptHandle'], None)
+        return {'Successful': [{'Id': entry['Id']} for entry in Entries], 'Failed': []}
+
+    def change_message_visibility_batch(self, QueueUrl: str, Entries: List[Dict[str, Any]],
+                                        **kwargs) -> Dict[str, Any]:
+        self._check_batch(Entries, 'ChangeMessageVisibilityBatch')
+        successful, failed = [], []
+        with self._lock:
+            in_flight = self.in_flight.get(QueueUrl, {})
+            for entry in Entries:
+                if entry['ReceiptHandle'] not in in_flight:
+                    failed.append({'Id': entry['Id'], 'Code': 'ReceiptHandleIsInvalid', 'SenderFault': True})
+                    continue
+                in_flight[entry['ReceiptHandle']] = (time.monotonic() + entry['VisibilityTimeout'],
+                                                     in_flight[entry['ReceiptHandle']][1])
+                successful.append({'Id': entry['Id']})
+            self._lock.notify_all()
+        return {'Successful': successful, 'Failed': failed}
+
+    @staticmethod
+    def _check_batch(entries: List[Dict[str, Any]], operation: str) -> None:
+        if not entries:
+            raise client_error('EmptyBatchRequest', 'There should be at least one entry in the request.', operation)
+        if len(entries) > 10:
+            raise client_error('TooManyEntriesInBatchRequest', f"Maximum number of entries per request are 10. "
+                               f"You have sent {len(entries)}.", operation)
+
+    def get_queue_attributes(self, QueueUrl: str, **kwargs) -> Dict[str, Any]:
+        with self._lock:
+            self._expire(QueueUrl)
+            depth = len(self.queues.get(QueueUrl, []))
+            in_flight = len(self.in_flight.get(QueueUrl, {}))
+        return {'Attributes': {'QueueArn': QueueUrl, 'ApproximateNumberOfMessages': str(depth),
+                               'ApproximateNumberOfMessagesNotVisible': str(in_flight)}}
+
+
+class LocalSSM:
+    """Parameter Store backed by a dict of name to (type, value)."""
+
+    def __init__(self, parameters: Optional[Dict[str, Any]] = None):
+        self.parameters: Dict[str, Dict[str, Any]] = {}
+        for name, value in (parameters or {}).items():
+            self.put_parameter(Name=name, Value=value)
+
+    def put_parameter(self, Name: str, Value: str, Type: str = 'String', **kwargs) -> Dict[str, Any]:
+        self.parameters[Name] = {
+            'Name': Name,
+            'Type': Type,
+            'Value': Value,
+            'Version': 1,
+            'LastModifiedDate': datetime.now(timezone.utc)
+        }
+        return {'Version': 1}
+
+    def get_parameter(self, Name: str, **kwargs) -> Dict[str, Any]:
+        if Name not in self.parameters:
+            raise client_error('ParameterNotFound', f"Parameter {Name} not found", 'GetParameter')
+        return {'Parameter': dict(self.parameters[Name])}
+
+    def get_parameters_by_path(self, Path: str, Recursive: bool = False, **kwargs) -> Dict[str, Any]:
+        prefix = Path if Path.endswith('/') else f"{Path}/"
+        return {
+            'Parameters': [
+                dict(param) for name, param in sorted(self.parameters.items())
+                if name.startswith(prefix) and (Recursive or '/' not in name[len(prefix):])
+            ]
+        }
+
+
+class LatencyProxy:
+    """Delays every call on a stand-in to emulate the round trip to a real endpoint."""
+
+    def __init__(self, client: Any, latency_ms: float):
+        self._client = client
+        self._latency = latency_ms / 1000
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._client, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def delayed(*args, **kwargs):
+            time.sleep(self._latency)
+            return attr(*args, **kwargs)
+        return delayed
+
+
+class OutageProxy:
+    """Fails every call on a stand-in with a read timeout after `timeout_ms` while `outage` is set, and counts calls."""
+
+    def __init__(self, client: Any, service: str, timeout_ms: float = 1000):
+        self._client = client
+        self._service = service
+        self._timeout = timeout_ms / 1000
+        self.outage = threading.Event()
+        self.calls = 0
+        self.failed = 0
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._client, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            self.calls += 1
+            if self.outage.is_set():
+                self.failed += 1
+                time.sleep(self._timeout)
+                raise ReadTimeoutError(endpoint_url=f"https://{self._service}.us-east-1.amazonaws.com/")
+            return attr(*args, **kwargs)
+        return call
+
+
+class ThrottledS3:
+    """
+    S3 stand-in proxy enforcing S3's request-rate limits per prefix.
+
+    Requests are admitted per partition, the bucket plus the first `depth`
+    directory levels of the key or listing prefix, from two token buckets:
+    `read_rps` for GET, HEAD and LIST requests and `write_rps` for the others,
+    each holding up to `burst_seconds` of its rate. A request finding no token
+    fails with 503 SlowDown, as S3 answers a prefix over its rate. Every request
+    takes `latency_ms`, stretched in proportion once more than `knee` requests
+    are in flight on its partition, as at an overloaded partition. Only calls
+    naming a `Bucket` keyword are limited, so seeding with `put` is not.
+    """
+
+    READ_OPERATIONS = frozenset(('get_object', 'head_object', 'head_bucket', 'list_objects_v2',
+                                 'list_object_versions', 'select_object_content'))
+
+    def __init__(self, client: Any, read_rps: float = 5500, write_rps: float = 3500, depth: int = 2,
+                 burst_seconds: float = 0.1, latency_ms: float = 0, knee: int = 0):
+        self._client = client
+        self._rates = {'read': read_rps, 'write': write_rps}
+        self._depth = depth
+        self._burst_seconds = burst_seconds
+        self._latency = latency_ms / 1000
+        self._knee = knee
+        self._tokens: Dict[Any, List[float]] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.admitted: Dict[str, int] = {}
+        self.throttled: Dict[str, int] = {}
+        self.peak_in_flight: Dict[str, int] = {}
+
+    def partition(self, bucket: str, key: str) -> str:
+        directories = key.split('/')[:-1][:self._depth]
+        return f"{bucket}/" + ''.join(f"{directory}/" for directory in directories)
+
+    def _admit(self, partition: str, kind: str) -> int:
+        """Take a token for the request and return the requests in flight with it, or 0 if throttled."""
+        rate = self._rates[kind]
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._tokens.setdefault((partition, kind), [rate * self._burst_seconds, now])
+            bucket[0] = min(bucket[0] + (now - bucket[1]) * rate, max(rate * self._burst_seconds, 1))
+            bucket[1] = now
+            if bucket[0] < 1:
+                self.throttled[partition] = self.throttled.get(partition, 0) + 1
+                return 0
+            bucket[0] -= 1
+            self.admitted[partition] = self.admitted.get(partition, 0) + 1
+            in_flight = self._in_flight[partition] = self._in_flight.get(partition, 0) + 1
+            self.peak_in_flight[partition] = max(self.peak_in_flight.get(partition, 0), in_flight)
+            return in_flight
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._client, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+        kind = 'read' if name in self.READ_OPERATIONS else 'write'
+        operation = ''.join(part.title() for part in name.split('_'))
+
+        def limited(*args, **kwargs):
+            if 'Bucket' not in kwargs:
+                return attr(*args, **kwargs)
+            partition = self.partition(kwargs['Bucket'], kwargs.get('Key', kwargs.get('Prefix', '')) or '')
+            in_flight = self._admit(partition, kind)
+            if not in_flight:
+                time.sleep(self._latency)
+                raise client_error('SlowDown', 'Please reduce your request rate.', operation, 503)
+            try:
+                time.sleep(self._latency * max(1.0, in_flight / self._knee if self._knee else 1.0))
+                return attr(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._in_flight[partition] -= 1
+        return limited
+
+
+class SlowFirstByteS3:
+    """
+    S3 stand-in proxy with a heavy tail of time to first byte.
+
+    GET and HEAD requests wait `latency_ms`, varied by `jitter` either way,
+    before returning, and `slow_fraction` of them wait `slow_ms` instead, as a
+    request landing on a busy or failing S3 host does. Other requests wait
+    `latency_ms`. Draws come from a generator seeded with `seed`, so scenarios
+    are comparable. `requests` counts the GET and HEAD requests received.
+    """
+
+    READS = frozenset(('get_object', 'head_object'))
+
+    def __init__(self, client: Any, latency_ms: float = 10, jitter: float = 0.3, slow_fraction: float = 0.01,
+                 slow_ms: float = 500, seed: int = 42):
+        self._client = client
+        self._latency = latency_ms / 1000
+        self._jitter = jitter
+        self._slow_fraction = slow_fraction
+        self._slow = slow_ms / 1000
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    def _delay(self) -> float:
+        with self._lock:
+            self.requests += 1
+            if self._random.random() < self._slow_fraction:
+                return self._slow
+            return self._latency * (1 + self._random.uniform(-self._jitter, self._jitter))
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._client, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def delayed(*args, **kwargs):
+            time.sleep(self._delay() if name in self.READS else self._latency)
+            return attr(*args, **kwargs)
+        return delayed
+
+
+class LocalAWS:
+    """Registry of stand-in clients handed out by the patched `boto3.client`."""
+
+    def __init__(self, latency_ms: float = 0, stream_mib_per_second: float = 0, discard_writes: bool = False,
+                 **clients: Any):
+        self.latency_ms = latency_ms
+        self.clients: Dict[str, Any] = {
+            's3': LocalS3(stream_mib_per_second=stream_mib_per_second, discard_writes=discard_writes),
+            'sns': LocalSNS(),
+            'sqs': LocalSQS(),
+            'ssm': LocalSSM(),
+            'cloudwatch': LocalCloudWatch()
+        }
+        self.clients.update(clients)
+
+    def client(self, service_name: str, *args, **kwargs) -> Any:
+        if service_name not in self.clients:
+            self.clients[service_name] = UnavailableService(service_name)
+        client = self.clients[service_name]
+        return LatencyProxy(client, self.latency_ms) if self.latency_ms else client
+
+    @contextlib.contextmanager
+    def patched(self):
+        """Make `boto3.client` return the local stand-ins."""
+        original = boto3.client
+        boto3.client = self.client
+        try:
+            yield self
+        finally:
+            boto3.client = original
+
+
+class LocalContext:
+    """Lambda context object for in-process invocations."""
+
+    def __init__(self, function_name: str = 'local-function', memory_limit_in_mb: int = 512,
+                 timeout_seconds: float = 60):
+        self.function_name = function_name
+        self.function_version = '$LATEST'
+        self.invoked_function_arn = f"arn:aws:lambda:us-east-1:123456789012:function:{function_name}"
+        self.memory_limit_in_mb = memory_limit_in_mb
+        self.aws_request_id = str(uuid.uuid4())
+        self.log_group_name = f"/aws/lambda/{function_name}"
+        self.log_stream_name = 'local'
+        self._deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(int((self._deadline - time.monotonic()) * 1000), 0)
+
+
+class LocalInvocation:
+    """What the local Runtime API observed for one invocation."""
+
+    def __init__(self, request_id: str, event: Any):
+        self.request_id = request_id
+        self.event = event
+        self.dispatched = 0.0
+        self.first_byte = None
+        self.finished = None
+        self.mode = None
+        self.status_code = None
+        self.headers: Dict[str, str] = {}
+        self.body_bytes = 0
+        self.chunks = 0
+        self.body = bytearray()
+        self.error = None
+        self.done = threading.Event()
+
+    @property
+    def ttfb_ms(self) -> Optional[float]:
+        return (self.first_byte - self.dispatched) * 1000 if self.first_byte else None
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        return (self.finished - self.dispatched) * 1000 if self.finished else None
+
+
+class LocalRuntimeAPI:
+    """
+    Lambda Runtime API on localhost for running a runtime loop against queued events.
+
+    Streamed responses are parsed as they arrive, so the time to the first body
+    byte after the function URL prelude is measured the way a client sees it.
+    Buffered responses above the 6 MB Lambda limit are rejected with 413.
+    """
+
+    BUFFERED_LIMIT = 6 * 1024 * 1024
+    PRELUDE_DELIMITER = b'\x00' * 8
+
+    def __init__(self, keep_body: bool = False, deadline_seconds: float = 900):
+        self.keep_body = keep_body
+        self.deadline_seconds = deadline_seconds
+        self.invocations: Dict[str, LocalInvocation] = {}
+        self._pending: 'queue.Queue[LocalInvocation]' = queue.Queue()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._request_handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def address(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"{host}:{port}"
+
+    def enqueue(self, event: Any) -> LocalInvocation:
+        invocation = LocalInvocation(str(uuid.uuid4()), event)
+        self.invocations[invocation.request_id] = invocation
+        self._pending.put(invocation)
+        return invocation
+
+    def __enter__(self) -> 'LocalRuntimeAPI':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _request_handler(self):
+        runtime = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def _reply(self, status: int, body: bytes = b'', headers: Optional[Dict[str, str]] = None) -> None:
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self) -> None:
+                invocation = runtime._pending.get()
+                invocation.dispatched = time.perf_counter()
+                deadline_ms = int((time.time() + runtime.deadline_seconds) * 1000)
+                self._reply(200, json.dumps(invocation.event).encode('utf-8'), {
+                    'Content-Type': 'application/json',
+                    'Lambda-Runtime-Aws-Request-Id': invocation.request_id,
+                    'Lambda-Runtime-Deadline-Ms': str(deadline_ms),
+                    'Lambda-Runtime-Invoked-Function-Arn': 'arn:aws:lambda:us-east-1:123456789012:function:local'
+                })
+
+            def do_POST(self) -> None:
+                parts = self.path.strip('/').split('/')
+                if parts[-2:] == ['init', 'error']:
+                    self._reply(202)
+                    return
+                invocation = runtime.invocations[parts[-2]]
+                if parts[-1] == 'error':
+                    invocation.error = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+                    invocation.mode = 'error'
+                elif self.headers.get('Transfer-Encoding') == 'chunked':
+                    invocation.mode = 'streaming'
+                    self._read_stream(invocation)
+                else:
+                    invocation.mode = 'buffered'
+                    length = int(self.headers.get('Content-Length', 0))
+                    body = self.rfile.read(length)
+                    invocation.first_byte = invocation.finished = time.perf_counter()
+                    invocation.body_bytes = length
+                    if length > runtime.BUFFERED_LIMIT:
+                        invocation.error = 'Response payload size exceeded maximum allowed payload size'
+                        invocation.done.set()
+                        self._reply(413)
+                        return
+                    payload = json.loads(body)
+                    if isinstance(payload, dict):
+                        invocation.status_code = payload.get('statusCode')
+                        invocation.headers = payload.get('headers') or {}
+                    if runtime.keep_body:
+                        invocation.body.extend(body)
+                invocation.done.set()
+                self._reply(202)
+
+            def _read_stream(self, invocation: LocalInvocation) -> None:
+                prelude = bytearray()
+                in_body = 'http-integration-response' not in self.headers.get('Content-Type', '')
+                while True:
+                    size = int(self.rfile.readline().split(b';')[0], 16)
+                    if size == 0:
+                        break
+                    data = self.rfile.read(size)
+                    self.rfile.read(2)
+                    invocation.chunks += 1
+                    if not in_body:
+                        prelude.extend(data)
+                        if runtime.PRELUDE_DELIMITER not in prelude:
+                            continue
+                        head, data = bytes(prelude).split(runtime.PRELUDE_DELIMITER, 1)
+                        metadata = json.loads(head)
+                        invocation.status_code = metadata.get('statusCode')
+                        invocation.headers = metadata.get('headers') or {}
+                        in_body = True
+                    if data:
+                        if invocation.first_byte is None:
+                            invocation.first_byte = time.perf_counter()
+                        invocation.body_bytes += len(data)
+                        if runtime.keep_body:
+                            invocation.body.extend(data)
+                # Trailers carry mid-stream errors
+                while True:
+                    line = self.rfile.readline().strip()
+                    if not line:
+                        break
+                    name, _, value = line.decode('utf-8').partition(':')
+                    if name.strip() == 'Lambda-Runtime-Function-Error-Type':
+                        invocation.error = value.strip()
+                invocation.finished = time.perf_counter()
+
+        return Handler
+
+
+def load_handler(example: str, filename: str, local: LocalAWS, module_name: str = None) -> ModuleType:
+    """Import an example handler with its AWS clients bound to the local stand-ins."""
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    example_dir = EXAMPLES_DIR / example
+    for path in (str(example_dir), str(COMMON_DIR)):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+    module_name = module_name or f"{example.replace('-', '_')}_{Path(filename).stem}"
+    spec = importlib.util.spec_from_file_location(module_name, example_dir / filename)
+    module = importlib.util.module_from_spec(spec)
+    with local.patched():
+        spec.loader.exec_module(module)
+    sys.modules[module_name] = module
+    return module
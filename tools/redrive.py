@@ -0,0 +1,349 @@
+"""
+Replay the events in a Lambda dead-letter queue, in parallel, and delete those that were replayed.
+
+The queue the module creates with `create_dlq` receives the event of every
+asynchronous invocation that failed all its attempts as the message body, with
+the RequestID, ErrorCode and ErrorMessage message attributes. --workers threads
+long-poll it (--wait-seconds) with batch receives of 10 and invoke each event
+again, no faster than --rate invocations per second across workers:
+
+    --function-name NAME    asynchronous Invoke of the deployed function; the
+                            event counts as replayed once Lambda accepts it
+    --local HANDLER         in-process call of an example handler against the
+                            local stand-ins; a raised exception or a statusCode
+                            of 500 or more is a failure
+
+Replayed messages are deleted with delete_message_batch. A message whose body
+is not JSON, whose event Lambda rejects as invalid or too large, or that failed
+and has been received --max-receives times is poison: with --poison-queue-url
+it is sent there, with a RedriveError attribute, and deleted; without, it stays
+in the queue. Other failures are made visible again after --retry-seconds.
+Each worker stops after --idle-polls empty receives in a row, or once
+--max-messages messages have been received in all.
+
+With --local the queue is a local SQS stand-in seeded with --messages events of
+the handler's benchmark mix, --poison-percent of them with a body that is not
+JSON and --failing-percent of them marked to fail in the local target every
+time. The tool exits 1 if a seeded message is neither replayed nor moved to the
+poison queue.
+
+The report lists messages received, replayed, poisoned and still in the queue,
+invocation failures and receives, and messages per second up to the last
+message replayed or moved aside, leaving out the idle polls that end the run.
+
+    python tools/redrive.py --queue-url https://sqs.us-east-1.amazonaws.com/123456789012/my-function-dlq \\
+        --function-name my-function:live --poison-queue-url https://sqs.us-east-1.amazonaws.com/123456789012/poison \\
+        --workers 8 --rate 50
+    python tools/redrive.py --local complete-lambda-example --messages 2000 --workers 8 --latency-ms 5
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from botocore.exceptions import ClientError
+
+from bench_handlers import BENCHMARKS
+from local_aws import LocalAWS, LocalContext, load_handler
+
+logger = logging.getLogger('redrive')
+
+BATCH_SIZE = 10
+# Invoke errors that replaying the same event cannot fix
+REJECTED_CODES = frozenset(('InvalidRequestContentException', 'RequestTooLargeException'))
+LOCAL_QUEUE_URL = 'https://sqs.us-east-1.amazonaws.com/123456789012/local-function-dlq'
+LOCAL_POISON_QUEUE_URL = 'https://sqs.us-east-1.amazonaws.com/123456789012/local-function-dlq-poison'
+# Key of seeded events the local target fails every time, as an event that still breaks the handler
+FAIL_MARKER = 'redrive_fail'
+
+
+class Rejected(Exception):
+    """The event can never be replayed, whatever the number of attempts."""
+
+
+class RateLimiter:
+    """Spaces calls from all threads at least 1 / `rate` seconds apart; no limit when `rate` is 0."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def lambda_target(client: Any, function_name: str) -> Callable[[Any], None]:
+    """Invoke the deployed function asynchronously, as the invocation that failed was."""
+    def invoke(event: Any) -> None:
+        try:
+            client.invoke(FunctionName=function_name, InvocationType='Event',
+                          Payload=json.dumps(event).encode('utf-8'))
+        except ClientError as e:
+            if e.response['Error']['Code'] in REJECTED_CODES:
+                raise Rejected(e.response['Error']['Code']) from e
+            raise
+    return invoke
+
+
+def local_target(module: Any, function_name: str) -> Callable[[Any], None]:
+    """Call an example handler in this process."""
+    def invoke(event: Any) -> None:
+        if isinstance(event, dict) and event.get(FAIL_MARKER):
+            raise RuntimeError('Event marked to fail')
+        response = module.lambda_handler(event, LocalContext(function_name))
+        if isinstance(response, dict) and response.get('statusCode', 200) >= 500:
+            raise RuntimeError(f"Handler returned status {response['statusCode']}")
+    return invoke
+
+
+class Redrive:
+    """Workers draining a dead-letter queue through a target, with shared counters."""
+
+    def __init__(self, sqs: Any, queue_url: str, target: Callable[[Any], None], args: argparse.Namespace):
+        self.sqs = sqs
+        self.queue_url = queue_url
+        self.target = target
+        self.poison_queue_url = args.poison_queue_url
+        self.max_receives = args.max_receives
+        self.max_messages = args.max_messages
+        self.wait_seconds = args.wait_seconds
+        self.retry_seconds = args.retry_seconds
+        self.visibility_timeout = args.visibility_timeout
+        self.idle_polls = args.idle_polls
+        self.limiter = RateLimiter(args.rate)
+        self.counters = dict.fromkeys(('received', 'replayed', 'poisoned', 'failed_invocations', 'delete_failures',
+                                       'receives', 'empty_receives'), 0)
+        # When the last message was replayed or moved aside, so idle polls at the end are not counted
+        self.settled = 0.0
+        self._lock = threading.Lock()
+
+    def count(self, **increments: int) -> None:
+        with self._lock:
+            for name, value in increments.items():
+                self.counters[name] += value
+            if increments.get('replayed') or increments.get('poisoned'):
+                self.settled = time.perf_counter()
+
+    def _claim(self) -> int:
+        """Messages this worker may still receive, under --max-messages."""
+        if not self.max_messages:
+            return BATCH_SIZE
+        with self._lock:
+            return max(min(BATCH_SIZE, self.max_messages - self.counters['received']), 0)
+
+    def work(self) -> None:
+        idle = 0
+        while idle < self.idle_polls:
+            wanted = self._claim()
+            if not wanted:
+                return
+            response = self.sqs.receive_message(
+                QueueUrl=self.queue_url, MaxNumberOfMessages=wanted, WaitTimeSeconds=self.wait_seconds,
+                VisibilityTimeout=self.visibility_timeout, AttributeNames=['ApproximateReceiveCount'],
+                MessageAttributeNames=['All']
+            )
+            messages = response.get('Messages', [])
+            self.count(receives=1, received=len(messages), empty_receives=0 if messages else 1)
+            idle = 0 if messages else idle + 1
+            if messages:
+                self.replay(messages)
+
+    def replay(self, messages: List[Dict[str, Any]]) -> None:
+        """Invoke each message's event, then delete, move aside or retry it."""
+        done: List[Dict[str, Any]] = []
+        poison: List[Dict[str, Any]] = []
+        retry: List[Dict[str, Any]] = []
+        for message in messages:
+            try:
+                event = json.loads(message['Body'])
+            except ValueError:
+                poison.append({**message, 'RedriveError': 'Body is not JSON'})
+                continue
+            self.limiter.acquire()
+            try:
+                self.target(event)
+                done.append(message)
+            except Rejected as e:
+                self.count(failed_invocations=1)
+                poison.append({**message, 'RedriveError': str(e)})
+            except Exception as e:
+                self.count(failed_invocations=1)
+                receives = int(message.get('Attributes', {}).get('ApproximateReceiveCount', '1'))
+                if receives >= self.max_receives:
+                    poison.append({**message, 'RedriveError': f"{type(e).__name__}: {e}"[:256]})
+                else:
+                    logger.warning(f"Replay of {message['MessageId']} failed, attempt {receives}: {e}")
+                    retry.append(message)
+        moved = self.move_aside(poison)
+        self.count(replayed=len(done), poisoned=len(moved))
+        self.delete(done + moved)
+        if retry:
+            self.sqs.change_message_visibility_batch(QueueUrl=self.queue_url, Entries=[
+                {'Id': str(index), 'ReceiptHandle': message['ReceiptHandle'],
+                 'VisibilityTimeout': self.retry_seconds}
+                for index, message in enumerate(retry)
+            ])
+
+    def move_aside(self, poison: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Send poison messages to the poison queue; returns those sent, which may be deleted."""
+        if not poison or not self.poison_queue_url:
+            for message in poison:
+                logger.error(f"Poison message {message['MessageId']} left in the queue: {message['RedriveError']}")
+            return []
+        response = self.sqs.send_message_batch(QueueUrl=self.poison_queue_url, Entries=[
+            {'Id': str(index), 'MessageBody': message['Body'], 'MessageAttributes': {
+                **message.get('MessageAttributes', {}),
+                'RedriveError': {'DataType': 'String', 'StringValue': message['RedriveError']}
+            }}
+            for index, message in enumerate(poison)
+        ])
+        for failure in response.get('Failed', []):
+            logger.error(f"Poison message not moved: {failure}")
+        return [poison[int(entry['Id'])] for entry in response.get('Successful', [])]
+
+    def delete(self, messages: List[Dict[str, Any]]) -> None:
+        for start in range(0, len(messages), BATCH_SIZE):
+            chunk = messages[start:start + BATCH_SIZE]
+            response = self.sqs.delete_message_batch(QueueUrl=self.queue_url, Entries=[
+                {'Id': str(index), 'ReceiptHandle': message['ReceiptHandle']} for index, message in enumerate(chunk)
+            ])
+            failed = response.get('Failed', [])
+            if failed:
+                # Replayed but not deleted: the message comes back and is replayed again
+                logger.error(f"{len(failed)} messages not deleted: {failed}")
+                self.count(delete_failures=len(failed))
+
+    def run(self, workers: int) -> Dict[str, float]:
+        """Drain with `workers` threads; returns the seconds taken, in all and until the last message settled."""
+        start = time.perf_counter()
+        threads = [threading.Thread(target=self.work, name=f"redrive-{index}") for index in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return {'seconds': time.perf_counter() - start, 'drain_seconds': max(self.settled - start, 0)}
+
+
+def seed(local: LocalAWS, benchmark: Any, args: argparse.Namespace) -> int:
+    """Fill the local dead-letter queue the way Lambda does; returns the number of messages."""
+    benchmark.seed(local, args.objects, 1024)
+    rng = random.Random(args.seed)
+    mix = {name: weight for name, (weight, _) in benchmark.mix.items()}
+    events = benchmark.events(mix, rng, 1, args.objects)
+    entries = []
+    for index in range(args.messages):
+        _, event = next(events)
+        draw = rng.random() * 100
+        if draw < args.poison_percent:
+            body = json.dumps(event)[:-1]
+        elif draw < args.poison_percent + args.failing_percent:
+            body = json.dumps({**event, FAIL_MARKER: True})
+        else:
+            body = json.dumps(event)
+        entries.append({'Id': str(index % BATCH_SIZE), 'MessageBody': body, 'MessageAttributes': {
+            'RequestID': {'DataType': 'String', 'StringValue': str(uuid.uuid4())},
+            'ErrorCode': {'DataType': 'Number', 'StringValue': '200'},
+            'ErrorMessage': {'DataType': 'String', 'StringValue': 'Task timed out after 30.00 seconds'}
+        }})
+        if len(entries) == BATCH_SIZE:
+            local.clients['sqs'].send_message_batch(QueueUrl=LOCAL_QUEUE_URL, Entries=entries)
+            entries = []
+    if entries:
+        local.clients['sqs'].send_message_batch(QueueUrl=LOCAL_QUEUE_URL, Entries=entries)
+    return args.messages
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--function-name', help='function, alias or version ARN to invoke asynchronously')
+    target.add_argument('--local', choices=sorted(BENCHMARKS), help='example handler to call in-process')
+    parser.add_argument('--queue-url', help='dead-letter queue; the local stand-in with --local')
+    parser.add_argument('--poison-queue-url', help='where poison messages go; a local stand-in with --local')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=0, help='invocations per second across workers; 0 for no limit')
+    parser.add_argument('--max-receives', type=int, default=3, help='receives after which a failing message is poison')
+    parser.add_argument('--max-messages', type=int, default=0, help='stop after receiving this many; 0 for all')
+    parser.add_argument('--wait-seconds', type=int, help='long-poll wait per receive; default 20, 1 with --local')
+    parser.add_argument('--idle-polls', type=int, default=2, help='empty receives in a row that stop a worker')
+    parser.add_argument('--visibility-timeout', type=int, default=120, help='time a received message is hidden')
+    parser.add_argument('--retry-seconds', type=int, help='delay before a failed replay is retried; '
+                                                          'default 10, 0 with --local')
+    parser.add_argument('--messages', type=int, default=1000, help='messages seeded with --local')
+    parser.add_argument('--poison-percent', type=float, default=2, help='seeded bodies that are not JSON')
+    parser.add_argument('--failing-percent', type=float, default=2, help='seeded events that always fail')
+    parser.add_argument('--latency-ms', type=float, default=0, help='round trip of every local stand-in call')
+    parser.add_argument('--objects', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    if args.wait_seconds is None:
+        args.wait_seconds = 1 if args.local else 20
+    if args.retry_seconds is None:
+        args.retry_seconds = 0 if args.local else 10
+    logging.basicConfig(level=logging.ERROR, format='%(levelname)s %(message)s')
+
+    seeded = 0
+    local: Optional[LocalAWS] = None
+    if args.local:
+        local = LocalAWS(latency_ms=args.latency_ms)
+        args.queue_url = args.queue_url or LOCAL_QUEUE_URL
+        args.poison_queue_url = args.poison_queue_url or LOCAL_POISON_QUEUE_URL
+        benchmark = BENCHMARKS[args.local]()
+        os.environ.update(benchmark.environment)
+        os.environ.setdefault('LOG_LEVEL', 'ERROR')
+        seeded = seed(local, benchmark, args)
+        module = load_handler(benchmark.example, benchmark.filename, local)
+        sqs = local.client('sqs')
+        redrive = Redrive(sqs, args.queue_url, local_target(module, args.local), args)
+    else:
+        import boto3
+        if not args.queue_url:
+            parser.error('--queue-url is required with --function-name')
+        sqs = boto3.client('sqs')
+        redrive = Redrive(sqs, args.queue_url, lambda_target(boto3.client('lambda'), args.function_name), args)
+
+    # Handlers print EMF lines; sys.stdout is shared by the workers, so it is redirected once around all of them
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull if args.local else sys.stdout):
+        timing = redrive.run(args.workers)
+    attributes = sqs.get_queue_attributes(
+        QueueUrl=args.queue_url,
+        AttributeNames=['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible']
+    )['Attributes']
+    counters = redrive.counters
+    report: Dict[str, Any] = {
+        'workers': args.workers,
+        'rate': args.rate,
+        **counters,
+        'left_in_queue': int(attributes['ApproximateNumberOfMessages']),
+        'left_in_flight': int(attributes['ApproximateNumberOfMessagesNotVisible']),
+        'seconds': round(timing['seconds'], 2),
+        'drain_seconds': round(timing['drain_seconds'], 2),
+        'messages_per_second': round((counters['replayed'] + counters['poisoned']) / timing['drain_seconds'], 1)
+        if timing['drain_seconds'] else 0
+    }
+    if args.local:
+        report['seeded'] = seeded
+        report['in_poison_queue'] = len(local.clients['sqs'].queues.get(args.poison_queue_url, []))
+    print(json.dumps(report, indent=2))
+    if args.local and counters['replayed'] + counters['poisoned'] != seeded:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,250 @@
+"""
+Replay a recorded corpus against a handler at a target rate, serving AWS calls from the recording.
+
+Each invocation's recorded calls are queued per service and operation; a call
+made by the handler is answered with the recorded call whose parameters match,
+or with the next recorded call of the same operation when the parameters have
+drifted. Calls with no recording left raise a `ReplayMiss` ClientError or, with
+--fallback, are served by the seeded local stand-ins (for handlers that do not
+record their calls, or corpora of bare events). Nothing touches the network, so
+two runs of the same corpus see identical downstream responses and differ only
+by the handler code.
+
+    python tools/corpus.py record --handler s3-lambda --invocations 1000 -o s3.jsonl.gz
+    python tools/replay.py --handler s3-lambda --corpus s3.jsonl.gz --rate 200 --save-baseline replay.json
+    python tools/replay.py --handler s3-lambda --corpus s3.jsonl.gz --rate 200 --compare replay.json
+
+Invocations are dispatched on an open-loop schedule, so `queued_p99_ms`
+includes time spent waiting for a free worker when the handler cannot keep up.
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from bench_handlers import BENCHMARKS, compare, percentile
+from corpus import read_invocations
+from local_aws import COMMON_DIR, LocalAWS, LocalContext, client_error, load_handler
+
+sys.path.insert(0, str(COMMON_DIR))
+from recording import decode, encode  # noqa: E402
+
+
+class ReplaySession:
+    """Serves each thread's current invocation from its recorded calls and counts the outcome."""
+
+    def __init__(self, recorded_latency: bool = False, fallback: Optional[LocalAWS] = None):
+        self.recorded_latency = recorded_latency
+        self.fallback = fallback
+        self.served = 0
+        self.param_drift = 0
+        self.fallbacks = 0
+        self.misses = 0
+        self.unused = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def begin(self, invocation: Dict[str, Any]) -> None:
+        pending: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        for call in invocation.get('calls') or []:
+            pending.setdefault((call['service'], call['operation']), []).append(call)
+        self._local.pending = pending
+
+    def end(self) -> None:
+        leftover = sum(len(calls) for calls in self._local.pending.values())
+        with self._lock:
+            self.unused += leftover
+        self._local.pending = {}
+
+    def serve(self, service: str, operation: str, params: Dict[str, Any]) -> Any:
+        calls = getattr(self._local, 'pending', {}).get((service, operation))
+        if not calls:
+            if self.fallback is not None:
+                with self._lock:
+                    self.fallbacks += 1
+                return getattr(self.fallback.client(service), operation)(**params)
+            with self._lock:
+                self.misses += 1
+            raise client_error('ReplayMiss', f"No recorded response for {service}.{operation}", operation)
+
+        encoded = encode(params)
+        call = next((candidate for candidate in calls if candidate['params'] == encoded), None)
+        drifted = call is None
+        call = call or calls[0]
+        calls.remove(call)
+        with self._lock:
+            self.served += 1
+            self.param_drift += drifted
+
+        if self.recorded_latency:
+            time.sleep(call.get('duration_ms', 0) / 1000)
+        if 'error' in call:
+            error = call['error']
+            raise client_error(error['code'], error['message'], operation, error.get('status', 400))
+        return decode(call['response'])
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'served': self.served,
+            'param_drift': self.param_drift,
+            'fallbacks': self.fallbacks,
+            'misses': self.misses,
+            'unused': self.unused
+        }
+
+
+class ReplayClient:
+    """Client whose operations are answered by a ReplaySession."""
+
+    def __init__(self, service: str, session: ReplaySession):
+        self._service = service
+        self._session = session
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def operation(**kwargs):
+            return self._session.serve(self._service, name, kwargs)
+        return operation
+
+
+class ReplayAWS(LocalAWS):
+    """Hands out replay clients from the patched `boto3.client`."""
+
+    def __init__(self, session: ReplaySession):
+        self.latency_ms = 0
+        self.session = session
+        self.clients: Dict[str, Any] = {}
+
+    def client(self, service_name: str, *args, **kwargs) -> Any:
+        if service_name not in self.clients:
+            self.clients[service_name] = ReplayClient(service_name, self.session)
+        return self.clients[service_name]
+
+
+def invoke(module: Any, session: ReplaySession, invocation: Dict[str, Any], context: Any) -> Any:
+    """Run one recorded invocation through the handler with its calls served from the recording."""
+    session.begin(invocation)
+    try:
+        return module.lambda_handler(decode(invocation['event']), context)
+    finally:
+        session.end()
+
+
+def status_code(response: Any) -> Optional[int]:
+    return response.get('statusCode') if isinstance(response, dict) else None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--handler', required=True, choices=sorted(BENCHMARKS))
+    parser.add_argument('--corpus', required=True)
+    parser.add_argument('--rate', type=float, default=0, help='invocations per second; 0 dispatches as fast as possible')
+    parser.add_argument('--concurrency', type=int, default=1, help='invocations in flight at once')
+    parser.add_argument('--repeat', type=int, default=1, help='times the corpus is replayed')
+    parser.add_argument('--recorded-latency', action='store_true', help='delay each AWS call by its recorded duration')
+    parser.add_argument('--fallback', action='store_true',
+                        help='serve calls missing from the recording from the seeded local stand-ins')
+    parser.add_argument('--objects', type=int, default=200, help='objects seeded for --fallback')
+    parser.add_argument('--object-size', type=int, default=4096, help='object size seeded for --fallback')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='environment for the handler, on top of its benchmark defaults')
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--save-baseline', help='write the results to this file')
+    parser.add_argument('--compare', help='fail when results regress against this baseline file')
+    parser.add_argument('--tolerance', type=float, default=10.0, help='allowed regression in percent')
+    args = parser.parse_args()
+
+    benchmark = BENCHMARKS[args.handler]()
+    os.environ.update(benchmark.environment)
+    os.environ.update(dict(entry.split('=', 1) for entry in args.env))
+    os.environ['LOG_LEVEL'] = args.log_level
+    logging.getLogger().setLevel(args.log_level)
+
+    invocations = list(read_invocations(args.corpus)) * args.repeat
+    fallback = None
+    if args.fallback:
+        fallback = LocalAWS()
+        benchmark.seed(fallback, args.objects, args.object_size)
+    session = ReplaySession(args.recorded_latency, fallback)
+
+    service_ms: List[float] = []
+    queued_ms: List[float] = []
+    failures = 0
+    status_mismatches = 0
+    lock = threading.Lock()
+
+    def run(invocation: Dict[str, Any], scheduled: float) -> None:
+        nonlocal failures, status_mismatches
+        context = LocalContext(args.handler, memory_limit_in_mb=invocation.get('memory_limit_in_mb') or 512)
+        start = time.perf_counter()
+        try:
+            response = invoke(module, session, invocation, context)
+            failed = (status_code(response) or 200) >= 500
+        except Exception:
+            response, failed = None, True
+        end = time.perf_counter()
+        recorded = status_code(invocation.get('response'))
+        with lock:
+            service_ms.append((end - start) * 1000)
+            queued_ms.append((end - scheduled) * 1000)
+            failures += failed
+            status_mismatches += recorded is not None and status_code(response) != recorded
+
+    # Handlers print EMF and log lines; keep stdout free for the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        module = load_handler(benchmark.example, benchmark.filename, ReplayAWS(session))
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            for position, invocation in enumerate(invocations):
+                scheduled = started + position / args.rate if args.rate else time.perf_counter()
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(run, invocation, scheduled)
+        duration = time.perf_counter() - started
+
+    service_ms.sort()
+    queued_ms.sort()
+    result = {
+        'handler': args.handler,
+        'invocations': len(invocations),
+        'target_rate': args.rate,
+        'concurrency': args.concurrency,
+        'throughput_per_second': round(len(invocations) / duration, 2),
+        'errors': failures,
+        'status_mismatches': status_mismatches,
+        'p50_ms': round(percentile(service_ms, 0.50), 4),
+        'p95_ms': round(percentile(service_ms, 0.95), 4),
+        'p99_ms': round(percentile(service_ms, 0.99), 4),
+        'max_ms': round(service_ms[-1], 4),
+        'queued_p99_ms': round(percentile(queued_ms, 0.99), 4),
+        'peak_rss_mib': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2),
+        'downstream_calls': session.stats()
+    }
+    print(json.dumps(result, indent=2))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as baseline_file:
+            json.dump({args.handler: result}, baseline_file, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline_file:
+            regressions = compare({args.handler: result}, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,235 @@
+"""
+Recommend memory_size, architectures and ephemeral_storage from local profiling.
+
+A corpus of recorded events is replayed through one handler, in a fresh worker
+process per candidate memory size, against the local AWS stand-ins. Lambda
+gives a function CPU in proportion to its memory (one full vCPU at 1769 MB), so
+below that size the worker is duty-cycled with SIGSTOP/SIGCONT to the same
+share of one core. Each candidate reports invocation durations, peak RSS and
+peak /tmp usage, which are priced with the Lambda GB-second rate.
+
+    python tools/tune_memory.py --handler s3-lambda --corpus events.jsonl.gz
+    python tools/tune_memory.py --handler complete-lambda-example --synthetic 200 --architecture arm64
+
+The corpus is read with tools/corpus.py, so recorded corpora and plain JSON Lines
+event files both work; recorded AWS calls are served from the recording and
+anything else from the seeded stand-ins.
+The duty cycle only throttles a single core, so sizes above 1769 MB are measured
+unthrottled and gains from extra vCPUs are not modelled. Architecture only changes
+the price since the host cannot emulate a different instruction set.
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import resource
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List
+
+from bench_handlers import BENCHMARKS
+from corpus import read_invocations
+from local_aws import LocalAWS, LocalContext, load_handler
+from replay import ReplayAWS, ReplaySession, invoke
+
+FULL_VCPU_MEMORY_MB = 1769
+DEFAULT_MEMORY_SIZES = '128,256,512,1024,1536,1769,2048,3008'
+
+# us-east-1 on-demand prices
+PRICE_PER_GB_SECOND = {'x86_64': 0.0000166667, 'arm64': 0.0000133334}
+PRICE_PER_REQUEST = 0.0000002
+
+MIN_EPHEMERAL_STORAGE_MB = 512
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            with contextlib.suppress(OSError):
+                total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def run_worker(args: argparse.Namespace) -> Dict[str, Any]:
+    """Replay the corpus at one memory size inside this (throttled) process."""
+    benchmark = BENCHMARKS[args.handler]()
+    os.environ.update(benchmark.environment)
+    os.environ['LOG_LEVEL'] = args.log_level
+    os.environ['AWS_LAMBDA_FUNCTION_MEMORY_SIZE'] = str(args.worker)
+
+    if args.corpus:
+        invocations = list(read_invocations(args.corpus))
+    else:
+        rng = random.Random(args.seed)
+        mix = {name: weight for name, (weight, _) in benchmark.mix.items()}
+        generator = benchmark.events(mix, rng, args.batch_size, args.objects)
+        invocations = [{'event': next(generator)[1], 'calls': []} for _ in range(args.synthetic)]
+
+    # /tmp usage is measured in a private scratch directory handed out by tempfile
+    scratch = tempfile.mkdtemp(prefix='tune-memory-')
+    tempfile.tempdir = scratch
+    os.environ['TMPDIR'] = scratch
+    tmp_peak = 0
+
+    durations: List[float] = []
+    with contextlib.redirect_stdout(io.StringIO()) as captured:
+        init_start = time.perf_counter()
+        local = LocalAWS()
+        benchmark.seed(local, args.objects, args.object_size)
+        session = ReplaySession(fallback=local)
+        module = load_handler(benchmark.example, benchmark.filename, ReplayAWS(session))
+        init_ms = (time.perf_counter() - init_start) * 1000
+
+        for _ in range(args.repeat):
+            for invocation in invocations:
+                context = LocalContext(args.handler, memory_limit_in_mb=args.worker)
+                start = time.perf_counter()
+                invoke(module, session, invocation, context)
+                durations.append((time.perf_counter() - start) * 1000)
+                tmp_peak = max(tmp_peak, directory_size(scratch))
+                captured.seek(0)
+                captured.truncate()
+
+    shutil.rmtree(scratch, ignore_errors=True)
+    return {
+        'init_ms': round(init_ms, 2),
+        'durations_ms': durations,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2),
+        'tmp_peak_mb': round(tmp_peak / (1024 * 1024), 2)
+    }
+
+
+def run_throttled(command: List[str], cpu_share: float, period_ms: float) -> str:
+    """Run a worker process, holding it to `cpu_share` of one core with a SIGSTOP/SIGCONT duty cycle."""
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    output: List[str] = []
+    reader = threading.Thread(target=lambda: output.append(process.stdout.read()))
+    reader.start()
+
+    if cpu_share < 1:
+        running, stopped = period_ms * cpu_share / 1000, period_ms * (1 - cpu_share) / 1000
+        try:
+            while process.poll() is None:
+                time.sleep(running)
+                process.send_signal(signal.SIGSTOP)
+                time.sleep(stopped)
+                process.send_signal(signal.SIGCONT)
+        except ProcessLookupError:
+            pass
+
+    process.wait()
+    reader.join()
+    if process.returncode != 0:
+        raise RuntimeError(f"Worker exited with status {process.returncode}")
+    return output[0]
+
+
+def summarise(memory_mb: int, result: Dict[str, Any], architecture: str) -> Dict[str, Any]:
+    """Price a candidate and reduce its durations to percentiles."""
+    durations = sorted(result['durations_ms'])
+    billed_ms = [math.ceil(duration) for duration in durations]
+    gb_seconds = statistics.mean(billed_ms) / 1000 * memory_mb / 1024
+    cost = gb_seconds * PRICE_PER_GB_SECOND[architecture] + PRICE_PER_REQUEST
+    return {
+        'memory_mb': memory_mb,
+        'cpu_share': round(min(memory_mb / FULL_VCPU_MEMORY_MB, 1.0), 3),
+        'init_ms': result['init_ms'],
+        'mean_ms': round(statistics.mean(durations), 2),
+        'p50_ms': round(durations[len(durations) // 2], 2),
+        'p95_ms': round(durations[min(int(len(durations) * 0.95), len(durations) - 1)], 2),
+        'peak_rss_mb': result['peak_rss_mb'],
+        'tmp_peak_mb': result['tmp_peak_mb'],
+        'fits': result['peak_rss_mb'] < memory_mb,
+        'cost_per_million_usd': round(cost * 1_000_000, 4)
+    }
+
+
+def module_inputs(candidate: Dict[str, Any], architecture: str) -> str:
+    """Format a candidate as arguments for the lambda function module."""
+    ephemeral = max(MIN_EPHEMERAL_STORAGE_MB, math.ceil(candidate['tmp_peak_mb'] * 1.5))
+    return '\n'.join([
+        f"  memory_size       = {candidate['memory_mb']}",
+        f"  architectures     = [\"{architecture}\"]",
+        f"  ephemeral_storage = {ephemeral}"
+    ])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--handler', required=True, choices=sorted(BENCHMARKS))
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--corpus', help='recorded corpus or events (.jsonl or .jsonl.gz)')
+    source.add_argument('--synthetic', type=int, help='generate this many events from the benchmark mix instead')
+    parser.add_argument('--memory-sizes', default=DEFAULT_MEMORY_SIZES, help='comma-separated candidates in MB')
+    parser.add_argument('--architecture', choices=sorted(PRICE_PER_GB_SECOND), default='x86_64')
+    parser.add_argument('--repeat', type=int, default=3, help='times the corpus is replayed per candidate')
+    parser.add_argument('--period-ms', type=float, default=20.0, help='duty-cycle period of the CPU throttle')
+    parser.add_argument('--latency-tolerance', type=float, default=5.0,
+                        help='percent above the best p95 still counted as latency-optimal')
+    parser.add_argument('--batch-size', type=int, default=5)
+    parser.add_argument('--objects', type=int, default=200)
+    parser.add_argument('--object-size', type=int, default=4096)
+    parser.add_argument('--log-level', default='INFO')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', action='store_true', help='print the candidates as JSON')
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args)))
+        return 0
+
+    forwarded = [
+        f"--handler={args.handler}", f"--repeat={args.repeat}", f"--batch-size={args.batch_size}",
+        f"--objects={args.objects}", f"--object-size={args.object_size}", f"--log-level={args.log_level}",
+        f"--seed={args.seed}",
+        f"--corpus={os.path.abspath(args.corpus)}" if args.corpus else f"--synthetic={args.synthetic}"
+    ]
+
+    candidates = []
+    for memory_mb in sorted(int(size) for size in args.memory_sizes.split(',')):
+        share = min(memory_mb / FULL_VCPU_MEMORY_MB, 1.0)
+        command = [sys.executable, os.path.abspath(__file__), f"--worker={memory_mb}"] + forwarded
+        result = json.loads(run_throttled(command, share, args.period_ms))
+        candidates.append(summarise(memory_mb, result, args.architecture))
+
+    if args.json:
+        print(json.dumps(candidates, indent=2))
+
+    feasible = [candidate for candidate in candidates if candidate['fits']]
+    if not feasible:
+        print("No candidate memory size fits the measured peak RSS", file=sys.stderr)
+        return 1
+
+    cheapest = min(feasible, key=lambda candidate: candidate['cost_per_million_usd'])
+    best_p95 = min(candidate['p95_ms'] for candidate in feasible)
+    fastest = min(
+        (candidate for candidate in feasible if candidate['p95_ms'] <= best_p95 * (1 + args.latency_tolerance / 100)),
+        key=lambda candidate: candidate['memory_mb']
+    )
+
+    print(f"{'memory':>7} {'cpu':>6} {'p50 ms':>9} {'p95 ms':>9} {'rss MB':>8} {'tmp MB':>7} {'$/1M':>9}")
+    for candidate in candidates:
+        print(f"{candidate['memory_mb']:>7} {candidate['cpu_share']:>6} {candidate['p50_ms']:>9} "
+              f"{candidate['p95_ms']:>9} {candidate['peak_rss_mb']:>8} {candidate['tmp_peak_mb']:>7} "
+              f"{candidate['cost_per_million_usd']:>9}{'' if candidate['fits'] else '  (out of memory)'}")
+
+    print(f"\n# Cost-optimal: p95 {cheapest['p95_ms']} ms, ${cheapest['cost_per_million_usd']} per million invocations")
+    print(module_inputs(cheapest, args.architecture))
+    print(f"\n# Latency-optimal: p95 {fastest['p95_ms']} ms, ${fastest['cost_per_million_usd']} per million invocations")
+    print(module_inputs(fastest, args.architecture))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())